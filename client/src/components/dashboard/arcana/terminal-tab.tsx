@@ -53,7 +53,9 @@ export default function TerminalTab() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
     const accessToken = localStorage.getItem("access_token");
     // Connect to the new orchestrator endpoint
-    const ws = new WebSocket(`${protocol}//${window.location.host}/ws/shell/${id}?token=${accessToken}`);
+    // Shell output arrives as raw binary frames; xterm decodes the UTF-8 itself
+    const ws = new WebSocket(`${protocol}//${window.location.host}/ws/shell/${id}?token=${accessToken}&binary=true`);
+    ws.binaryType = 'arraybuffer';
 
     ws.onopen = () => {
       console.log(`Orchestrator WebSocket connected for terminal ${id}`);
@@ -70,6 +72,10 @@ export default function TerminalTab() {
     };
 
     ws.onmessage = (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        terminal.write(new Uint8Array(event.data));
+        return;
+      }
       try {
         const message = JSON.parse(event.data);
         if (message.type === 'shell_output' && message.payload.data) {
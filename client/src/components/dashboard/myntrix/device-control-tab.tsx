@@ -118,7 +118,7 @@ export default function DeviceControlTab() {
 
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
     const accessToken = localStorage.getItem("access_token");
-    const ws = new WebSocket(`${protocol}//${window.location.host}/ws/telemetry/${activeDevice}?token=${accessToken}`);
+    const ws = new WebSocket(`${protocol}//${window.location.host}/api/myntrix/ws/myntrix/telemetry/subscribe?device_id=${activeDevice}&token=${accessToken}`);
 
     ws.onopen = () => {
       console.log(`Telemetry WebSocket connected for device ${activeDevice}`);
@@ -128,7 +128,8 @@ export default function DeviceControlTab() {
     ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
       if (data.type === 'telemetry') {
-        setTelemetryData(data.payload);
+        // Each message only carries the metrics that changed since the previous one
+        setTelemetryData((prev: any) => ({ ...prev, ...data.payload }));
       } else if (data.type === 'log') {
         setTelemetryLogs((prev) => [...prev, `[${new Date().toLocaleTimeString()}] ${data.payload}`]);
       }
@@ -7,6 +7,7 @@ from server_python.database import User, ArcanaAgent
 from server_python.llm_service import get_openrouter_completion
 from server_python.cognisys.llm_interaction import call_llm_api
 from server_python.cognisys.crud import decrypt_api_key
+from server_python.cognisys.tool_executor import ToolExecutor
 from server_python.database import LLMModel, LLMProvider, UserLLMPreference # Import UserLLMPreference
 from . import schemas, crud
 from .code_generation_service import generate_code
@@ -216,7 +217,7 @@ async def execute_agent_task(db: Session, user: User, request: schemas.AgentExec
             messages.append({"role": "user", "content": request.task_prompt})
             llm_response = await call_llm_api(
                 provider=llm_provider, model_name=agent_llm_model.model_name,
-                messages=messages, api_key=api_key
+                messages=messages, api_key=api_key, db=db
             )
             final_output = llm_response.get("message", {}).get("content", "No response from LLM.")
             await crud.add_agent_job_log(db, job_id, "thought", f"Chat mode response: {final_output}")
@@ -256,7 +257,7 @@ async def execute_agent_task(db: Session, user: User, request: schemas.AgentExec
                 await crud.add_agent_job_log(db, job_id, "thought", f"LLM call iteration {i+1}")
                 llm_response = await call_llm_api(
                     provider=llm_provider, model_name=agent_llm_model.model_name,
-                    messages=messages, api_key=api_key, tools=all_tools_schema
+                    messages=messages, api_key=api_key, tools=all_tools_schema, db=db
                 )
                 response_message = llm_response.get("message", {})
                 messages.append(response_message)
@@ -266,66 +267,66 @@ async def execute_agent_task(db: Session, user: User, request: schemas.AgentExec
                     break
                 tool_calls = response_message["tool_calls"]
                 await crud.add_agent_job_log(db, job_id, "thought", f"Decided to use tools: {[tc['function']['name'] for tc in tool_calls]}")
-                tool_results = []
-                for tool_call in tool_calls:
-                    function_name = tool_call['function']['name']
-                    function_args = json.loads(tool_call['function']['arguments'])
+                # request_human_input pauses the job: later calls of the turn are not run
+                human_input_at = next((index for index, tool_call in enumerate(tool_calls) if tool_call['function']['name'] == "request_human_input"), None)
+                if human_input_at is not None:
+                    tool_calls = tool_calls[:human_input_at + 1]
+                paused = False
+
+                async def log_tool_start(function_name: str, function_args: Dict[str, Any]) -> None:
                     await crud.add_agent_job_log(db, job_id, "command", f"Executing tool '{function_name}' with args: {function_args}")
-                    result_content = f"Error: Tool '{function_name}' not found."
 
+                async def run_tool(function_name: str, function_args: Dict[str, Any]) -> Any:
+                    nonlocal paused
                     tool_func = agent_tool_registry.get(function_name) # Check agent-specific registry
+                    if not tool_func:
+                        return f"Error: Tool '{function_name}' not found in registry."
+                    # Special handling for request_human_input
+                    if function_name == "request_human_input":
+                        # This tool will update job status and return a signal to pause
+                        result = await tool_func(db=db, job_id=job_id, **function_args)
+                        paused = result.get("status") == "awaiting_human_input"
+                        return result.get("message", "Human input requested.")
+                    elif function_name == "reflect":
+                        return await tool_func(db=db, user=user, job_id=job_id, **function_args)
+                    elif function_name == "generate_code":
+                        code_req = schemas.CodeGenerationRequest(**function_args)
+                        code_res = await tool_func(db, user, code_req)
+                        return code_res.generated_code if code_res.success else code_res.error_message
+                    elif function_name == "translate_shell_command":
+                        shell_req = schemas.ShellCommandTranslationRequest(**function_args)
+                        shell_res = await tool_func(db, user, shell_req)
+                        return shell_res.translated_command if shell_res.success else shell_res.error_message
+                    elif function_name == "perform_file_operation":
+                        file_req = schemas.FileOperationRequest(**function_args)
+                        file_res = await tool_func(user, file_req)
+                        return file_res.message
+                    elif function_name == "generate_reasoning":
+                        reason_req = schemas.ReasoningRequest(**function_args)
+                        reason_res = await tool_func(db, user, reason_req)
+                        return reason_res.summary if reason_res.success else reason_res.error_message
+                    elif function_name.startswith("git_"):
+                        return await tool_func(git_service=git_service, local_path=target_repo_path, **function_args)
+                    elif function_name == "execute_shell_command":
+                        return await tool_func(terminal_service=terminal_service, **function_args)
+                    elif function_name == "run_tests":
+                        return await tool_func(terminal_service=terminal_service, local_path=target_repo_path, **function_args)
+                    elif function_name == "store_context_item":
+                        return await tool_func(db=db, user=user, **function_args)
+                    elif function_name == "retrieve_context_items":
+                        return await tool_func(db=db, user=user, **function_args)
+                    return f"Error: Tool '{function_name}' not implemented in agent orchestration."
 
-                    if tool_func:
-                        try:
-                            # Special handling for request_human_input
-                            if function_name == "request_human_input":
-                                # This tool will update job status and return a signal to pause
-                                result = await tool_func(db=db, job_id=job_id, **function_args)
-                                if result.get("status") == "awaiting_human_input":
-                                    # Agent is waiting for human input, so we return immediately
-                                    await crud.add_agent_job_log(db, job_id, "info", "Agent paused, awaiting human input.")
-                                    return # Exit the task execution loop
-                                result_content = result.get("message", "Human input requested.")
-                            elif function_name == "reflect":
-                                result_content = await tool_func(db=db, user=user, job_id=job_id, **function_args)
-                            elif function_name == "generate_code":
-                                code_req = schemas.CodeGenerationRequest(**function_args)
-                                code_res = await tool_func(db, user, code_req)
-                                result_content = code_res.generated_code if code_res.success else code_res.error_message
-                            elif function_name == "translate_shell_command":
-                                shell_req = schemas.ShellCommandTranslationRequest(**function_args)
-                                shell_res = await tool_func(db, user, shell_req)
-                                result_content = shell_res.translated_command if shell_res.success else shell_res.error_message
-                            elif function_name == "perform_file_operation":
-                                file_req = schemas.FileOperationRequest(**function_args)
-                                file_res = await tool_func(user, file_req)
-                                result_content = file_res.message
-                            elif function_name == "generate_reasoning":
-                                reason_req = schemas.ReasoningRequest(**function_args)
-                                reason_res = await tool_func(db, user, reason_req)
-                                result_content = reason_res.summary if reason_res.success else reason_res.error_message
-                            elif function_name.startswith("git_"):
-                                result_content = await tool_func(git_service=git_service, local_path=target_repo_path, **function_args)
-                            elif function_name == "execute_shell_command":
-                                result_content = await tool_func(terminal_service=terminal_service, **function_args)
-                            elif function_name == "run_tests":
-                                result_content = await tool_func(terminal_service=terminal_service, local_path=target_repo_path, **function_args)
-                            elif function_name == "store_context_item":
-                                result_content = await tool_func(db=db, user=user, **function_args)
-                            elif function_name == "retrieve_context_items":
-                                result_content = await tool_func(db=db, user=user, **function_args)
-                            else:
-                                result_content = f"Error: Tool '{function_name}' not implemented in agent orchestration."
-                        except Exception as e:
-                            result_content = f"Error executing tool '{function_name}': {e}"
-                    else:
-                        result_content = f"Error: Tool '{function_name}' not found in registry."
-                    await crud.add_agent_job_log(db, job_id, "output", result_content)
-                    tool_results.append({
-                        "tool_call_id": tool_call['id'], "role": "tool",
-                        "name": function_name, "content": result_content,
-                    })
-                messages.extend(tool_results)
+                # Independent calls run concurrently; mutating tools on the repository stay ordered
+                tool_results = await ToolExecutor(default_path=target_repo_path).run(tool_calls, run_tool, on_start=log_tool_start)
+                for result in tool_results:
+                    if not (paused and result.name == "request_human_input"): # Already logged as human_input_needed
+                        await crud.add_agent_job_log(db, job_id, "output", result.content)
+                if paused:
+                    # Agent is waiting for human input, so we return immediately
+                    await crud.add_agent_job_log(db, job_id, "info", "Agent paused, awaiting human input.")
+                    return # Exit the task execution loop
+                messages.extend(result.message() for result in tool_results)
             
             # If loop finishes without breaking due to human input, update status
             if crud.get_agent_job(db, job_id, str(user.id)).status != "awaiting_human_input":
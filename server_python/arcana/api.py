@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import json
 import asyncio
 import logging
 
 from server_python.database import get_db, User as DBUser
 from server_python.auth import get_current_user
+from server_python.pagination import set_next_cursor
 from . import crud, schemas
 from server_python.schemas import ArcanaCliCommandResponse, ArcanaCliCommandRequest, ArcanaApiKeyResponse # Import ArcanaCliCommandResponse, ArcanaCliCommandRequest, and ArcanaApiKeyResponse from top-level schemas
 from . import code_generation_service
@@ -14,6 +15,7 @@ from . import shell_translation_service
 from . import reasoning_service
 from . import file_management_service
 from . import agent_orchestration_service
+from .job_queue import agent_job_queue
 
 # Initialize a logger for this module
 logger = logging.getLogger(__name__)
@@ -177,12 +179,11 @@ async def file_operations_endpoint(
 async def execute_arcana_agent_task(
     agent_id: str,
     request: schemas.AgentExecuteRequest,
-    background_tasks: BackgroundTasks,
     current_user: DBUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Executes a task for a specific Arcana Agent as a background job.
+    Executes a task for a specific Arcana Agent as a job on the durable agent job queue.
     """
     logger.info(f"User {current_user.id} requested to execute task for agent {agent_id}.")
     if str(request.agent_id) != agent_id:
@@ -200,32 +201,30 @@ async def execute_arcana_agent_task(
     )
     logger.info(f"Created job {job.id} for agent {agent_id}.")
 
-    background_tasks.add_task(
-        agent_orchestration_service.execute_agent_task,
-        db,
-        current_user,
-        request,
-        job.id,
-        initial_messages=initial_messages,
-        original_request_obj=request
-    )
-    logger.info(f"Added job {job.id} to background tasks for execution.")
+    agent_job_queue.enqueue(db, job.id)
+    logger.info(f"Added job {job.id} to the agent job queue for execution.")
 
-    return job
+    # Re-read through crud so message_history/original_request are deserialized for the response
+    return crud.get_agent_job(db, job_id=job.id, owner_id=str(current_user.id))
 
 @router.get("/agents/{agent_id}/jobs/", response_model=List[schemas.ArcanaAgentJobResponse])
 def get_agent_jobs(
     agent_id: str,
+    response: Response,
     current_user: DBUser = Depends(get_current_user),
     db: Session = Depends(get_db),
     skip: int = 0,
-    limit: int = 10
+    limit: int = 10,
+    cursor: Optional[str] = None
 ):
     """
-    Get all jobs for a specific agent.
+    Get jobs for a specific agent, newest first. Pass the X-Next-Cursor header of a
+    page back as `cursor` to fetch the next one.
     """
     logger.info(f"User {current_user.id} is fetching jobs for agent {agent_id}.")
-    return crud.get_agent_jobs_for_agent(db, agent_id=agent_id, owner_id=str(current_user.id), skip=skip, limit=limit)
+    jobs = crud.get_agent_jobs_for_agent(db, agent_id=agent_id, owner_id=str(current_user.id), skip=skip, limit=limit, cursor=cursor)
+    set_next_cursor(response, jobs, limit, "created_at")
+    return jobs
 
 @router.get("/jobs/{job_id}", response_model=schemas.ArcanaAgentJobResponse)
 def get_agent_job(
@@ -257,13 +256,12 @@ def get_agent_job_logs(
     if not job:
         logger.warning(f"User {current_user.id} failed to find job {job_id} while fetching logs.")
         raise HTTPException(status_code=404, detail="Job not found")
-    return job.logs
+    return crud.get_agent_job_logs(db, job_id=job_id)
 
 @router.post("/jobs/{job_id}/submit_human_input", response_model=schemas.ArcanaAgentJobResponse)
 async def submit_human_input(
     job_id: str,
     human_input_request: schemas.HumanInputRequest,
-    background_tasks: BackgroundTasks,
     current_user: DBUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -283,7 +281,7 @@ async def submit_human_input(
     updated_messages = job.message_history if job.message_history else []
     updated_messages.append(human_message)
 
-    crud.add_agent_job_log(db, job_id, "human_input", human_input_request.human_input)
+    await crud.add_agent_job_log(db, job_id, "human_input", human_input_request.human_input)
     crud.update_agent_job_status(db, job_id, "resumed", message_history=updated_messages)
     logger.info(f"Job {job_id} status updated to 'resumed' after receiving human input.")
 
@@ -291,16 +289,8 @@ async def submit_human_input(
         logger.error(f"Original request not found for job {job_id}. Cannot resume.")
         raise HTTPException(status_code=500, detail="Original request not found for resuming job.")
 
-    background_tasks.add_task(
-        agent_orchestration_service.execute_agent_task,
-        db,
-        current_user,
-        job.original_request,
-        job.id,
-        initial_messages=updated_messages,
-        original_request_obj=job.original_request
-    )
-    logger.info(f"Resumed job {job.id} and added to background tasks.")
+    agent_job_queue.enqueue(db, job.id)
+    logger.info(f"Resumed job {job.id} and added it to the agent job queue.")
 
     updated_job = crud.get_agent_job(db, job_id=job_id, owner_id=str(current_user.id))
     return updated_job
@@ -322,7 +312,6 @@ async def resume_agent_job(
 @router.post("/cli/execute", response_model=ArcanaCliCommandResponse)
 async def execute_cli_command(
     request: ArcanaCliCommandRequest,
-    background_tasks: BackgroundTasks, # Correctly inject BackgroundTasks
     db: Session = Depends(get_db)
 ):
     """
@@ -423,16 +412,8 @@ async def execute_cli_command(
             )
             logger.info(f"Created job {job.id} for agent {agent_id} for user {current_user.id}.")
 
-            # Run the agent task in the background
-            background_tasks.add_task( # Use the injected background_tasks
-                agent_orchestration_service.execute_agent_task,
-                db,
-                current_user,
-                agent_execute_request,
-                job.id,
-                initial_messages=[{"role": "user", "content": task_prompt}],
-                original_request_obj=agent_execute_request
-            )
+            # Run the agent task on the durable job queue
+            agent_job_queue.enqueue(db, job.id)
             response_output = f"Job ID: {job.id}"
             response_message = "Agent task initiated. Use 'arcana job-status <job_id>' to check progress."
             logger.info(f"User {current_user.id} successfully initiated 'agent-execute' for agent {agent_id}. Job ID: {job.id}.")
@@ -57,7 +57,8 @@ If the request is unclear, make reasonable assumptions and generate the most lik
             messages=messages,
             api_key=api_key,
             temperature=0.7, # Can be adjusted for creativity
-            top_p=1.0
+            top_p=1.0,
+            db=db
         )
         
         llm_content = llm_response_data["message"]["content"]
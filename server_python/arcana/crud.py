@@ -1,14 +1,19 @@
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 import uuid
 import json
-from typing import List, Optional, Dict, Any # Added Dict, Any
+from typing import List, Optional, Dict, Any, Set # Added Dict, Any
 from datetime import datetime
 import hashlib # Import hashlib
+import hmac
+import time
+import threading
 
 from . import schemas
 from server_python.schemas import ArcanaApiKeyCreate, UserCliConfigCreate # Import ArcanaApiKeyCreate and UserCliConfigCreate from top-level schemas
 from server_python.database import ArcanaAgent as DBArcanaAgent, ArcanaAgentJob as DBArcanaAgentJob, ArcanaAgentJobLog as DBArcanaAgentJobLog, ArcanaApiKey as DBArcanaApiKey
-from server_python.encryption_utils import encrypt_api_key, decrypt_api_key
+from server_python.pagination import paginate
+from server_python.encryption_utils import encrypt_api_key, decrypt_api_key, compute_api_key_fingerprint
 
 def get_agent(db: Session, agent_id: str, owner_id: str):
     """
@@ -102,7 +107,8 @@ def create_agent_job(
     owner_id: str, 
     goal: str, 
     message_history: Optional[List[Dict[str, Any]]] = None,
-    original_request: Optional[schemas.AgentExecuteRequest] = None
+    original_request: Optional[schemas.AgentExecuteRequest] = None,
+    parent_job_id: Optional[str] = None
 ) -> DBArcanaAgentJob:
     """
     Creates a new job for an Arcana agent.
@@ -114,7 +120,8 @@ def create_agent_job(
         goal=goal,
         status="starting",
         message_history=json.dumps(message_history) if message_history else None,
-        original_request=json.dumps(original_request.dict()) if original_request else None
+        original_request=json.dumps(original_request.dict()) if original_request else None,
+        parent_job_id=parent_job_id
     )
     db.add(db_job)
     db.commit()
@@ -125,38 +132,49 @@ def get_agent_job(db: Session, job_id: str, owner_id: str) -> Optional[DBArcanaA
     """
     Retrieves a specific agent job.
     """
-    db_job = db.query(DBArcanaAgentJob).filter(DBArcanaAgentJob.id == job_id, DBArcanaAgentJob.owner_id == owner_id).first()
+    # populate_existing: jobs are updated by queue workers in their own sessions, so always read fresh state
+    db_job = db.query(DBArcanaAgentJob).filter(DBArcanaAgentJob.id == job_id, DBArcanaAgentJob.owner_id == owner_id).populate_existing().first()
     if db_job:
-        if db_job.message_history:
-            db_job.message_history = json.loads(db_job.message_history)
-        if db_job.original_request:
-            db_job.original_request = schemas.AgentExecuteRequest.parse_raw(db_job.original_request)
+        _deserialize_agent_job(db_job)
     return db_job
 
+def _deserialize_agent_job(db_job: DBArcanaAgentJob):
+    """
+    Replaces the JSON columns with parsed values for API responses. The values are set as
+    committed state so the parsed objects are never flushed back into the Text columns.
+    """
+    if isinstance(db_job.message_history, str):
+        set_committed_value(db_job, "message_history", json.loads(db_job.message_history))
+    if isinstance(db_job.original_request, str):
+        set_committed_value(db_job, "original_request", schemas.AgentExecuteRequest.parse_raw(db_job.original_request))
+
 def update_agent_job_status(db: Session, job_id: str, status: str, final_output: str = None, message_history: Optional[List[Dict[str, Any]]] = None):
     """
     Updates the status, optionally the final output, and message history of an agent job.
     """
     db_job = db.query(DBArcanaAgentJob).filter(DBArcanaAgentJob.id == job_id).first()
     if db_job:
+        now = datetime.utcnow()
         db_job.status = status
+        db_job.updated_at = now
         if status in ["completed", "failed"]:
-            db_job.ended_at = datetime.utcnow()
+            db_job.ended_at = now
         if final_output:
             db_job.final_output = final_output
         if message_history is not None:
             db_job.message_history = json.dumps(message_history)
+        final_output_value = db_job.final_output
+        # No refresh: everything the status message needs is already known locally
         db.commit()
-        db.refresh(db_job)
 
         # Send status update via WebSocket
         status_message = {
             "type": "agent_status_update",
             "payload": {
                 "job_id": job_id,
-                "status": db_job.status,
-                "updated_at": db_job.updated_at.isoformat(),
-                "final_output": db_job.final_output
+                "status": status,
+                "updated_at": now.isoformat(),
+                "final_output": final_output_value
             }
         }
         # This needs to be awaited, but this function is not async.
@@ -168,34 +186,14 @@ def update_agent_job_status(db: Session, job_id: str, status: str, final_output:
     return db_job
 
 from server_python.orchestrator.connection_manager import manager # Import the WebSocket manager
+from .job_log_sink import agent_job_log_sink
 
 async def add_agent_job_log(db: Session, job_id: str, log_type: str, content: str):
     """
     Adds a log entry to an agent job and sends it via WebSocket.
+    The entry is pushed immediately and written to the database in batches (see job_log_sink).
     """
-    db_log = DBArcanaAgentJobLog(
-        id=str(uuid.uuid4()),
-        job_id=job_id,
-        timestamp=datetime.utcnow(),
-        log_type=log_type,
-        content=content
-    )
-    db.add(db_log)
-    db.commit()
-    db.refresh(db_log)
-
-    # Send log via WebSocket
-    log_message = {
-        "type": "agent_log",
-        "payload": {
-            "job_id": job_id,
-            "log_id": str(db_log.id),
-            "timestamp": db_log.timestamp.isoformat(),
-            "log_type": db_log.log_type,
-            "content": db_log.content
-        }
-    }
-    await manager.send_to_session(job_id, json.dumps(log_message))
+    return await agent_job_log_sink.add(db, job_id, log_type, content)
 
 def get_recent_agent_job_logs(db: Session, job_id: str, limit: int = 5) -> List[schemas.ArcanaAgentJobLogResponse]:
     """
@@ -204,22 +202,38 @@ def get_recent_agent_job_logs(db: Session, job_id: str, limit: int = 5) -> List[
     logs = db.query(DBArcanaAgentJobLog).filter(DBArcanaAgentJobLog.job_id == job_id)\
         .order_by(DBArcanaAgentJobLog.timestamp.desc())\
         .limit(limit).all()
-    return [schemas.ArcanaAgentJobLogResponse.from_orm(log) for log in reversed(logs)] # Return in chronological order
+    recent = [schemas.ArcanaAgentJobLogResponse.from_orm(log) for log in reversed(logs)] # Return in chronological order
+    # Include entries still waiting in the log buffer
+    recent += _unstored_pending_logs(job_id, {log.id for log in logs})
+    return recent[-limit:]
+
+def get_agent_job_logs(db: Session, job_id: str) -> List[schemas.ArcanaAgentJobLogResponse]:
+    """
+    Retrieves all log entries for an agent job in chronological order, including buffered entries.
+    """
+    logs = db.query(DBArcanaAgentJobLog).filter(DBArcanaAgentJobLog.job_id == job_id)\
+        .order_by(DBArcanaAgentJobLog.timestamp).all()
+    return [schemas.ArcanaAgentJobLogResponse.from_orm(log) for log in logs] + \
+        _unstored_pending_logs(job_id, {log.id for log in logs})
+
+def _unstored_pending_logs(job_id: str, stored_ids: Set[str]) -> List[schemas.ArcanaAgentJobLogResponse]:
+    """Buffered log entries of a job, minus those a concurrent flush has already committed."""
+    return [schemas.ArcanaAgentJobLogResponse(**record) for record in agent_job_log_sink.pending(job_id) if record["id"] not in stored_ids]
 
-def get_agent_jobs_for_agent(db: Session, agent_id: str, owner_id: str, skip: int = 0, limit: int = 10) -> List[DBArcanaAgentJob]:
+def get_agent_jobs_for_agent(db: Session, agent_id: str, owner_id: str, skip: int = 0, limit: int = 10, cursor: Optional[str] = None) -> List[DBArcanaAgentJob]:
     """
-    Retrieves all jobs for a specific agent.
+    Retrieves jobs for a specific agent, newest first.
     """
-    jobs = db.query(DBArcanaAgentJob).filter(
+    query = db.query(DBArcanaAgentJob).filter(
         DBArcanaAgentJob.agent_id == agent_id,
         DBArcanaAgentJob.owner_id == owner_id
-    ).order_by(DBArcanaAgentJob.created_at.desc()).offset(skip).limit(limit).all()
+    )
+    jobs = paginate(
+        query, DBArcanaAgentJob.created_at, DBArcanaAgentJob.id, skip=skip, limit=limit, cursor=cursor, descending=True
+    ).populate_existing().all()
     
     for job in jobs:
-        if job.message_history:
-            job.message_history = json.loads(job.message_history)
-        if job.original_request:
-            job.original_request = schemas.AgentExecuteRequest.parse_raw(job.original_request)
+        _deserialize_agent_job(job)
     return jobs
 
 
@@ -243,6 +257,7 @@ def create_api_key(db: Session, api_key_data: ArcanaApiKeyCreate, owner_id: str)
     db_api_key = DBArcanaApiKey(
         id=str(uuid.uuid4()),
         key=encrypted_key,
+        key_fingerprint=compute_api_key_fingerprint(raw_key),
         user_id=owner_id,
         name=api_key_data.name,
         expires_at=api_key_data.expires_at,
@@ -254,25 +269,71 @@ def create_api_key(db: Session, api_key_data: ArcanaApiKeyCreate, owner_id: str)
     db_api_key.raw_key = raw_key # Temporarily attach raw key for response
     return db_api_key
 
+# Short-lived cache of verified keys: fingerprint -> (api_key_id, cache expiry).
+# A hit skips decryption and resolves the key with a primary-key lookup; the
+# is_active/expires_at checks are still applied on every request.
+API_KEY_CACHE_TTL_SECONDS = 30
+_verified_api_key_cache: Dict[str, tuple] = {}
+_verified_api_key_cache_lock = threading.Lock()
+
+def _invalidate_api_key_cache(api_key_id: str):
+    with _verified_api_key_cache_lock:
+        for fingerprint, (cached_id, _) in list(_verified_api_key_cache.items()):
+            if cached_id == api_key_id:
+                _verified_api_key_cache.pop(fingerprint, None)
+
+def _is_usable_api_key(db_key: Optional[DBArcanaApiKey], now: datetime) -> bool:
+    return bool(db_key and db_key.is_active and (db_key.expires_at is None or db_key.expires_at > now))
+
 def get_api_key_by_key(db: Session, api_key: str) -> Optional[DBArcanaApiKey]:
     """
     Retrieves an Arcana API key by its raw (unencrypted) key.
-    This function iterates through active and non-expired keys and decrypts them for comparison.
+    The key is located through its HMAC fingerprint (a single indexed query) and the
+    stored ciphertext is decrypted once to confirm the match. Keys created before
+    fingerprints existed are fingerprinted on first successful use.
     """
+    fingerprint = compute_api_key_fingerprint(api_key)
+    if not fingerprint:
+        return None
     now = datetime.utcnow()
-    all_active_keys = db.query(DBArcanaApiKey).filter(
-        DBArcanaApiKey.is_active == True,
-        (DBArcanaApiKey.expires_at == None) | (DBArcanaApiKey.expires_at > now)
-    ).all()
-    for db_key in all_active_keys:
+
+    with _verified_api_key_cache_lock:
+        cached = _verified_api_key_cache.get(fingerprint)
+    if cached and cached[1] > time.monotonic():
+        db_key = db.query(DBArcanaApiKey).filter(DBArcanaApiKey.id == cached[0]).first()
+        if _is_usable_api_key(db_key, now):
+            return db_key
+        _invalidate_api_key_cache(cached[0])
+
+    db_key = db.query(DBArcanaApiKey).filter(DBArcanaApiKey.key_fingerprint == fingerprint).first()
+    if db_key is None:
+        db_key = _find_legacy_api_key(db, api_key, fingerprint)
+    elif not hmac.compare_digest(decrypt_api_key(db_key.key), api_key):
+        return None
+
+    if not _is_usable_api_key(db_key, now):
+        return None
+    with _verified_api_key_cache_lock:
+        _verified_api_key_cache[fingerprint] = (db_key.id, time.monotonic() + API_KEY_CACHE_TTL_SECONDS)
+    return db_key
+
+def _find_legacy_api_key(db: Session, api_key: str, fingerprint: str) -> Optional[DBArcanaApiKey]:
+    """
+    Fallback for keys that have not been backfilled yet (see
+    migrate_arcana_api_key_fingerprints). Only rows without a fingerprint are scanned.
+    """
+    for db_key in db.query(DBArcanaApiKey).filter(DBArcanaApiKey.key_fingerprint == None).all():
         try:
             decrypted_key = decrypt_api_key(db_key.key)
-            if decrypted_key == api_key:
-                return db_key
         except Exception as e:
             # Log decryption errors but don't expose them
             print(f"Error decrypting API key {db_key.id}: {e}")
             continue
+        if decrypted_key and hmac.compare_digest(decrypted_key, api_key):
+            db_key.key_fingerprint = fingerprint
+            db.commit()
+            db.refresh(db_key)
+            return db_key
     return None
 
 def get_api_keys_for_user(db: Session, owner_id: str, skip: int = 0, limit: int = 100) -> List[DBArcanaApiKey]:
@@ -290,6 +351,7 @@ def deactivate_api_key(db: Session, api_key_id: str, owner_id: str) -> Optional[
         db_api_key.is_active = False
         db.commit()
         db.refresh(db_api_key)
+        _invalidate_api_key_cache(db_api_key.id)
     return db_api_key
 
 def rotate_api_key(db: Session, api_key_id: str, owner_id: str, new_key_name: str) -> Optional[DBArcanaApiKey]:
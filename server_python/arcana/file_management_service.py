@@ -1,3 +1,4 @@
+import asyncio
 import os
 import shutil
 from datetime import datetime
@@ -116,9 +117,13 @@ def get_user_file_path(user_id: str, relative_path: str) -> str:
 async def perform_file_operation(user: User, request: schemas.FileOperationRequest) -> schemas.FileOperationResponse:
     """
     Performs file operations (read, write, delete, list, create_directory) within a user's sandboxed directory.
+    The file I/O runs in a worker thread, so concurrent tool calls do not block the event loop.
     """
+    return await asyncio.to_thread(_perform_file_operation, str(user.id), request)
+
+def _perform_file_operation(user_id: str, request: schemas.FileOperationRequest) -> schemas.FileOperationResponse:
     try:
-        target_path = get_user_file_path(str(user.id), request.path)
+        target_path = get_user_file_path(user_id, request.path)
 
         if request.action == "read":
             if not os.path.exists(target_path) or os.path.isdir(target_path):
@@ -163,7 +168,7 @@ async def perform_file_operation(user: User, request: schemas.FileOperationReque
                 last_mod = datetime.fromtimestamp(os.path.getmtime(entry_path))
                 file_list.append(schemas.FileInfo(
                     name=entry_name,
-                    path=os.path.relpath(entry_path, get_user_file_path(str(user.id), "")), # Relative to user's root
+                    path=os.path.relpath(entry_path, get_user_file_path(user_id, "")), # Relative to user's root
                     is_directory=is_dir,
                     size=size,
                     last_modified=last_mod
@@ -180,8 +185,8 @@ async def perform_file_operation(user: User, request: schemas.FileOperationReque
             if not request.new_path:
                 raise HTTPException(status_code=400, detail="new_path is required for rename operation.")
             
-            old_path_abs = get_user_file_path(str(user.id), request.path)
-            new_path_abs = get_user_file_path(str(user.id), request.new_path)
+            old_path_abs = get_user_file_path(user_id, request.path)
+            new_path_abs = get_user_file_path(user_id, request.new_path)
 
             if not os.path.exists(old_path_abs):
                 raise HTTPException(status_code=404, detail=f"File or directory '{request.path}' not found.")
@@ -198,7 +203,7 @@ async def perform_file_operation(user: User, request: schemas.FileOperationReque
         elif request.action == "read_many":
             content = ""
             for p in request.path:
-                path = get_user_file_path(str(user.id), p)
+                path = get_user_file_path(user_id, p)
                 if not os.path.exists(path) or os.path.isdir(path):
                     return schemas.FileOperationResponse(success=False, message=f"File not found or is a directory: {p}", error_message="File not found or is a directory.")
                 with open(path, "r") as f:
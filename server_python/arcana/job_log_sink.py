@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from server_python.database import ArcanaAgentJobLog as DBArcanaAgentJobLog
+from server_python.orchestrator.connection_manager import manager
+
+logger = logging.getLogger(__name__)
+
+ARCANA_JOB_LOG_BATCH_SIZE = int(os.getenv("ARCANA_JOB_LOG_BATCH_SIZE", "50"))
+ARCANA_JOB_LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("ARCANA_JOB_LOG_FLUSH_INTERVAL_SECONDS", "0.5"))
+
+
+class AgentJobLogSink:
+    """
+    Buffers ArcanaAgentJobLog records per job and writes them in bulk.
+
+    Each record is pushed to the job's WebSocket session as soon as it is added;
+    the database write happens later, when the job's buffer reaches `batch_size`,
+    after `flush_interval` seconds, or when flush() is called at the end of a job.
+    Records are written through the same database the caller's session is bound to.
+    """
+
+    def __init__(self, batch_size: int = ARCANA_JOB_LOG_BATCH_SIZE, flush_interval: float = ARCANA_JOB_LOG_FLUSH_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffers: Dict[str, List[Dict[str, Any]]] = {}
+        self._writing: Dict[str, List[Dict[str, Any]]] = {} # Taken from the buffer, not committed yet
+        self._binds: Dict[str, Any] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def add(self, db: Session, job_id: str, log_type: str, content: str) -> Dict[str, Any]:
+        record = {
+            "id": str(uuid.uuid4()),
+            "job_id": job_id,
+            "timestamp": datetime.utcnow(),
+            "log_type": log_type,
+            "content": content,
+        }
+        self._buffers.setdefault(job_id, []).append(record)
+        self._binds[job_id] = db.get_bind()
+
+        # Stream the record right away; persistence must not delay live output
+        log_message = {
+            "type": "agent_log",
+            "payload": {
+                "job_id": job_id,
+                "log_id": record["id"],
+                "timestamp": record["timestamp"].isoformat(),
+                "log_type": log_type,
+                "content": content
+            }
+        }
+        await manager.send_to_session(job_id, json.dumps(log_message))
+
+        if len(self._buffers[job_id]) >= self.batch_size:
+            await self.flush(job_id)
+        elif job_id not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[job_id] = loop.call_later(self.flush_interval, lambda: asyncio.ensure_future(self.flush(job_id)))
+        return record
+
+    def pending(self, job_id: str) -> List[Dict[str, Any]]:
+        """
+        Records added for a job that may not be in the database yet, oldest first.
+        Records being written are included until their write returns, so for a
+        moment a record can be both pending and stored: merge by id.
+        """
+        return self._writing.get(job_id, []) + self._buffers.get(job_id, [])
+
+    async def flush(self, job_id: Optional[str] = None) -> int:
+        """Writes buffered records for one job (or all jobs) in a single transaction each."""
+        if job_id is None:
+            written = 0
+            for pending_job_id in list(self._buffers):
+                written += await self.flush(pending_job_id)
+            return written
+
+        async with self._locks.setdefault(job_id, asyncio.Lock()):
+            timer = self._timers.pop(job_id, None)
+            if timer:
+                timer.cancel()
+            records = self._buffers.pop(job_id, [])
+            bind = self._binds.pop(job_id, None)
+            if not records or bind is None:
+                return 0
+            self._writing[job_id] = records
+            try:
+                if isinstance(bind, Connection):
+                    # A caller-owned connection (e.g. an open transaction) must stay on this thread
+                    self._write(bind, records)
+                else:
+                    await asyncio.to_thread(self._write, bind, records)
+            except Exception as e:
+                # Put the records back so a later flush can retry them
+                logger.error(f"Failed to write {len(records)} log records for Arcana job {job_id}: {e}", exc_info=True)
+                self._buffers[job_id] = records + self._buffers.get(job_id, [])
+                self._binds.setdefault(job_id, bind)
+                return 0
+            finally:
+                self._writing.pop(job_id, None)
+        if job_id not in self._buffers:
+            self._locks.pop(job_id, None)
+        return len(records)
+
+    @staticmethod
+    def _write(bind, records: List[Dict[str, Any]]) -> None:
+        db = Session(bind=bind)
+        try:
+            db.bulk_insert_mappings(DBArcanaAgentJobLog, records)
+            db.commit()
+        finally:
+            db.close()
+
+
+agent_job_log_sink = AgentJobLogSink()
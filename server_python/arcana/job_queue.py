@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from server_python.database import SessionLocal, ArcanaAgentJob as DBArcanaAgentJob, User as DBUser
+from server_python.llm_admission import BACKGROUND, llm_request_lane
+from . import crud, schemas
+from .job_log_sink import agent_job_log_sink
+
+logger = logging.getLogger(__name__)
+
+ARCANA_JOB_WORKERS = int(os.getenv("ARCANA_JOB_WORKERS", "2"))
+ARCANA_JOB_LEASE_SECONDS = int(os.getenv("ARCANA_JOB_LEASE_SECONDS", "60"))
+ARCANA_JOB_POLL_INTERVAL_SECONDS = float(os.getenv("ARCANA_JOB_POLL_INTERVAL_SECONDS", "1"))
+ARCANA_JOB_MAX_ATTEMPTS = int(os.getenv("ARCANA_JOB_MAX_ATTEMPTS", "3"))
+ARCANA_MAX_CONCURRENT_JOBS_PER_USER = int(os.getenv("ARCANA_MAX_CONCURRENT_JOBS_PER_USER", "2"))
+
+QUEUE_STATE_QUEUED = "queued"
+QUEUE_STATE_RUNNING = "running"
+QUEUE_STATE_DONE = "done"
+
+
+class AgentJobQueue:
+    """
+    Durable queue for Arcana agent jobs, backed by the `arcana_agent_jobs` table.
+
+    Jobs are enqueued by setting `queue_state` to "queued". A pool of async workers
+    claims jobs with a time-limited lease (renewed by heartbeats while the job runs),
+    each using its own DB session. Leases left behind by a crashed or restarted
+    process expire and the job is re-queued, up to ARCANA_JOB_MAX_ATTEMPTS.
+    No more than `max_jobs_per_user` jobs run concurrently for the same owner.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        workers: int = ARCANA_JOB_WORKERS,
+        lease_seconds: int = ARCANA_JOB_LEASE_SECONDS,
+        poll_interval: float = ARCANA_JOB_POLL_INTERVAL_SECONDS,
+        max_attempts: int = ARCANA_JOB_MAX_ATTEMPTS,
+        max_jobs_per_user: int = ARCANA_MAX_CONCURRENT_JOBS_PER_USER,
+    ):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_jobs_per_user = max_jobs_per_user
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # --- Producer side ---
+
+    def enqueue(self, db: Session, job_id: str) -> None:
+        """Marks a job as ready to run and wakes an idle worker."""
+        db.query(DBArcanaAgentJob).filter(DBArcanaAgentJob.id == job_id).update({
+            DBArcanaAgentJob.queue_state: QUEUE_STATE_QUEUED,
+            DBArcanaAgentJob.lease_owner: None,
+            DBArcanaAgentJob.lease_expires_at: None,
+        }, synchronize_session=False)
+        db.commit()
+        logger.info(f"Enqueued Arcana agent job {job_id}.")
+        self._notify()
+
+    def _notify(self) -> None:
+        if self._loop and self._wakeup and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # --- Lifecycle ---
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(f"{self.instance_id}:{n}")) for n in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+        logger.info(f"Arcana job queue started with {self.workers} workers ({self.instance_id}).")
+
+    async def stop(self) -> None:
+        """Stops the workers; jobs they were running are released back to the queue."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        db = self.session_factory()
+        try:
+            released = db.query(DBArcanaAgentJob).filter(
+                DBArcanaAgentJob.queue_state == QUEUE_STATE_RUNNING,
+                DBArcanaAgentJob.lease_owner.like(f"{self.instance_id}:%")
+            ).update({
+                DBArcanaAgentJob.queue_state: QUEUE_STATE_QUEUED,
+                DBArcanaAgentJob.lease_owner: None,
+                DBArcanaAgentJob.lease_expires_at: None,
+            }, synchronize_session=False)
+            db.commit()
+            if released:
+                logger.info(f"Released {released} in-flight Arcana jobs back to the queue.")
+        finally:
+            db.close()
+        self._wakeup = None
+        self._loop = None
+
+    # --- Leasing ---
+
+    def claim_next_job(self, db: Session, worker_id: str) -> Optional[str]:
+        """
+        Atomically leases the oldest queued job whose owner is below the concurrency cap.
+        The conditional UPDATE makes the claim safe across workers and processes.
+        """
+        now = datetime.utcnow()
+        running_per_owner: Dict[str, int] = dict(
+            db.query(DBArcanaAgentJob.owner_id, func.count(DBArcanaAgentJob.id))
+            .filter(DBArcanaAgentJob.queue_state == QUEUE_STATE_RUNNING)
+            .group_by(DBArcanaAgentJob.owner_id)
+            .all()
+        )
+        candidates = db.query(DBArcanaAgentJob.id, DBArcanaAgentJob.owner_id).filter(
+            DBArcanaAgentJob.queue_state == QUEUE_STATE_QUEUED
+        ).order_by(DBArcanaAgentJob.created_at).limit(50).all()
+
+        for job_id, owner_id in candidates:
+            if running_per_owner.get(owner_id, 0) >= self.max_jobs_per_user:
+                continue
+            claimed = db.query(DBArcanaAgentJob).filter(
+                DBArcanaAgentJob.id == job_id,
+                DBArcanaAgentJob.queue_state == QUEUE_STATE_QUEUED
+            ).update({
+                DBArcanaAgentJob.queue_state: QUEUE_STATE_RUNNING,
+                DBArcanaAgentJob.lease_owner: worker_id,
+                DBArcanaAgentJob.lease_expires_at: now + timedelta(seconds=self.lease_seconds),
+                DBArcanaAgentJob.heartbeat_at: now,
+                DBArcanaAgentJob.attempts: func.coalesce(DBArcanaAgentJob.attempts, 0) + 1,
+            }, synchronize_session=False)
+            db.commit()
+            if claimed:
+                return job_id
+        return None
+
+    def renew_lease(self, db: Session, job_id: str, worker_id: str) -> bool:
+        now = datetime.utcnow()
+        renewed = db.query(DBArcanaAgentJob).filter(
+            DBArcanaAgentJob.id == job_id,
+            DBArcanaAgentJob.lease_owner == worker_id,
+            DBArcanaAgentJob.queue_state == QUEUE_STATE_RUNNING
+        ).update({
+            DBArcanaAgentJob.lease_expires_at: now + timedelta(seconds=self.lease_seconds),
+            DBArcanaAgentJob.heartbeat_at: now,
+        }, synchronize_session=False)
+        db.commit()
+        return bool(renewed)
+
+    def release_job(self, db: Session, job_id: str, worker_id: str) -> None:
+        db.query(DBArcanaAgentJob).filter(
+            DBArcanaAgentJob.id == job_id,
+            DBArcanaAgentJob.lease_owner == worker_id
+        ).update({
+            DBArcanaAgentJob.queue_state: QUEUE_STATE_DONE,
+            DBArcanaAgentJob.lease_owner: None,
+            DBArcanaAgentJob.lease_expires_at: None,
+        }, synchronize_session=False)
+        db.commit()
+
+    def requeue_expired_leases(self, db: Session) -> int:
+        """Re-queues jobs whose lease expired; jobs out of attempts are marked failed."""
+        expired = db.query(DBArcanaAgentJob).filter(
+            DBArcanaAgentJob.queue_state == QUEUE_STATE_RUNNING,
+            DBArcanaAgentJob.lease_expires_at < datetime.utcnow()
+        ).all()
+        for job in expired:
+            logger.warning(f"Lease on Arcana job {job.id} held by {job.lease_owner} expired (attempt {job.attempts}).")
+            job.lease_owner = None
+            job.lease_expires_at = None
+            if (job.attempts or 0) >= self.max_attempts:
+                job.queue_state = QUEUE_STATE_DONE
+                job.status = "failed"
+                job.ended_at = datetime.utcnow()
+                job.final_output = f"Error: Job abandoned after {job.attempts} attempts."
+            else:
+                job.queue_state = QUEUE_STATE_QUEUED
+        db.commit()
+        return len(expired)
+
+    # --- Workers ---
+
+    async def _wait_for_work(self) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _worker(self, worker_id: str) -> None:
+        while True:
+            try:
+                db = self.session_factory()
+                try:
+                    job_id = self.claim_next_job(db, worker_id)
+                finally:
+                    db.close()
+                if job_id is None:
+                    await self._wait_for_work()
+                    continue
+                await self._run_job(job_id, worker_id)
+                # A slot was freed; another worker may be able to pick up a capped user's job
+                self._notify()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Arcana job worker {worker_id} error: {e}", exc_info=True)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _reaper(self) -> None:
+        while True:
+            try:
+                db = self.session_factory()
+                try:
+                    if self.requeue_expired_leases(db):
+                        self._notify()
+                finally:
+                    db.close()
+            except Exception as e:
+                logger.error(f"Arcana job lease reaper error: {e}", exc_info=True)
+            await asyncio.sleep(max(self.lease_seconds / 3, self.poll_interval))
+
+    async def _heartbeat(self, job_id: str, worker_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            db = self.session_factory()
+            try:
+                if not self.renew_lease(db, job_id, worker_id):
+                    logger.warning(f"Worker {worker_id} lost the lease on Arcana job {job_id}.")
+                    return
+            finally:
+                db.close()
+
+    async def _run_job(self, job_id: str, worker_id: str) -> None:
+        # Imported lazily: the orchestration service imports the cognisys tools, which enqueue jobs
+        from .agent_orchestration_service import execute_agent_task
+
+        db = self.session_factory()
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, worker_id))
+        try:
+            job = db.query(DBArcanaAgentJob).filter(DBArcanaAgentJob.id == job_id).first()
+            user = db.query(DBUser).filter(DBUser.id == job.owner_id).first() if job else None
+            if not job or not user or not job.original_request:
+                logger.error(f"Arcana job {job_id} cannot run: job, owner or original request is missing.")
+                if job:
+                    crud.update_agent_job_status(db, job_id, "failed", final_output="Error: Job could not be started.")
+                return
+            request = schemas.AgentExecuteRequest.parse_raw(job.original_request)
+            logger.info(f"Worker {worker_id} running Arcana job {job_id} (attempt {job.attempts}).")
+            # Agent jobs yield provider capacity to interactive chat
+            with llm_request_lane(BACKGROUND):
+                await execute_agent_task(db, user, request, job_id)
+        finally:
+            heartbeat.cancel()
+            try:
+                # Persist any buffered log entries before the job is reported as finished
+                await agent_job_log_sink.flush(job_id)
+                self.release_job(db, job_id, worker_id)
+            finally:
+                db.close()
+
+
+agent_job_queue = AgentJobQueue()
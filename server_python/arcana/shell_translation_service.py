@@ -81,7 +81,8 @@ Example JSON output:
             messages=messages,
             api_key=api_key,
             temperature=0.2, # Lower temperature for more deterministic output
-            top_p=0.9
+            top_p=0.9,
+            db=db
         )
         
         llm_content = llm_response_data["message"]["content"]
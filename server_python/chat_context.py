@@ -0,0 +1,179 @@
+"""
+Token-budgeted conversation history for chat completions.
+
+Each turn sends the conversation's rolling summary (if any) followed by the most
+recent messages, within a history budget derived from the model's `max_tokens`.
+When the unsummarized messages outgrow the budget, the oldest of them are folded
+into the stored summary until the rest fits in CHAT_HISTORY_LOW_WATER of it, so
+the summary is only rewritten every few turns, and a turn only ever reads the
+messages after the summary instead of the whole conversation.
+"""
+import logging
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .database import ChatMessage, ConversationSummary, LLMModel
+
+logger = logging.getLogger(__name__)
+
+# Share of the model's max_tokens given to the history; the rest is left for the new message and the reply
+CHAT_HISTORY_BUDGET_SHARE = float(os.getenv("CHAT_HISTORY_BUDGET_SHARE", "0.5"))
+# History budget for models without a max_tokens (or not configured as an LLMModel)
+CHAT_HISTORY_DEFAULT_BUDGET_TOKENS = int(os.getenv("CHAT_HISTORY_DEFAULT_BUDGET_TOKENS", "4096"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "512"))
+# After folding, the recent messages take at most this share of their budget
+CHAT_HISTORY_LOW_WATER = float(os.getenv("CHAT_HISTORY_LOW_WATER", "0.6"))
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4 # Role and separators
+FALLBACK_MESSAGE_TOKENS = 30 # Kept of each folded message when summarization fails
+
+# Message senders as stored in ChatMessage -> chat completion roles
+_ROLES = {"user": "user", "llm": "assistant", "assistant": "assistant", "system": "system"}
+
+# (previous summary, messages to fold in, max summary tokens) -> new summary
+Summarizer = Callable[[Optional[str], List[Dict[str, str]], int], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    """A cheap token estimate (about four characters per token) for budgeting."""
+    return -(-len(text or "") // CHARS_PER_TOKEN)
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def history_budget(db: Session, model_name: Optional[str]) -> int:
+    """Tokens the history (summary and recent messages) may use for this model."""
+    max_tokens = None
+    if model_name:
+        max_tokens = db.query(LLMModel.max_tokens).filter(LLMModel.model_name == model_name, LLMModel.max_tokens != None).limit(1).scalar()
+    if not max_tokens:
+        return CHAT_HISTORY_DEFAULT_BUDGET_TOKENS
+    return max(1, int(max_tokens * CHAT_HISTORY_BUDGET_SHARE))
+
+
+def to_chat_message(message: ChatMessage) -> Dict[str, str]:
+    return {"role": _ROLES.get(message.sender, "user"), "content": message.message_content}
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+
+def fallback_summary(previous_summary: Optional[str], messages: Sequence[Dict[str, str]], max_tokens: int) -> str:
+    """
+    Used when no summarizer is available or it fails: keeps the previous summary
+    and the start of each folded message, dropping the oldest text beyond the cap.
+    """
+    lines = [previous_summary] if previous_summary else []
+    lines += [f"{message['role']}: {truncate_to_tokens(' '.join(message['content'].split()), FALLBACK_MESSAGE_TOKENS)}" for message in messages]
+    text = "\n".join(lines)
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else "…" + text[-(max_chars - 1):]
+
+
+def summary_message(summary: str) -> Dict[str, str]:
+    return {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+
+async def assemble_history(db: Session, owner_id: str, conversation_id: str, model_name: Optional[str] = None,
+                           exclude_message_id: Optional[str] = None, summarize: Optional[Summarizer] = None) -> List[Dict[str, str]]:
+    """
+    Returns the history messages to send before the new message: the rolling
+    summary as a system message, then the recent messages, oldest first.
+    `exclude_message_id` is the new message when it has already been saved.
+    """
+    budget = history_budget(db, model_name)
+    summary_cap = min(CHAT_SUMMARY_MAX_TOKENS, budget // 4)
+    window = budget - summary_cap
+
+    summary = db.get(ConversationSummary, str(conversation_id))
+    query = db.query(ChatMessage).filter(ChatMessage.conversation_id == str(conversation_id), ChatMessage.user_id == owner_id)
+    if exclude_message_id:
+        query = query.filter(ChatMessage.id != str(exclude_message_id))
+    if summary is not None:
+        query = query.filter(or_(
+            ChatMessage.timestamp > summary.covered_until,
+            and_(ChatMessage.timestamp == summary.covered_until, ChatMessage.id > summary.covered_message_id),
+        ))
+    recent = query.order_by(ChatMessage.timestamp, ChatMessage.id).all()
+    recent_messages = [to_chat_message(message) for message in recent]
+    sizes = [message_tokens(message) for message in recent_messages]
+
+    total = sum(sizes)
+    if total > window:
+        fold = 0
+        low_water = window * CHAT_HISTORY_LOW_WATER
+        while fold < len(recent) and total > low_water:
+            total -= sizes[fold]
+            fold += 1
+        summary = await fold_into_summary(db, str(conversation_id), summary, recent[:fold], recent_messages[:fold], summary_cap, summarize)
+        recent_messages = recent_messages[fold:]
+
+    history = [summary_message(summary.content)] if summary is not None else []
+    return history + recent_messages
+
+
+def _insert(db: Session):
+    """The dialect's INSERT, which supports ON CONFLICT."""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(ConversationSummary.__table__)
+
+
+async def fold_into_summary(db: Session, conversation_id: str, summary: Optional[ConversationSummary],
+                            folded: Sequence[ChatMessage], folded_messages: List[Dict[str, str]], max_tokens: int,
+                            summarize: Optional[Summarizer] = None) -> ConversationSummary:
+    """Folds `folded` (the oldest unsummarized messages) into the conversation's stored summary."""
+    previous = summary.content if summary is not None else None
+    content = None
+    if summarize is not None:
+        try:
+            content = await summarize(previous, folded_messages, max_tokens)
+        except Exception as e:
+            logger.warning(f"Summarizing conversation {conversation_id} failed: {e}")
+        if content is not None and (not content.strip() or content.startswith("Error:")):
+            logger.warning(f"Summarizing conversation {conversation_id} failed: {content}")
+            content = None
+    if content is None:
+        content = fallback_summary(previous, folded_messages, max_tokens)
+    content = truncate_to_tokens(content.strip(), max_tokens)
+
+    values = dict(
+        conversation_id=conversation_id, content=content,
+        covered_until=folded[-1].timestamp, covered_message_id=folded[-1].id,
+        covered_messages=((summary.covered_messages or 0) if summary is not None else 0) + len(folded),
+        updated_at=datetime.utcnow(),
+    )
+    table = ConversationSummary.__table__
+    statement = _insert(db).values(**values)
+    # Concurrent turns of a conversation may fold at the same time: the summary covering more messages wins
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.conversation_id],
+        set_={name: statement.excluded[name] for name in values if name != "conversation_id"},
+        where=tuple_(table.c.covered_until, table.c.covered_message_id)
+        < tuple_(statement.excluded.covered_until, statement.excluded.covered_message_id),
+    ))
+    db.commit()
+    logger.info(f"Folded {len(folded)} messages into the summary of conversation {conversation_id}.")
+    return db.query(ConversationSummary).filter(ConversationSummary.conversation_id == conversation_id).one()
+
+
+def summarization_prompt(previous_summary: Optional[str], messages: Sequence[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+    """Chat messages asking a model to update a conversation summary."""
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    words = max(20, int(max_tokens * 0.75))
+    return [
+        {"role": "system", "content": (
+            "You maintain a running summary of a conversation between a user and an assistant. "
+            "Update the summary with the new messages. Keep facts, decisions, names, numbers and open "
+            f"questions the rest of the conversation may rely on. Answer with the summary only, in at most {words} words."
+        )},
+        {"role": "user", "content": f"Current summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"},
+    ]
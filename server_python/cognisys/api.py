@@ -1,15 +1,23 @@
 import httpx
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Any, Dict, List, Optional
 import logging
 import os
 
 from server_python.database import get_db, User as DBUser
 from server_python.auth import get_current_user, PermissionChecker
+from server_python.pagination import set_next_cursor
 from . import crud, schemas, llm_interaction
 from .llm_interaction import process_chat_request
+from .routing_engine import routing_rule_cache
+from .intent_classifier import intent_cache
 from server_python.terminal.service import TerminalService
+from server_python.llm_client_registry import provider_clients
+from server_python.llm_response_cache import llm_response_cache
+from server_python.single_flight import llm_request_flights
+from server_python.llm_admission import provider_admission
+from server_python.llm_resilience import llm_latencies, provider_breakers
 
 # Initialize a logger for this module
 logger = logging.getLogger(__name__)
@@ -51,6 +59,8 @@ def update_llm_provider(provider_id: str, provider: schemas.LLMProviderUpdate, c
     if db_provider is None:
         logger.warning(f"Admin user {current_user.id} failed to update non-existent LLM provider {provider_id}.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="LLM Provider not found")
+    # Drop the pooled HTTP client so the next call picks up a changed base_url or key
+    provider_clients.invalidate(provider_id)
     logger.info(f"LLM provider {provider_id} updated successfully.")
     return db_provider
 
@@ -61,6 +71,7 @@ def delete_llm_provider(provider_id: str, current_user: DBUser = Depends(Permiss
     if db_provider is None:
         logger.warning(f"Admin user {current_user.id} failed to delete non-existent LLM provider {provider_id}.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="LLM Provider not found")
+    provider_clients.invalidate(provider_id)
     logger.info(f"LLM provider {provider_id} deleted successfully.")
     return {"ok": True}
 
@@ -116,6 +127,7 @@ async def test_llm_provider_connection(provider_id: str, current_user: DBUser =
 def create_llm_model(model: schemas.LLMModelCreate, current_user: DBUser = Depends(PermissionChecker(["admin_access"])), db: Session = Depends(get_db)):
     logger.info(f"Admin user {current_user.id} creating new LLM model '{model.model_name}'.")
     db_model = crud.create_llm_model(db=db, model=model)
+    routing_rule_cache.invalidate() # Rules may target this model name
     logger.info(f"LLM model '{db_model.model_name}' created with ID {db_model.id}.")
     return db_model
 
@@ -141,6 +153,7 @@ def update_llm_model(model_id: str, model: schemas.LLMModelUpdate, current_user:
     if db_model is None:
         logger.warning(f"Admin user {current_user.id} failed to update non-existent LLM model {model_id}.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="LLM Model not found")
+    routing_rule_cache.invalidate()
     logger.info(f"LLM model {model_id} updated successfully.")
     return db_model
 
@@ -151,6 +164,7 @@ def delete_llm_model(model_id: str, current_user: DBUser = Depends(PermissionChe
     if db_model is None:
         logger.warning(f"Admin user {current_user.id} failed to delete non-existent LLM model {model_id}.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="LLM Model not found")
+    routing_rule_cache.invalidate()
     logger.info(f"LLM model {model_id} deleted successfully.")
     return {"ok": True}
 
@@ -160,13 +174,15 @@ def delete_llm_model(model_id: str, current_user: DBUser = Depends(PermissionChe
 def create_routing_rule(rule: schemas.RoutingRuleCreate, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
     logger.info(f"User {current_user.id} creating new routing rule '{rule.name}'.")
     db_rule = crud.create_routing_rule(db=db, rule=rule, owner_id=str(current_user.id))
+    routing_rule_cache.invalidate(str(current_user.id))
     logger.info(f"Routing rule '{db_rule.name}' created with ID {db_rule.id} for user {current_user.id}.")
     return db_rule
 
 @router.get("/routing-rules/", response_model=List[schemas.RoutingRuleResponse])
-def read_routing_rules(skip: int = 0, limit: int = 100, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+def read_routing_rules(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
     logger.info(f"User {current_user.id} reading routing rules.")
-    rules = crud.get_routing_rules(db, skip=skip, limit=limit)
+    rules = crud.get_routing_rules(db, skip=skip, limit=limit, cursor=cursor)
+    set_next_cursor(response, rules, limit, "created_at")
     return rules
 
 @router.get("/routing-rules/{rule_id}", response_model=schemas.RoutingRuleResponse)
@@ -185,6 +201,7 @@ def update_routing_rule(rule_id: str, rule: schemas.RoutingRuleUpdate, current_u
     if db_rule is None:
         logger.warning(f"User {current_user.id} failed to update non-existent routing rule {rule_id}.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Routing Rule not found")
+    routing_rule_cache.invalidate(db_rule.owner_id)
     logger.info(f"Routing rule {rule_id} updated successfully for user {current_user.id}.")
     return db_rule
 
@@ -195,6 +212,7 @@ def delete_routing_rule(rule_id: str, current_user: DBUser = Depends(get_current
     if db_rule is None:
         logger.warning(f"User {current_user.id} failed to delete non-existent routing rule {rule_id}.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Routing Rule not found")
+    routing_rule_cache.invalidate(db_rule.owner_id)
     logger.info(f"Routing rule {rule_id} deleted successfully.")
     return {"ok": True}
 
@@ -244,12 +262,34 @@ async def detect_user_intent(
     logger.info(f"Intent detected for user {current_user.id}: {response.intent}")
     return response
 
+@router.get("/llm-cache/stats", response_model=Dict[str, Any])
+def get_llm_cache_stats(current_user: DBUser = Depends(get_current_user)):
+    """
+    Hit/miss counters and memory use of the LLM response cache in this worker,
+    and how many requests were coalesced with an identical one in flight.
+    """
+    return {**llm_response_cache.stats(), "single_flight": llm_request_flights.stats()}
+
+@router.get("/llm-admission/stats", response_model=Dict[str, Any])
+def get_llm_admission_stats(current_user: DBUser = Depends(get_current_user)):
+    """
+    Per provider: the current adaptive concurrency limit, in-flight requests,
+    and queue depth and wait times of the interactive and background lanes.
+    """
+    return provider_admission.stats()
+
+@router.get("/llm-resilience/stats", response_model=Dict[str, Any])
+def get_llm_resilience_stats(current_user: DBUser = Depends(get_current_user)):
+    """Circuit breaker state per provider, and how often requests were hedged."""
+    return {"circuits": provider_breakers.stats(), "hedging": llm_latencies.stats()}
+
 ### System Prompt Management ###
 
 @router.post("/system-prompts/", response_model=schemas.SystemPromptResponse, status_code=status.HTTP_201_CREATED)
 def create_system_prompt(prompt: schemas.SystemPromptCreate, current_user: DBUser = Depends(PermissionChecker(["admin_access"])), db: Session = Depends(get_db)):
     logger.info(f"Admin user {current_user.id} creating new system prompt '{prompt.name}'.")
     db_prompt = crud.create_system_prompt(db=db, prompt=prompt)
+    intent_cache.clear() # Cached intents may come from the previous intent_detection_prompt
     logger.info(f"System prompt '{db_prompt.name}' created with ID {db_prompt.id}.")
     return db_prompt
 
@@ -275,6 +315,7 @@ def update_system_prompt(prompt_id: str, prompt: schemas.SystemPromptUpdate, cur
     if db_prompt is None:
         logger.warning(f"Admin user {current_user.id} failed to update non-existent system prompt {prompt_id}.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="System Prompt not found")
+    intent_cache.clear() # Cached intents may come from the previous intent_detection_prompt
     logger.info(f"System prompt {prompt_id} updated successfully.")
     return db_prompt
 
@@ -285,6 +326,7 @@ def delete_system_prompt(prompt_id: str, current_user: DBUser = Depends(Permissi
     if db_prompt is None:
         logger.warning(f"Admin user {current_user.id} failed to delete non-existent system prompt {prompt_id}.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="System Prompt not found")
+    intent_cache.clear() # Cached intents may come from the previous intent_detection_prompt
     logger.info(f"System prompt {prompt_id} deleted successfully.")
     return {"ok": True}
 
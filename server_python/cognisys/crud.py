@@ -9,6 +9,7 @@ from server_python.encryption_utils import encrypt_api_key, decrypt_api_key, Inv
 from . import schemas # Add this import
 
 from server_python.database import LLMProvider, LLMModel, RoutingRule, RoutingRule as DBRoutingRule, SystemPrompt # Changed from ..database
+from server_python.pagination import paginate
 from .schemas import LLMProviderCreate, LLMProviderUpdate, LLMModelCreate, LLMModelUpdate, RoutingRuleCreate, RoutingRuleUpdate, SystemPromptCreate, SystemPromptUpdate
 
 logger = logging.getLogger(__name__)
@@ -229,8 +230,8 @@ def get_user_preferred_model_details(db: Session, user_id: str) -> Optional[Dict
 def get_routing_rule(db: Session, rule_id: str):
     return db.query(DBRoutingRule).filter(DBRoutingRule.id == rule_id).first()
 
-def get_routing_rules(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(DBRoutingRule).offset(skip).limit(limit).all()
+def get_routing_rules(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return paginate(db.query(DBRoutingRule), DBRoutingRule.created_at, DBRoutingRule.id, skip=skip, limit=limit, cursor=cursor).all()
 
 def create_routing_rule(db: Session, rule: schemas.RoutingRuleCreate, owner_id: str):
     db_rule = DBRoutingRule(
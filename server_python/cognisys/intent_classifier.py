@@ -0,0 +1,117 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from .schemas import IntentDetectionResponse
+
+# Local answers at or above this confidence skip the LLM intent detection call
+INTENT_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("INTENT_FAST_PATH_MIN_CONFIDENCE", "0.8"))
+INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "1024"))
+INTENT_CACHE_TTL_SECONDS = float(os.getenv("INTENT_CACHE_TTL_SECONDS", "3600"))
+# Cues are matched against this many leading characters of the normalized prompt
+INTENT_CLASSIFIER_MAX_CHARS = int(os.getenv("INTENT_CLASSIFIER_MAX_CHARS", "2048"))
+
+# Up to eight words between a verb and its object. A bounded gap keeps each search
+# linear in the prompt length, where ".*" backtracks quadratically on long prompts.
+_GAP = r"\W+(?:\w+\W+){0,8}?"
+
+# Weighted cues for the categories of the intent_detection_prompt. A weight of 4 is
+# a decisive cue on its own; lower weights only add up with other cues.
+_RULES: Dict[str, List[Tuple[str, float]]] = {
+    "shell_command": [
+        (r"\b(run|execute)" + _GAP + r"(command|in (the )?(terminal|shell|console))\b", 4.0),
+        (r"^\s*(sudo|ls|cd|pwd|git|npm|npx|pip3?|docker|kubectl|grep|chmod|chown|curl|wget|apt(-get)?|brew|systemctl|ps|kill|tail)\s", 4.0),
+        (r"\b(terminal|shell|bash|zsh|powershell|command line)\b", 2.0),
+        (r"\bcommand\b", 1.5),
+    ],
+    "code_generation": [
+        (r"\b(write|generate|implement|create|refactor|fix|debug|optimi[sz]e)" + _GAP + r"(function|class|method|code|program|regex|unit tests?|component|algorithm|endpoint)\b", 4.0),
+        (r"```", 3.0),
+        (r"\b(traceback|stack trace|exception|syntax error|compile error|segfault)\b", 2.5),
+        (r"\b(python|javascript|typescript|java|rust|golang|c\+\+|c#|sql|react|html|css)\b", 1.5),
+    ],
+    "file_operation": [
+        (r"\b(create|read|write|delete|remove|rename|move|copy|list|open|edit|append to|save)" + _GAP + r"(files?|folders?|director(y|ies))\b", 4.0),
+        (r"\b[\w.-]+\.(txt|md|json|csv|py|js|ts|ya?ml|log|ini|cfg|toml|env)\b", 1.5),
+    ],
+    "arcana_agent_management": [
+        (r"\b(create|list|update|delete|remove|show|start|stop|configure)" + _GAP + r"agents?\b", 3.0),
+        (r"\barcana\b", 2.0),
+    ],
+    "conversation": [
+        (r"^\s*(hi|hello|hey|good (morning|afternoon|evening)|thanks|thank you)\b", 4.0),
+        (r"\b(explain|tell me about|what is|what are|who is|who was)\b", 2.0),
+        (r"\?\s*$", 1.0),
+    ],
+}
+_COMPILED_RULES: Dict[str, List[Tuple[Pattern, float]]] = {
+    intent: [(re.compile(pattern), weight) for pattern, weight in cues] for intent, cues in _RULES.items()
+}
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+
+def classify_intent_locally(prompt: str) -> IntentDetectionResponse:
+    """
+    Scores the prompt against keyword/regex cues per intent. Confidence is the top
+    score relative to the runner-up (plus one, so a lone weak cue stays low):
+    one decisive cue scores 0.8, competing cues pull it down. Only the first
+    INTENT_CLASSIFIER_MAX_CHARS characters are scored, as this runs on the event loop.
+    """
+    text = normalize_prompt(prompt)[:INTENT_CLASSIFIER_MAX_CHARS]
+    scores = sorted(
+        ((sum(weight for pattern, weight in cues if pattern.search(text)), intent) for intent, cues in _COMPILED_RULES.items()),
+        reverse=True,
+    )
+    (top, intent), (runner_up, _) = scores[0], scores[1]
+    if top == 0:
+        return IntentDetectionResponse(intent="unknown", confidence=0.0, reasoning="No local intent cues matched.")
+    return IntentDetectionResponse(
+        intent=intent,
+        confidence=round(top / (top + runner_up + 1.0), 3),
+        reasoning="Local keyword classifier.",
+    )
+
+
+class IntentCache:
+    """LRU cache of recent prompt -> intent results, keyed by the normalized prompt."""
+
+    def __init__(self, max_size: int = INTENT_CACHE_SIZE, ttl: float = INTENT_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, IntentDetectionResponse]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, prompt: str) -> Optional[IntentDetectionResponse]:
+        key = normalize_prompt(prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, prompt: str, response: IntentDetectionResponse) -> None:
+        if self.max_size <= 0:
+            return
+        key = normalize_prompt(prompt)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+intent_cache = IntentCache()
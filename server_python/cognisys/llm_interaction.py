@@ -1,14 +1,24 @@
 from sqlalchemy.orm import Session
-from typing import Dict, Any, List, Optional # Added Optional
+from typing import Dict, Any, List, Optional, AsyncIterator, Awaitable, Callable, Iterator, Tuple # Added Optional
+from contextlib import AsyncExitStack
 import json
+import logging
 import os
+import sys
 import httpx
 from fastapi import HTTPException, BackgroundTasks
 
 from server_python.database import LLMProvider, LLMModel, RoutingRule, User # Changed from ..database
 from .crud import decrypt_api_key # Import the decrypt function
 from .schemas import IntentDetectionResponse # Import the new schema
-from server_python.llm_service import get_openrouter_completion # Import the generic LLM completion service
+from server_python.llm_service import get_openrouter_completion, iter_sse_chunks # Import the generic LLM completion service
+from server_python.llm_client_registry import provider_clients
+from server_python.llm_response_cache import llm_response_cache, response_cache_key
+from server_python.single_flight import llm_request_flights
+from server_python.llm_admission import provider_admission
+from server_python.llm_resilience import ProviderError, call_deadline, call_with_resilience, deadline_exceeded, is_failover_error, provider_breakers
+
+logger = logging.getLogger(__name__)
 
 # Placeholder for LLM API call function
 async def call_llm_api(
@@ -18,8 +28,32 @@ async def call_llm_api(
     messages: List[Dict[str, Any]], # Now required
     tools: Optional[List[Dict[str, Any]]] = None,
     temperature: float = 0.7, # Add temperature
-    top_p: float = 1.0 # Add top_p
+    top_p: float = 1.0, # Add top_p
+    stream: bool = False,
+    cache: Optional[bool] = None,
+    db: Optional[Session] = None,
+    deadline: Optional[float] = None
 ) -> Dict[str, Any]:
+    """
+    Calls the provider's chat completion API and returns the complete response.
+    With stream=True, returns the async iterator from stream_llm_api instead.
+
+    Low-temperature calls are answered from llm_response_cache when the same
+    request was made before; `cache=True` caches any call, `cache=False` opts out.
+    Concurrent identical requests are coalesced into one upstream call.
+    Transient provider errors are retried (see llm_resilience); given `db`, a call
+    the provider still can't serve fails over to another active model of the
+    same role or type (see failover_candidates). Retries and failovers stop at
+    `deadline` (a time.monotonic() value, LLM_CALL_DEADLINE_SECONDS from now by
+    default); a call still running then fails with 504.
+    """
+    if deadline is None:
+        deadline = call_deadline()
+    if stream:
+        if db is not None:
+            return _stream_with_failover(db, provider, model_name, api_key, messages, tools=tools, temperature=temperature, top_p=top_p, deadline=deadline)
+        return stream_llm_api(provider, model_name, api_key, messages, tools=tools, temperature=temperature, top_p=top_p, deadline=deadline)
+
     headers = {}
     payload = {}
     api_endpoint = ""
@@ -30,6 +64,13 @@ async def call_llm_api(
         # This part will be overridden by mocker in tests, but it's good to have a default
         return {"message": {"content": "Mock LLM response"}}
 
+    cache_key = None
+    if llm_response_cache.should_cache(temperature, cache):
+        cache_key = response_cache_key(provider.id, provider.base_url, model_name, messages, tools=tools, temperature=temperature, top_p=top_p)
+        cached_response = await llm_response_cache.aget(cache_key)
+        if cached_response is not None:
+            return cached_response
+
     # Determine provider type and configure request accordingly
     if "openrouter" in provider.base_url.lower(): # Assuming OpenRouter for now
         print(f"DEBUG: OpenRouter API Key (first 5 chars): {api_key[:5] if api_key else 'None'}")
@@ -80,21 +121,26 @@ async def call_llm_api(
     else:
         raise HTTPException(status_code=500, detail=f"Unsupported LLM provider: {provider.name}")
 
-    try:
-        async with httpx.AsyncClient() as client:
-            if "generativelanguage.googleapis.com" in provider.base_url.lower():
-                response = await client.post(api_endpoint, headers=headers, json=payload, timeout=60.0)
-            else: # Default to JSON payload for other providers like OpenRouter
-                response = await client.post(api_endpoint, headers=headers, json=payload, timeout=60.0)
-            
-            response.raise_for_status()
+    async def send_request() -> Dict[str, Any]:
+        try:
+            # Reuse the provider's pooled keep-alive client instead of opening a new connection per call
+            client = provider_clients.get_client(provider.id, provider.base_url, api_key)
+
+            async def post() -> httpx.Response:
+                # Wait for a slot under the provider's adaptive concurrency limit (429s and timeouts lower it)
+                async with provider_admission.slot(provider.id):
+                    response = await client.post(api_endpoint, headers=headers, json=payload, timeout=60.0)
+                    response.raise_for_status()
+                    return response
+
+            response = await call_with_resilience(provider.id, f"{provider.id}:{model_name}", post, deadline=deadline)
             response_data = response.json()
-            
+        
             # Flexible response handling
             if "openrouter" in provider.base_url.lower():
                 message = response_data['choices'][0]['message']
                 usage = response_data.get('usage', {})
-                return {
+                result = {
                     "message": message, # This can contain 'content' or 'tool_calls'
                     "prompt_tokens": usage.get('prompt_tokens', 0),
                     "completion_tokens": usage.get('completion_tokens', 0),
@@ -107,22 +153,219 @@ async def call_llm_api(
                 # For now, estimate based on content length
                 prompt_tokens = sum(len(msg["content"].split()) for msg in messages if "content" in msg)
                 completion_tokens = len(content.split())
-                return {
+                result = {
                     "message": {"role": "assistant", "content": content},
                     "prompt_tokens": prompt_tokens,
                     "completion_tokens": completion_tokens,
                     "total_tokens": prompt_tokens + completion_tokens,
                     "model_used": model_name
                 }
+            if cache_key is not None:
+                await llm_response_cache.aput(cache_key, result)
+            return result
+        except httpx.RequestError as e:
+            print(f"HTTPX Request Error: {e}")
+            raise ProviderError(status_code=500, detail=f"LLM API request failed: {e.__class__.__name__} - {e}")
+        except httpx.HTTPStatusError as e:
+            print(f"HTTPX Status Error: {e.response.status_code} - {e.response.text}")
+            raise ProviderError(status_code=e.response.status_code, detail=f"LLM API returned an error: {e.response.status_code} - {e.response.text}")
+        except HTTPException:
+            raise # Circuit open, no admission slot or out of time: keep the 503/504
+        except Exception as e:
+            print(f"An unexpected error occurred during LLM API call: {e}")
+            raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+    # Identical requests already in flight (from other users or jobs) share one upstream call
+    flight_key = cache_key or response_cache_key(provider.id, provider.base_url, model_name, messages, tools=tools, temperature=temperature, top_p=top_p)
+    try:
+        return await llm_request_flights.run(flight_key, send_request)
+    except HTTPException as e:
+        if db is None or not is_failover_error(e):
+            raise
+        for alternate_model, alternate_provider, alternate_key in failover_candidates(db, provider, model_name):
+            if deadline_exceeded(deadline):
+                break
+            logger.warning(f"LLM call to {model_name} on {provider.name} failed ({e.status_code}); failing over to {alternate_model.model_name} on {alternate_provider.name}.")
+            try:
+                return await call_llm_api(alternate_provider, alternate_model.model_name, alternate_key, messages, tools=tools,
+                                          temperature=temperature, top_p=top_p, cache=cache, deadline=deadline)
+            except HTTPException as alternate_error:
+                if not is_failover_error(alternate_error):
+                    raise
+        raise
+
+
+def failover_candidates(db: Session, provider: LLMProvider, model_name: str) -> Iterator[Tuple[LLMModel, LLMProvider, str]]:
+    """
+    Active models that can stand in for `model_name` on `provider`: same role (or,
+    for models without a role, same type), on enabled providers whose circuit
+    lets requests through, models on other providers first.
+    """
+    current = db.query(LLMModel).filter(LLMModel.provider_id == provider.id, LLMModel.model_name == model_name).first()
+    if current is None or not (current.role or current.type):
+        return
+    query = db.query(LLMModel, LLMProvider).join(LLMProvider, LLMModel.provider_id == LLMProvider.id).filter(
+        LLMModel.id != current.id, LLMModel.is_active == True, LLMProvider.enabled == True
+    )
+    query = query.filter(LLMModel.role == current.role) if current.role else query.filter(LLMModel.type == current.type)
+    alternates = sorted(query.order_by(LLMModel.created_at).all(), key=lambda row: row[1].id == provider.id)
+    for alternate_model, alternate_provider in alternates:
+        if provider_breakers.is_available(alternate_provider.id):
+            yield alternate_model, alternate_provider, decrypt_api_key(alternate_provider.api_key_encrypted)
+
+
+async def _stream_with_failover(db: Session, provider: LLMProvider, model_name: str, api_key: str, messages: List[Dict[str, Any]],
+                                tools: Optional[List[Dict[str, Any]]] = None, temperature: float = 0.7, top_p: float = 1.0,
+                                deadline: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+    """stream_llm_api, failing over like call_llm_api as long as nothing has been streamed yet and the deadline allows."""
+    candidates = [(provider, model_name, api_key)]
+    alternates = None
+    while candidates:
+        candidate_provider, candidate_model, candidate_key = candidates.pop(0)
+        streamed = False
+        try:
+            async for event in stream_llm_api(candidate_provider, candidate_model, candidate_key, messages, tools=tools, temperature=temperature, top_p=top_p, deadline=deadline):
+                streamed = True
+                yield event
+            return
+        except HTTPException as e:
+            if streamed or not is_failover_error(e):
+                raise
+            if alternates is None:
+                alternates = [(alternate_provider, alternate_model.model_name, alternate_key)
+                              for alternate_model, alternate_provider, alternate_key in failover_candidates(db, provider, model_name)]
+                candidates = alternates
+            if not candidates or deadline_exceeded(deadline):
+                raise
+            logger.warning(f"Streaming {candidate_model} on {candidate_provider.name} failed ({e.status_code}); failing over to {candidates[0][1]} on {candidates[0][0].name}.")
+
+
+async def stream_llm_api(
+    provider: LLMProvider,
+    model_name: str,
+    api_key: str,
+    messages: List[Dict[str, Any]],
+    tools: Optional[List[Dict[str, Any]]] = None,
+    temperature: float = 0.7,
+    top_p: float = 1.0,
+    deadline: Optional[float] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streams a chat completion using the OpenAI/OpenRouter `stream: true` protocol.
+    Yields {"delta": "<text>"} for every content fragment, followed by one final
+    event {"done": True, ...} shaped like the call_llm_api result, with tool call
+    fragments assembled into complete `tool_calls`.
+    Providers without streaming support yield their complete response as a single delta.
+    `deadline` bounds opening the stream, retries included.
+    """
+    if "openrouter" not in provider.base_url.lower():
+        result = await call_llm_api(provider, model_name, api_key, messages, tools=tools, temperature=temperature, top_p=top_p, deadline=deadline)
+        content = result.get("message", {}).get("content")
+        if content:
+            yield {"delta": content}
+        yield {"done": True, **result}
+        return
+
+    headers = {
+        "HTTP-Referer": "http://localhost:3000",
+        "X-Title": "Vareon",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
+    }
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    payload = {
+        "model": model_name,
+        "messages": messages,
+        "temperature": temperature,
+        "top_p": top_p,
+        "stream": True
+    }
+    if tools:
+        payload["tools"] = tools
+        payload["tool_choice"] = "auto"
+    api_endpoint = f"{provider.base_url.rstrip('/')}/chat/completions"
+
+    content_parts: List[str] = []
+    tool_calls: Dict[int, Dict[str, Any]] = {}
+    usage: Dict[str, Any] = {}
+    try:
+        client = provider_clients.get_client(provider.id, provider.base_url, api_key)
+
+        async def open_stream() -> Tuple[AsyncExitStack, httpx.Response]:
+            # The admission slot and the response stay open until the stream is drained
+            stack = AsyncExitStack()
+            await stack.__aenter__()
+            try:
+                await stack.enter_async_context(provider_admission.slot(provider.id))
+                response = await stack.enter_async_context(client.stream("POST", api_endpoint, headers=headers, json=payload, timeout=60.0))
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+            except BaseException:
+                if not await stack.__aexit__(*sys.exc_info()):
+                    raise
+            return stack, response
+
+        # Retries only cover opening the stream; nothing has been yielded by then
+        stream_context, response = await call_with_resilience(provider.id, f"{provider.id}:{model_name}", open_stream, hedge=False, deadline=deadline)
+        async with stream_context:
+            async for chunk in iter_sse_chunks(response):
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices", []):
+                    delta = choice.get("delta", {})
+                    if delta.get("content"):
+                        content_parts.append(delta["content"])
+                        yield {"delta": delta["content"]}
+                    for tool_call_delta in delta.get("tool_calls") or []:
+                        tool_call = tool_calls.setdefault(
+                            tool_call_delta.get("index", 0),
+                            {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+                        )
+                        if tool_call_delta.get("id"):
+                            tool_call["id"] = tool_call_delta["id"]
+                        function_delta = tool_call_delta.get("function", {})
+                        tool_call["function"]["name"] += function_delta.get("name") or ""
+                        tool_call["function"]["arguments"] += function_delta.get("arguments") or ""
     except httpx.RequestError as e:
         print(f"HTTPX Request Error: {e}")
-        raise HTTPException(status_code=500, detail=f"LLM API request failed: {e.__class__.__name__} - {e}")
+        raise ProviderError(status_code=500, detail=f"LLM API request failed: {e.__class__.__name__} - {e}")
     except httpx.HTTPStatusError as e:
         print(f"HTTPX Status Error: {e.response.status_code} - {e.response.text}")
-        raise HTTPException(status_code=e.response.status_code, detail=f"LLM API returned an error: {e.response.status_code} - {e.response.text}")
-    except Exception as e:
-        print(f"An unexpected error occurred during LLM API call: {e}")
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+        raise ProviderError(status_code=e.response.status_code, detail=f"LLM API returned an error: {e.response.status_code} - {e.response.text}")
+
+    message: Dict[str, Any] = {"role": "assistant", "content": "".join(content_parts)}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    yield {
+        "done": True,
+        "message": message,
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
+        "model_used": model_name
+    }
+
+
+async def collect_llm_stream(llm_result: Any, on_delta: Callable[[str], Awaitable[None]]) -> Dict[str, Any]:
+    """
+    Drains the result of call_llm_api(..., stream=True), forwarding each content
+    delta to `on_delta`, and returns the final call_llm_api-shaped response.
+    A plain (non-streamed) response dict is forwarded as a single delta.
+    """
+    if isinstance(llm_result, dict):
+        content = llm_result.get("message", {}).get("content")
+        if content:
+            await on_delta(content)
+        return llm_result
+
+    final_response: Dict[str, Any] = {}
+    async for event in llm_result:
+        if event.get("done"):
+            final_response = {key: value for key, value in event.items() if key != "done"}
+        elif event.get("delta"):
+            await on_delta(event["delta"])
+    return final_response
 
 
 async def detect_intent(db: Session, user: User, prompt: str) -> IntentDetectionResponse:
@@ -211,7 +454,8 @@ Example JSON output:
             messages=messages,
             api_key=api_key,
             temperature=0.2, # Lower temperature for more deterministic output
-            top_p=0.9
+            top_p=0.9,
+            db=db
         )
         
         llm_content = llm_response_data["message"]["content"]
@@ -233,55 +477,36 @@ Example JSON output:
         return IntentDetectionResponse(intent="unknown", confidence=0.1, reasoning=f"Error: {e}")
 
 
-def _evaluate_condition(condition_obj: Dict[str, Any], intent: str, prompt: str) -> bool:
-    if "all" in condition_obj: # AND combinator
-        return all(_evaluate_condition(sub_cond, intent, prompt) for sub_cond in condition_obj["all"])
-    elif "any" in condition_obj: # OR combinator
-        return any(_evaluate_condition(sub_cond, intent, prompt) for sub_cond in condition_obj["any"])
-    else: # Individual condition
-        fact = condition_obj.get("fact")
-        operator = condition_obj.get("operator")
-        value = condition_obj.get("value")
-
-        if fact == "intent":
-            target_value = intent
-        elif fact == "prompt":
-            target_value = prompt
-        else:
-            return False # Unknown fact
-
-        if operator == "equals":
-            return target_value.lower() == str(value).lower()
-        elif operator == "contains":
-            return str(value).lower() in target_value.lower()
-        elif operator == "startsWith":
-            return target_value.lower().startswith(str(value).lower())
-        elif operator == "endsWith":
-            return target_value.lower().endswith(str(value).lower())
-        else:
-            return False # Unknown operator
+async def resolve_intent(db: Session, user: User, prompt: str) -> IntentDetectionResponse:
+    """
+    Intent for the chat pipeline: a cached result for the same prompt, else the
+    local classifier when it is confident enough, else the LLM (detect_intent).
+    """
+    cached = intent_cache.get(prompt)
+    if cached is not None:
+        return cached
+    response = classify_intent_locally(prompt)
+    if response.confidence < INTENT_FAST_PATH_MIN_CONFIDENCE:
+        response = await detect_intent(db, user, prompt)
+        if response.intent == "unknown" and response.confidence < 0.5:
+            return response # An error or unusable LLM answer; worth retrying next time
+    intent_cache.put(prompt, response)
+    return response
 
 def evaluate_routing_rules(db: Session, user: User, intent: str, prompt: str) -> Optional[LLMModel]:
-    # Fetch all routing rules for the user, ordered by priority
-    rules = db.query(RoutingRule).filter(RoutingRule.owner_id == str(user.id)).order_by(RoutingRule.priority.desc()).all()
-
-    for rule in rules:
-        try:
-            condition_obj = json.loads(rule.condition)
-            if _evaluate_condition(condition_obj, intent, prompt):
-                # Find the target model
-                model = db.query(LLMModel).filter(LLMModel.model_name == rule.target_model).first()
-                if model:
-                    return model
-        except json.JSONDecodeError:
-            print(f"Warning: Routing rule {rule.id} has invalid JSON condition: {rule.condition}")
-            continue # Skip this rule if condition is malformed JSON
-        except Exception as e:
-            print(f"Error evaluating routing rule {rule.id}: {e}")
-            continue
-    return None
-
+    # The user's rules are compiled once and cached (see routing_engine); only the selected model is loaded
+    rule, _ = routing_rule_cache.get(db, str(user.id)).evaluate(intent, prompt)
+    if rule is None:
+        return None
+    model = db.get(LLMModel, rule.target_model_id)
+    if model is None:
+        routing_rule_cache.invalidate(str(user.id)) # Deleted since the rules were compiled
+    return model
+
+from .routing_engine import routing_rule_cache
+from .intent_classifier import INTENT_FAST_PATH_MIN_CONFIDENCE, classify_intent_locally, intent_cache
 from .tools import tools_schema, tool_registry
+from .tool_executor import tool_executor
 import asyncio
 import json
 
@@ -290,7 +515,8 @@ async def process_chat_request(
     user: User, 
     prompt: str, 
     session_data: Dict[str, Any],
-    background_tasks: BackgroundTasks # Added background_tasks
+    background_tasks: Optional[BackgroundTasks] = None, # Added background_tasks
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None # Receives streamed content deltas
 ) -> Dict[str, Any]:
     
     terminal_service = session_data.get("terminal")
@@ -303,8 +529,12 @@ async def process_chat_request(
     last_node_id = "user_prompt"
     y_pos = 100
 
-    # 1. Intent Detection
-    intent_response = await detect_intent(db, user, prompt) # Use the new LLM-based intent detection
+    # 1. Intent Detection, only when one of the user's routing rules can depend on it
+    rule_set = routing_rule_cache.get(db, str(user.id))
+    if rule_set.needs_intent(prompt):
+        intent_response = await resolve_intent(db, user, prompt)
+    else:
+        intent_response = IntentDetectionResponse(intent="unknown", confidence=0.0, reasoning="Skipped: no routing rule depends on the intent.")
     intent = intent_response.intent
     print(f"DEBUG: Detected intent: {intent} (Confidence: {intent_response.confidence:.2f})")
 
@@ -318,8 +548,7 @@ async def process_chat_request(
     y_pos += 100
 
     # 2. Rule Evaluation and Visualization
-    all_routing_rules = db.query(RoutingRule).filter(RoutingRule.owner_id == str(user.id)).order_by(RoutingRule.priority.desc()).all()
-    print(f"DEBUG: Found {len(all_routing_rules)} routing rules for user {user.id}.")
+    print(f"DEBUG: Found {len(rule_set.rules)} routing rules for user {user.id}.")
     
     rule_evaluation_node_id = "rule_evaluation"
     nodes.append({"id": rule_evaluation_node_id, "data": {"label": "Evaluating Routing Rules"}, "position": {"x": 0, "y": y_pos}})
@@ -328,66 +557,35 @@ async def process_chat_request(
     y_pos += 100
 
     selected_llm_model = None
-    for rule in all_routing_rules:
+    selected_rule, outcomes = rule_set.evaluate(intent, prompt)
+    for outcome in outcomes:
+        rule = outcome.rule
         rule_node_id = f"rule_{rule.id}"
-        try:
-            condition_obj = json.loads(rule.condition)
-            condition_matched = _evaluate_condition(condition_obj, intent, prompt)
-            print(f"DEBUG: Evaluating rule '{rule.name}' (ID: {rule.id}). Condition: {rule.condition}. Matched: {condition_matched}")
-            
-            nodes.append({
-                "id": rule_node_id,
-                "data": {
-                    "label": f"Rule: {rule.name} (P: {rule.priority})",
-                    "subLabel": f"Condition: {'Matched' if condition_matched else 'Not Matched'}",
-                    "status": "success" if condition_matched else "default"
-                },
-                "position": {"x": 0, "y": y_pos}
-            })
-            edges.append({"id": f"e-{last_node_id}-{rule_node_id}", "source": last_node_id, "target": rule_node_id})
-            last_node_id = rule_node_id
-            y_pos += 70 # Smaller increment for rules
-
-            if condition_matched and not selected_llm_model:
-                model = db.query(LLMModel).filter(LLMModel.model_name == rule.target_model).first()
-                if model:
-                    selected_llm_model = model
-                    print(f"DEBUG: Rule '{rule.name}' matched. Selected model: {selected_llm_model.model_name}")
-                    nodes[-1]["data"]["status"] = "primary" # Highlight selected rule
-                    nodes[-1]["data"]["subLabel"] += " (Selected)"
-                    break # Found a matching rule, stop evaluating
-                else:
-                    print(f"DEBUG: Rule '{rule.name}' matched, but target model '{rule.target_model}' not found.")
-        except json.JSONDecodeError:
-            nodes.append({
-                "id": rule_node_id,
-                "data": {
-                    "label": f"Rule: {rule.name} (P: {rule.priority})",
-                    "subLabel": "Condition: Invalid JSON",
-                    "status": "destructive"
-                },
-                "position": {"x": 0, "y": y_pos}
-            })
-            edges.append({"id": f"e-{last_node_id}-{rule_node_id}", "source": last_node_id, "target": rule_node_id})
-            last_node_id = rule_node_id
-            y_pos += 70
-            print(f"Warning: Routing rule {rule.id} has invalid JSON condition: {rule.condition}")
-            continue # Skip this rule if condition is malformed JSON
-        except Exception as e:
-            nodes.append({
-                "id": rule_node_id,
-                "data": {
-                    "label": f"Rule: {rule.name} (P: {rule.priority})",
-                    "subLabel": f"Error: {e}",
-                    "status": "destructive"
-                },
-                "position": {"x": 0, "y": y_pos}
-            })
-            edges.append({"id": f"e-{last_node_id}-{rule_node_id}", "source": last_node_id, "target": rule_node_id})
-            last_node_id = rule_node_id
-            y_pos += 70
-            print(f"Error evaluating routing rule {rule.id}: {e}")
-            continue
+        if rule.error:
+            sub_label, node_status = rule.error, "destructive"
+        elif outcome.selected:
+            sub_label, node_status = "Condition: Matched (Selected)", "primary" # Highlight selected rule
+        else:
+            sub_label = f"Condition: {'Matched' if outcome.matched else 'Not Matched'}"
+            node_status = "success" if outcome.matched else "default"
+            if outcome.matched:
+                print(f"DEBUG: Rule '{rule.name}' matched, but target model '{rule.target_model}' not found.")
+        nodes.append({
+            "id": rule_node_id,
+            "data": {"label": f"Rule: {rule.name} (P: {rule.priority})", "subLabel": sub_label, "status": node_status},
+            "position": {"x": 0, "y": y_pos}
+        })
+        edges.append({"id": f"e-{last_node_id}-{rule_node_id}", "source": last_node_id, "target": rule_node_id})
+        last_node_id = rule_node_id
+        y_pos += 70 # Smaller increment for rules
+
+    if selected_rule is not None:
+        selected_llm_model = db.get(LLMModel, selected_rule.target_model_id)
+        if selected_llm_model:
+            print(f"DEBUG: Rule '{selected_rule.name}' matched. Selected model: {selected_llm_model.model_name}")
+        else:
+            # Deleted since the rules were compiled; recompile on the next request
+            routing_rule_cache.invalidate(str(user.id))
 
     if not selected_llm_model:
         print("DEBUG: No model selected by routing rules. Checking user preferences for default model.")
@@ -436,10 +634,19 @@ async def process_chat_request(
         y_pos += 100
 
         try:
-            llm_response = await call_llm_api(
-                provider=llm_provider, model_name=selected_llm_model.model_name,
-                messages=messages, api_key=api_key, tools=tools_schema
-            )
+            if on_delta:
+                llm_response = await collect_llm_stream(
+                    await call_llm_api(
+                        provider=llm_provider, model_name=selected_llm_model.model_name,
+                        messages=messages, api_key=api_key, tools=tools_schema, stream=True, db=db
+                    ),
+                    on_delta
+                )
+            else:
+                llm_response = await call_llm_api(
+                    provider=llm_provider, model_name=selected_llm_model.model_name,
+                    messages=messages, api_key=api_key, tools=tools_schema, db=db
+                )
         except HTTPException as e:
             print(f"ERROR: HTTPException caught in process_chat_request: {e.detail}")
             raise e
@@ -467,33 +674,22 @@ async def process_chat_request(
         last_node_id = node_id
         y_pos += 100
 
-        tool_results = []
-        for tool_call in tool_calls:
-            function_name = tool_call['function']['name']
+        async def run_tool(function_name: str, function_args: Dict[str, Any]) -> Any:
             function_to_call = tool_registry.get(function_name)
-            
             if not function_to_call:
-                result_content = f"Error: Tool '{function_name}' not found."
-            else:
-                try:
-                    function_args = json.loads(tool_call['function']['arguments'])
-                    # Pass the full context to the tool function
-                    result_content = await function_to_call(
-                        db=db, 
-                        user=user, 
-                        terminal_service=terminal_service, 
-                        background_tasks=background_tasks,
-                        **function_args
-                    )
-                except Exception as e:
-                    result_content = f"Error executing tool '{function_name}': {e}"
-
-            tool_results.append({
-                "tool_call_id": tool_call['id'], "role": "tool",
-                "name": function_name, "content": result_content,
-            })
-        
-        messages.extend(tool_results)
+                return f"Error: Tool '{function_name}' not found."
+            # Pass the full context to the tool function
+            return await function_to_call(
+                db=db, 
+                user=user, 
+                terminal_service=terminal_service, 
+                background_tasks=background_tasks,
+                **function_args
+            )
+
+        # Independent calls run concurrently; results keep the order of the tool calls
+        tool_results = await tool_executor.run(tool_calls, run_tool)
+        messages.extend(result.message() for result in tool_results)
 
     final_message = messages[-1].get("content", "Max tool call iterations reached.")
     return {
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from server_python.database import LLMModel, RoutingRule
+
+logger = logging.getLogger(__name__)
+
+# Compiled rule sets are also rebuilt after this long, to pick up out-of-band changes
+ROUTING_RULE_CACHE_TTL_SECONDS = float(os.getenv("ROUTING_RULE_CACHE_TTL_SECONDS", "300"))
+
+# A compiled condition takes the lower-cased intent and prompt
+Predicate = Callable[[str, str], bool]
+
+_FACT_INDEX = {"intent": 0, "prompt": 1}
+_OPERATORS: Dict[str, Callable[[str, str], bool]] = {
+    "equals": lambda target, operand: target == operand,
+    "contains": lambda target, operand: operand in target,
+    "startsWith": lambda target, operand: target.startswith(operand),
+    "endsWith": lambda target, operand: target.endswith(operand),
+}
+
+
+def _never(intent: str, prompt: str) -> bool:
+    return False
+
+
+def compile_condition(condition_obj: Dict[str, Any]) -> Predicate:
+    """
+    Compiles a condition tree ({"all": [...]}, {"any": [...]} or a
+    {"fact", "operator", "value"} leaf) into a predicate. Operands are lower-cased
+    here once; unknown facts and operators compile to a predicate that never matches.
+    """
+    if "all" in condition_obj:
+        children = tuple(compile_condition(child) for child in condition_obj["all"])
+        return lambda intent, prompt: all(child(intent, prompt) for child in children)
+    if "any" in condition_obj:
+        children = tuple(compile_condition(child) for child in condition_obj["any"])
+        return lambda intent, prompt: any(child(intent, prompt) for child in children)
+
+    fact_index = _FACT_INDEX.get(condition_obj.get("fact"))
+    compare = _OPERATORS.get(condition_obj.get("operator"))
+    if fact_index is None or compare is None:
+        return _never
+    operand = str(condition_obj.get("value")).lower()
+    if fact_index == 0:
+        return lambda intent, prompt: compare(intent, operand)
+    return lambda intent, prompt: compare(prompt, operand)
+
+
+def condition_facts(condition_obj: Dict[str, Any]) -> FrozenSet[str]:
+    """The facts ("intent", "prompt") a condition tree reads."""
+    if "all" in condition_obj or "any" in condition_obj:
+        children = condition_obj.get("all", condition_obj.get("any"))
+        return frozenset().union(*(condition_facts(child) for child in children))
+    fact = condition_obj.get("fact")
+    return frozenset([fact]) if fact in _FACT_INDEX else frozenset()
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    id: str
+    name: str
+    priority: int
+    condition: str
+    target_model: str
+    target_model_id: Optional[str] # None when no LLM model has that name
+    predicate: Optional[Predicate] # None when the condition could not be compiled
+    error: Optional[str] = None # Why it could not be, as shown in the chat visualisation
+    facts: FrozenSet[str] = frozenset()
+
+    @property
+    def selectable(self) -> bool:
+        return self.predicate is not None and self.target_model_id is not None
+
+
+@dataclass(frozen=True)
+class RuleOutcome:
+    """How one rule fared in an evaluation, in priority order."""
+    rule: CompiledRule
+    matched: bool
+    selected: bool = False
+
+
+@dataclass
+class CompiledRuleSet:
+    """A user's routing rules, highest priority first, ready for in-memory evaluation."""
+    rules: Tuple[CompiledRule, ...]
+    expires_at: float = field(default=0.0, compare=False)
+
+    def needs_intent(self, prompt: str) -> bool:
+        """
+        Whether the intent can change which rule is selected for `prompt`: true only
+        if a selectable rule reading the intent comes before the first selectable
+        rule that matches on the prompt alone. Otherwise intent detection is skipped.
+        """
+        prompt = (prompt or "").lower()
+        for rule in self.rules:
+            if not rule.selectable:
+                continue
+            if "intent" in rule.facts:
+                return True
+            if rule.predicate("", prompt):
+                return False
+        return False
+
+    def evaluate(self, intent: str, prompt: str) -> Tuple[Optional[CompiledRule], List[RuleOutcome]]:
+        """
+        Returns the first matching rule whose target model exists, and the outcome
+        of every rule up to and including it (for the chat visualisation).
+        """
+        intent, prompt = (intent or "").lower(), (prompt or "").lower()
+        outcomes: List[RuleOutcome] = []
+        for rule in self.rules:
+            matched = rule.predicate is not None and rule.predicate(intent, prompt)
+            selected = matched and rule.target_model_id is not None
+            outcomes.append(RuleOutcome(rule, matched, selected))
+            if selected:
+                return rule, outcomes
+        return None, outcomes
+
+
+def compile_rules(db: Session, owner_id: str, ttl: float = ROUTING_RULE_CACHE_TTL_SECONDS) -> CompiledRuleSet:
+    """Loads, compiles and resolves the target models of a user's rules with two queries."""
+    rules = db.query(RoutingRule).filter(RoutingRule.owner_id == owner_id).order_by(RoutingRule.priority.desc()).all()
+    model_ids: Dict[str, str] = {}
+    target_names = {rule.target_model for rule in rules}
+    if target_names:
+        for model_id, model_name in db.query(LLMModel.id, LLMModel.model_name).filter(LLMModel.model_name.in_(target_names)):
+            model_ids.setdefault(model_name, model_id)
+
+    compiled = []
+    for rule in rules:
+        predicate, error, facts = None, None, frozenset()
+        try:
+            condition_obj = json.loads(rule.condition)
+            predicate = compile_condition(condition_obj)
+            facts = condition_facts(condition_obj)
+        except json.JSONDecodeError:
+            error = "Condition: Invalid JSON"
+            logger.warning(f"Routing rule {rule.id} has invalid JSON condition: {rule.condition}")
+        except Exception as e:
+            error = f"Error: {e}"
+            logger.warning(f"Routing rule {rule.id} has an invalid condition: {e}")
+        compiled.append(CompiledRule(
+            id=rule.id, name=rule.name, priority=rule.priority, condition=rule.condition,
+            target_model=rule.target_model, target_model_id=model_ids.get(rule.target_model),
+            predicate=predicate, error=error, facts=facts,
+        ))
+    return CompiledRuleSet(rules=tuple(compiled), expires_at=time.monotonic() + ttl)
+
+
+class RoutingRuleCache:
+    """
+    Compiled routing rules per user. Entries are dropped by invalidate() whenever a
+    user's rules (or the LLM models they target) change, and expire after `ttl`.
+    """
+
+    def __init__(self, ttl: float = ROUTING_RULE_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._rule_sets: Dict[str, CompiledRuleSet] = {}
+        self._lock = threading.Lock()
+        self._generation = 0 # Bumped by invalidate(), so a compile that raced with it is not stored
+
+    def get(self, db: Session, owner_id: str) -> CompiledRuleSet:
+        owner_id = str(owner_id)
+        with self._lock:
+            rule_set = self._rule_sets.get(owner_id)
+            generation = self._generation
+        if rule_set is not None and rule_set.expires_at > time.monotonic():
+            return rule_set
+        rule_set = compile_rules(db, owner_id, ttl=self.ttl)
+        with self._lock:
+            if generation == self._generation:
+                self._rule_sets[owner_id] = rule_set
+        return rule_set
+
+    def invalidate(self, owner_id: Optional[str] = None) -> None:
+        """Drops one user's compiled rules, or everyone's when no user is given."""
+        with self._lock:
+            self._generation += 1
+            if owner_id is None:
+                self._rule_sets.clear()
+            else:
+                self._rule_sets.pop(str(owner_id), None)
+
+
+routing_rule_cache = RoutingRuleCache()
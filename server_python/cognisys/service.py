@@ -1,9 +1,31 @@
+import asyncio
+import logging
+from fastapi import BackgroundTasks
 from sqlalchemy.orm import Session
-from typing import Dict, Any
+from typing import Dict, Any, Awaitable, Callable, Set
 
-from server_python.database import User as DBUser
+from server_python.database import User as DBUser, Conversation as DBConversation, ChatMessage as DBChatMessage
 from . import llm_interaction
 
+logger = logging.getLogger(__name__)
+
+# The event loop only keeps weak references to tasks: hold on to the running ones until they finish
+_background_runs: Set[asyncio.Task] = set()
+
+
+def _run_in_background(background_tasks: BackgroundTasks) -> None:
+    """Runs `background_tasks` after the reply, since there is no HTTP response to attach them to."""
+    task = asyncio.create_task(background_tasks())
+    _background_runs.add(task)
+    task.add_done_callback(_background_run_finished)
+
+
+def _background_run_finished(task: asyncio.Task) -> None:
+    _background_runs.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Chat background task failed", exc_info=task.exception())
+
+
 class ChatService:
     def __init__(self, db: Session):
         self.db = db
@@ -14,14 +36,73 @@ class ChatService:
         """
         print(f"ChatService handling message for user {user.id}: '{prompt}'")
 
+        background_tasks = BackgroundTasks()
         response_data = await llm_interaction.process_chat_request(
             db=self.db, 
             user=user, 
             prompt=prompt,
-            session_data=session_data
+            session_data=session_data,
+            background_tasks=background_tasks
         )
+        _run_in_background(background_tasks)
         
         return response_data
 
+    async def stream_message(
+        self,
+        user: DBUser,
+        prompt: str,
+        session_data: Dict[str, Any],
+        on_delta: Callable[[str], Awaitable[None]]
+    ) -> Dict[str, Any]:
+        """
+        Like handle_message, but forwards response tokens to `on_delta` as they are generated.
+        The exchange is persisted to the session's conversation once the stream completes.
+        """
+        print(f"ChatService streaming message for user {user.id}: '{prompt}'")
+        conversation = self._get_session_conversation(user, prompt, session_data)
+        self._save_message(conversation, user, "user", prompt)
+
+        background_tasks = BackgroundTasks()
+        response_data = await llm_interaction.process_chat_request(
+            db=self.db,
+            user=user,
+            prompt=prompt,
+            session_data=session_data,
+            background_tasks=background_tasks,
+            on_delta=on_delta
+        )
+        llm_message = self._save_message(conversation, user, "llm", response_data.get("response") or "")
+        _run_in_background(background_tasks)
+
+        response_data["conversation_id"] = conversation.id
+        response_data["message_id"] = llm_message.id
+        return response_data
+
+    def _get_session_conversation(self, user: DBUser, prompt: str, session_data: Dict[str, Any]) -> DBConversation:
+        conversation_id = session_data.get("conversation_id")
+        conversation = None
+        if conversation_id:
+            conversation = self.db.query(DBConversation).filter(DBConversation.id == conversation_id, DBConversation.user_id == str(user.id)).first()
+        if not conversation:
+            conversation = DBConversation(user_id=str(user.id), title=prompt[:50])
+            self.db.add(conversation)
+            self.db.commit()
+            self.db.refresh(conversation)
+            session_data["conversation_id"] = conversation.id
+        return conversation
+
+    def _save_message(self, conversation: DBConversation, user: DBUser, sender: str, content: str) -> DBChatMessage:
+        chat_message = DBChatMessage(
+            conversation_id=conversation.id,
+            user_id=str(user.id),
+            sender=sender,
+            message_content=content
+        )
+        self.db.add(chat_message)
+        self.db.commit()
+        self.db.refresh(chat_message)
+        return chat_message
+
 # You can create a single instance or create one per request depending on dependency management
 # For now, we'll instantiate it where needed.
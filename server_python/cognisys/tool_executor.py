@@ -0,0 +1,216 @@
+"""
+Concurrent execution of the tool calls the model returns in one turn.
+
+Every tool has a concurrency class: read-only tools run alongside anything else,
+mutating tools are ordered after the earlier calls of the turn that touch the same
+resource (a repository or file path, or a named shared resource). A mutating tool
+with no known resource, like a shell command outside a repository, could touch
+anything and waits for every earlier call. Each call has its own timeout, and the
+results come back in the order of the tool calls for the message history.
+
+Calls overlap only while they await, so tools run blocking work (GitPython, file
+I/O) via asyncio.to_thread; a tool blocking the event loop would also keep its
+timeout from firing.
+"""
+import asyncio
+import json
+import logging
+import os
+import posixpath
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+TOOL_CALL_TIMEOUT_SECONDS = float(os.getenv("TOOL_CALL_TIMEOUT_SECONDS", "120"))
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "8"))
+
+READ_ONLY = "read_only"
+MUTATING = "mutating"
+
+# ("path", normalized path) or ("name", shared resource name)
+Resource = Tuple[str, str]
+# Runs one tool by name with its parsed arguments and returns the tool message content
+ToolDispatch = Callable[[str, Dict[str, Any]], Awaitable[Any]]
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    concurrency: Union[str, Callable[[Dict[str, Any]], str]] = MUTATING
+    path_args: Tuple[str, ...] = ("local_path",) # Arguments naming the path the tool works on
+    resource: Optional[str] = None # A named resource the tool always uses instead of a path
+    timeout: Optional[float] = None # Overrides the executor's per-call timeout
+
+    def concurrency_for(self, arguments: Dict[str, Any]) -> str:
+        return self.concurrency(arguments) if callable(self.concurrency) else self.concurrency
+
+
+def _file_operation_concurrency(arguments: Dict[str, Any]) -> str:
+    return READ_ONLY if arguments.get("action") in ("read", "read_many", "list") else MUTATING
+
+
+# Tools of the Cognisys chat and of Arcana agents. Unknown tools are treated as mutating.
+TOOL_SPECS: Dict[str, ToolSpec] = {
+    "execute_shell_command": ToolSpec(MUTATING, path_args=()),
+    "delegate_task_to_arcana": ToolSpec(MUTATING, resource="arcana_jobs"),
+    "git_clone_repo": ToolSpec(MUTATING, timeout=600),
+    "git_get_status": ToolSpec(READ_ONLY),
+    "git_get_diff": ToolSpec(READ_ONLY),
+    "git_add_files": ToolSpec(MUTATING),
+    "git_commit_changes": ToolSpec(MUTATING),
+    "git_push_changes": ToolSpec(MUTATING, timeout=300),
+    "git_pull_changes": ToolSpec(MUTATING, timeout=300),
+    "git_checkout_branch": ToolSpec(MUTATING),
+    "git_create_branch": ToolSpec(MUTATING),
+    "run_tests": ToolSpec(MUTATING, timeout=600),
+    "perform_file_operation": ToolSpec(_file_operation_concurrency, path_args=("path",)),
+    "store_context_item": ToolSpec(MUTATING, resource="context_items"),
+    "retrieve_context_items": ToolSpec(READ_ONLY, resource="context_items"),
+    "reflect": ToolSpec(READ_ONLY, path_args=()),
+    "generate_code": ToolSpec(READ_ONLY, path_args=()),
+    "translate_shell_command": ToolSpec(READ_ONLY, path_args=()),
+    "generate_reasoning": ToolSpec(READ_ONLY, path_args=()),
+    "request_human_input": ToolSpec(MUTATING, path_args=()),
+}
+_DEFAULT_SPEC = ToolSpec()
+
+
+@dataclass
+class ToolCallResult:
+    tool_call_id: str
+    name: str
+    arguments: Dict[str, Any]
+    content: Any
+    elapsed: float = 0.0
+    timed_out: bool = False
+
+    def message(self) -> Dict[str, Any]:
+        """The tool message for the conversation history."""
+        return {"tool_call_id": self.tool_call_id, "role": "tool", "name": self.name, "content": self.content}
+
+
+@dataclass
+class PlannedCall:
+    index: int
+    tool_call_id: str
+    name: str
+    arguments: Dict[str, Any]
+    read_only: bool
+    resource: Optional[Resource]
+    timeout: Optional[float]
+    error: Optional[str] = None # Set when the arguments could not be parsed
+
+
+def _normalize_path(path: str) -> str:
+    return posixpath.normpath(path.replace("\\", "/"))
+
+
+def _overlaps(first: Resource, second: Resource) -> bool:
+    if first[0] != second[0]:
+        return False
+    if first[1] == second[1]:
+        return True
+    if first[0] == "name":
+        return False
+    # A path overlaps its parent directories and everything below it
+    shorter, longer = sorted((first[1], second[1]), key=len)
+    return longer.startswith(shorter.rstrip("/") + "/")
+
+
+def conflicts(earlier: PlannedCall, later: PlannedCall) -> bool:
+    """Whether `later` has to wait for `earlier`, a call that comes before it in the same turn."""
+    if earlier.read_only and later.read_only:
+        return False
+    # A read-only tool without a resource shares nothing with other calls
+    if (earlier.read_only and earlier.resource is None) or (later.read_only and later.resource is None):
+        return False
+    if earlier.resource is None or later.resource is None:
+        return True
+    return _overlaps(earlier.resource, later.resource)
+
+
+class ToolExecutor:
+    """
+    Runs the tool calls of one model turn concurrently, as far as their concurrency
+    classes and resources allow. `default_path` is the resource of tools that do
+    not name a path themselves (an Arcana agent's repository, for example).
+    """
+
+    def __init__(self, specs: Optional[Dict[str, ToolSpec]] = None, default_path: Optional[str] = None,
+                 timeout: Optional[float] = TOOL_CALL_TIMEOUT_SECONDS, max_concurrency: int = TOOL_MAX_CONCURRENCY):
+        self.specs = TOOL_SPECS if specs is None else specs
+        self.default_path = default_path
+        self.timeout = timeout or None
+        self.max_concurrency = max(1, max_concurrency)
+
+    def plan(self, tool_calls: Sequence[Dict[str, Any]]) -> List[PlannedCall]:
+        planned = []
+        for index, tool_call in enumerate(tool_calls):
+            name = tool_call['function']['name']
+            spec = self.specs.get(name, _DEFAULT_SPEC)
+            arguments, error = {}, None
+            try:
+                raw_arguments = tool_call['function'].get('arguments') or {}
+                arguments = json.loads(raw_arguments) if isinstance(raw_arguments, str) else raw_arguments
+                if not isinstance(arguments, dict):
+                    raise ValueError("arguments must be a JSON object")
+            except ValueError as e:
+                arguments, error = {}, f"Error executing tool '{name}': {e}"
+
+            resource = None
+            if spec.resource:
+                resource = ("name", spec.resource)
+            else:
+                path = next((arguments[arg] for arg in spec.path_args if isinstance(arguments.get(arg), str)), None)
+                if path is None and spec.path_args:
+                    path = self.default_path
+                if path:
+                    resource = ("path", _normalize_path(path))
+
+            planned.append(PlannedCall(
+                index=index, tool_call_id=tool_call.get('id'), name=name, arguments=arguments,
+                read_only=spec.concurrency_for(arguments) == READ_ONLY, resource=resource,
+                timeout=spec.timeout or self.timeout, error=error,
+            ))
+        return planned
+
+    async def run(self, tool_calls: Sequence[Dict[str, Any]], dispatch: ToolDispatch,
+                  on_start: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None) -> List[ToolCallResult]:
+        """
+        Executes the tool calls and returns their results in the original order.
+        Errors and timeouts become the content of that call's result; `on_start` is
+        awaited as each call starts.
+        """
+        planned = self.plan(tool_calls)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks: List[asyncio.Future] = []
+        for call in planned:
+            waits_for = [tasks[earlier.index] for earlier in planned[:call.index] if conflicts(earlier, call)]
+            tasks.append(asyncio.ensure_future(self._run_call(call, waits_for, semaphore, dispatch, on_start)))
+        return list(await asyncio.gather(*tasks))
+
+    async def _run_call(self, call: PlannedCall, waits_for: List[asyncio.Future], semaphore: asyncio.Semaphore,
+                        dispatch: ToolDispatch, on_start) -> ToolCallResult:
+        result = ToolCallResult(tool_call_id=call.tool_call_id, name=call.name, arguments=call.arguments, content=call.error)
+        if waits_for:
+            await asyncio.wait(waits_for)
+        if call.error is not None:
+            return result
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                if on_start is not None:
+                    await on_start(call.name, call.arguments)
+                result.content = await asyncio.wait_for(dispatch(call.name, call.arguments), timeout=call.timeout)
+            except asyncio.TimeoutError:
+                result.timed_out = True
+                result.content = f"Error: Tool '{call.name}' timed out after {call.timeout:g} seconds."
+                logger.warning(f"Tool call '{call.name}' ({call.tool_call_id}) timed out after {call.timeout:g}s")
+            except Exception as e:
+                result.content = f"Error executing tool '{call.name}': {e}"
+            result.elapsed = time.monotonic() - started
+        return result
+
+
+tool_executor = ToolExecutor()
@@ -11,6 +11,7 @@ from server_python.database import User
 from server_python.arcana import crud as arcana_crud
 from server_python.arcana import agent_orchestration_service as arcana_service
 from server_python.arcana.schemas import AgentExecuteRequest
+from server_python.arcana.job_queue import agent_job_queue
 
 # 1. Tool Definition
 # A tool is a dictionary with a schema for the LLM and a function to call.
@@ -70,16 +71,8 @@ async def delegate_task_to_arcana(
             original_request=arcana_request,
             parent_job_id=parent_job_id # Link to the parent job
         )
-        db.flush() # Ensure job.id is available
-        
-        # 3. Add the execution to background tasks
-        background_tasks.add_task(
-            arcana_service.execute_agent_task,
-            db=db,
-            user=user,
-            request=arcana_request,
-            job_id=job.id
-        )
+        # 3. Hand the job to the durable agent job queue
+        agent_job_queue.enqueue(db, job.id)
         
         return f"Task successfully delegated to Arcana agent '{worker_agent.name}' (ID: {agent_id}). Job ID: {job.id}. Monitor this job ID for completion."
     except Exception as e:
@@ -93,49 +86,49 @@ async def git_clone_repo(db: Session, user: User, terminal_service: TerminalServ
     """Clones a Git repository from a given URL to a local path."""
     git_service = GitService(db, user)
     request = git_schemas.GitCloneRequest(repo_url=repo_url, local_path=local_path, pat=pat, branch=branch)
-    return git_service.clone_repo(request)
+    return await git_service.clone_repo(request)
 
 async def git_get_status(db: Session, user: User, terminal_service: TerminalService, local_path: str) -> Dict[str, Any]:
     """Gets the current Git status of a repository."""
     git_service = GitService(db, user)
-    status = git_service.get_status(local_path)
+    status = await git_service.get_status(local_path)
     return status.dict()
 
 async def git_add_files(db: Session, user: User, terminal_service: TerminalService, local_path: str, files: List[str]) -> str:
     """Adds files to the Git staging area."""
     git_service = GitService(db, user)
     request = git_schemas.GitAddRequest(files=files)
-    return git_service.add_files(local_path, request)
+    return await git_service.add_files(local_path, request)
 
 async def git_commit_changes(db: Session, user: User, terminal_service: TerminalService, local_path: str, message: str, author_name: Optional[str] = None, author_email: Optional[str] = None) -> str:
     """Commits staged changes to the repository."""
     git_service = GitService(db, user)
     request = git_schemas.GitCommitRequest(message=message, author_name=author_name, author_email=author_email)
-    return git_service.commit_changes(local_path, request)
+    return await git_service.commit_changes(local_path, request)
 
 async def git_push_changes(db: Session, user: User, terminal_service: TerminalService, local_path: str, remote_name: Optional[str] = "origin", branch_name: Optional[str] = None) -> str:
     """Pushes committed changes to a remote repository."""
     git_service = GitService(db, user)
     request = git_schemas.GitPushRequest(remote_name=remote_name, branch_name=branch_name)
-    return git_service.push_changes(local_path, request)
+    return await git_service.push_changes(local_path, request)
 
 async def git_pull_changes(db: Session, user: User, terminal_service: TerminalService, local_path: str, remote_name: Optional[str] = "origin", branch_name: Optional[str] = None) -> str:
     """Pulls changes from a remote repository."""
     git_service = GitService(db, user)
     request = git_schemas.GitPullRequest(remote_name=remote_name, branch_name=branch_name)
-    return git_service.pull_changes(local_path, request)
+    return await git_service.pull_changes(local_path, request)
 
 async def git_checkout_branch(db: Session, user: User, terminal_service: TerminalService, local_path: str, branch_name: str) -> str:
     """Switches to a specified Git branch."""
     git_service = GitService(db, user)
     request = git_schemas.GitCheckoutRequest(branch_name=branch_name)
-    return git_service.checkout_branch(local_path, request)
+    return await git_service.checkout_branch(local_path, request)
 
 async def git_create_branch(db: Session, user: User, terminal_service: TerminalService, local_path: str, branch_name: str) -> str:
     """Creates a new Git branch."""
     git_service = GitService(db, user)
     request = git_schemas.GitCreateBranchRequest(branch_name=branch_name)
-    return git_service.create_branch(local_path, request)
+    return await git_service.create_branch(local_path, request)
 
 # 2. Tool Schema for the LLM
 # This tells the LLM how to call our function.
@@ -0,0 +1,197 @@
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import case, delete, event, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import ORMExecuteState, Session, attributes
+
+from server_python.database import (
+    Agent as DBAgent,
+    Workflow as DBWorkflow,
+    Dataset as DBDataset,
+    RoutingRule as DBRoutingRule,
+    HardwareDevice as DBHardwareDevice,
+    Conversation as DBConversation,
+    ChatMessage as DBChatMessage,
+    UserDashboardStats as DBUserDashboardStats,
+)
+
+logger = logging.getLogger(__name__)
+
+# For each tracked model: the attribute holding the owning user, and the counters
+# a row contributes to (a counter with a predicate only counts matching rows).
+Predicate = Optional[Callable[[Optional[str]], bool]]
+TRACKED_MODELS: Dict[type, Tuple[str, Dict[str, Predicate]]] = {
+    DBAgent: ("owner_id", {"agents_total": None, "agents_online": lambda status: status == "online"}),
+    DBWorkflow: ("owner_id", {"workflows_total": None, "workflows_running": lambda status: status == "running"}),
+    DBDataset: ("owner_id", {"datasets": None}),
+    DBRoutingRule: ("owner_id", {"routing_rules": None}),
+    DBHardwareDevice: ("owner_id", {"devices_total": None, "devices_connected": lambda status: status == "connected"}),
+    DBConversation: ("user_id", {"conversations": None}),
+    DBChatMessage: ("user_id", {"chat_messages": None}),
+}
+
+# SQL equivalents of the predicates above, used when counters are (re)built from scratch
+_STATUS_FILTERS = {
+    "agents_online": "online",
+    "workflows_running": "running",
+    "devices_connected": "connected",
+}
+
+
+def _contribution(model: type, status: Optional[str]) -> Dict[str, int]:
+    _, counters = TRACKED_MODELS[model]
+    return {column: 1 for column, predicate in counters.items() if predicate is None or predicate(status)}
+
+
+def _old_and_new(target, key: str):
+    history = attributes.get_history(target, key)
+    if history.deleted:
+        return history.deleted[0], (history.added[0] if history.added else None)
+    current = history.unchanged[0] if history.unchanged else (history.added[0] if history.added else None)
+    return current, current
+
+
+def count_user_stats(connection, user_id: str) -> Dict[str, int]:
+    """Counts a user's rows directly; used to seed a user's counters."""
+    counts: Dict[str, int] = {}
+    for model, (owner_key, counters) in TRACKED_MODELS.items():
+        owner_column = getattr(model, owner_key)
+        columns = []
+        for column in counters:
+            if column in _STATUS_FILTERS:
+                columns.append(func.coalesce(func.sum(case((model.status == _STATUS_FILTERS[column], 1), else_=0)), 0))
+            else:
+                columns.append(func.count())
+        row = connection.execute(select(*columns).select_from(model).where(owner_column == user_id)).one()
+        counts.update(zip(counters, (int(value) for value in row)))
+    return counts
+
+
+def _insert(connection):
+    """The dialect's INSERT, which supports ON CONFLICT."""
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    return dialect.insert(DBUserDashboardStats.__table__)
+
+
+def seed_user_stats(connection, user_id: str) -> None:
+    """Creates a user's counters row from a full count, unless another transaction already has."""
+    values = dict(count_user_stats(connection, user_id), user_id=user_id, updated_at=datetime.utcnow())
+    connection.execute(_insert(connection).values(values).on_conflict_do_nothing(index_elements=["user_id"]))
+
+
+def apply_deltas(connection, user_id: Optional[str], deltas: Dict[str, int]) -> None:
+    """
+    Adds `deltas` to a user's counters in the current transaction. A user without
+    a counters row gets one seeded from a full count, which already includes this
+    transaction's changes; if a concurrent seed wins the insert, the deltas are
+    added to its row instead.
+    """
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if not user_id or not deltas:
+        return
+    table = DBUserDashboardStats.__table__
+    values = {column: table.c[column] + delta for column, delta in deltas.items()}
+    values["updated_at"] = datetime.utcnow()
+    if connection.execute(update(table).where(table.c.user_id == user_id).values(values)).rowcount:
+        return
+    seed = dict(count_user_stats(connection, user_id), user_id=user_id, updated_at=values["updated_at"])
+    connection.execute(_insert(connection).values(seed).on_conflict_do_update(index_elements=["user_id"], set_=values))
+
+
+def _after_insert(mapper, connection, target):
+    model = mapper.class_
+    owner_key, _ = TRACKED_MODELS[model]
+    apply_deltas(connection, getattr(target, owner_key), _contribution(model, getattr(target, "status", None)))
+
+
+def _after_delete(mapper, connection, target):
+    model = mapper.class_
+    owner_key, _ = TRACKED_MODELS[model]
+    contribution = _contribution(model, getattr(target, "status", None))
+    apply_deltas(connection, getattr(target, owner_key), {column: -delta for column, delta in contribution.items()})
+
+
+def _after_update(mapper, connection, target):
+    model = mapper.class_
+    owner_key, _ = TRACKED_MODELS[model]
+    old_owner, new_owner = _old_and_new(target, owner_key)
+    old_status, new_status = _old_and_new(target, "status") if hasattr(model, "status") else (None, None)
+    if old_owner == new_owner and old_status == new_status:
+        return
+    old_contribution = _contribution(model, old_status)
+    new_contribution = _contribution(model, new_status)
+    if old_owner == new_owner:
+        columns = set(old_contribution) | set(new_contribution)
+        apply_deltas(connection, new_owner, {c: new_contribution.get(c, 0) - old_contribution.get(c, 0) for c in columns})
+    else:
+        apply_deltas(connection, old_owner, {column: -delta for column, delta in old_contribution.items()})
+        apply_deltas(connection, new_owner, new_contribution)
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+for _model, (_owner_key, _) in TRACKED_MODELS.items():
+    event.listen(_model, "after_insert", _after_insert)
+    event.listen(_model, "after_delete", _after_delete)
+    event.listen(_model, "after_update", _after_update)
+    # active_history loads the previous value when an expired attribute is assigned,
+    # so _after_update can tell which counters the row moves out of
+    for _key in (_owner_key, "status"):
+        if hasattr(_model, _key):
+            event.listen(getattr(_model, _key), "set", _load_old_value, active_history=True, retval=True)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _invalidate_bulk_changes(orm_execute_state: ORMExecuteState):
+    """
+    Bulk UPDATE/DELETE statements (Query.update()/delete(), update()/delete()
+    constructs) bypass the per-row events. The counters of the users owning the
+    affected rows, before and after an update, are dropped and re-seeded on next use.
+    """
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ not in TRACKED_MODELS:
+        return None
+    model = mapper.class_
+    owner_column = getattr(model, TRACKED_MODELS[model][0])
+    primary_key = mapper.primary_key[0]
+    session = orm_execute_state.session
+
+    whereclause = orm_execute_state.statement.whereclause
+    if whereclause is None:
+        # Unfiltered, or bulk UPDATE by primary key: any user may be affected
+        result = orm_execute_state.invoke_statement()
+        session.execute(delete(DBUserDashboardStats))
+        return result
+    rows = session.execute(select(primary_key, owner_column).where(whereclause)).all()
+    result = orm_execute_state.invoke_statement()
+
+    user_ids = {owner for _, owner in rows if owner}
+    if orm_execute_state.is_update and rows:
+        # The update may have moved rows to other owners
+        ids = [row_id for row_id, _ in rows]
+        user_ids.update(owner for owner in session.execute(select(owner_column).where(primary_key.in_(ids))).scalars() if owner)
+    if user_ids:
+        session.execute(delete(DBUserDashboardStats).where(DBUserDashboardStats.user_id.in_(user_ids)))
+    return result
+
+
+def get_user_stats(db: Session, user_id: str) -> DBUserDashboardStats:
+    """Reads a user's counters by primary key, seeding them on first use."""
+    stats = db.get(DBUserDashboardStats, user_id)
+    if stats is None:
+        seed_user_stats(db.connection(), user_id)
+        db.commit()
+        stats = db.get(DBUserDashboardStats, user_id, populate_existing=True)
+    return stats
+
+
+def reset_dashboard_stats(bind) -> None:
+    """Drops all counters so they are re-seeded from the tables (run at startup)."""
+    with bind.begin() as connection:
+        connection.execute(delete(DBUserDashboardStats))
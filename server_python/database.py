@@ -1,10 +1,13 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Table, Text, Float, UniqueConstraint
+from sqlalchemy import create_engine, event, func, Column, Integer, String, Boolean, DateTime, ForeignKey, Table, Text, Float, UniqueConstraint, Index
 from sqlalchemy.orm import sessionmaker, Session, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict
 import uuid # Import uuid
-from .encryption_utils import encrypt_api_key
+import logging
+from .encryption_utils import encrypt_api_key, decrypt_api_key, compute_api_key_fingerprint
+
+logger = logging.getLogger(__name__)
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
 
@@ -87,6 +90,7 @@ class ArcanaApiKey(Base):
     __tablename__ = "arcana_api_keys"
     id = Column(String(36), primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
     key = Column(String, unique=True, nullable=False) # Encrypted API key
+    key_fingerprint = Column(String(64), unique=True, index=True, nullable=True) # HMAC of the raw key, used for indexed lookups
     user_id = Column(String(36), ForeignKey('users.id'), nullable=False)
     name = Column(String, nullable=False) # User-defined name for the key
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -184,6 +188,73 @@ class TelemetryData(Base):
     device = relationship("Device", backref="telemetry_data")
     owner = relationship("User", backref="telemetry_data")
 
+    __table_args__ = (
+        Index("ix_telemetry_data_owner_metric_timestamp", "owner_id", "metric_name", "timestamp"),
+    )
+
+# --- Compact telemetry store (see neosyntis/telemetry_store.py) ---
+class TelemetryMetric(Base):
+    """Dictionary of metric names, so samples reference a small integer instead of repeating the name."""
+    __tablename__ = "telemetry_metrics"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, unique=True, nullable=False)
+
+class TelemetrySegment(Base):
+    """
+    One time partition of one series: the samples of a (owner, metric, workflow,
+    dataset, device) combination whose timestamps fall in [start_ts, start_ts + segment length).
+    The series columns live here once instead of on every sample.
+    """
+    __tablename__ = "telemetry_segments"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner_id = Column(String(36), ForeignKey('users.id'), nullable=False)
+    metric_id = Column(Integer, ForeignKey('telemetry_metrics.id'), nullable=False)
+    workflow_id = Column(String(36), ForeignKey('workflows.id'), nullable=True)
+    dataset_id = Column(String(36), ForeignKey('datasets.id'), nullable=True)
+    device_id = Column(String(36), ForeignKey('devices.id'), nullable=True)
+    start_ts = Column(Integer, nullable=False) # Epoch milliseconds
+    sample_count = Column(Integer, default=0, nullable=False)
+    # Range of samples written since the rollups were last computed (NULL when up to date)
+    dirty_from_ts = Column(Integer, nullable=True)
+    dirty_to_ts = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        # One segment per series and partition; NULL ids are coalesced since NULLs never conflict
+        Index(
+            "ix_telemetry_segments_series", "owner_id", "metric_id", "start_ts",
+            func.coalesce(workflow_id, ""), func.coalesce(dataset_id, ""), func.coalesce(device_id, ""),
+            unique=True,
+        ),
+        Index("ix_telemetry_segments_dirty", "dirty_from_ts"),
+    )
+
+class TelemetrySample(Base):
+    __tablename__ = "telemetry_samples"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    segment_id = Column(Integer, ForeignKey('telemetry_segments.id'), nullable=False)
+    ts = Column(Integer, nullable=False) # Epoch milliseconds
+    value = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_telemetry_samples_segment_ts", "segment_id", "ts"),
+    )
+
+class TelemetryRollup(Base):
+    """min/max/sum/count of a segment's samples per `resolution`-second bucket."""
+    __tablename__ = "telemetry_rollups"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    segment_id = Column(Integer, ForeignKey('telemetry_segments.id'), nullable=False)
+    resolution = Column(Integer, nullable=False) # Seconds
+    bucket_ts = Column(Integer, nullable=False) # Epoch milliseconds
+    min_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+    sum_value = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_telemetry_rollups_segment_resolution_bucket", "segment_id", "resolution", "bucket_ts", unique=True),
+    )
+
 class MLModel(Base):
     __tablename__ = "ml_models"
     id = Column(String(36), primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
@@ -259,6 +330,10 @@ class RoutingRule(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     owner = relationship("User", backref="routing_rules")
 
+    __table_args__ = (
+        Index("ix_routing_rules_owner_priority", "owner_id", "priority"),
+    )
+
 class Conversation(Base):
     __tablename__ = "conversations"
     id = Column(String(36), primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
@@ -279,6 +354,24 @@ class ChatMessage(Base):
     conversation = relationship("Conversation", backref="messages")
     user = relationship("User", backref="chat_messages")
 
+    __table_args__ = (
+        Index("ix_chat_messages_conversation_timestamp", "conversation_id", "timestamp"),
+    )
+
+class ConversationSummary(Base):
+    """
+    Rolling summary of the messages of a conversation that no longer fit in the
+    model's context window (see chat_context.py). It covers every message up to
+    and including (covered_until, covered_message_id) in (timestamp, id) order.
+    """
+    __tablename__ = "conversation_summaries"
+    conversation_id = Column(String(36), ForeignKey('conversations.id'), primary_key=True)
+    content = Column(Text, nullable=False)
+    covered_until = Column(DateTime, nullable=False)
+    covered_message_id = Column(String(36), nullable=False)
+    covered_messages = Column(Integer, default=0) # How many messages the summary covers
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class ContextMemory(Base):
     __tablename__ = "context_memory"
     id = Column(String(36), primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
@@ -290,6 +383,10 @@ class ContextMemory(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user = relationship("User", backref="context_memories")
 
+    __table_args__ = (
+        Index("ix_context_memory_user_key", "user_id", "key"),
+    )
+
 class LLMProvider(Base):
     __tablename__ = "llm_providers"
     id = Column(String(36), primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
@@ -347,6 +444,10 @@ class TerminalCommandHistory(Base):
     output = Column(Text, nullable=True) # Truncated output
     session = relationship("TerminalSession", backref="command_history")
 
+    __table_args__ = (
+        Index("ix_terminal_command_history_session_timestamp", "session_id", "timestamp"),
+    )
+
 class UserGitConfig(Base):
     __tablename__ = "user_git_configs"
     id = Column(String(36), primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
@@ -390,6 +491,13 @@ class ArcanaAgentJob(Base):
     ended_at = Column(DateTime, nullable=True)
     final_output = Column(Text, nullable=True)
 
+    # Durable job queue state (see arcana.job_queue)
+    queue_state = Column(String, nullable=True, index=True) # queued, running, done
+    lease_owner = Column(String, nullable=True) # Worker currently holding the lease
+    lease_expires_at = Column(DateTime, nullable=True) # Lease is re-queued if not renewed by then
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
+
     # New column for parent-child relationship
     parent_job_id = Column(String(36), ForeignKey("arcana_agent_jobs.id"), nullable=True)
 
@@ -402,6 +510,10 @@ class ArcanaAgentJob(Base):
     parent_job = relationship("ArcanaAgentJob", remote_side=[id], back_populates="child_jobs")
     child_jobs = relationship("ArcanaAgentJob", back_populates="parent_job", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_arcana_agent_jobs_agent_owner_created", "agent_id", "owner_id", "created_at"),
+    )
+
 class ArcanaAgentJobLog(Base):
     __tablename__ = "arcana_agent_job_logs"
     id = Column(String(36), primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
@@ -411,6 +523,10 @@ class ArcanaAgentJobLog(Base):
     content = Column(Text, nullable=False)
     job = relationship("ArcanaAgentJob", back_populates="logs")
 
+    __table_args__ = (
+        Index("ix_arcana_agent_job_logs_job_timestamp", "job_id", "timestamp"),
+    )
+
 
 class SystemPrompt(Base):
     __tablename__ = "system_prompts"
@@ -421,7 +537,214 @@ class SystemPrompt(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class UserDashboardStats(Base):
+    """Per-user counters behind /api/system/status, kept current by dashboard_stats.py."""
+    __tablename__ = "user_dashboard_stats"
+    user_id = Column(String(36), ForeignKey('users.id'), primary_key=True)
+    agents_total = Column(Integer, nullable=False, default=0)
+    agents_online = Column(Integer, nullable=False, default=0)
+    workflows_total = Column(Integer, nullable=False, default=0)
+    workflows_running = Column(Integer, nullable=False, default=0)
+    datasets = Column(Integer, nullable=False, default=0)
+    routing_rules = Column(Integer, nullable=False, default=0)
+    devices_total = Column(Integer, nullable=False, default=0)
+    devices_connected = Column(Integer, nullable=False, default=0)
+    conversations = Column(Integer, nullable=False, default=0)
+    chat_messages = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class SearchDocument(Base):
+    """
+    One searchable entity (workflow, dataset, ...), written by SQL triggers on the
+    source tables and indexed by the `search_fts` FTS5 table (see search_index.py).
+    """
+    __tablename__ = "search_documents"
+    id = Column(Integer, primary_key=True)
+    entity_type = Column(String, nullable=False)
+    entity_id = Column(String(36), nullable=False)
+    owner_id = Column(String(36), nullable=False)
+    title = Column(String, nullable=False)
+    body = Column(Text, nullable=True)
+    fields = Column(Text, nullable=True) # JSON object of extra fields returned with search hits
+
+    __table_args__ = (
+        Index("ix_search_documents_entity", "entity_type", "entity_id", unique=True),
+        Index("ix_search_documents_owner_id", "owner_id"),
+    )
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_index(target, connection, **kw) -> None:
+    # The FTS table and triggers are not ORM tables; create them once all source tables exist
+    from server_python.search_index import create_search_index
+
+    create_search_index(connection)
+
+class SchemaMigration(Base):
+    """Schema migrations that have been applied to this database (see run_migrations)."""
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
 # --- Database Utility Functions ---
+def add_missing_columns(bind, table_name: str, columns: Dict[str, str]) -> bool:
+    """
+    Adds columns that were introduced after a table was first created, since
+    `create_all` never alters existing tables. `columns` maps column names to
+    their SQL type/default clause. Returns False if the table does not exist.
+    """
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(bind)
+    if table_name not in inspector.get_table_names():
+        return False
+    existing = {column["name"] for column in inspector.get_columns(table_name)}
+    with bind.begin() as conn:
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {ddl}"))
+    return True
+
+def migrate_arcana_agent_job_queue_columns(bind) -> None:
+    """Adds the job-queue leasing columns to `arcana_agent_jobs` on older databases."""
+    from sqlalchemy import text
+
+    if add_missing_columns(bind, "arcana_agent_jobs", {
+        "queue_state": "VARCHAR",
+        "lease_owner": "VARCHAR",
+        "lease_expires_at": "DATETIME",
+        "heartbeat_at": "DATETIME",
+        "attempts": "INTEGER DEFAULT 0",
+    }):
+        with bind.begin() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_arcana_agent_jobs_queue_state "
+                "ON arcana_agent_jobs (queue_state)"
+            ))
+
+def migrate_arcana_api_key_fingerprints(bind) -> int:
+    """
+    Adds the `key_fingerprint` column and index to `arcana_api_keys` on databases
+    created before it existed, then backfills fingerprints for existing keys.
+    Returns the number of keys that were backfilled.
+    """
+    from sqlalchemy import text
+
+    if not add_missing_columns(bind, "arcana_api_keys", {"key_fingerprint": "VARCHAR(64)"}):
+        return 0
+    with bind.begin() as conn:
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_arcana_api_keys_key_fingerprint "
+            "ON arcana_api_keys (key_fingerprint)"
+        ))
+
+    db = SessionLocal(bind=bind)
+    backfilled = 0
+    try:
+        for db_key in db.query(ArcanaApiKey).filter(ArcanaApiKey.key_fingerprint == None).all():
+            fingerprint = compute_api_key_fingerprint(decrypt_api_key(db_key.key))
+            if fingerprint:
+                db_key.key_fingerprint = fingerprint
+                backfilled += 1
+        db.commit()
+    finally:
+        db.close()
+    return backfilled
+
+def create_hot_query_indexes(bind) -> None:
+    """Creates the composite indexes declared on the models for the hot query paths."""
+    with bind.begin() as conn:
+        for table in (TelemetryData, RoutingRule, ChatMessage, ContextMemory, TerminalCommandHistory, ArcanaAgentJob, ArcanaAgentJobLog):
+            for index in table.__table__.indexes:
+                if len(index.columns) > 1:
+                    index.create(conn, checkfirst=True)
+
+def migrate_legacy_telemetry(bind) -> int:
+    """Moves `telemetry_data` rows into the compact telemetry store tables."""
+    from server_python.neosyntis.telemetry_store import backfill_legacy_telemetry
+
+    for table in (TelemetryMetric, TelemetrySegment, TelemetrySample, TelemetryRollup):
+        table.__table__.create(bind, checkfirst=True)
+    return backfill_legacy_telemetry(bind)
+
+def migrate_search_index(bind) -> int:
+    """Creates the full-text search index and indexes the rows that already exist."""
+    from server_python.search_index import rebuild_search_index
+
+    if bind.dialect.name != "sqlite":
+        return 0
+    SearchDocument.__table__.create(bind, checkfirst=True)
+    with bind.begin() as conn:
+        return rebuild_search_index(conn)
+
+def migrate_telemetry_segment_series_index(bind) -> int:
+    """
+    Merges segments that concurrent writers created twice for the same series and
+    partition, then replaces the plain segment index with the unique series index.
+    Returns the number of duplicate segments merged away.
+    """
+    from sqlalchemy import text
+    from sqlalchemy.schema import CreateIndex
+
+    from server_python.neosyntis.telemetry_store import merge_duplicate_segments
+
+    merged = merge_duplicate_segments(bind)
+    with bind.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_telemetry_segments_owner_metric_start"))
+        for index in TelemetrySegment.__table__.indexes:
+            # Reflection skips expression indexes, so checkfirst cannot be used here
+            conn.execute(CreateIndex(index, if_not_exists=True))
+    return merged
+
+def migrate_search_update_triggers(bind) -> None:
+    """Limits the search sync triggers on existing databases to updates of the indexed columns."""
+    from server_python.search_index import refresh_search_triggers
+
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as conn:
+        refresh_search_triggers(conn)
+
+# Ordered schema migrations: (version, name, function taking the engine).
+# `create_all` creates missing tables but never alters existing ones, so every
+# change to an existing table needs an entry here. Never renumber or remove entries.
+SCHEMA_MIGRATIONS = [
+    (1, "arcana_api_key_fingerprints", migrate_arcana_api_key_fingerprints),
+    (2, "arcana_agent_job_queue_columns", migrate_arcana_agent_job_queue_columns),
+    (3, "hot_query_composite_indexes", create_hot_query_indexes),
+    (4, "telemetry_store_backfill", migrate_legacy_telemetry),
+    (5, "full_text_search_index", migrate_search_index),
+    (6, "telemetry_segment_series_index", migrate_telemetry_segment_series_index),
+    (7, "search_update_triggers", migrate_search_update_triggers),
+]
+
+def run_migrations(bind) -> List[int]:
+    """
+    Applies the SCHEMA_MIGRATIONS not yet recorded in `schema_migrations`, in order.
+    Stops at the first failure so later migrations never run on a partial schema.
+    Returns the versions that were applied.
+    """
+    SchemaMigration.__table__.create(bind, checkfirst=True)
+    db = SessionLocal(bind=bind)
+    applied: List[int] = []
+    try:
+        done = {version for (version,) in db.query(SchemaMigration.version).all()}
+        for version, name, migrate in SCHEMA_MIGRATIONS:
+            if version in done:
+                continue
+            try:
+                migrate(bind)
+            except Exception as e:
+                logger.error(f"Schema migration {version} ({name}) failed: {e}", exc_info=True)
+                break
+            db.add(SchemaMigration(version=version, name=name))
+            db.commit()
+            applied.append(version)
+            logger.info(f"Applied schema migration {version} ({name}).")
+    finally:
+        db.close()
+    return applied
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,4 +1,6 @@
 import os
+import hmac
+import hashlib
 from cryptography.fernet import Fernet, InvalidToken
 from typing import Optional
 import logging
@@ -53,3 +55,19 @@ def decrypt_api_key(encrypted_api_key: Optional[str]) -> str:
     except Exception as e:
         logger.error(f"An unexpected decryption error occurred: {e}")
         return ""
+
+def compute_api_key_fingerprint(api_key: str) -> Optional[str]:
+    """
+    Computes a deterministic, keyed fingerprint (HMAC-SHA256) of a raw API key.
+    Unlike the Fernet ciphertext, the fingerprint is stable, so it can be stored
+    in an indexed column and used for direct lookups without decrypting rows.
+    Uses API_KEY_FINGERPRINT_SECRET if set, otherwise falls back to FERNET_KEY.
+    Returns None if no secret is available.
+    """
+    if not api_key:
+        return None
+    secret = os.getenv("API_KEY_FINGERPRINT_SECRET") or os.getenv("FERNET_KEY")
+    if not secret:
+        logger.error("CRITICAL: Neither API_KEY_FINGERPRINT_SECRET nor FERNET_KEY is set; cannot fingerprint API keys.")
+        return None
+    return hmac.new(secret.encode(), api_key.encode(), hashlib.sha256).hexdigest()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import shutil
 from typing import List, Optional, Tuple
@@ -12,6 +13,12 @@ from server_python.github_app import get_installation_access_token
 from . import schemas, crud
 
 class GitService:
+    """
+    Git operations on the user's repositories. GitPython blocks on the git
+    subprocess, so the async methods run it via asyncio.to_thread; database
+    lookups and token requests stay on the event loop.
+    """
+
     def __init__(self, db: Session, user: User):
         self.db = db
         self.user = user
@@ -82,7 +89,7 @@ class GitService:
                 parsed_url = git.cmd.Git.polish_url(request.repo_url)
                 auth_repo_url = f"https://x-access-token:{installation_token}@{parsed_url.hostname}{parsed_url.path}"
 
-            repo = git.Repo.clone_from(auth_repo_url, repo_path, branch=request.branch)
+            await asyncio.to_thread(git.Repo.clone_from, auth_repo_url, repo_path, branch=request.branch)
             return f"Repository '{request.repo_url}' cloned to {request.local_path}"
         except git.exc.GitCommandError as e:
             raise HTTPException(status_code=400, detail=f"Failed to clone repository: {e.stderr}")
@@ -91,7 +98,9 @@ class GitService:
 
     async def get_status(self, local_path: str) -> schemas.GitStatus:
         repo = await self._get_repo(local_path)
-        
+        return await asyncio.to_thread(self._read_status, repo)
+
+    def _read_status(self, repo: git.Repo) -> schemas.GitStatus:
         staged_files = []
         unstaged_files = []
         untracked_files = []
@@ -136,29 +145,31 @@ class GitService:
         repo = await self._get_repo(local_path)
         try:
             if '.' in request.files:
-                repo.git.add(all=True)
+                await asyncio.to_thread(repo.git.add, all=True)
             else:
-                repo.index.add(request.files)
+                await asyncio.to_thread(repo.index.add, request.files)
             return f"Files added to staging in {local_path}"
         except git.exc.GitCommandError as e:
             raise HTTPException(status_code=400, detail=f"Failed to add files: {e.stderr}")
 
     async def commit_changes(self, local_path: str, request: schemas.GitCommitRequest) -> str:
         repo = await self._get_repo(local_path)
-        if not repo.index.diff("HEAD"):
+        if not await asyncio.to_thread(repo.index.diff, "HEAD"):
             raise HTTPException(status_code=400, detail="No changes to commit from index.")
         
         user_config = self._get_user_git_config()
         author_name_to_use = request.author_name or (user_config.default_author_name if user_config else None)
         author_email_to_use = request.author_email or (user_config.default_author_email if user_config else None)
 
-        try:
+        def commit() -> git.Commit:
             # Set author if provided or from user config
             if author_name_to_use and author_email_to_use:
                 repo.config_writer().set_value('user', 'name', author_name_to_use).release()
                 repo.config_writer().set_value('user', 'email', author_email_to_use).release()
-            
-            commit_result = repo.index.commit(request.message)
+            return repo.index.commit(request.message)
+
+        try:
+            commit_result = await asyncio.to_thread(commit)
             return f"Changes committed with SHA: {commit_result.hexsha[:7]}"
         except git.exc.GitCommandError as e:
             raise HTTPException(status_code=400, detail=f"Failed to commit changes: {e.stderr}")
@@ -167,11 +178,11 @@ class GitService:
 
     async def push_changes(self, local_path: str, request: schemas.GitPushRequest) -> str:
         repo = await self._get_repo(local_path)
+        user_config = self._get_user_git_config()
         try:
             remote = repo.remote(request.remote_name)
             branch_name = request.branch_name or repo.active_branch.name
             
-            user_config = self._get_user_git_config()
             if user_config and hasattr(user_config, 'github_pat') and user_config.github_pat:
                 # This should ideally update the remote's URL to include the PAT
                 # before calling push, or rely on credential helper.
@@ -184,26 +195,26 @@ class GitService:
                     auth_url = f"https://oauth2:{user_config.github_pat}@{parsed_url.hostname}{parsed_url.path}"
                     remote.set_url(auth_url) # Temporarily change URL for push
                 
-            remote.push(branch_name)
+            await asyncio.to_thread(remote.push, branch_name)
             return f"Changes pushed to {request.remote_name}/{branch_name}"
         except git.exc.GitCommandError as e:
             raise HTTPException(status_code=400, detail=f"Failed to push changes: {e.stderr}")
 
     async def pull_changes(self, local_path: str, request: schemas.GitPullRequest) -> str:
         repo = await self._get_repo(local_path)
+        user_config = self._get_user_git_config()
         try:
             remote = repo.remote(request.remote_name)
             branch_name = request.branch_name or repo.active_branch.name
 
             # Use PAT if available for pull
-            user_config = self._get_user_git_config()
             if user_config and hasattr(user_config, 'github_pat') and user_config.github_pat:
                 if "github.com" in remote.url and remote.url.startswith("https://"):
                     parsed_url = git.cmd.Git.polish_url(remote.url)
                     auth_url = f"https://oauth2:{user_config.github_pat}@{parsed_url.hostname}{parsed_url.path}"
                     remote.set_url(auth_url)
             
-            remote.pull(branch_name)
+            await asyncio.to_thread(remote.pull, branch_name)
             return f"Changes pulled from {request.remote_name}/{branch_name}"
         except git.exc.GitCommandError as e:
             raise HTTPException(status_code=400, detail=f"Failed to pull changes: {e.stderr}")
@@ -211,7 +222,7 @@ class GitService:
     async def checkout_branch(self, local_path: str, request: schemas.GitCheckoutRequest) -> str:
         repo = await self._get_repo(local_path)
         try:
-            repo.git.checkout(request.branch_name)
+            await asyncio.to_thread(repo.git.checkout, request.branch_name)
             return f"Checked out branch {request.branch_name}"
         except git.exc.GitCommandError as e:
             raise HTTPException(status_code=400, detail=f"Failed to checkout branch: {e.stderr}")
@@ -219,7 +230,7 @@ class GitService:
     async def create_branch(self, local_path: str, request: schemas.GitCreateBranchRequest) -> str:
         repo = await self._get_repo(local_path)
         try:
-            new_branch = repo.create_head(request.branch_name)
+            new_branch = await asyncio.to_thread(repo.create_head, request.branch_name)
             # new_branch.checkout() # Often you want to checkout after creating
             return f"Created branch {request.branch_name}"
         except git.exc.GitCommandError as e:
@@ -295,9 +306,9 @@ class GitService:
         repo = await self._get_repo(local_path)
         try:
             if request.path:
-                diff_output = repo.git.diff(request.path)
+                diff_output = await asyncio.to_thread(repo.git.diff, request.path)
             else:
-                diff_output = repo.git.diff()
+                diff_output = await asyncio.to_thread(repo.git.diff)
             return schemas.GitDiffResponse(diff=diff_output)
         except git.exc.GitCommandError as e:
             raise HTTPException(status_code=400, detail=f"Failed to get diff: {e.stderr}")
@@ -0,0 +1,238 @@
+"""
+Per-provider admission control for LLM requests.
+
+Every request to a provider takes a slot. The number of slots adapts AIMD-style:
+it grows by about one per limit's worth of fast successful requests and shrinks
+multiplicatively on 429s and timeouts (and slightly on requests slower than the
+latency target). Waiting requests are served by lane: interactive requests (chat,
+WebSockets) always go before background ones (agent jobs, workflows), and the
+background lane may only fill part of the limit, so interactive traffic always
+has headroom. The lane of a request comes from the calling context (see
+llm_request_lane), so call sites don't have to pass it along.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from server_python.llm_resilience import ProviderError
+
+logger = logging.getLogger(__name__)
+
+LLM_ADMISSION_ENABLED = os.getenv("LLM_ADMISSION_ENABLED", "true").lower() == "true"
+LLM_ADMISSION_INITIAL_LIMIT = float(os.getenv("LLM_ADMISSION_INITIAL_LIMIT", "8"))
+LLM_ADMISSION_MIN_LIMIT = float(os.getenv("LLM_ADMISSION_MIN_LIMIT", "1"))
+LLM_ADMISSION_MAX_LIMIT = float(os.getenv("LLM_ADMISSION_MAX_LIMIT", "64"))
+# Successful requests slower than this count as a congestion signal
+LLM_ADMISSION_LATENCY_TARGET_SECONDS = float(os.getenv("LLM_ADMISSION_LATENCY_TARGET_SECONDS", "30"))
+# Share of the limit the background lane may use
+LLM_ADMISSION_BACKGROUND_SHARE = float(os.getenv("LLM_ADMISSION_BACKGROUND_SHARE", "0.75"))
+# Requests waiting longer than this for a slot fail with 503
+LLM_ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("LLM_ADMISSION_MAX_WAIT_SECONDS", "120"))
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND) # In priority order
+
+_OVERLOAD_BACKOFF = 0.5
+_LATENCY_BACKOFF = 0.9
+
+_current_lane: contextvars.ContextVar[str] = contextvars.ContextVar("llm_request_lane", default=INTERACTIVE)
+
+
+@contextmanager
+def llm_request_lane(lane: str) -> Iterator[None]:
+    """Runs the enclosed code's LLM requests (and the tasks it starts) in `lane`."""
+    if lane not in LANES:
+        raise ValueError(f"Unknown LLM request lane '{lane}'")
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def current_lane() -> str:
+    return _current_lane.get()
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """429s and timeouts mean the provider is saturated."""
+    if isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, HTTPException):
+        return error.status_code == 429
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429
+    return False
+
+
+class AdaptiveLimit:
+    """An additive-increase/multiplicative-decrease concurrency limit."""
+
+    def __init__(self, initial: float = LLM_ADMISSION_INITIAL_LIMIT, min_limit: float = LLM_ADMISSION_MIN_LIMIT,
+                 max_limit: float = LLM_ADMISSION_MAX_LIMIT, latency_target: float = LLM_ADMISSION_LATENCY_TARGET_SECONDS):
+        self.min_limit = max(1.0, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.value = min(self.max_limit, max(self.min_limit, initial))
+        self.latency_target = latency_target
+
+    @property
+    def slots(self) -> int:
+        return max(1, int(self.value))
+
+    def on_success(self, latency: float) -> None:
+        if self.latency_target and latency > self.latency_target:
+            self.value = max(self.min_limit, self.value * _LATENCY_BACKOFF)
+        else:
+            self.value = min(self.max_limit, self.value + 1.0 / self.value)
+
+    def on_overload(self) -> None:
+        self.value = max(self.min_limit, self.value * _OVERLOAD_BACKOFF)
+
+
+class _ProviderState:
+    def __init__(self, limit: AdaptiveLimit):
+        self.limit = limit
+        self.in_flight = {lane: 0 for lane in LANES}
+        self.waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self.admitted = {lane: 0 for lane in LANES}
+        self.wait_seconds = {lane: 0.0 for lane in LANES}
+        self.max_wait_seconds = {lane: 0.0 for lane in LANES}
+        self.rejected = 0
+        self.overloads = 0
+
+
+class ProviderAdmissionController:
+    """Adaptive concurrency limits and priority lanes per LLM provider (keyed by LLMProvider.id)."""
+
+    def __init__(self, initial_limit: float = LLM_ADMISSION_INITIAL_LIMIT, min_limit: float = LLM_ADMISSION_MIN_LIMIT,
+                 max_limit: float = LLM_ADMISSION_MAX_LIMIT, latency_target: float = LLM_ADMISSION_LATENCY_TARGET_SECONDS,
+                 background_share: float = LLM_ADMISSION_BACKGROUND_SHARE, max_wait: float = LLM_ADMISSION_MAX_WAIT_SECONDS,
+                 enabled: bool = LLM_ADMISSION_ENABLED):
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.background_share = background_share
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self._providers: Dict[str, _ProviderState] = {}
+
+    def _state(self, provider_id: str) -> _ProviderState:
+        state = self._providers.get(provider_id)
+        if state is None:
+            state = _ProviderState(AdaptiveLimit(self.initial_limit, self.min_limit, self.max_limit, self.latency_target))
+            self._providers[provider_id] = state
+        return state
+
+    def _can_admit(self, state: _ProviderState, lane: str) -> bool:
+        slots = state.limit.slots
+        if sum(state.in_flight.values()) >= slots:
+            return False
+        if lane == BACKGROUND:
+            if state.waiters[INTERACTIVE]:
+                return False
+            return state.in_flight[BACKGROUND] < max(1, math.floor(slots * self.background_share))
+        return True
+
+    def _wake(self, state: _ProviderState) -> None:
+        for lane in LANES:
+            waiters = state.waiters[lane]
+            while waiters and self._can_admit(state, lane):
+                waiter = waiters.popleft()
+                if waiter.done():
+                    continue
+                state.in_flight[lane] += 1
+                waiter.set_result(None)
+
+    async def _acquire(self, state: _ProviderState, lane: str) -> None:
+        if not state.waiters[lane] and self._can_admit(state, lane):
+            state.in_flight[lane] += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters[lane].append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait or None)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted as this request gave up: hand it on
+                state.in_flight[lane] -= 1
+                self._wake(state)
+            else:
+                waiter.cancel()
+                try:
+                    state.waiters[lane].remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                state.rejected += 1
+                raise ProviderError(status_code=503, detail="The LLM provider is busy, please retry shortly.")
+            raise
+
+    @asynccontextmanager
+    async def slot(self, provider_id: str, lane: Optional[str] = None) -> AsyncIterator[None]:
+        """
+        Holds one of the provider's slots for the enclosed request, waiting in the
+        lane's queue if none is free. 429s and timeouts raised inside shrink the
+        limit; successes grow it.
+        """
+        if not self.enabled:
+            yield
+            return
+        lane = lane or current_lane()
+        state = self._state(provider_id)
+        queued_at = time.monotonic()
+        await self._acquire(state, lane)
+        waited = time.monotonic() - queued_at
+        state.admitted[lane] += 1
+        state.wait_seconds[lane] += waited
+        state.max_wait_seconds[lane] = max(state.max_wait_seconds[lane], waited)
+
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            if is_overload_error(e):
+                state.overloads += 1
+                state.limit.on_overload()
+                logger.warning(f"LLM provider {provider_id} is overloaded ({e!r}); concurrency limit lowered to {state.limit.value:.1f}.")
+            raise
+        else:
+            state.limit.on_success(time.monotonic() - started)
+        finally:
+            state.in_flight[lane] -= 1
+            self._wake(state)
+
+    def stats(self) -> Dict[str, Any]:
+        """Limit, in-flight requests, queue depth and wait times per provider and lane."""
+        return {
+            provider_id: {
+                "limit": round(state.limit.value, 2),
+                "in_flight": sum(state.in_flight.values()),
+                "overloads": state.overloads,
+                "rejected": state.rejected,
+                "lanes": {
+                    lane: {
+                        "in_flight": state.in_flight[lane],
+                        "queued": len(state.waiters[lane]),
+                        "admitted": state.admitted[lane],
+                        "avg_wait_seconds": round(state.wait_seconds[lane] / state.admitted[lane], 4) if state.admitted[lane] else 0.0,
+                        "max_wait_seconds": round(state.max_wait_seconds[lane], 4),
+                    }
+                    for lane in LANES
+                },
+            }
+            for provider_id, state in self._providers.items()
+        }
+
+
+provider_admission = ProviderAdmissionController()
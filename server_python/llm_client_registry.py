@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings shared by every provider client.
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+LLM_HTTP_TIMEOUT_SECONDS = float(os.getenv("LLM_HTTP_TIMEOUT_SECONDS", "60"))
+LLM_HTTP2_ENABLED = os.getenv("LLM_HTTP2_ENABLED", "false").lower() == "true"
+LLM_HTTP_WARMUP_TIMEOUT_SECONDS = float(os.getenv("LLM_HTTP_WARMUP_TIMEOUT_SECONDS", "5"))
+
+
+@dataclass
+class _ProviderClient:
+    client: httpx.AsyncClient
+    config_fingerprint: str
+    loop: asyncio.AbstractEventLoop
+
+
+def _config_fingerprint(base_url: str, api_key: Optional[str]) -> str:
+    return hashlib.sha256(f"{base_url}\n{api_key or ''}".encode()).hexdigest()
+
+
+class ProviderClientRegistry:
+    """
+    Keeps one long-lived httpx.AsyncClient (and therefore one keep-alive
+    connection pool) per LLM provider, keyed by LLMProvider.id.
+
+    A client is rebuilt when the provider's base_url or API key changes, or when
+    it is requested from a different event loop than the one it was created on.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        timeout: float = LLM_HTTP_TIMEOUT_SECONDS,
+        http2: bool = LLM_HTTP2_ENABLED,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        self.http2 = http2 and self._http2_available()
+        self._clients: Dict[str, _ProviderClient] = {}
+
+    @staticmethod
+    def _http2_available() -> bool:
+        if importlib.util.find_spec("h2") is None:
+            logger.warning("LLM_HTTP2_ENABLED is set but the 'h2' package is not installed; falling back to HTTP/1.1.")
+            return False
+        return True
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+
+    def get_client(self, provider_id: str, base_url: str, api_key: Optional[str] = None) -> httpx.AsyncClient:
+        """
+        Returns the pooled client for a provider, creating or rebuilding it if needed.
+        Must be called from within a running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        fingerprint = _config_fingerprint(base_url, api_key)
+        entry = self._clients.get(provider_id)
+        if entry and entry.config_fingerprint == fingerprint and entry.loop is loop and not entry.client.is_closed:
+            return entry.client
+
+        if entry:
+            logger.info(f"Rebuilding HTTP client for LLM provider {provider_id} (configuration or event loop changed).")
+            self._close_entry(entry)
+        client = self._build_client()
+        self._clients[provider_id] = _ProviderClient(client=client, config_fingerprint=fingerprint, loop=loop)
+        return client
+
+    def invalidate(self, provider_id: str) -> None:
+        """
+        Drops the pooled client for a provider, e.g. after its base_url or key was
+        updated or the provider was deleted. Safe to call from sync routes.
+        """
+        entry = self._clients.pop(provider_id, None)
+        if entry:
+            logger.info(f"Invalidated HTTP client for LLM provider {provider_id}.")
+            self._close_entry(entry)
+
+    @staticmethod
+    def _close_entry(entry: _ProviderClient) -> None:
+        if entry.client.is_closed or entry.loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is entry.loop:
+            entry.loop.create_task(entry.client.aclose())
+        else:
+            entry.loop.call_soon_threadsafe(lambda: entry.loop.create_task(entry.client.aclose()))
+
+    async def warm_up(self, providers: Iterable) -> None:
+        """
+        Creates clients for the given providers and opens a connection to each
+        base_url so the first LLM call does not pay the TCP+TLS handshake.
+        Failures are logged and otherwise ignored.
+        """
+        async def _warm(provider_id: str, base_url: str, api_key: Optional[str]):
+            client = self.get_client(provider_id, base_url, api_key)
+            try:
+                await client.head(base_url, timeout=LLM_HTTP_WARMUP_TIMEOUT_SECONDS)
+            except Exception as e:
+                logger.warning(f"Warm-up request to LLM provider {provider_id} at {base_url} failed: {e}")
+
+        tasks = [
+            _warm(provider_id, base_url, api_key)
+            for provider_id, base_url, api_key in providers
+            if base_url and "mock-llm.com" not in base_url.lower()
+        ]
+        if tasks:
+            await asyncio.gather(*tasks)
+            logger.info(f"Warmed up HTTP clients for {len(tasks)} LLM providers.")
+
+    async def aclose(self) -> None:
+        """Closes every pooled client owned by the current event loop."""
+        loop = asyncio.get_running_loop()
+        for provider_id, entry in list(self._clients.items()):
+            if entry.loop is loop:
+                self._clients.pop(provider_id, None)
+                await entry.client.aclose()
+
+
+provider_clients = ProviderClientRegistry()
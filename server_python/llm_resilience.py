@@ -0,0 +1,304 @@
+"""
+Retries, circuit breaking and hedging for LLM provider requests.
+
+call_with_resilience runs one provider request: it fails fast while the
+provider's circuit is open, retries transport errors and retryable statuses
+with jittered exponential backoff (honouring Retry-After), and, when hedging is
+enabled, fires a duplicate request once the first has taken longer than the
+model's p95 latency, using whichever answers first. Failing over to another
+model when a provider stays unavailable is up to the caller (see call_llm_api),
+since only it knows which models can stand in for one another. A deadline
+bounds one call across its retries and failovers (see call_deadline).
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+LLM_RETRY_MAX_DELAY_SECONDS = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", "8"))
+# Consecutive failed attempts that open a provider's circuit
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+# How long an open circuit rejects requests before letting a probe through
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+# Hedged requests cost tokens, so they are opt-in
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+# Latency samples a model needs before its requests are hedged
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Upper bound on one LLM call, including its retries, backoff and failovers (0 disables it)
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv("LLM_CALL_DEADLINE_SECONDS", "180"))
+
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_LATENCY_WINDOW = 200
+
+T = TypeVar("T")
+
+
+class ProviderError(HTTPException):
+    """
+    An HTTPException caused by the provider: a status it answered with, a transport
+    error reaching it, its open circuit or its full admission queue. Errors raised
+    on our side (an unsupported provider, an unparseable response) stay plain
+    HTTPExceptions, so they are never mistaken for an unavailable provider.
+    """
+
+
+def call_deadline(seconds: float = LLM_CALL_DEADLINE_SECONDS) -> Optional[float]:
+    """time.monotonic() value by which a call starting now must finish, or None for no deadline."""
+    return time.monotonic() + seconds if seconds > 0 else None
+
+
+def deadline_exceeded(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def deadline_error() -> HTTPException:
+    return HTTPException(status_code=504, detail="The LLM request did not complete in time, please retry shortly.")
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Transport errors (including timeouts) and retryable HTTP statuses from the provider."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, httpx.TransportError)
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """Provider errors from call_llm_api that another provider or model may not have."""
+    return isinstance(error, ProviderError) and error.status_code in RETRYABLE_STATUS_CODES
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    try:
+        return max(0.0, float(error.response.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+
+def retry_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff for the retry after `attempt` (0-based), capped at the max delay."""
+    if retry_after is not None:
+        return min(retry_after, LLM_RETRY_MAX_DELAY_SECONDS)
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY_SECONDS, LLM_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+
+
+class _Circuit:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.times_opened = 0
+
+
+class CircuitBreakers:
+    """
+    One circuit per provider. A circuit opens after `failure_threshold`
+    consecutive failed attempts and rejects requests for `reset_seconds`; then a
+    single probe request is let through, which closes the circuit on success or
+    opens it again on failure.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = LLM_CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self._circuits: Dict[str, _Circuit] = {}
+
+    def _circuit(self, provider_id: str) -> _Circuit:
+        return self._circuits.setdefault(provider_id, _Circuit())
+
+    def state(self, provider_id: str) -> str:
+        circuit = self._circuits.get(provider_id)
+        if circuit is None:
+            return CLOSED
+        if circuit.state == OPEN and time.monotonic() - circuit.opened_at >= self.reset_seconds:
+            return HALF_OPEN
+        return circuit.state
+
+    def is_available(self, provider_id: str) -> bool:
+        """Whether a request to the provider would be let through right now."""
+        state = self.state(provider_id)
+        return state == CLOSED or (state == HALF_OPEN and not self._circuit(provider_id).probing)
+
+    def before_request(self, provider_id: str) -> None:
+        """Raises a 503 HTTPException while the provider's circuit rejects requests."""
+        circuit = self._circuit(provider_id)
+        state = self.state(provider_id)
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and not circuit.probing:
+            circuit.state = HALF_OPEN
+            circuit.probing = True
+            return
+        raise ProviderError(status_code=503, detail=f"LLM provider {provider_id} is unavailable (circuit open), please retry shortly.")
+
+    def record_success(self, provider_id: str) -> None:
+        circuit = self._circuit(provider_id)
+        if circuit.state != CLOSED:
+            logger.info(f"LLM provider {provider_id} recovered; circuit closed.")
+        circuit.state = CLOSED
+        circuit.failures = 0
+        circuit.probing = False
+
+    def record_failure(self, provider_id: str) -> None:
+        circuit = self._circuit(provider_id)
+        circuit.failures += 1
+        if circuit.state == HALF_OPEN or (circuit.state == CLOSED and circuit.failures >= self.failure_threshold):
+            circuit.state = OPEN
+            circuit.opened_at = time.monotonic()
+            circuit.times_opened += 1
+            logger.warning(f"LLM provider {provider_id} failed {circuit.failures} times in a row; circuit opened for {self.reset_seconds}s.")
+        circuit.probing = False
+
+    def release_probe(self, provider_id: str) -> None:
+        """Lets another probe through when one ended without telling whether the provider is healthy."""
+        self._circuit(provider_id).probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            provider_id: {"state": self.state(provider_id), "consecutive_failures": circuit.failures, "times_opened": circuit.times_opened}
+            for provider_id, circuit in self._circuits.items()
+        }
+
+
+class LatencyTracker:
+    """Recent successful request latencies per provider and model, for hedging."""
+
+    def __init__(self, quantile: float = LLM_HEDGE_QUANTILE, min_samples: int = LLM_HEDGE_MIN_SAMPLES, enabled: bool = LLM_HEDGE_ENABLED):
+        self.quantile_level = quantile
+        self.min_samples = max(1, min_samples)
+        self.enabled = enabled
+        self._samples: Dict[str, Deque[float]] = {}
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def observe(self, key: str, seconds: float) -> None:
+        self._samples.setdefault(key, deque(maxlen=_LATENCY_WINDOW)).append(seconds)
+
+    def quantile(self, key: str) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(self.quantile_level * len(ordered)))]
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """Seconds after which a duplicate request is sent, or None to not hedge."""
+        return self.quantile(key) if self.enabled else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedging_enabled": self.enabled,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_after_seconds": {key: round(value, 3) for key in self._samples if (value := self.quantile(key)) is not None},
+        }
+
+
+async def hedged(call: Callable[[], Awaitable[T]], delay: Optional[float], tracker: Optional["LatencyTracker"] = None) -> T:
+    """
+    Runs `call`; if it hasn't finished after `delay` seconds, starts a second one
+    and returns whichever succeeds first, cancelling the other. The first
+    error is raised only if both fail.
+    """
+    if delay is None:
+        return await call()
+    first = asyncio.ensure_future(call())
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+    except BaseException:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+
+    if tracker is not None:
+        tracker.hedged += 1
+    second = asyncio.ensure_future(call())
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second and tracker is not None:
+                        tracker.hedge_wins += 1
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+provider_breakers = CircuitBreakers()
+llm_latencies = LatencyTracker()
+
+
+async def call_with_resilience(provider_id: str, latency_key: str, attempt: Callable[[], Awaitable[T]],
+                               max_attempts: int = LLM_RETRY_MAX_ATTEMPTS, hedge: bool = True,
+                               deadline: Optional[float] = None) -> T:
+    """
+    Runs `attempt` (one provider request) under the provider's circuit breaker,
+    retrying retryable errors with backoff. The last error is raised unchanged
+    once the attempts are used up, or when the next retry would start after
+    `deadline` (a time.monotonic() value); a 503 ProviderError when the circuit
+    is open, and a 504 HTTPException when an attempt runs into the deadline.
+    `hedge=False` is for attempts whose result must not be discarded (open streams).
+    """
+    for attempt_number in range(max(1, max_attempts)):
+        if deadline_exceeded(deadline):
+            raise deadline_error()
+        provider_breakers.before_request(provider_id)
+        started = time.monotonic()
+        try:
+            call = hedged(attempt, llm_latencies.hedge_delay(latency_key) if hedge else None, llm_latencies)
+            if deadline is None:
+                result = await call
+            else:
+                try:
+                    result = await asyncio.wait_for(call, timeout=deadline - started)
+                except asyncio.TimeoutError:
+                    if not deadline_exceeded(deadline):
+                        raise
+                    raise deadline_error()
+        except Exception as e:
+            if not is_retryable_error(e):
+                if isinstance(e, httpx.HTTPStatusError):
+                    provider_breakers.record_success(provider_id) # It answered, just not with a completion
+                else:
+                    provider_breakers.release_probe(provider_id) # Failed on our side or ran out of time
+                raise
+            provider_breakers.record_failure(provider_id)
+            if attempt_number + 1 >= max_attempts:
+                raise
+            delay = retry_delay(attempt_number, retry_after_seconds(e))
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+            logger.warning(f"LLM request to provider {provider_id} failed ({e!r}); retry {attempt_number + 1} in {delay:.2f}s.")
+            await asyncio.sleep(delay)
+        except BaseException:
+            provider_breakers.release_probe(provider_id)
+            raise
+        else:
+            provider_breakers.record_success(provider_id)
+            llm_latencies.observe(latency_key, time.monotonic() - started)
+            return result
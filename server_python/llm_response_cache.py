@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LLM_RESPONSE_CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+LLM_RESPONSE_CACHE_MAX_BYTES = int(os.getenv("LLM_RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+LLM_RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("LLM_RESPONSE_CACHE_TTL_SECONDS", "86400"))
+# Calls at or below this temperature are cached unless they opt out; hotter calls only when they opt in
+LLM_RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_RESPONSE_CACHE_MAX_TEMPERATURE", "0.3"))
+# SQLite file shared by all workers on the host; unset to keep the cache in process only
+LLM_RESPONSE_CACHE_DISK_PATH = os.getenv("LLM_RESPONSE_CACHE_DISK_PATH")
+LLM_RESPONSE_CACHE_DISK_MAX_ENTRIES = int(os.getenv("LLM_RESPONSE_CACHE_DISK_MAX_ENTRIES", "50000"))
+
+_ENTRY_OVERHEAD_BYTES = 200 # Key, bookkeeping and dict slot of an in-memory entry
+_DISK_PRUNE_EVERY = 500 # Disk writes between prunes of expired and excess entries
+
+
+def _normalize_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    normalized = dict(message)
+    if isinstance(normalized.get("content"), str):
+        normalized["content"] = normalized["content"].strip()
+    return normalized
+
+
+def response_cache_key(provider_id: str, base_url: str, model_name: str, messages: List[Dict[str, Any]],
+                       tools: Optional[List[Dict[str, Any]]] = None, temperature: float = 0.7, top_p: float = 1.0) -> str:
+    """
+    SHA-256 of everything that determines a completion: provider, model, messages,
+    tools and sampling parameters, as canonical JSON. Message text is stripped, so
+    prompts differing only in surrounding whitespace share an entry.
+    """
+    canonical = json.dumps({
+        "provider": provider_id,
+        "base_url": (base_url or "").rstrip("/").lower(),
+        "model": model_name,
+        "messages": [_normalize_message(message) for message in messages],
+        "tools": tools or [],
+        "temperature": round(float(temperature), 4),
+        "top_p": round(float(top_p), 4),
+    }, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """Cache entries in an SQLite file, shared by the processes of one host."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_response_cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, stored_at REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, now: float) -> Optional[Tuple[bytes, float]]:
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM llm_response_cache WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def put(self, key: str, value: bytes, expires_at: float, now: float) -> None:
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_response_cache (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?)",
+            (key, value, expires_at, now),
+        )
+        self._writes += 1
+        if self._writes % _DISK_PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM llm_response_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM llm_response_cache WHERE key IN (SELECT key FROM llm_response_cache "
+                "ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM llm_response_cache")
+
+
+class LLMResponseCache:
+    """
+    Completions of deterministic LLM calls, keyed by response_cache_key(). Entries
+    live in an in-process LRU bounded by `max_bytes` of serialized responses and,
+    when `disk_path` is set, in an SQLite file shared with the other workers;
+    disk hits are promoted to memory.
+    """
+
+    def __init__(self, max_bytes: int = LLM_RESPONSE_CACHE_MAX_BYTES, ttl: float = LLM_RESPONSE_CACHE_TTL_SECONDS,
+                 disk_path: Optional[str] = LLM_RESPONSE_CACHE_DISK_PATH, disk_max_entries: int = LLM_RESPONSE_CACHE_DISK_MAX_ENTRIES,
+                 max_temperature: float = LLM_RESPONSE_CACHE_MAX_TEMPERATURE, enabled: bool = LLM_RESPONSE_CACHE_ENABLED):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk: Optional[_DiskTier] = None
+        if disk_path:
+            try:
+                self._disk = _DiskTier(disk_path, disk_max_entries)
+            except Exception as e:
+                logger.warning(f"LLM response disk cache at {disk_path} is unavailable, caching in memory only: {e}")
+        self._stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bypassed": 0, "disk_errors": 0}
+
+    def should_cache(self, temperature: float, cache: Optional[bool] = None) -> bool:
+        """
+        Whether a call is looked up and stored: `cache=False` opts out, `cache=True`
+        opts in regardless of temperature, None caches only low-temperature calls.
+        """
+        if not self.enabled:
+            return False
+        if cache is True or (cache is None and temperature <= self.max_temperature):
+            return True
+        self._count("bypassed")
+        return False
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns a copy of the cached response, or None."""
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self._disk is not None:
+            value = self._get_disk(key, now)
+        return self._found(value)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """get() for the event loop: the disk tier is read in a worker thread."""
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self._disk is not None:
+            value = await asyncio.to_thread(self._get_disk, key, now)
+        return self._found(value)
+
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        entry = self._put_memory(key, response)
+        if self._disk is not None:
+            self._put_disk(key, *entry)
+
+    async def aput(self, key: str, response: Dict[str, Any]) -> None:
+        """put() for the event loop: the disk tier is written in a worker thread."""
+        entry = self._put_memory(key, response)
+        if self._disk is not None:
+            await asyncio.to_thread(self._put_disk, key, *entry)
+
+    def _get_memory(self, key: str, now: float) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            self._stats["memory_hits"] += 1
+            return entry[1]
+
+    def _get_disk(self, key: str, now: float) -> Optional[bytes]:
+        """Reads the disk tier, promoting a hit to memory."""
+        try:
+            found = self._disk.get(key, now)
+        except Exception as e:
+            self._count("disk_errors")
+            logger.warning(f"LLM response disk cache read failed: {e}")
+            return None
+        if found is None:
+            return None
+        value, expires_at = found
+        with self._lock:
+            self._store(key, value, expires_at)
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+        return value
+
+    def _found(self, value: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        if value is None:
+            self._count("misses")
+            return None
+        return json.loads(value)
+
+    def _put_memory(self, key: str, response: Dict[str, Any]) -> Tuple[bytes, float, float]:
+        value = json.dumps(response, separators=(",", ":"), default=str).encode("utf-8")
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._store(key, value, expires_at)
+            self._stats["stores"] += 1
+        return value, expires_at, now
+
+    def _put_disk(self, key: str, value: bytes, expires_at: float, now: float) -> None:
+        try:
+            self._disk.put(key, value, expires_at, now)
+        except Exception as e:
+            self._count("disk_errors")
+            logger.warning(f"LLM response disk cache write failed: {e}")
+
+    def _store(self, key: str, value: bytes, expires_at: float) -> None:
+        size = len(value) + _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (expires_at, value)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1]) + _ENTRY_OVERHEAD_BYTES
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes})
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["disk_enabled"] = self._disk is not None
+        return stats
+
+
+llm_response_cache = LLMResponseCache()
@@ -1,12 +1,16 @@
 import httpx
 import os
+import json
 import logging
 from dotenv import load_dotenv
 import uuid # Import uuid
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 from sqlalchemy.orm import Session
 from .database import Agent as DBAgent, Workflow as DBWorkflow, ChatMessage as DBChatMessage, Conversation as DBConversation, User as DBUser, LLMProvider, LLMModel # Import necessary DB models
 from datetime import datetime, timezone # Import datetime and timezone for utcnow
+from .llm_client_registry import provider_clients
+from .llm_admission import provider_admission
+from . import chat_context
 
 # Load environment variables
 load_dotenv()
@@ -15,24 +19,47 @@ logger = logging.getLogger(__name__)
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "google/gemini-1.5-pro")
+# Model that folds old chat messages into the rolling conversation summary
+OPENROUTER_SUMMARY_MODEL = os.getenv("OPENROUTER_SUMMARY_MODEL", OPENROUTER_MODEL)
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+# Registry key for the env-configured OpenRouter client (not backed by an LLMProvider row)
+OPENROUTER_ENV_CLIENT_ID = "env:openrouter"
 
-async def get_openrouter_completion(user_id: str, message: str, model_name: Optional[str] = None, db: Optional[Session] = None, owner_id: Optional[str] = None, conversation_id: Optional[uuid.UUID] = None) -> str:
+async def iter_sse_chunks(response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    """Yields the JSON chunks of an OpenAI-style `stream: true` response, up to the [DONE] marker."""
+    async for line in response.aiter_lines():
+        # SSE comments (e.g. ": OPENROUTER PROCESSING") and blank separators carry no data
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        yield json.loads(data)
+
+async def _summarize_with_openrouter(previous_summary: Optional[str], messages: List[Dict[str, str]], max_tokens: int) -> str:
+    """Summarizer for chat_context: updates a conversation summary with the env-configured OpenRouter model."""
     if not OPENROUTER_API_KEY or OPENROUTER_API_KEY == "YOUR_OPENROUTER_API_KEY":
-        logger.error("OPENROUTER_API_KEY is not set or is default. Please configure it in .env")
         return "Error: OpenRouter API key not configured."
+    payload = {
+        "model": OPENROUTER_SUMMARY_MODEL,
+        "messages": chat_context.summarization_prompt(previous_summary, messages, max_tokens),
+        "max_tokens": max_tokens,
+    }
+    client = provider_clients.get_client(OPENROUTER_ENV_CLIENT_ID, OPENROUTER_BASE_URL, OPENROUTER_API_KEY)
+    async with provider_admission.slot(OPENROUTER_ENV_CLIENT_ID):
+        response = await client.post(f"{OPENROUTER_BASE_URL}/chat/completions", headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}, json=payload, timeout=30.0)
+        response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"]
 
+async def _build_openrouter_messages(message: str, db: Optional[Session] = None, owner_id: Optional[str] = None, conversation_id: Optional[uuid.UUID] = None, model_name: Optional[str] = None, current_message_id: Optional[str] = None) -> List[Dict[str, Any]]:
     messages_payload = []
 
-    # Fetch conversation history from the database if conversation_id is provided
+    # Conversation history within the model's token budget: a rolling summary plus the recent messages
     if db and conversation_id and owner_id:
-        conversation_messages = db.query(DBChatMessage).filter(
-            DBChatMessage.conversation_id == str(conversation_id),
-            DBChatMessage.user_id == owner_id
-        ).order_by(DBChatMessage.timestamp).all()
-        
-        for msg in conversation_messages:
-            messages_payload.append({"role": msg.sender, "content": msg.message_content})
+        messages_payload += await chat_context.assemble_history(
+            db, owner_id, str(conversation_id), model_name=model_name or OPENROUTER_MODEL,
+            exclude_message_id=current_message_id, summarize=_summarize_with_openrouter,
+        )
     
     # --- Arcana Contextual Awareness ---
     context_message = ""
@@ -63,6 +90,14 @@ async def get_openrouter_completion(user_id: str, message: str, model_name: Opti
 
     # Add user's current message to the payload
     messages_payload.append({"role": "user", "content": full_message})
+    return messages_payload
+
+async def get_openrouter_completion(user_id: str, message: str, model_name: Optional[str] = None, db: Optional[Session] = None, owner_id: Optional[str] = None, conversation_id: Optional[uuid.UUID] = None, current_message_id: Optional[str] = None) -> str:
+    if not OPENROUTER_API_KEY or OPENROUTER_API_KEY == "YOUR_OPENROUTER_API_KEY":
+        logger.error("OPENROUTER_API_KEY is not set or is default. Please configure it in .env")
+        return "Error: OpenRouter API key not configured."
+
+    messages_payload = await _build_openrouter_messages(message, db=db, owner_id=owner_id, conversation_id=conversation_id, model_name=model_name, current_message_id=current_message_id)
 
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
@@ -74,18 +109,19 @@ async def get_openrouter_completion(user_id: str, message: str, model_name: Opti
     }
 
     try:
-        async with httpx.AsyncClient() as client:
+        client = provider_clients.get_client(OPENROUTER_ENV_CLIENT_ID, OPENROUTER_BASE_URL, OPENROUTER_API_KEY)
+        async with provider_admission.slot(OPENROUTER_ENV_CLIENT_ID):
             response = await client.post(f"{OPENROUTER_BASE_URL}/chat/completions", headers=headers, json=payload, timeout=30.0)
             response.raise_for_status() # Raise an exception for 4xx or 5xx responses
-            
-            response_data = response.json()
-            if "choices" in response_data and response_data["choices"]:
-                llm_response_content = response_data["choices"][0]["message"]["content"]
-                # Add LLM's response to history (REMOVED - now handled by main.py)
-                return llm_response_content
-            else:
-                logger.error(f"OpenRouter API response missing choices: {response_data}")
-                return "Error: Could not get a valid response from LLM."
+        
+        response_data = response.json()
+        if "choices" in response_data and response_data["choices"]:
+            llm_response_content = response_data["choices"][0]["message"]["content"]
+            # Add LLM's response to history (REMOVED - now handled by main.py)
+            return llm_response_content
+        else:
+            logger.error(f"OpenRouter API response missing choices: {response_data}")
+            return "Error: Could not get a valid response from LLM."
     except httpx.RequestError as e:
         logger.error(f"OpenRouter API request failed: {e}")
         return f"Error: Failed to connect to OpenRouter API. {e}"
@@ -96,6 +132,50 @@ async def get_openrouter_completion(user_id: str, message: str, model_name: Opti
         logger.error(f"An unexpected error occurred: {e}")
         return f"Error: An unexpected error occurred. {e}"
 
+async def stream_openrouter_completion(user_id: str, message: str, model_name: Optional[str] = None, db: Optional[Session] = None, owner_id: Optional[str] = None, conversation_id: Optional[uuid.UUID] = None, current_message_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Streaming counterpart of get_openrouter_completion: yields content fragments as
+    OpenRouter generates them (`stream: true`). Errors are yielded as a single
+    "Error: ..." fragment, mirroring the non-streaming function.
+    """
+    if not OPENROUTER_API_KEY or OPENROUTER_API_KEY == "YOUR_OPENROUTER_API_KEY":
+        logger.error("OPENROUTER_API_KEY is not set or is default. Please configure it in .env")
+        yield "Error: OpenRouter API key not configured."
+        return
+
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
+    }
+    payload = {
+        "model": model_name if model_name else OPENROUTER_MODEL,
+        "messages": await _build_openrouter_messages(message, db=db, owner_id=owner_id, conversation_id=conversation_id, model_name=model_name, current_message_id=current_message_id),
+        "stream": True
+    }
+
+    try:
+        client = provider_clients.get_client(OPENROUTER_ENV_CLIENT_ID, OPENROUTER_BASE_URL, OPENROUTER_API_KEY)
+        async with provider_admission.slot(OPENROUTER_ENV_CLIENT_ID), \
+                client.stream("POST", f"{OPENROUTER_BASE_URL}/chat/completions", headers=headers, json=payload, timeout=30.0) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()
+            async for chunk in iter_sse_chunks(response):
+                for choice in chunk.get("choices", []):
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        yield content
+    except httpx.RequestError as e:
+        logger.error(f"OpenRouter API request failed: {e}")
+        yield f"Error: Failed to connect to OpenRouter API. {e}"
+    except httpx.HTTPStatusError as e:
+        logger.error(f"OpenRouter API returned an error: {e.response.status_code} - {e.response.text}")
+        yield f"Error: OpenRouter API returned an error. Status: {e.response.status_code}. Details: {e.response.text}"
+    except Exception as e:
+        logger.error(f"An unexpected error occurred: {e}")
+        yield f"Error: An unexpected error occurred. {e}"
+
 # Function to clear conversation history for a user (REMOVED - now handled by main.py)
 # def clear_conversation_history(db: Session, owner_id: str, conversation_id: Optional[uuid.UUID] = None):
 #     if conversation_id:
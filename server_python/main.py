@@ -6,16 +6,18 @@ import argparse
 import time
 
 import pty
+import fcntl
+import termios
+import struct
 import asyncio
 import json
 from typing import List, Dict, Any, Optional
 import uuid # Import uuid
-import psutil # Import psutil for system metrics
 from fastapi import FastAPI, Depends, HTTPException, status, Request, Response, WebSocket, WebSocketDisconnect, Query
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from dotenv import load_dotenv # Import load_dotenv
@@ -34,19 +36,37 @@ from server_python.database import (
     create_user_in_db, get_db, User as DBUser, get_user_by_username_or_email, 
     Agent as DBAgent, HardwareDevice as DBHardwareDevice, Workflow as DBWorkflow, 
     Dataset as DBDataset, RoutingRule as DBRoutingRule, Conversation as DBConversation, 
-    ChatMessage as DBChatMessage, ContextMemory as DBContextMemory, 
+    ChatMessage as DBChatMessage, ConversationSummary as DBConversationSummary, ContextMemory as DBContextMemory, 
     LLMProvider as DBLLMProvider, LLMModel as DBLLMModel, 
     UserLLMPreference as DBUserLLMPreference, TerminalSession as DBTerminalSession, 
     TerminalCommandHistory as DBTerminalCommandHistory, populate_initial_llm_data,
+    run_migrations,
     seed_initial_plans, Plan, UserSubscription # Import Plan and UserSubscription
 )
 from server_python.auth import get_password_hash, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, generate_verification_token, send_verification_email, PermissionChecker, VERIFICATION_TOKEN_EXPIRE_MINUTES, get_websocket_token, get_current_websocket_user
 from server_python.schemas import Token, User, UserCreate, UserBase, Agent, AgentCreate, HardwareDevice, HardwareDeviceUpdate, Workflow, WorkflowCreate, Dataset, DatasetCreate, RoutingRule, RoutingRuleCreate, MessageResponse, UserUpdate, TelemetryData, ChatRequest, ChatResponse, ChatMessage, Conversation, ConversationCreate, ConversationUpdate, ContextMemory, ContextMemoryCreate, ContextMemoryUpdate, LLMProvider, LLMProviderCreate, LLMProviderUpdate, LLMModel, LLMModelCreate, LLMModelUpdate, UserLLMPreference, UserLLMPreferenceCreate, UserLLMPreferenceUpdate, TerminalSession, TerminalSessionCreate, TerminalSessionUpdate, TerminalCommandHistory, TerminalCommandHistoryCreate, SystemStatus
 from server_python import llm_service # Import the new LLM service
+from server_python.llm_admission import BACKGROUND, llm_request_lane
+from server_python.llm_client_registry import provider_clients
+from server_python.system_metrics import system_metrics_sampler
+from server_python.dashboard_stats import get_user_stats, reset_dashboard_stats
+from server_python.pagination import paginate, set_next_cursor, NEXT_CURSOR_HEADER
+from server_python import search_index
+from server_python.search_index import SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from server_python.encryption_utils import decrypt_api_key
 from server_python.cognisys import api as cognisys_api # Import the cognisys API router
+from server_python.cognisys.routing_engine import routing_rule_cache
 from server_python.myntrix import api as myntrix_api # Import the myntrix API router
 from server_python.neosyntis import api as neosyntis_api # Import the neosyntis API router
+from server_python.neosyntis.schemas import TelemetryDataCreate as NeosyntisTelemetryDataCreate
+from server_python.neosyntis.telemetry_ingest import ingest_telemetry_batch
+from server_python.neosyntis.telemetry_store import telemetry_rollup_worker
+from server_python.neosyntis.telemetry_hub import telemetry_hub
 from server_python.arcana import api as arcana_api # Import the arcana API router
+from server_python.arcana.job_queue import agent_job_queue
+from server_python.arcana.job_log_sink import agent_job_log_sink
+from server_python.terminal.pty_stream import PtyOutputStream, write_to_pty
+from server_python.terminal.command_history import CommandLineAccumulator, TerminalHistoryWriter
 from server_python.orchestrator import main as orchestrator_app # Import the orchestrator app
 from server_python.context_memory import api as context_memory_api # Import the context_memory API router
 from server_python.git_service import api as git_api # Import the git_service API router
@@ -83,6 +103,17 @@ async def startup_event():
         logger.info("Database tables created or already exist.")
     except Exception as e:
         logger.error(f"Error creating database tables: {e}", exc_info=True)
+
+    # Bring existing databases up to date (new columns, indexes and backfills)
+    try:
+        run_migrations(engine)
+    except Exception as e:
+        logger.error(f"Error running schema migrations: {e}", exc_info=True)
+    try:
+        # Dashboard counters are re-seeded per user on first read, picking up any out-of-band changes
+        reset_dashboard_stats(engine)
+    except Exception as e:
+        logger.error(f"Error resetting dashboard counters: {e}", exc_info=True)
     
     # Setup default user, roles, and seed initial data
     db = SessionLocal()
@@ -90,16 +121,42 @@ async def startup_event():
         setup_default_user(db, get_password_hash)
         populate_initial_llm_data(db)
         seed_initial_plans(db) # Seed the subscription plans
+        enabled_providers = [
+            (provider.id, provider.base_url, decrypt_api_key(provider.api_key_encrypted))
+            for provider in db.query(DBLLMProvider).filter(DBLLMProvider.enabled == True).all()
+        ]
     finally:
         db.close()
+
+    # Open pooled connections to the enabled LLM providers in the background
+    if os.getenv("LLM_HTTP_WARMUP", "true").lower() == "true":
+        asyncio.create_task(provider_clients.warm_up(enabled_providers))
+
+    # Start the Arcana agent job workers (this also resumes jobs queued before a restart)
+    await agent_job_queue.start()
+
+    # Sample system metrics in the background for the status and metrics endpoints
+    await system_metrics_sampler.start()
+
+    # Roll up newly ingested telemetry into the 1m/1h aggregates
+    await telemetry_rollup_worker.start()
     logger.info("Application startup sequence finished.")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await system_metrics_sampler.stop()
+    await telemetry_rollup_worker.stop()
+    await agent_job_queue.stop()
+    await agent_job_log_sink.flush()
+    await provider_clients.aclose()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER], # Let browser clients read the pagination cursor
 )
 
 module_startup_times = {
@@ -122,9 +179,18 @@ CACHE_TTL_SECONDS = 5 # Cache validity in seconds
 
 
 @app.post("/api/neosyntis/telemetry", response_model=MessageResponse)
-async def receive_neosyntis_telemetry(telemetry_data: TelemetryData):
-    logger.info(f"Received telemetry from {telemetry_data.source_type} (ID: {telemetry_data.source_id}): Metric='{telemetry_data.metric_name}', Value={telemetry_data.metric_value}, Timestamp={telemetry_data.timestamp}")
-    # In a real system, this data would be stored in a time-series database or processed further.
+async def receive_neosyntis_telemetry(telemetry_data: TelemetryData, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    logger.debug(f"Received telemetry from {telemetry_data.source_type} (ID: {telemetry_data.source_id}): Metric='{telemetry_data.metric_name}', Value={telemetry_data.metric_value}, Timestamp={telemetry_data.timestamp}")
+    point = NeosyntisTelemetryDataCreate(
+        metric_name=telemetry_data.metric_name,
+        value=telemetry_data.metric_value,
+        timestamp=telemetry_data.timestamp,
+        # Only registered devices can be referenced; other sources are stored by metric alone
+        device_id=telemetry_data.source_id if telemetry_data.source_type == "device" else None,
+    )
+    # The write runs in a worker thread; the hub is published to from the event loop
+    await asyncio.to_thread(ingest_telemetry_batch, db, [point], owner_id=str(current_user.id))
+    telemetry_hub.publish(str(current_user.id), [point])
     return {"message": "Telemetry data received successfully!"}
 
 # --- Multimodel Routing API ---
@@ -136,8 +202,8 @@ async def create_cognisys_routing_rule(rule: RoutingRuleCreate, current_user: Us
     db.commit()
     db.refresh(db_rule)
     logger.info(f"AUDIT: Routing rule created. User ID: {current_user.id}, Rule ID: {db_rule.id}, Name: {db_rule.name}")
+    routing_rule_cache.invalidate(str(current_user.id))
     if "cognisys_status" in cache: del cache["cognisys_status"]
-    if "system_status" in cache: del cache["system_status"]
     return db_rule
 
 @app.get("/api/cognisys/routing-rules", response_model=List[RoutingRule])
@@ -172,8 +238,8 @@ async def update_cognisys_routing_rule(rule_id: str, rule_update: RoutingRuleCre
     db.commit()
     db.refresh(db_rule)
     logger.info(f"AUDIT: Routing rule updated. User ID: {current_user.id}, Rule ID: {db_rule.id}, Name: {db_rule.name}")
+    routing_rule_cache.invalidate(str(current_user.id))
     if "cognisys_status" in cache: del cache["cognisys_status"]
-    if "system_status" in cache: del cache["system_status"]
     return db_rule
 
 @app.delete("/api/cognisys/routing-rules/{rule_id}", response_model=MessageResponse)
@@ -185,8 +251,8 @@ async def delete_cognisys_routing_rule(rule_id: str, current_user: User = Depend
     db.delete(db_rule)
     db.commit()
     logger.info(f"AUDIT: Routing rule deleted. User ID: {current_user.id}, Rule ID: {rule_id}")
+    routing_rule_cache.invalidate(str(current_user.id))
     if "cognisys_status" in cache: del cache["cognisys_status"]
-    if "system_status" in cache: del cache["system_status"]
     return {"message": "Routing rule deleted successfully"}
 
 # --- API Routes ---
@@ -346,36 +412,14 @@ def format_timedelta(td: timedelta) -> str:
 
 @app.get("/api/system/status", response_model=SystemStatus)
 async def get_system_status(current_user: Optional[User] = Depends(get_current_user, use_cache=False), db: Session = Depends(get_db)):
-    # Fetch system metrics using psutil with fallback
-    cpu_percent = 0.0
-    memory_percent = 0.0
-    memory_total = 0
-    memory_available = 0
-    system_metrics_mocked = False
-    system_metrics_reason = ""
-
-    try:
-        cpu_percent = psutil.cpu_percent(interval=0.1) # Short interval for quick check
-        memory_info = psutil.virtual_memory()
-        memory_percent = memory_info.percent
-        memory_total = memory_info.total
-        memory_available = memory_info.available
-    except PermissionError:
-        logger.warning("Permission denied to access system metrics via psutil. Falling back to mock data.")
-        cpu_percent = 10.0
-        memory_percent = 30.0
-        memory_total = 8 * 1024 * 1024 * 1024 # 8 GB
-        memory_available = 5 * 1024 * 1024 * 1024 # 5 GB
-        system_metrics_mocked = True
-        system_metrics_reason = "PermissionError accessing system metrics"
-    except Exception as e:
-        logger.error(f"Failed to get system metrics via psutil: {e}. Falling back to mock data.", exc_info=True)
-        cpu_percent = 10.0
-        memory_percent = 30.0
-        memory_total = 8 * 1024 * 1024 * 1024 # 8 GB
-        memory_available = 5 * 1024 * 1024 * 1024 # 5 GB
-        system_metrics_mocked = True
-        system_metrics_reason = f"Unexpected error: {e}"
+    # Latest sample from the background sampler; no psutil calls on the request path
+    system_metrics = system_metrics_sampler.latest()
+    cpu_percent = system_metrics["cpu_percent"]
+    memory_percent = system_metrics["memory_percent"]
+    memory_total = system_metrics["memory_total"]
+    memory_available = system_metrics["memory_available"]
+    system_metrics_mocked = system_metrics.get("mocked", False)
+    system_metrics_reason = system_metrics.get("reason", "")
 
     # Check for mock mode environment variable or if user is not authenticated
     if os.getenv("VAREON_MOCK_SYSTEM_STATUS", "false").lower() == "true" or current_user is None:
@@ -475,10 +519,6 @@ async def get_system_status(current_user: Optional[User] = Depends(get_current_u
         logger.info(f"Returning mocked system status: {json.dumps(return_data, indent=2)}")
         return return_data
 
-    cache_key = "system_status"
-    if cache_key in cache and (datetime.now(timezone.utc) - cache[cache_key]["timestamp"]).total_seconds() < CACHE_TTL_SECONDS:
-        return cache[cache_key]["data"]
-
     current_time = datetime.now(timezone.utc)
 
     arcana_uptime = format_timedelta(current_time - module_startup_times["arcana"])
@@ -486,23 +526,17 @@ async def get_system_status(current_user: Optional[User] = Depends(get_current_u
     neosyntis_uptime = format_timedelta(current_time - module_startup_times["neosyntis"])
     cognisys_uptime = format_timedelta(current_time - module_startup_times["cognisys"])
 
-    # Fetch real data from the database
-    active_agents_count = db.query(DBAgent).filter(DBAgent.owner_id == str(current_user.id), DBAgent.status == "online").count()
-    total_agents_count = db.query(DBAgent).filter(DBAgent.owner_id == str(current_user.id)).count()
-    
-    active_workflows_count = db.query(DBWorkflow).filter(DBWorkflow.owner_id == str(current_user.id), DBWorkflow.status == "running").count()
-    total_workflows_count = db.query(DBWorkflow).filter(DBWorkflow.owner_id == str(current_user.id)).count()
-
-    datasets_managed_count = db.query(DBDataset).filter(DBDataset.owner_id == str(current_user.id)).count()
-
-    routing_rules_count = db.query(DBRoutingRule).filter(DBRoutingRule.owner_id == str(current_user.id)).count()
-    
-    devices_connected_count = db.query(DBHardwareDevice).filter(DBHardwareDevice.owner_id == str(current_user.id), DBHardwareDevice.status == "connected").count()
-    total_devices_count = db.query(DBHardwareDevice).filter(DBHardwareDevice.owner_id == str(current_user.id)).count()
+    # Per-user counters, maintained incrementally by dashboard_stats (a single primary-key read)
+    stats = get_user_stats(db, str(current_user.id))
+    active_agents_count = stats.agents_online
+    active_workflows_count = stats.workflows_running
+    datasets_managed_count = stats.datasets
+    routing_rules_count = stats.routing_rules
+    devices_connected_count = stats.devices_connected
 
     # Fetch Arcana specific data
-    active_chats_count = db.query(DBConversation).filter(DBConversation.user_id == str(current_user.id)).count()
-    messages_processed_count = db.query(DBChatMessage).filter(DBChatMessage.user_id == str(current_user.id)).count()
+    active_chats_count = stats.conversations
+    messages_processed_count = stats.chat_messages
 
     response_data = {
         "arcana": {
@@ -601,7 +635,6 @@ async def get_system_status(current_user: Optional[User] = Depends(get_current_u
         response_data["mocked"] = True
         response_data["reason"] = system_metrics_reason
 
-    cache[cache_key] = {"data": response_data, "timestamp": datetime.now(timezone.utc)}
     return response_data
 
 @app.post("/api/neosyntis/open-lab")
@@ -609,7 +642,6 @@ async def open_neosyntis_lab():
     logger.info("Quick action: Open Neosyntis Lab triggered.")
     # TODO: Implement actual logic for opening Neosyntis Lab
     if "neosyntis_status" in cache: del cache["neosyntis_status"]
-    if "system_status" in cache: del cache["system_status"]
     return {"message": "Neosyntis Lab opened successfully!"}
 
 @app.post("/api/arcana/start-chat", response_model=MessageResponse)
@@ -631,7 +663,6 @@ async def start_arcana_chat(current_user: DBUser = Depends(get_current_user), db
     logger.info(f"Arcana Chat session started. New conversation ID: {new_conversation.id}")
     
     if "arcana_status" in cache: del cache["arcana_status"]
-    if "system_status" in cache: del cache["system_status"]
     return {"message": f"Arcana Chat started successfully! Conversation ID: {new_conversation.id}"}
 
 @app.post("/api/myntrix/deploy-model")
@@ -639,7 +670,6 @@ async def deploy_model():
     logger.info("Quick action: Deploy Model triggered.")
     # TODO: Implement actual logic for deploying Myntrix Model
     if "myntrix_status" in cache: del cache["myntrix_status"]
-    if "system_status" in cache: del cache["system_status"]
     return {"message": "Model deployed successfully!"}
 
 @app.post("/api/myntrix/manage-agents")
@@ -647,49 +677,25 @@ async def manage_agents():
     logger.info("Quick action: Manage Agents triggered.")
     # TODO: Implement actual logic for managing Myntrix Agents
     if "myntrix_status" in cache: del cache["myntrix_status"]
-    if "system_status" in cache: del cache["system_status"]
     return {"message": "Agents managed successfully!"}
 
 @app.get("/api/search", response_model=List[Dict[str, Any]])
-async def global_search(query: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    results = []
-    search_pattern = f"%{query}%"
-
-    # Search Workflows
-    workflows = db.query(DBWorkflow).filter(DBWorkflow.owner_id == str(current_user.id), DBWorkflow.name.ilike(search_pattern)).all()
-    for wf in workflows:
-        results.append({"type": "workflow", "id": wf.id, "name": wf.name, "status": wf.status})
-
-    # Search Datasets
-    datasets = db.query(DBDataset).filter(DBDataset.owner_id == str(current_user.id), DBDataset.name.ilike(search_pattern)).all()
-    for ds in datasets:
-        results.append({"type": "dataset", "id": ds.id, "name": ds.name, "format": ds.format})
-
-    # Search Agents
-    agents = db.query(DBAgent).filter(DBAgent.owner_id == str(current_user.id), DBAgent.name.ilike(search_pattern)).all()
-    for agent in agents:
-        results.append({"type": "agent", "id": agent.id, "name": agent.name, "status": agent.status})
-
-    # Search Hardware Devices
-    hardware_devices = db.query(DBHardwareDevice).filter(DBHardwareDevice.owner_id == str(current_user.id), DBHardwareDevice.name.ilike(search_pattern)).all()
-    for hd in hardware_devices:
-        results.append({"type": "hardware_device", "id": hd.id, "name": hd.name, "device_type": hd.device_type})
-
-    # Search Routing Rules
-    routing_rules = db.query(DBRoutingRule).filter(DBRoutingRule.owner_id == str(current_user.id), DBRoutingRule.name.ilike(search_pattern)).all()
-    for rr in routing_rules:
-        results.append({"type": "routing_rule", "id": rr.id, "name": rr.name, "target_model": rr.target_model})
-
-    return results
+async def global_search(
+    query: str,
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # One ranked full-text query over all of the user's searchable entities
+    return search_index.search(db, owner_id=str(current_user.id), query=query, limit=limit)
 
 # --- Chat Interface API ---
 class ChatRequest(BaseModel):
     message: str
+    conversation_id: Optional[uuid.UUID] = None
 
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat_with_llm(request: ChatRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    user_id = str(current_user.id)
-
+def _start_chat_exchange(request: ChatRequest, user_id: str, db: Session):
+    """Resolves the conversation, saves the user's message and routes the request to a model."""
     # 1. Determine conversation_id
     if request.conversation_id:
         conversation = db.query(DBConversation).filter(DBConversation.id == str(request.conversation_id), DBConversation.user_id == user_id).first()
@@ -714,12 +720,10 @@ async def chat_with_llm(request: ChatRequest, current_user: User = Depends(get_c
     db.refresh(user_chat_message)
     logger.info(f"AUDIT: User message saved. User ID: {user_id}, Conversation ID: {conversation.id}, Message ID: {user_chat_message.id}")
 
-    # Implement Dynamic LLM Routing
-    routing_rules = db.query(DBRoutingRule).filter(DBRoutingRule.owner_id == user_id).order_by(DBRoutingRule.priority.desc()).all()
-
+    # Implement Dynamic LLM Routing (over the user's cached, priority-ordered rules)
     selected_model = None
-    for rule in routing_rules:
-        if rule.condition == "true" or (rule.condition == "user.id == current_user.id" and rule.owner_id == user_id):
+    for rule in routing_rule_cache.get(db, user_id).rules:
+        if rule.condition == "true" or rule.condition == "user.id == current_user.id": # Every cached rule is the user's own
             selected_model = rule.target_model
             break
     
@@ -727,13 +731,19 @@ async def chat_with_llm(request: ChatRequest, current_user: User = Depends(get_c
         selected_model = "gemini-pro"
 
     logger.info(f"User {user_id} chat request routed to: {selected_model}")
+    return conversation, user_chat_message, selected_model
 
-    llm_response_content = ""
+async def _run_chat_orchestration(request: ChatRequest, selected_model: str, user_id: str, db: Session) -> Optional[str]:
+    """
+    Runs Myntrix/Neosyntis service orchestration when the routed model names one.
+    Returns the response content, or None if the request should go to the LLM.
+    """
+    llm_response_content = None
     # Service Orchestration: Check if the selected_model indicates a service to orchestrate
     if selected_model.startswith("myntrix_agent:"):
         agent_id = selected_model.split(":")[1]
         task_details = {"request_message": request.message}
-        success = await trigger_myntrix_agent_task(agent_id, task_details, user_id, db)
+        success = await llm_service.trigger_myntrix_agent_task(agent_id, task_details, user_id, db)
         if success:
             llm_response_content = f"Myntrix Agent {agent_id} triggered with message: {request.message}"
         else:
@@ -753,7 +763,7 @@ async def chat_with_llm(request: ChatRequest, current_user: User = Depends(get_c
                     agent_id = step.get("agent_id")
                     task_details = step.get("task_details", {})
                     if agent_id:
-                        success = await trigger_myntrix_agent_task(agent_id, task_details, user_id, db)
+                        success = await llm_service.trigger_myntrix_agent_task(agent_id, task_details, user_id, db)
                         if not success:
                             raise HTTPException(status_code=400, detail=f"Failed to trigger agent {agent_id} from orchestrated workflow")
                     else:
@@ -762,7 +772,9 @@ async def chat_with_llm(request: ChatRequest, current_user: User = Depends(get_c
                     llm_task = step.get("llm_task")
                     input_data = step.get("input_data", "")
                     if llm_task:
-                        llm_response_content = await utilize_arcana_llm_task(llm_task, input_data, user_id, db)
+                        # Workflow steps queue behind interactive chat for provider capacity
+                        with llm_request_lane(BACKGROUND):
+                            llm_response_content = await llm_service.utilize_arcana_llm_task(llm_task, input_data, user_id, db)
                         logger.info(f"Arcana LLM responded from orchestrated workflow: {llm_response_content}")
                     else:
                         logger.warning(f"Orchestrated workflow {workflow_id} step missing llm_task for 'utilize_llm' action: {step}")
@@ -770,7 +782,7 @@ async def chat_with_llm(request: ChatRequest, current_user: User = Depends(get_c
                     model_id = step.get("model_id")
                     operation = step.get("operation")
                     if model_id and operation:
-                        success = await manage_myntrix_model_task(model_id, operation, user_id, db)
+                        success = await llm_service.manage_myntrix_model_task(model_id, operation, user_id, db)
                         if not success:
                             raise HTTPException(status_code=400, detail=f"Failed to manage model {model_id} with operation {operation} from orchestrated workflow")
                     else:
@@ -796,11 +808,9 @@ async def chat_with_llm(request: ChatRequest, current_user: User = Depends(get_c
             db.commit()
             db.refresh(db_workflow)
             raise HTTPException(status_code=500, detail="Error orchestrating workflow.")
-    else:
-        # If not a service orchestration, proceed with LLM completion
-        llm_response_content = await llm_service.get_openrouter_completion(user_id, request.message, model_name=selected_model, db=db, owner_id=user_id)
-    
-    # 3. Save LLM's response
+    return llm_response_content
+
+def _save_llm_chat_message(conversation, user_id: str, llm_response_content: str, db: Session):
     llm_chat_message = DBChatMessage(
         conversation_id=conversation.id,
         user_id=user_id,
@@ -811,17 +821,78 @@ async def chat_with_llm(request: ChatRequest, current_user: User = Depends(get_c
     db.commit()
     db.refresh(llm_chat_message)
     logger.info(f"AUDIT: LLM response saved. User ID: {user_id}, Conversation ID: {conversation.id}, Message ID: {llm_chat_message.id}")
+    return llm_chat_message
+
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat_with_llm(request: ChatRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    user_id = str(current_user.id)
+    conversation, user_chat_message, selected_model = _start_chat_exchange(request, user_id, db)
+
+    # Service Orchestration: Check if the selected_model indicates a service to orchestrate
+    llm_response_content = await _run_chat_orchestration(request, selected_model, user_id, db)
+    if llm_response_content is None:
+        # If not a service orchestration, proceed with LLM completion
+        llm_response_content = await llm_service.get_openrouter_completion(
+            user_id, request.message, model_name=selected_model, db=db, owner_id=user_id,
+            conversation_id=conversation.id, current_message_id=user_chat_message.id,
+        )
+    
+    # 3. Save LLM's response
+    llm_chat_message = _save_llm_chat_message(conversation, user_id, llm_response_content, db)
 
     return ChatResponse(response=llm_response_content, conversation_id=conversation.id, message_id=llm_chat_message.id)
 
+@app.post("/api/chat/stream")
+async def stream_chat_with_llm(request: ChatRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Server-Sent Events variant of /api/chat. Emits `delta` events as tokens arrive and a
+    final `done` event (same fields as ChatResponse) once the reply has been persisted.
+    """
+    user_id = str(current_user.id)
+    conversation, user_chat_message, selected_model = _start_chat_exchange(request, user_id, db)
+
+    def sse_event(event: str, data: Dict[str, Any]) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    # Orchestrated services are not streamed; run them up front so failures still map to HTTP errors
+    orchestration_content = await _run_chat_orchestration(request, selected_model, user_id, db)
+
+    async def event_stream():
+        llm_response_content = orchestration_content
+        if llm_response_content is not None:
+            yield sse_event("delta", {"delta": llm_response_content})
+        else:
+            parts = []
+            async for delta in llm_service.stream_openrouter_completion(
+                user_id, request.message, model_name=selected_model, db=db, owner_id=user_id,
+                conversation_id=conversation.id, current_message_id=user_chat_message.id,
+            ):
+                parts.append(delta)
+                yield sse_event("delta", {"delta": delta})
+            llm_response_content = "".join(parts)
+
+        llm_chat_message = _save_llm_chat_message(conversation, user_id, llm_response_content, db)
+        yield sse_event("done", {"response": llm_response_content, "conversation_id": str(conversation.id), "message_id": str(llm_chat_message.id)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/api/chat/history/{conversation_id}", response_model=List[ChatMessage])
-async def get_chat_history(conversation_id: uuid.UUID, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_chat_history(
+    conversation_id: uuid.UUID,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000), # Omit to get the whole conversation
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     user_id = str(current_user.id)
     conversation = db.query(DBConversation).filter(DBConversation.id == str(conversation_id), DBConversation.user_id == user_id).first()
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    messages = db.query(DBChatMessage).filter(DBChatMessage.conversation_id == str(conversation_id)).order_by(DBChatMessage.timestamp).all()
+    query = db.query(DBChatMessage).filter(DBChatMessage.conversation_id == str(conversation_id))
+    messages = paginate(query, DBChatMessage.timestamp, DBChatMessage.id, limit=limit, cursor=cursor).all()
+    set_next_cursor(response, messages, limit, "timestamp")
     logger.info(f"AUDIT: Chat history retrieved. User ID: {user_id}, Conversation ID: {conversation_id}")
     return messages
 
@@ -865,6 +936,7 @@ async def delete_conversation(conversation_id: uuid.UUID, current_user: User = D
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     db.query(DBChatMessage).filter(DBChatMessage.conversation_id == str(conversation_id)).delete()
+    db.query(DBConversationSummary).filter(DBConversationSummary.conversation_id == str(conversation_id)).delete()
     db.delete(conversation)
     db.commit()
     logger.info(f"AUDIT: Conversation and its messages deleted. User ID: {user_id}, Conversation ID: {conversation_id}")
@@ -878,6 +950,7 @@ async def clear_chat_history(current_user: User = Depends(get_current_user), db:
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
         db.query(DBChatMessage).filter(DBChatMessage.conversation_id == str(conversation_id)).delete()
+        db.query(DBConversationSummary).filter(DBConversationSummary.conversation_id == str(conversation_id)).delete()
         db.commit()
         logger.info(f"AUDIT: Chat history cleared for conversation. User ID: {user_id}, Conversation ID: {conversation_id}")
         return {"message": f"Chat history cleared for conversation {conversation_id}."}
@@ -886,6 +959,7 @@ async def clear_chat_history(current_user: User = Depends(get_current_user), db:
         conversations = db.query(DBConversation).filter(DBConversation.user_id == user_id).all()
         for conv in conversations:
             db.query(DBChatMessage).filter(DBChatMessage.conversation_id == str(conv.id)).delete()
+            db.query(DBConversationSummary).filter(DBConversationSummary.conversation_id == str(conv.id)).delete()
             db.delete(conv)
         db.commit()
         logger.info(f"AUDIT: All chat history cleared for user. User ID: {user_id}")
@@ -988,13 +1062,22 @@ async def list_terminal_sessions(current_user: User = Depends(get_current_user),
     return sessions
 
 @app.get("/api/arcana/terminal/sessions/{session_id}/history", response_model=List[TerminalCommandHistory])
-async def get_terminal_session_history(session_id: uuid.UUID, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_terminal_session_history(
+    session_id: uuid.UUID,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000), # Omit to get the whole history
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     user_id = str(current_user.id)
     session = db.query(DBTerminalSession).filter(DBTerminalSession.id == str(session_id), DBTerminalSession.user_id == user_id).first()
     if not session:
         raise HTTPException(status_code=404, detail="Terminal session not found")
     
-    history = db.query(DBTerminalCommandHistory).filter(DBTerminalCommandHistory.session_id == str(session_id)).order_by(DBTerminalCommandHistory.timestamp).all()
+    query = db.query(DBTerminalCommandHistory).filter(DBTerminalCommandHistory.session_id == str(session_id))
+    history = paginate(query, DBTerminalCommandHistory.timestamp, DBTerminalCommandHistory.id, limit=limit, cursor=cursor).all()
+    set_next_cursor(response, history, limit, "timestamp")
     logger.info(f"AUDIT: Terminal session history retrieved. User ID: {user_id}, Session ID: {session_id}")
     return history
 
@@ -1068,7 +1151,8 @@ async def websocket_shell(
     websocket: WebSocket,
     session_id: uuid.UUID, # Renamed from chat_id to session_id
     current_user: User = Depends(get_current_websocket_user), # Authenticate WebSocket
-    db: Session = Depends(get_db) # Inject DB session
+    db: Session = Depends(get_db), # Inject DB session
+    binary: bool = Query(False) # Send shell output as raw binary frames instead of text
 ):
     logger.info(f"[WebSocket] Entering websocket_shell function for session {session_id}.")
     user_id = str(current_user.id)
@@ -1095,18 +1179,19 @@ async def websocket_shell(
         cwd=project_root # Use project_root
     )
 
-    # Get a non-blocking file-like object for the master end of the pty
-    master_reader = os.fdopen(master_fd, 'rb', 0)
+    # Watch the master end of the pty from the event loop; output arrives as coalesced frames
+    shell_output = PtyOutputStream(master_fd)
 
     async def forward_shell_to_client():
         """Reads from the shell's output and sends it to the WebSocket client."""
         try:
-            while True:
-                output = await asyncio.to_thread(master_reader.read, 1024)
-                if not output:
-                    logger.info(f"[WebSocket] Shell output stream for client {session_id} ended (output was empty).")
-                    break
-                await websocket.send_text(output.decode(errors='ignore'))
+            if binary:
+                async for frame in shell_output.frames():
+                    await websocket.send_bytes(frame)
+            else:
+                async for text in shell_output.text_frames():
+                    await websocket.send_text(text)
+            logger.info(f"[WebSocket] Shell output stream for client {session_id} ended.")
         except (IOError, WebSocketDisconnect) as e:
             logger.info(f"[WebSocket] Shell output stream for client {session_id} closed due to: {e}")
         except Exception as e:
@@ -1115,6 +1200,8 @@ async def websocket_shell(
             logger.info(f"[WebSocket] forward_shell_to_client task for client {session_id} finishing.")
 
     client_task = asyncio.create_task(forward_shell_to_client(), name=f"shell_forwarder_{session_id}")
+    command_line = CommandLineAccumulator()
+    history_writer = TerminalHistoryWriter(db, str(session_id))
 
     try:
         while True:
@@ -1122,44 +1209,33 @@ async def websocket_shell(
                 data = await websocket.receive_text()
                 logger.debug(f"[WebSocket] Received data from client {session_id}: {data[:100]}...") # Log first 100 chars
                 
-                # Check for resize command (sent as JSON from frontend)
+                # Input arrives either as raw text or as JSON events from the frontend
                 try:
                     data_json = json.loads(data)
-                    if 'resize' in data_json:
-                        cols, rows = data_json['resize']['cols'], data_json['resize']['rows']
-                        logger.info(f"[WebSocket] Resizing PTY for client {session_id} to {cols}x{rows}")
-                        # To fully implement terminal resizing, uncomment the line below and ensure
-                        # 'termios' and 'struct' are imported at the top of the file.
-                        # import fcntl
-                        # import termios
-                        # import struct
-                        # fcntl.ioctl(master_fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
-                        # The above line is commented out, which means resize commands are not being processed.
-                        # This might not be the cause of the immediate close, but it's an issue.
-                        continue # Skip writing resize command to shell
                 except json.JSONDecodeError:
-                    pass # It's regular user input, not a resize command
-
-                # Log command to history
-                command_history_entry = DBTerminalCommandHistory(
-                    session_id=str(session_id),
-                    command=data,
-                    output="" # Output will be captured later if needed
-                )
-                db.add(command_history_entry)
-                db.commit()
-                db.refresh(command_history_entry)
-                terminal_session.last_command = data # Update last command in session
-                db.commit()
+                    data_json = None # It's regular user input
+                if isinstance(data_json, dict):
+                    if data_json.get("type") == "shell_input":
+                        data = str(data_json.get("payload", {}).get("data", ""))
+                    elif data_json.get("type") == "shell_resize" or 'resize' in data_json:
+                        size = data_json.get("payload") or data_json.get("resize") or {}
+                        cols, rows = size.get("cols"), size.get("rows")
+                        if cols and rows:
+                            logger.info(f"[WebSocket] Resizing PTY for client {session_id} to {cols}x{rows}")
+                            fcntl.ioctl(master_fd, termios.TIOCSWINSZ, struct.pack('HHHH', int(rows), int(cols), 0, 0))
+                        continue # Skip writing resize command to shell
 
-                # Forward user input to the shell
-                os.write(master_fd, data.encode())
+                # Forward user input to the shell first; history is recorded per submitted line, in batches
+                await write_to_pty(master_fd, data.encode())
+                for command in command_line.feed(data):
+                    history_writer.add(command)
             except WebSocketDisconnect:
                 logger.info(f"[WebSocket] Client {session_id} disconnected gracefully.")
                 break # Exit the loop on disconnect
 
     finally:
         logger.info(f"[WebSocket] Cleaning up resources for client {session_id}.")
+        await history_writer.aclose()
         # Update TerminalSession status on disconnect
         terminal_session.status = "closed"
         terminal_session.ended_at = datetime.utcnow()
@@ -1167,6 +1243,7 @@ async def websocket_shell(
         logger.info(f"AUDIT: Terminal session closed. User ID: {user_id}, Session ID: {session_id}")
 
         # Clean up: terminate the shell process and cancel the reading task
+        shell_output.close()
         client_task.cancel()
         if shell_process.returncode is None:
             logger.info(f"[WebSocket] Terminating shell process for client {session_id}.")
@@ -1178,7 +1255,10 @@ async def websocket_shell(
         except asyncio.CancelledError:
             logger.info(f"Shell process cleanup for client {session_id} was interrupted by server shutdown.")
 
-        master_reader.close()
+        try:
+            os.close(master_fd)
+        except OSError as e:
+            logger.error(f"Error closing master_fd for client {session_id}: {e}")
         try:
             os.close(slave_fd) # Explicitly close the slave file descriptor
         except OSError as e:
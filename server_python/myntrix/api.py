@@ -1,15 +1,24 @@
 import os
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, WebSocket, WebSocketDisconnect, Query, Response
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
-import psutil # Import psutil
 import json # Import json
+import asyncio
+import logging
+import numpy as np
 
 from server_python.database import get_db, User as DBUser
-from server_python.auth import get_current_user
+from server_python.auth import get_current_user, get_current_websocket_user
+from server_python.pagination import set_next_cursor
+from server_python.system_metrics import system_metrics_sampler, SYSTEM_METRICS_HISTORY_MINUTES
+from server_python.neosyntis.telemetry_hub import telemetry_hub
+from server_python.neosyntis.telemetry_frames import TelemetryFrameDecoder, TelemetryFrameError
+from server_python.neosyntis.telemetry_ingest import TELEMETRY_MAX_BATCH_POINTS, TelemetryBatchWriter, parse_device_message
 from . import crud, schemas
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 ### Agent Management ###
@@ -211,21 +220,91 @@ async def upload_file_to_device(device_id: str, file: UploadFile = File(...), cu
     print(f"Uploading file '{file.filename}' ({len(file_content)} bytes) to device {db_device.name}")
     return {"message": f"File '{file.filename}' uploaded to device {db_device.name} (placeholder)."}
 
-# WebSocket endpoint for telemetry
+# WebSocket endpoints for telemetry
+# The subscriber route is declared first so "subscribe" is not taken for a device id
+@router.websocket("/ws/myntrix/telemetry/subscribe")
+async def websocket_telemetry_subscribe(
+    websocket: WebSocket,
+    device_id: List[str] = Query([]),
+    metric_name: List[str] = Query([]),
+    mode: str = Query("conflate", regex="^(conflate|drop)$"),
+    current_user: DBUser = Depends(get_current_websocket_user)
+):
+    """
+    Live telemetry for dashboards, optionally filtered by device and metric. Each
+    message carries the samples queued since the previous one:
+    {"type": "telemetry", "payload": {metric: latest value}, "samples": [...], "dropped": n}.
+    A slow client only loses (drop) or merges (conflate) its own samples.
+    """
+    await websocket.accept()
+    subscription = telemetry_hub.subscribe(str(current_user.id), device_id, metric_name, conflate=(mode == "conflate"))
+
+    async def send_samples():
+        reported_drops = 0
+        while True:
+            samples = await subscription.get()
+            dropped, reported_drops = subscription.dropped - reported_drops, subscription.dropped
+            await websocket.send_json({
+                "type": "telemetry",
+                "payload": {sample["metric_name"]: sample["value"] for sample in samples},
+                "samples": samples,
+                "dropped": dropped,
+            })
+
+    sender = asyncio.create_task(send_samples())
+    try:
+        while True:
+            await websocket.receive_text() # Nothing is expected from the client; this notices the disconnect
+    except WebSocketDisconnect:
+        pass
+    finally:
+        telemetry_hub.unsubscribe(subscription)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+
 @router.websocket("/ws/myntrix/telemetry/{device_id}")
-async def websocket_telemetry_endpoint(websocket: WebSocket, device_id: str, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+async def websocket_telemetry_endpoint(websocket: WebSocket, device_id: str, current_user: DBUser = Depends(get_current_websocket_user), db: Session = Depends(get_db)):
+    """
+    Telemetry pushed by a device, as JSON text messages or binary frames (see
+    neosyntis.telemetry_frames). Samples are fanned out to live subscribers at
+    once and stored in batches through the bulk ingest path.
+    """
+    db_device = crud.get_device(db, device_id=device_id)
+    if db_device is None or db_device.owner_id != str(current_user.id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    owner_id = str(current_user.id)
+    writer = TelemetryBatchWriter(db, owner_id)
+    decoder = TelemetryFrameDecoder(max_samples=TELEMETRY_MAX_BATCH_POINTS)
     await websocket.accept()
     try:
         while True:
-            data = await websocket.receive_text()
-            print(f"Received telemetry from device {device_id}: {data}")
-            await websocket.send_text(f"Message received from device {device_id}: {data}")
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+            if message.get("bytes") is not None:
+                try:
+                    blocks = decoder.decode(message["bytes"])
+                except TelemetryFrameError as e:
+                    await websocket.send_json({"type": "error", "errors": [{"index": 0, "error": str(e)}]})
+                    continue
+                for metric_name, timestamps, values in blocks:
+                    ts_ms = np.rint(timestamps * 1000).astype(np.int64)
+                    telemetry_hub.publish_columns(owner_id, metric_name, ts_ms, values, device_id=device_id)
+                    writer.add_columns(metric_name, ts_ms, values, device_id=device_id)
+                continue
+            points, errors = parse_device_message(message.get("text") or "", device_id)
+            if points:
+                telemetry_hub.publish(owner_id, points)
+                writer.add(points)
+            if errors:
+                await websocket.send_json({"type": "error", "errors": [error.dict() for error in errors]})
     except WebSocketDisconnect:
-        print(f"Device {device_id} disconnected from telemetry WebSocket.")
+        logger.info(f"Device {device_id} disconnected from telemetry WebSocket.")
     except Exception as e:
-        print(f"Error in telemetry WebSocket for device {device_id}: {e}")
+        logger.error(f"Error in telemetry WebSocket for device {device_id}: {e}", exc_info=True)
     finally:
-        await websocket.close()
+        await writer.aclose()
 
 ### Resource Monitoring ###
 
@@ -243,46 +322,24 @@ async def get_system_metrics(current_user: DBUser = Depends(get_current_user), d
             "mocked": True
         }
 
-    try:
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory_info = psutil.virtual_memory()
-        
-        return {
-            "cpu_percent": cpu_percent,
-            "memory_percent": memory_info.percent,
-            "memory_total": memory_info.total,
-            "memory_available": memory_info.available,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-    except PermissionError:
-        # If PermissionError occurs, log it and fall back to mock data
-        print("WARNING: Permission denied to access system metrics. Falling back to mock data.")
-        return {
-            "cpu_percent": 10.0,
-            "memory_percent": 30.0,
-            "memory_total": 8 * 1024 * 1024 * 1024, # 8 GB
-            "memory_available": 5 * 1024 * 1024 * 1024, # 5 GB
-            "timestamp": datetime.utcnow().isoformat(),
-            "mocked": True,
-            "reason": "PermissionError accessing system metrics"
-        }
-    except Exception as e:
-        # Catch any other unexpected errors and fall back to mock data
-        print(f"ERROR: Failed to get system metrics: {e}. Falling back to mock data.")
-        return {
-            "cpu_percent": 10.0,
-            "memory_percent": 30.0,
-            "memory_total": 8 * 1024 * 1024 * 1024, # 8 GB
-            "memory_available": 5 * 1024 * 1024 * 1024, # 5 GB
-            "timestamp": datetime.utcnow().isoformat(),
-            "mocked": True,
-            "reason": f"Unexpected error: {e}"
-        }
+    # Served from the background sampler; no psutil calls on the request path
+    return system_metrics_sampler.latest()
+
+@router.get("/system-metrics/history", response_model=Dict[str, Any])
+async def get_system_metrics_history(
+    minutes: float = Query(15, gt=0, le=SYSTEM_METRICS_HISTORY_MINUTES),
+    current_user: DBUser = Depends(get_current_user)
+):
+    return {
+        "interval_seconds": system_metrics_sampler.interval,
+        "samples": system_metrics_sampler.history(minutes),
+    }
 
 @router.get("/jobs/", response_model=List[schemas.JobResponse])
-def read_jobs(skip: int = 0, limit: int = 100, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+def read_jobs(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # TODO: Add authentication/authorization
-    jobs = crud.get_jobs(db, owner_id=str(current_user.id), skip=skip, limit=limit)
+    jobs = crud.get_jobs(db, owner_id=str(current_user.id), skip=skip, limit=limit, cursor=cursor)
+    set_next_cursor(response, jobs, limit, "created_at")
     for job in jobs:
         if job.details:
             job.details = json.loads(job.details)
@@ -373,13 +430,14 @@ def run_scheduled_task(task_id: str, current_user: DBUser = Depends(get_current_
     return db_task_run
 
 @router.get("/tasks/history/{task_id}", response_model=List[schemas.TaskRunResponse])
-def get_task_history(task_id: str, skip: int = 0, limit: int = 100, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_task_history(task_id: str, response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
     # TODO: Add authentication/authorization
     db_task = crud.get_scheduled_task(db, task_id=task_id)
     if db_task is None or db_task.owner_id != str(current_user.id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Scheduled Task not found")
     
-    task_runs = crud.get_task_runs_for_task(db, task_id=task_id, skip=skip, limit=limit)
+    task_runs = crud.get_task_runs_for_task(db, task_id=task_id, skip=skip, limit=limit, cursor=cursor)
+    set_next_cursor(response, task_runs, limit, "start_time")
     return task_runs
 
 ### 3D Visualization ###
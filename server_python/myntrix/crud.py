@@ -5,6 +5,7 @@ from datetime import datetime
 import json
 
 from server_python.database import Agent, Device, Job, ScheduledTask, TaskRun # Changed from ..database
+from server_python.pagination import paginate
 from .schemas import AgentCreate, AgentUpdate, DeviceCreate, DeviceUpdate, JobCreate, JobUpdate, ScheduledTaskCreate, ScheduledTaskUpdate, TaskRunCreate, TaskRunUpdate
 
 ### Agent CRUD Operations ###
@@ -115,8 +116,9 @@ def delete_device(db: Session, device_id: str):
 def get_job(db: Session, job_id: str):
     return db.query(Job).filter(Job.id == job_id).first()
 
-def get_jobs(db: Session, owner_id: str, skip: int = 0, limit: int = 100):
-    return db.query(Job).filter(Job.owner_id == owner_id).offset(skip).limit(limit).all()
+def get_jobs(db: Session, owner_id: str, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    query = db.query(Job).filter(Job.owner_id == owner_id)
+    return paginate(query, Job.created_at, Job.id, skip=skip, limit=limit, cursor=cursor).all()
 
 def create_job(db: Session, job: JobCreate, owner_id: str):
     db_job = Job(
@@ -215,8 +217,9 @@ def delete_scheduled_task(db: Session, task_id: str):
 def get_task_run(db: Session, run_id: str):
     return db.query(TaskRun).filter(TaskRun.id == run_id).first()
 
-def get_task_runs_for_task(db: Session, task_id: str, skip: int = 0, limit: int = 100):
-    return db.query(TaskRun).filter(TaskRun.task_id == task_id).offset(skip).limit(limit).all()
+def get_task_runs_for_task(db: Session, task_id: str, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    query = db.query(TaskRun).filter(TaskRun.task_id == task_id)
+    return paginate(query, TaskRun.start_time, TaskRun.id, skip=skip, limit=limit, cursor=cursor).all()
 
 def create_task_run(db: Session, run: TaskRunCreate):
     db_run = TaskRun(
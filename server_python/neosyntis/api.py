@@ -1,15 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query, Request, Response
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
+import asyncio
 import json
 import uuid # Import uuid
 import os # Import os
 from datetime import datetime # Added this line
 
-from server_python.database import get_db, User as DBUser, Workflow, Dataset, MLModel
+from server_python.database import get_db, User as DBUser
 from server_python.auth import get_current_user
-from . import crud, schemas, storage_service
+from server_python.pagination import set_next_cursor
+from server_python import search_index
+from . import crud, schemas, storage_service, telemetry_ingest, telemetry_query, telemetry_store
+from .telemetry_hub import telemetry_hub
 
 router = APIRouter()
 
@@ -153,77 +157,83 @@ def ingest_telemetry(telemetry_data: schemas.TelemetryDataCreate, current_user:
     db_telemetry = crud.create_telemetry_data(db=db, telemetry_data=telemetry_data, owner_id=str(current_user.id))
     return db_telemetry
 
+@router.post("/telemetry/ingest/batch", response_model=schemas.TelemetryBatchIngestResponse)
+async def ingest_telemetry_batch(request: Request, current_user: DBUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Ingests many points per request: a JSON array or an NDJSON body
+    (Content-Type: application/x-ndjson). Invalid points are reported by index
+    and the valid ones are stored in a single transaction, off the event loop.
+    """
+    points, errors = telemetry_ingest.parse_telemetry_batch(await request.body(), request.headers.get("content-type", ""))
+    accepted = await asyncio.to_thread(telemetry_ingest.ingest_telemetry_batch, db, points, owner_id=str(current_user.id))
+    telemetry_hub.publish(str(current_user.id), points)
+    return schemas.TelemetryBatchIngestResponse(accepted=accepted, rejected=len(errors), errors=errors)
+
 @router.get("/telemetry/", response_model=List[schemas.TelemetryDataResponse])
 def get_telemetry(
+    response: Response,
     metric_name: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: DBUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     # TODO: Add authentication/authorization
     if metric_name:
-        telemetry_data = crud.get_telemetry_data_by_metric(db, owner_id=str(current_user.id), metric_name=metric_name, skip=skip, limit=limit)
+        telemetry_data = crud.get_telemetry_data_by_metric(db, owner_id=str(current_user.id), metric_name=metric_name, skip=skip, limit=limit, cursor=cursor)
     else:
-        telemetry_data = crud.get_telemetry_data(db, owner_id=str(current_user.id), skip=skip, limit=limit)
+        telemetry_data = crud.get_telemetry_data(db, owner_id=str(current_user.id), skip=skip, limit=limit, cursor=cursor)
+    set_next_cursor(response, telemetry_data, limit, "timestamp")
     return telemetry_data
 
+@router.get("/telemetry/series", response_model=schemas.TelemetrySeriesResponse)
+def get_telemetry_series(
+    metric_name: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Optional[int] = Query(None, ge=1, description="Bucket width in seconds"),
+    current_user: DBUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return telemetry_store.query_series(db, owner_id=str(current_user.id), metric_name=metric_name, start=start, end=end, resolution=resolution)
+
+@router.get("/telemetry/query", response_model=schemas.TelemetryQueryResponse)
+def query_telemetry(
+    metric_name: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Optional[int] = Query(None, ge=1, description="Bucket width in seconds"),
+    aggs: str = Query("avg", description="Comma separated: avg, min, max, sum, count, rate, p50, p95, p99.9, ..."),
+    points: Optional[int] = Query(None, ge=3, le=100000, description="Downsample to this many points with LTTB"),
+    current_user: DBUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return telemetry_query.query_telemetry(
+        db, owner_id=str(current_user.id), metric_name=metric_name, start=start, end=end,
+        bucket=bucket, aggs=aggs, max_points=points,
+    )
+
 ### Search Engine ###
 
+# entity_type values accepted by the search endpoint
+SEARCH_ENTITY_TYPES = {"workflows": "workflow", "datasets": "dataset", "ml_models": "ml_model"}
+
 @router.get("/search", response_model=List[Dict[str, Any]])
 def search_neosyntis_entities(
     query: str,
     entity_type: Optional[str] = None,
+    limit: int = Query(search_index.SEARCH_DEFAULT_LIMIT, ge=1, le=search_index.SEARCH_MAX_LIMIT),
     current_user: DBUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # TODO: Add authentication/authorization
-    results = []
-    search_pattern = f"%{query}%"
-
-    if entity_type is None or entity_type == "workflows":
-        workflows = db.query(Workflow).filter(
-            Workflow.owner_id == str(current_user.id),
-            (Workflow.name.ilike(search_pattern)) | (Workflow.description.ilike(search_pattern))
-        ).all()
-        for wf in workflows:
-            results.append({
-                "type": "workflow",
-                "id": wf.id,
-                "name": wf.name,
-                "description": wf.description,
-                "status": wf.status
-            })
-
-    if entity_type is None or entity_type == "datasets":
-        datasets = db.query(Dataset).filter(
-            Dataset.owner_id == str(current_user.id),
-            (Dataset.name.ilike(search_pattern)) | (Dataset.description.ilike(search_pattern))
-        ).all()
-        for ds in datasets:
-            results.append({
-                "type": "dataset",
-                "id": ds.id,
-                "name": ds.name,
-                "description": ds.description,
-                "format": ds.format
-            })
-    
-    if entity_type is None or entity_type == "ml_models":
-        ml_models = db.query(MLModel).filter(
-            MLModel.owner_id == str(current_user.id),
-            (MLModel.name.ilike(search_pattern)) | (MLModel.version.ilike(search_pattern))
-        ).all()
-        for model in ml_models:
-            results.append({
-                "type": "ml_model",
-                "id": model.id,
-                "name": model.name,
-                "version": model.version,
-                "status": model.status
-            })
-    
-    return results
+    if entity_type is None:
+        entity_types = list(SEARCH_ENTITY_TYPES.values())
+    elif entity_type in SEARCH_ENTITY_TYPES:
+        entity_types = [SEARCH_ENTITY_TYPES[entity_type]]
+    else:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown entity type '{entity_type}'")
+    return search_index.search(db, owner_id=str(current_user.id), query=query, entity_types=entity_types, limit=limit)
 
 ### Model Deployment & Machine Learning ###
 
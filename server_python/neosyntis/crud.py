@@ -4,7 +4,8 @@ import uuid
 from datetime import datetime
 import json
 
-from server_python.database import Workflow, Dataset, TelemetryData, MLModel, TrainingJob # Changed from ..database
+from server_python.database import Workflow, Dataset, MLModel, TrainingJob # Changed from ..database
+from . import telemetry_store
 from .schemas import WorkflowCreate, WorkflowUpdate, DatasetCreate, DatasetUpdate, TelemetryDataCreate, MLModelCreate, MLModelUpdate, TrainingJobCreate, TrainingJobUpdate
 
 ### Workflow CRUD Operations ###
@@ -107,26 +108,13 @@ def delete_dataset(db: Session, dataset_id: str):
 ### TelemetryData CRUD Operations ###
 
 def create_telemetry_data(db: Session, telemetry_data: TelemetryDataCreate, owner_id: str):
-    db_telemetry = TelemetryData(
-        id=str(uuid.uuid4()),
-        owner_id=owner_id,
-        timestamp=telemetry_data.timestamp if telemetry_data.timestamp else datetime.utcnow(),
-        metric_name=telemetry_data.metric_name,
-        value=telemetry_data.value,
-        workflow_id=telemetry_data.workflow_id,
-        dataset_id=telemetry_data.dataset_id,
-        device_id=telemetry_data.device_id
-    )
-    db.add(db_telemetry)
-    db.commit()
-    db.refresh(db_telemetry)
-    return db_telemetry
+    return telemetry_store.append_point(db, telemetry_data, owner_id=owner_id)
 
-def get_telemetry_data(db: Session, owner_id: str, skip: int = 0, limit: int = 100):
-    return db.query(TelemetryData).filter(TelemetryData.owner_id == owner_id).offset(skip).limit(limit).all()
+def get_telemetry_data(db: Session, owner_id: str, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return telemetry_store.list_samples(db, owner_id=owner_id, skip=skip, limit=limit, cursor=cursor)
 
-def get_telemetry_data_by_metric(db: Session, owner_id: str, metric_name: str, skip: int = 0, limit: int = 100):
-    return db.query(TelemetryData).filter(TelemetryData.owner_id == owner_id, TelemetryData.metric_name == metric_name).offset(skip).limit(limit).all()
+def get_telemetry_data_by_metric(db: Session, owner_id: str, metric_name: str, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    return telemetry_store.list_samples(db, owner_id=owner_id, metric_name=metric_name, skip=skip, limit=limit, cursor=cursor)
 
 ### MLModel CRUD Operations ###
 
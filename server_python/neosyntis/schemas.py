@@ -150,4 +150,32 @@ class TrainingJobResponse(TrainingJobBase):
     owner_id: str
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+class TelemetryIngestError(BaseModel):
+    index: int
+    error: str
+
+class TelemetryBatchIngestResponse(BaseModel):
+    accepted: int
+    rejected: int
+    errors: List[TelemetryIngestError] = []
+
+class TelemetrySeriesPoint(BaseModel):
+    timestamp: datetime
+    min: float
+    max: float
+    avg: float
+    count: int
+
+class TelemetrySeriesResponse(BaseModel):
+    metric_name: str
+    resolution: int # Bucket width in seconds
+    source: str # "raw", "1m" or "1h": the data the buckets were computed from
+    points: List[TelemetrySeriesPoint] = []
+
+class TelemetryQueryResponse(BaseModel):
+    metric_name: str
+    bucket: Optional[int] = None # Bucket width in seconds; None for raw (downsampled) samples
+    aggregations: List[str]
+    source: str # "raw", "1m" or "1h"
+    points: List[Dict[str, Any]] = [] # {"timestamp": ..., "<aggregation>": value, ...}
@@ -0,0 +1,149 @@
+"""
+Binary telemetry frames for high-rate devices.
+
+All integers are little-endian. Every frame starts with an 8 byte header:
+
+    magic b"VT" | version u8 | kind u8 | count u16 | reserved u16
+
+A dictionary frame (kind 1) assigns metric indexes for the rest of the connection.
+`count` names follow a u16 first index; each name is a u16 byte length plus UTF-8:
+
+    first_index u16 | (length u16, name bytes) * count
+
+A data frame (kind 0) carries `count` blocks, one per metric, each followed by its
+sample columns (timestamps are float64 epoch seconds, years 1970-9999):
+
+    metric_index u16 | reserved u16 | samples u32 | float64 ts * samples | float64 value * samples
+
+Columns are read with numpy.frombuffer straight from the received bytes, so a frame
+of thousands of samples costs a few struct unpacks rather than JSON parsing.
+"""
+import struct
+from datetime import datetime, timezone
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+FRAME_MAGIC = b"VT"
+FRAME_VERSION = 1
+FRAME_KIND_DATA = 0
+FRAME_KIND_DICTIONARY = 1
+
+_HEADER = struct.Struct("<2sBBHH")
+_DICTIONARY_START = struct.Struct("<H")
+_NAME_LENGTH = struct.Struct("<H")
+_BLOCK = struct.Struct("<HHI")
+_FLOAT64 = np.dtype("<f8")
+# Timestamps must convert to a datetime once stored as epoch ms (years 1970-9999)
+_MAX_TIMESTAMP = datetime(9999, 12, 31, 23, 59, 59, tzinfo=timezone.utc).timestamp()
+
+
+class TelemetryFrameError(ValueError):
+    """Raised for a malformed or unsupported binary telemetry frame."""
+
+
+def encode_dictionary(names: Sequence[str], first_index: int = 0) -> bytes:
+    """Builds a dictionary frame assigning indexes first_index, first_index + 1, ... to `names`."""
+    parts = [_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, FRAME_KIND_DICTIONARY, len(names), 0), _DICTIONARY_START.pack(first_index)]
+    for name in names:
+        encoded = name.encode("utf-8")
+        parts.append(_NAME_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b"".join(parts)
+
+
+def encode_frame(blocks: Sequence[Tuple[int, Sequence[float], Sequence[float]]]) -> bytes:
+    """Builds a data frame from (metric_index, timestamps, values) blocks."""
+    parts = [_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, FRAME_KIND_DATA, len(blocks), 0)]
+    for metric_index, timestamps, values in blocks:
+        timestamps = np.asarray(timestamps, dtype=_FLOAT64)
+        values = np.asarray(values, dtype=_FLOAT64)
+        if timestamps.shape != values.shape:
+            raise TelemetryFrameError("Timestamp and value columns must have the same length")
+        parts.append(_BLOCK.pack(metric_index, 0, len(timestamps)))
+        parts.append(timestamps.tobytes())
+        parts.append(values.tobytes())
+    return b"".join(parts)
+
+
+class TelemetryFrameDecoder:
+    """
+    Decodes the binary frames of one device connection, keeping the metric
+    dictionary the device has sent so far.
+    """
+
+    def __init__(self, max_samples: int = 0):
+        self.metric_names: Dict[int, str] = {}
+        self.max_samples = max_samples # Per frame; 0 for no limit
+
+    def decode(self, frame: bytes) -> List[Tuple[str, np.ndarray, np.ndarray]]:
+        """
+        Returns (metric_name, timestamps, values) for each block of a data frame;
+        a dictionary frame updates the dictionary and returns an empty list. The
+        arrays are read-only views into `frame`.
+        """
+        view = memoryview(frame)
+        if len(view) < _HEADER.size:
+            raise TelemetryFrameError("Frame is shorter than its header")
+        magic, version, kind, count, _ = _HEADER.unpack_from(view)
+        if magic != FRAME_MAGIC:
+            raise TelemetryFrameError("Not a telemetry frame")
+        if version != FRAME_VERSION:
+            raise TelemetryFrameError(f"Unsupported frame version {version}")
+        if kind == FRAME_KIND_DICTIONARY:
+            self._decode_dictionary(view, count)
+            return []
+        if kind != FRAME_KIND_DATA:
+            raise TelemetryFrameError(f"Unknown frame kind {kind}")
+        return self._decode_data(view, count)
+
+    def _decode_dictionary(self, view: memoryview, count: int) -> None:
+        offset = _HEADER.size
+        if len(view) < offset + _DICTIONARY_START.size:
+            raise TelemetryFrameError("Truncated dictionary frame")
+        (first_index,) = _DICTIONARY_START.unpack_from(view, offset)
+        offset += _DICTIONARY_START.size
+        names: Dict[int, str] = {}
+        for index in range(first_index, first_index + count):
+            if len(view) < offset + _NAME_LENGTH.size:
+                raise TelemetryFrameError("Truncated dictionary frame")
+            (length,) = _NAME_LENGTH.unpack_from(view, offset)
+            offset += _NAME_LENGTH.size
+            if not length or len(view) < offset + length:
+                raise TelemetryFrameError(f"Invalid name for metric index {index}")
+            try:
+                names[index] = str(view[offset:offset + length], "utf-8")
+            except UnicodeDecodeError:
+                raise TelemetryFrameError(f"Metric name for index {index} is not valid UTF-8")
+            offset += length
+        # Applied only once the whole frame is known to be valid
+        self.metric_names.update(names)
+
+    def _decode_data(self, view: memoryview, count: int) -> List[Tuple[str, np.ndarray, np.ndarray]]:
+        offset = _HEADER.size
+        total = 0
+        blocks = []
+        for _ in range(count):
+            if len(view) < offset + _BLOCK.size:
+                raise TelemetryFrameError("Truncated data block header")
+            metric_index, _, samples = _BLOCK.unpack_from(view, offset)
+            offset += _BLOCK.size
+            metric_name = self.metric_names.get(metric_index)
+            if metric_name is None:
+                raise TelemetryFrameError(f"Metric index {metric_index} has not been defined")
+            total += samples
+            if self.max_samples and total > self.max_samples:
+                raise TelemetryFrameError(f"Frame exceeds the limit of {self.max_samples} samples")
+            if len(view) < offset + 16 * samples:
+                raise TelemetryFrameError(f"Truncated data block for metric '{metric_name}'")
+            timestamps = np.frombuffer(view, dtype=_FLOAT64, count=samples, offset=offset)
+            values = np.frombuffer(view, dtype=_FLOAT64, count=samples, offset=offset + 8 * samples)
+            offset += 16 * samples
+            if not (np.isfinite(timestamps).all() and np.isfinite(values).all()):
+                raise TelemetryFrameError(f"Non-finite sample for metric '{metric_name}'")
+            if samples and (timestamps.min() < 0 or timestamps.max() > _MAX_TIMESTAMP):
+                raise TelemetryFrameError(f"Timestamp out of range for metric '{metric_name}'")
+            blocks.append((metric_name, timestamps, values))
+        if offset != len(view):
+            raise TelemetryFrameError("Trailing bytes after the last data block")
+        return blocks
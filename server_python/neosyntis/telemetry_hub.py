@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from . import telemetry_store
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_SUBSCRIBER_QUEUE_SIZE = int(os.getenv("TELEMETRY_SUBSCRIBER_QUEUE_SIZE", "1000"))
+
+
+class TelemetrySubscription:
+    """
+    One live subscriber: a user's samples, optionally filtered by device and metric,
+    queued in a bounded buffer the publisher never waits on.
+
+    In "drop" mode the oldest queued samples are discarded when the queue is full.
+    In "conflate" mode only the latest sample per (device, metric) is kept, which is
+    all a dashboard showing current values needs.
+    """
+
+    def __init__(
+        self,
+        owner_id: str,
+        device_ids: Optional[Iterable[str]] = None,
+        metric_names: Optional[Iterable[str]] = None,
+        max_queue: int = TELEMETRY_SUBSCRIBER_QUEUE_SIZE,
+        conflate: bool = False,
+    ):
+        self.owner_id = owner_id
+        self.device_ids: Optional[Set[str]] = set(device_ids) if device_ids else None
+        self.metric_names: Optional[Set[str]] = set(metric_names) if metric_names else None
+        self.max_queue = max(1, max_queue)
+        self.conflate = conflate
+        self.dropped = 0 # Samples discarded or replaced before delivery
+        self._queue: deque = deque()
+        self._latest: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._ready = asyncio.Event()
+
+    def matches(self, sample: Dict[str, Any]) -> bool:
+        if self.device_ids is not None and sample.get("device_id") not in self.device_ids:
+            return False
+        if self.metric_names is not None and sample["metric_name"] not in self.metric_names:
+            return False
+        return True
+
+    def offer(self, sample: Dict[str, Any]) -> None:
+        """Queues a sample without ever blocking the publisher."""
+        if self.conflate:
+            key = (sample.get("device_id"), sample["metric_name"])
+            if key in self._latest:
+                self.dropped += 1
+                self._latest.move_to_end(key)
+            elif len(self._latest) >= self.max_queue:
+                self._latest.popitem(last=False)
+                self.dropped += 1
+            self._latest[key] = sample
+        else:
+            if len(self._queue) >= self.max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(sample)
+        self._ready.set()
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """Everything queued so far, oldest first."""
+        if self.conflate:
+            samples = list(self._latest.values())
+            self._latest.clear()
+        else:
+            samples = list(self._queue)
+            self._queue.clear()
+        self._ready.clear()
+        return samples
+
+    async def get(self) -> List[Dict[str, Any]]:
+        """Waits until at least one sample is queued and returns all queued samples."""
+        while True:
+            await self._ready.wait()
+            samples = self.drain()
+            if samples:
+                return samples
+
+
+class TelemetryHub:
+    """
+    In-process pub/sub for live telemetry. Publishing fans samples out to the
+    queues of the owner's matching subscribers and returns immediately, so a
+    slow consumer only ever loses its own samples and never stalls ingest.
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self):
+        self._subscriptions: Dict[str, Set[TelemetrySubscription]] = {}
+
+    def subscribe(self, owner_id: str, device_ids: Optional[Iterable[str]] = None, metric_names: Optional[Iterable[str]] = None,
+                  max_queue: int = TELEMETRY_SUBSCRIBER_QUEUE_SIZE, conflate: bool = False) -> TelemetrySubscription:
+        subscription = TelemetrySubscription(owner_id, device_ids, metric_names, max_queue=max_queue, conflate=conflate)
+        self._subscriptions.setdefault(owner_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: TelemetrySubscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.owner_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.owner_id]
+
+    def subscriber_count(self, owner_id: str) -> int:
+        return len(self._subscriptions.get(owner_id, ()))
+
+    def publish(self, owner_id: str, points: Iterable[Any]) -> int:
+        """
+        Fans out points (anything with metric_name, value, timestamp and device_id)
+        to the owner's subscribers. Returns the number of deliveries queued.
+        """
+        subscriptions = self._subscriptions.get(owner_id)
+        if not subscriptions:
+            return 0
+        delivered = 0
+        for point in points:
+            timestamp = point.timestamp or datetime.utcnow()
+            sample = {
+                "device_id": point.device_id,
+                "metric_name": point.metric_name,
+                "value": point.value,
+                "timestamp": timestamp.isoformat(),
+            }
+            for subscription in subscriptions:
+                if subscription.matches(sample):
+                    subscription.offer(sample)
+                    delivered += 1
+        return delivered
+
+    def publish_columns(self, owner_id: str, metric_name: str, ts_ms: Any, values: Any, device_id: Optional[str] = None) -> int:
+        """
+        Fans out one series given as epoch-ms timestamp and value arrays. Only the
+        samples a subscriber queue can hold are turned into dicts, so a large frame
+        costs little more than a small one, and nothing without subscribers.
+        """
+        subscriptions = self._subscriptions.get(owner_id)
+        if not subscriptions:
+            return 0
+        probe = {"device_id": device_id, "metric_name": metric_name}
+        matching = [subscription for subscription in subscriptions if subscription.matches(probe)]
+        if not matching:
+            return 0
+        # Conflating subscribers keep a single sample per (device, metric) anyway
+        tail = max(1 if subscription.conflate else subscription.max_queue for subscription in matching)
+        skipped = max(0, len(ts_ms) - tail)
+        samples = [
+            {"device_id": device_id, "metric_name": metric_name, "value": value, "timestamp": telemetry_store.from_ms(ts).isoformat()}
+            for ts, value in zip(ts_ms[skipped:].tolist(), values[skipped:].tolist())
+        ]
+        for subscription in matching:
+            subscription.dropped += skipped
+            for sample in samples:
+                subscription.offer(sample)
+        return len(samples) * len(matching)
+
+
+telemetry_hub = TelemetryHub()
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from . import telemetry_store
+from .schemas import TelemetryDataCreate, TelemetryIngestError
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_MAX_BATCH_POINTS = int(os.getenv("TELEMETRY_MAX_BATCH_POINTS", "10000"))
+TELEMETRY_STREAM_BATCH_SIZE = int(os.getenv("TELEMETRY_STREAM_BATCH_SIZE", "500"))
+TELEMETRY_STREAM_FLUSH_INTERVAL_SECONDS = float(os.getenv("TELEMETRY_STREAM_FLUSH_INTERVAL_SECONDS", "1"))
+
+
+def _decode_items(body: bytes, content_type: str) -> List[Any]:
+    """
+    Splits a request body into raw telemetry items. Accepts a JSON array, a
+    {"points": [...]} object, a single JSON object, or NDJSON (one object per line).
+    """
+    try:
+        text = body.decode("utf-8").strip()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Telemetry body must be UTF-8 encoded JSON")
+    if not text:
+        return []
+    if "ndjson" not in content_type and "jsonlines" not in content_type:
+        try:
+            payload = json.loads(text)
+        except json.JSONDecodeError as e:
+            # Several objects without a matching Content-Type are still read as NDJSON
+            if not text.startswith("{"):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON body: {e}")
+        else:
+            if isinstance(payload, dict):
+                payload = payload.get("points", [payload])
+            if not isinstance(payload, list):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a JSON array of telemetry points")
+            return payload
+    items: List[Any] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            # Kept so the line is reported with its index instead of failing the batch
+            items.append(e)
+    return items
+
+
+def validate_items(items: List[Any], overrides: Optional[Dict[str, Any]] = None) -> Tuple[List[TelemetryDataCreate], List[TelemetryIngestError]]:
+    """
+    Validates raw items in one pass; invalid items are reported by index, not raised.
+    Points without a timestamp are stamped with the time they were received, so live
+    subscribers and the store see the same time.
+    """
+    received_at = datetime.utcnow()
+    points: List[TelemetryDataCreate] = []
+    errors: List[TelemetryIngestError] = []
+    for index, item in enumerate(items):
+        if isinstance(item, Exception):
+            errors.append(TelemetryIngestError(index=index, error=f"Invalid JSON: {item}"))
+            continue
+        if overrides and isinstance(item, dict):
+            item = {**item, **overrides}
+        try:
+            point = TelemetryDataCreate.parse_obj(item)
+        except ValidationError as e:
+            errors.append(TelemetryIngestError(index=index, error="; ".join(
+                f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors()
+            )))
+            continue
+        if point.timestamp is None:
+            point.timestamp = received_at
+        points.append(point)
+    return points, errors
+
+
+def parse_telemetry_batch(body: bytes, content_type: str = "") -> Tuple[List[TelemetryDataCreate], List[TelemetryIngestError]]:
+    """Decodes and validates a batch request body (JSON array or NDJSON)."""
+    items = _decode_items(body, content_type)
+    if len(items) > TELEMETRY_MAX_BATCH_POINTS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch of {len(items)} points exceeds the limit of {TELEMETRY_MAX_BATCH_POINTS}",
+        )
+    return validate_items(items)
+
+
+def parse_device_message(message: str, device_id: str) -> Tuple[List[TelemetryDataCreate], List[TelemetryIngestError]]:
+    """
+    Parses one telemetry message sent by a device over its WebSocket. Accepts a
+    sample ({"metric_name": ..., "value": ...}), a list of samples, or a map of
+    metric names to values ({"temperature": 21.5, "speed": 1200}) with an optional
+    shared "timestamp". Every sample is attributed to `device_id`.
+    """
+    try:
+        payload = json.loads(message)
+    except json.JSONDecodeError as e:
+        return [], [TelemetryIngestError(index=0, error=f"Invalid JSON: {e}")]
+    if isinstance(payload, dict) and "metric_name" not in payload:
+        timestamp = payload.pop("timestamp", None)
+        payload = [{"metric_name": name, "value": value, "timestamp": timestamp} for name, value in payload.items()]
+    items = payload if isinstance(payload, list) else [payload]
+    return validate_items(items[:TELEMETRY_MAX_BATCH_POINTS], overrides={"device_id": device_id})
+
+
+def ingest_telemetry_batch(db: Session, points: List[TelemetryDataCreate], owner_id: str, commit: bool = True) -> int:
+    """
+    Stores `points` in the telemetry store with a single executemany INSERT and
+    one commit, instead of an INSERT/commit/refresh per point. Returns the number
+    of points written. With commit=False the caller commits.
+    """
+    accepted = telemetry_store.append_points(db, points, owner_id=owner_id, commit=commit)
+    logger.debug(f"Ingested {accepted} telemetry points for user {owner_id}.")
+    return accepted
+
+
+class TelemetryBatchWriter:
+    """
+    Buffers points arriving on a stream (e.g. a device WebSocket) and stores them
+    through ingest_telemetry_batch off the event loop. A write happens when
+    `batch_size` points are pending, `flush_interval` seconds after the first
+    pending point, or on aclose(). Column arrays from binary frames are buffered
+    alongside and stored through telemetry_store.append_columns.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        owner_id: str,
+        batch_size: int = TELEMETRY_STREAM_BATCH_SIZE,
+        flush_interval: float = TELEMETRY_STREAM_FLUSH_INTERVAL_SECONDS,
+    ):
+        self.bind = db.get_bind()
+        self.owner_id = owner_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[TelemetryDataCreate] = []
+        self._pending_columns: List[Tuple[str, Optional[str], np.ndarray, np.ndarray]] = []
+        self._pending_column_count = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock = asyncio.Lock()
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    def add(self, points: List[TelemetryDataCreate]) -> None:
+        self._pending.extend(points)
+        self._pending_added()
+
+    def add_columns(self, metric_name: str, ts_ms: np.ndarray, values: np.ndarray, device_id: Optional[str] = None) -> None:
+        """Buffers one series as epoch-ms timestamp and value arrays."""
+        if len(ts_ms):
+            self._pending_columns.append((metric_name, device_id, ts_ms, values))
+            self._pending_column_count += len(ts_ms)
+            self._pending_added()
+
+    def _pending_added(self) -> None:
+        pending = len(self._pending) + self._pending_column_count
+        if pending >= self.batch_size:
+            self._schedule_flush()
+        elif pending and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+
+    def _schedule_flush(self) -> None:
+        task = asyncio.ensure_future(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            points, self._pending = self._pending, []
+            columns, self._pending_columns = self._pending_columns, []
+            column_count, self._pending_column_count = self._pending_column_count, 0
+            if not points and not columns:
+                return 0
+            try:
+                return await asyncio.to_thread(self._write, points, columns)
+            except Exception as e:
+                logger.error(f"Failed to store {len(points) + column_count} telemetry points for user {self.owner_id}: {e}", exc_info=True)
+                # Keep them for the next flush, bounded so a broken database cannot exhaust memory
+                self._pending = (points + self._pending)[-TELEMETRY_MAX_BATCH_POINTS:]
+                columns += self._pending_columns
+                while len(columns) > 1 and sum(len(series[2]) for series in columns) > TELEMETRY_MAX_BATCH_POINTS:
+                    columns.pop(0)
+                self._pending_columns = columns
+                self._pending_column_count = sum(len(series[2]) for series in columns)
+                return 0
+
+    async def aclose(self) -> None:
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+
+    def _write(self, points: List[TelemetryDataCreate], columns: List[Tuple[str, Optional[str], np.ndarray, np.ndarray]]) -> int:
+        db = Session(bind=self.bind)
+        try:
+            # One commit for points and columns, so a failed write leaves nothing behind to re-store
+            written = ingest_telemetry_batch(db, points, owner_id=self.owner_id, commit=False) if points else 0
+            for metric_name, device_id, ts_ms, values in columns:
+                written += telemetry_store.append_columns(db, self.owner_id, metric_name, ts_ms, values, device_id=device_id, commit=False)
+            db.commit()
+            return written
+        finally:
+            db.close()
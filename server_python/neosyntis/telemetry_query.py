@@ -0,0 +1,225 @@
+import itertools
+import math
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from server_python.database import TelemetrySample, TelemetryRollup
+from . import telemetry_store
+
+# Aggregations that can be computed from the min/max/sum/count rollups
+ROLLUP_AGGREGATIONS = ("avg", "min", "max", "sum", "count")
+# Plus percentiles ("p50", "p99.9") and "rate" (per-second change), which need raw samples
+PERCENTILE_PATTERN = re.compile(r"^p(\d{1,2}(?:\.\d+)?|100)$")
+
+
+def parse_aggregations(aggs: str) -> List[str]:
+    """Validates a comma separated aggregation list such as "avg,max,p95,rate"."""
+    names = [name.strip().lower() for name in aggs.split(",") if name.strip()]
+    if not names:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one aggregation is required")
+    for name in names:
+        if name not in ROLLUP_AGGREGATIONS and name != "rate" and not PERCENTILE_PATTERN.match(name):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown aggregation '{name}'")
+    return list(dict.fromkeys(names))
+
+
+### Bulk column fetches ###
+
+def _fetch_columns(db: Session, query, width: int) -> np.ndarray:
+    """
+    Runs `query` on the session's connection and packs the rows into a float64
+    (rows, width) array. Rows are flattened through fromiter because np.array()
+    on SQLAlchemy Row objects probes every row for array attributes.
+    """
+    rows = db.connection().execute(query).fetchall()
+    flat = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64, count=len(rows) * width)
+    return flat.reshape(-1, width)
+
+def fetch_samples(db: Session, segment_ids: Sequence[int], start_ms: int, end_ms: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(ts, value) column arrays of the raw samples in [start_ms, end_ms), ordered by ts."""
+    columns = _fetch_columns(db, select(TelemetrySample.ts, TelemetrySample.value).where(
+        TelemetrySample.segment_id.in_(segment_ids), TelemetrySample.ts >= start_ms, TelemetrySample.ts < end_ms,
+    ), 2) # Epoch milliseconds are exact in a float64
+    # Sorting the columns here is much cheaper than an ORDER BY across segments (a temp B-tree in SQLite)
+    order = np.argsort(columns[:, 0], kind="stable")
+    return columns[order, 0].astype(np.int64), columns[order, 1]
+
+
+def fetch_rollups(db: Session, segment_ids: Sequence[int], level: int, start_ms: int, end_ms: int) -> Dict[str, np.ndarray]:
+    """bucket_ts/min/max/sum/count column arrays of one rollup level, ordered by bucket (as last rolled up)."""
+    query = (
+        select(TelemetryRollup.bucket_ts, TelemetryRollup.min_value, TelemetryRollup.max_value,
+               TelemetryRollup.sum_value, TelemetryRollup.count)
+        .where(
+            TelemetryRollup.segment_id.in_(segment_ids),
+            TelemetryRollup.resolution == level,
+            TelemetryRollup.bucket_ts >= start_ms - start_ms % (level * 1000),
+            TelemetryRollup.bucket_ts < end_ms,
+        )
+        .order_by(TelemetryRollup.bucket_ts)
+    )
+    columns = _fetch_columns(db, query, 5)
+    return {
+        "ts": columns[:, 0].astype(np.int64),
+        "min": columns[:, 1],
+        "max": columns[:, 2],
+        "sum": columns[:, 3],
+        "count": columns[:, 4],
+    }
+
+
+### Vectorized aggregation ###
+
+def _bucket_bounds(ts: np.ndarray, step_ms: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """For sorted timestamps: each bucket's start time, first index and length."""
+    keys = ts - ts % step_ms
+    first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    lengths = np.diff(np.r_[first, len(ts)])
+    return keys[first], first, lengths
+
+
+def aggregate_samples(ts: np.ndarray, values: np.ndarray, step_ms: int, aggs: Sequence[str]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Computes `aggs` per `step_ms` bucket over raw (ts, value) columns sorted by ts."""
+    if not len(ts):
+        return ts, {name: np.empty(0) for name in aggs}
+    buckets, first, lengths = _bucket_bounds(ts, step_ms)
+    last = first + lengths - 1
+    results: Dict[str, np.ndarray] = {}
+    sums = np.add.reduceat(values, first)
+    sorted_values = None
+    for name in aggs:
+        if name == "avg":
+            results[name] = sums / lengths
+        elif name == "sum":
+            results[name] = sums
+        elif name == "count":
+            results[name] = lengths.astype(np.float64)
+        elif name == "min":
+            results[name] = np.minimum.reduceat(values, first)
+        elif name == "max":
+            results[name] = np.maximum.reduceat(values, first)
+        elif name == "rate":
+            elapsed = (ts[last] - ts[first]) / 1000.0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                results[name] = np.where(elapsed > 0, (values[last] - values[first]) / elapsed, np.nan)
+        else:
+            if sorted_values is None:
+                # Sort values within each bucket once; buckets are already in order
+                sorted_values = values[np.lexsort((values, np.repeat(np.arange(len(first)), lengths)))]
+            # Linear interpolation between closest ranks, as numpy.percentile does
+            position = first + float(name[1:]) / 100.0 * (lengths - 1)
+            low = np.floor(position).astype(np.int64)
+            high = np.ceil(position).astype(np.int64)
+            results[name] = sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+    return buckets, results
+
+
+def aggregate_rollups(rollups: Dict[str, np.ndarray], step_ms: int, aggs: Sequence[str]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Combines finer rollup buckets into `step_ms` buckets."""
+    if not len(rollups["ts"]):
+        return rollups["ts"], {name: np.empty(0) for name in aggs}
+    buckets, first, _ = _bucket_bounds(rollups["ts"], step_ms)
+    sums = np.add.reduceat(rollups["sum"], first)
+    counts = np.add.reduceat(rollups["count"], first)
+    combined = {
+        "avg": sums / counts,
+        "sum": sums,
+        "count": counts,
+        "min": np.minimum.reduceat(rollups["min"], first),
+        "max": np.maximum.reduceat(rollups["max"], first),
+    }
+    return buckets, {name: combined[name] for name in aggs}
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: indices of `threshold` points
+    that keep the visual shape of the (x, y) series, always including both ends.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        next_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        # Average of the next bucket (the last point for the final bucket)
+        if end < next_end:
+            avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+### Query ###
+
+def _points(timestamps: np.ndarray, columns: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    lists = {name: column.tolist() for name, column in columns.items()}
+    points = []
+    for index, ts in enumerate(timestamps.tolist()):
+        point: Dict[str, Any] = {"timestamp": telemetry_store.from_ms(ts)}
+        for name, values in lists.items():
+            value = values[index]
+            point[name] = None if math.isnan(value) else value
+        points.append(point)
+    return points
+
+
+def query_telemetry(db: Session, owner_id: str, metric_name: str, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, bucket: Optional[int] = None, aggs: str = "avg",
+                    max_points: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Aggregates a metric over [start, end) with NumPy over columns fetched in one query.
+
+    With `bucket` (seconds), each point holds the requested aggregations of one
+    bucket; min/max/avg/sum/count are read from the coarsest rollup that tiles the
+    bucket exactly. Without it, raw samples are returned. Either series is then
+    reduced to `max_points` with LTTB (on the first aggregation for buckets).
+    Without a bucket, max_points defaults to TELEMETRY_MAX_SERIES_POINTS.
+    """
+    start_ms, end_ms = telemetry_store.resolve_range(start, end)
+    names = parse_aggregations(aggs) if bucket else ["value"]
+    if not bucket and max_points is None:
+        max_points = telemetry_store.TELEMETRY_MAX_SERIES_POINTS
+    level = telemetry_store.pick_rollup_resolution(bucket) if bucket and set(names) <= set(ROLLUP_AGGREGATIONS) else 0
+    result: Dict[str, Any] = {
+        "metric_name": metric_name,
+        "bucket": bucket,
+        "aggregations": names,
+        "source": telemetry_store.rollup_source(level),
+        "points": [],
+    }
+
+    segment_ids = telemetry_store.find_segment_ids(db, owner_id, metric_name, start_ms, end_ms)
+    if not segment_ids:
+        return result
+    if level:
+        timestamps, columns = aggregate_rollups(fetch_rollups(db, segment_ids, level, start_ms, end_ms), bucket * 1000, names)
+    else:
+        ts, values = fetch_samples(db, segment_ids, start_ms, end_ms)
+        if bucket:
+            timestamps, columns = aggregate_samples(ts, values, bucket * 1000, names)
+        else:
+            timestamps, columns = ts, {"value": values}
+
+    if max_points and len(timestamps) > max_points:
+        y = np.nan_to_num(columns[names[0]])
+        keep = lttb(timestamps, y, max_points)
+        timestamps = timestamps[keep]
+        columns = {name: column[keep] for name, column in columns.items()}
+    result["points"] = _points(timestamps, columns)
+    return result
@@ -0,0 +1,524 @@
+import asyncio
+import logging
+import math
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi import HTTPException, status
+from sqlalchemy import case, delete, func, insert, literal, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from server_python.database import (
+    SessionLocal,
+    TelemetryData,
+    TelemetryMetric,
+    TelemetrySegment,
+    TelemetrySample,
+    TelemetryRollup,
+)
+from server_python.pagination import decode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Rollup resolutions in seconds (1m and 1h), finest first
+ROLLUP_RESOLUTIONS = (60, 3600)
+# Segments always hold whole hours so every rollup bucket belongs to exactly one segment
+TELEMETRY_SEGMENT_SECONDS = max(1, int(os.getenv("TELEMETRY_SEGMENT_SECONDS", "86400")) // 3600) * 3600
+TELEMETRY_ROLLUP_INTERVAL_SECONDS = float(os.getenv("TELEMETRY_ROLLUP_INTERVAL_SECONDS", "30"))
+# Resolution picked for series queries that do not ask for one: about this many points per range
+TELEMETRY_MAX_SERIES_POINTS = int(os.getenv("TELEMETRY_MAX_SERIES_POINTS", "1000"))
+
+SEGMENT_MS = TELEMETRY_SEGMENT_SECONDS * 1000
+ROLLUP_ALIGN_MS = max(ROLLUP_RESOLUTIONS) * 1000
+
+
+@dataclass
+class TelemetryRecord:
+    """One stored sample, shaped like the legacy TelemetryData rows for the API schemas."""
+    id: str
+    owner_id: str
+    metric_name: str
+    value: float
+    timestamp: datetime
+    workflow_id: Optional[str] = None
+    dataset_id: Optional[str] = None
+    device_id: Optional[str] = None
+
+
+def to_ms(value: datetime) -> int:
+    """Epoch milliseconds; naive datetimes are UTC, as everywhere else in the app."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(round(value.timestamp() * 1000))
+
+
+def from_ms(value: int) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(milliseconds=value)
+
+
+def _insert(db: Session, table):
+    """The dialect's INSERT, which supports ON CONFLICT."""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table.__table__)
+
+
+def get_metric_ids(db: Session, names: Iterable[str], create: bool = True) -> Dict[str, int]:
+    """Maps metric names to their dictionary ids, adding names seen for the first time."""
+    names = set(names)
+    if not names:
+        return {}
+    ids = dict(db.execute(select(TelemetryMetric.name, TelemetryMetric.id).where(TelemetryMetric.name.in_(names))).all())
+    missing = names - ids.keys()
+    if missing and create:
+        # Another writer may add the same names meanwhile; the re-select picks up its ids
+        db.execute(_insert(db, TelemetryMetric).on_conflict_do_nothing(index_elements=["name"]), [{"name": name} for name in sorted(missing)])
+        ids.update(db.execute(select(TelemetryMetric.name, TelemetryMetric.id).where(TelemetryMetric.name.in_(missing))).all())
+    return ids
+
+
+def _get_or_create_segment(db: Session, owner_id: str, key: Tuple[int, Optional[str], Optional[str], Optional[str], int]) -> int:
+    metric_id, workflow_id, dataset_id, device_id, start_ts = key
+    find_segment = select(TelemetrySegment.id).where(
+        TelemetrySegment.owner_id == owner_id,
+        TelemetrySegment.metric_id == metric_id,
+        TelemetrySegment.start_ts == start_ts,
+        TelemetrySegment.workflow_id == workflow_id, # `== None` compiles to IS NULL
+        TelemetrySegment.dataset_id == dataset_id,
+        TelemetrySegment.device_id == device_id,
+    )
+    segment_id = db.execute(find_segment).scalar()
+    if segment_id is None:
+        # The unique series index turns a concurrent writer's insert into a no-op; both then read the same row
+        db.execute(_insert(db, TelemetrySegment).values(
+            owner_id=owner_id, metric_id=metric_id, workflow_id=workflow_id, dataset_id=dataset_id,
+            device_id=device_id, start_ts=start_ts, sample_count=0,
+        ).on_conflict_do_nothing())
+        segment_id = db.execute(find_segment).scalar_one()
+    return segment_id
+
+
+def _mark_written(db: Session, segment_id: int, count: int, first_ts: int, last_ts: int) -> None:
+    """Counts new samples on a segment and widens its dirty range for the rollup worker."""
+    db.execute(update(TelemetrySegment).where(TelemetrySegment.id == segment_id).values(
+        sample_count=TelemetrySegment.sample_count + count,
+        dirty_from_ts=case(
+            (or_(TelemetrySegment.dirty_from_ts == None, TelemetrySegment.dirty_from_ts > first_ts), first_ts),
+            else_=TelemetrySegment.dirty_from_ts,
+        ),
+        dirty_to_ts=case(
+            (or_(TelemetrySegment.dirty_to_ts == None, TelemetrySegment.dirty_to_ts < last_ts), last_ts),
+            else_=TelemetrySegment.dirty_to_ts,
+        ),
+    ))
+
+
+def _write_points(db: Session, points: Sequence[Any], owner_id: str, commit: bool, returning: bool) -> Tuple[List[Dict[str, Any]], List[int]]:
+    metric_ids = get_metric_ids(db, (point.metric_name for point in points))
+    now_ms = to_ms(datetime.utcnow())
+    segment_ids: Dict[tuple, int] = {}
+    segment_ranges: Dict[int, List[int]] = {} # segment id -> [count, min ts, max ts]
+    rows = []
+    for point in points:
+        ts = to_ms(point.timestamp) if point.timestamp else now_ms
+        key = (metric_ids[point.metric_name], point.workflow_id, point.dataset_id, point.device_id, ts - ts % SEGMENT_MS)
+        segment_id = segment_ids.get(key)
+        if segment_id is None:
+            segment_id = segment_ids[key] = _get_or_create_segment(db, owner_id, key)
+        written = segment_ranges.setdefault(segment_id, [0, ts, ts])
+        written[0] += 1
+        written[1] = min(written[1], ts)
+        written[2] = max(written[2], ts)
+        rows.append({"segment_id": segment_id, "ts": ts, "value": point.value})
+
+    sample_ids: List[int] = []
+    try:
+        if returning:
+            sample_ids = db.execute(
+                insert(TelemetrySample).returning(TelemetrySample.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+        else:
+            # A plain executemany; RETURNING makes large batches several times slower
+            db.execute(insert(TelemetrySample), rows)
+        for segment_id, (count, first_ts, last_ts) in segment_ranges.items():
+            _mark_written(db, segment_id, count, first_ts, last_ts)
+        if commit:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return rows, sample_ids
+
+
+def append_points(db: Session, points: Sequence[Any], owner_id: str, commit: bool = True) -> int:
+    """
+    Stores points (anything with metric_name, value, timestamp, workflow_id, dataset_id
+    and device_id) with one executemany INSERT into their segments, and marks the
+    written time range of each segment for the rollup worker. Returns the number stored.
+    """
+    if not points:
+        return 0
+    rows, _ = _write_points(db, points, owner_id, commit=commit, returning=False)
+    return len(rows)
+
+
+def append_point(db: Session, point: Any, owner_id: str) -> TelemetryRecord:
+    """Stores a single point and returns it with its id."""
+    rows, sample_ids = _write_points(db, [point], owner_id, commit=True, returning=True)
+    return TelemetryRecord(
+        id=str(sample_ids[0]), owner_id=owner_id, metric_name=point.metric_name, value=rows[0]["value"],
+        timestamp=from_ms(rows[0]["ts"]), workflow_id=point.workflow_id, dataset_id=point.dataset_id, device_id=point.device_id,
+    )
+
+
+# DBAPI positional parameter markers, for the raw executemany in append_columns
+_POSITIONAL_MARKERS = {"qmark": "?", "format": "%s", "pyformat": "%s"}
+
+
+def append_columns(db: Session, owner_id: str, metric_name: str, ts_ms: np.ndarray, values: np.ndarray,
+                   device_id: Optional[str] = None, workflow_id: Optional[str] = None, dataset_id: Optional[str] = None,
+                   commit: bool = True) -> int:
+    """
+    Stores one series given as column arrays (epoch-ms timestamps and values), as
+    decoded from binary telemetry frames. Segments are split with NumPy and the
+    rows go to the driver's executemany as plain tuples, skipping per-row objects.
+    Returns the number of samples stored.
+    """
+    if not len(ts_ms):
+        return 0
+    metric_id = get_metric_ids(db, [metric_name])[metric_name]
+    ts_ms = np.asarray(ts_ms, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    starts = ts_ms - ts_ms % SEGMENT_MS
+    rows: List[Tuple[int, int, float]] = []
+    try:
+        for start in np.unique(starts).tolist():
+            in_segment = starts == start
+            segment_ts = ts_ms[in_segment]
+            segment_id = _get_or_create_segment(db, owner_id, (metric_id, workflow_id, dataset_id, device_id, start))
+            _mark_written(db, segment_id, len(segment_ts), int(segment_ts.min()), int(segment_ts.max()))
+            rows.extend(zip([segment_id] * len(segment_ts), segment_ts.tolist(), values[in_segment].tolist()))
+
+        connection = db.connection()
+        marker = _POSITIONAL_MARKERS.get(connection.dialect.paramstyle)
+        if marker:
+            connection.exec_driver_sql(
+                f"INSERT INTO {TelemetrySample.__tablename__} (segment_id, ts, value) VALUES ({marker}, {marker}, {marker})", rows
+            )
+        else:
+            db.execute(insert(TelemetrySample), [{"segment_id": row[0], "ts": row[1], "value": row[2]} for row in rows])
+        if commit:
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(rows)
+
+
+def list_samples(db: Session, owner_id: str, metric_name: Optional[str] = None, skip: int = 0,
+                 limit: Optional[int] = 100, cursor: Optional[str] = None) -> List[TelemetryRecord]:
+    """Raw samples ordered by (timestamp, id), paged with skip/limit or a keyset cursor."""
+    query = (
+        select(
+            TelemetrySample.id, TelemetrySample.ts, TelemetrySample.value, TelemetryMetric.name,
+            TelemetrySegment.workflow_id, TelemetrySegment.dataset_id, TelemetrySegment.device_id,
+        )
+        .join(TelemetrySegment, TelemetrySegment.id == TelemetrySample.segment_id)
+        .join(TelemetryMetric, TelemetryMetric.id == TelemetrySegment.metric_id)
+        .where(TelemetrySegment.owner_id == owner_id)
+        .order_by(TelemetrySample.ts, TelemetrySample.id)
+    )
+    if metric_name is not None:
+        query = query.where(TelemetryMetric.name == metric_name)
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        if sort_value is None or not row_id.isdigit():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+        ts, sample_id = to_ms(sort_value), int(row_id)
+        query = query.where(
+            # Segments ending before the cursor hold nothing after it; the row value seeks (segment_id, ts)
+            TelemetrySegment.start_ts > ts - SEGMENT_MS,
+            tuple_(TelemetrySample.ts, TelemetrySample.id) > tuple_(ts, sample_id),
+        )
+    elif skip:
+        query = query.offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    return [
+        TelemetryRecord(
+            id=str(sample_id), owner_id=owner_id, metric_name=name, value=value, timestamp=from_ms(ts),
+            workflow_id=workflow_id, dataset_id=dataset_id, device_id=device_id,
+        )
+        for sample_id, ts, value, name, workflow_id, dataset_id, device_id in db.execute(query)
+    ]
+
+
+### Rollups ###
+
+def compute_rollups(db: Session, segment_ids: Optional[Iterable[int]] = None, max_segments: Optional[int] = None) -> int:
+    """
+    Recomputes the 1m/1h rollup buckets overlapping the range written since each
+    segment's last rollup, then marks the segment clean. Limited to `segment_ids`
+    when given. Returns the number of segments rolled up.
+    """
+    query = select(TelemetrySegment.id, TelemetrySegment.dirty_from_ts, TelemetrySegment.dirty_to_ts).where(
+        TelemetrySegment.dirty_from_ts != None
+    )
+    if segment_ids is not None:
+        query = query.where(TelemetrySegment.id.in_(list(segment_ids)))
+    if max_segments:
+        query = query.limit(max_segments)
+    dirty = db.execute(query).all()
+
+    for segment_id, dirty_from, dirty_to in dirty:
+        window_start = dirty_from - dirty_from % ROLLUP_ALIGN_MS
+        window_end = dirty_to - dirty_to % ROLLUP_ALIGN_MS + ROLLUP_ALIGN_MS
+        try:
+            for resolution in ROLLUP_RESOLUTIONS:
+                step = resolution * 1000
+                db.execute(delete(TelemetryRollup).where(
+                    TelemetryRollup.segment_id == segment_id,
+                    TelemetryRollup.resolution == resolution,
+                    TelemetryRollup.bucket_ts >= window_start,
+                    TelemetryRollup.bucket_ts < window_end,
+                ))
+                bucket = (TelemetrySample.ts - TelemetrySample.ts % step).label("bucket_ts")
+                buckets = (
+                    select(
+                        TelemetrySample.segment_id, literal(resolution), bucket,
+                        func.min(TelemetrySample.value), func.max(TelemetrySample.value),
+                        func.sum(TelemetrySample.value), func.count(),
+                    )
+                    .where(
+                        TelemetrySample.segment_id == segment_id,
+                        TelemetrySample.ts >= window_start,
+                        TelemetrySample.ts < window_end,
+                    )
+                    .group_by(TelemetrySample.segment_id, bucket)
+                )
+                db.execute(insert(TelemetryRollup).from_select(
+                    ["segment_id", "resolution", "bucket_ts", "min_value", "max_value", "sum_value", "count"], buckets
+                ))
+            # Writes made meanwhile widen the dirty range, which keeps the segment dirty
+            db.execute(update(TelemetrySegment).where(
+                TelemetrySegment.id == segment_id,
+                TelemetrySegment.dirty_from_ts == dirty_from,
+                TelemetrySegment.dirty_to_ts == dirty_to,
+            ).values(dirty_from_ts=None, dirty_to_ts=None))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return len(dirty)
+
+
+class TelemetryRollupWorker:
+    """Rolls up newly written telemetry in the background every `interval` seconds."""
+
+    def __init__(self, interval: float = TELEMETRY_ROLLUP_INTERVAL_SECONDS, session_factory: Callable[[], Session] = SessionLocal):
+        self.interval = interval
+        self.session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+
+    def run_once(self) -> int:
+        db = self.session_factory()
+        try:
+            return compute_rollups(db)
+        finally:
+            db.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                rolled_up = await asyncio.to_thread(self.run_once)
+                if rolled_up:
+                    logger.debug(f"Rolled up {rolled_up} telemetry segments.")
+            except Exception as e:
+                logger.error(f"Telemetry rollup error: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Telemetry rollup worker started ({self.interval}s interval).")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+telemetry_rollup_worker = TelemetryRollupWorker()
+
+
+### Queries ###
+
+def pick_rollup_resolution(resolution: int) -> int:
+    """
+    The coarsest rollup whose buckets tile `resolution`-second buckets exactly,
+    or 0 when only raw samples can serve it.
+    """
+    return max((level for level in ROLLUP_RESOLUTIONS if resolution % level == 0), default=0)
+
+
+def auto_resolution(start_ms: int, end_ms: int) -> int:
+    """
+    Bucket width in seconds giving at most about TELEMETRY_MAX_SERIES_POINTS buckets
+    over [start_ms, end_ms), rounded up to a multiple of the coarsest rollup that
+    fits in it, so longer ranges are served from rollups instead of raw samples.
+    """
+    resolution = max(1, math.ceil((end_ms - start_ms) / 1000 / TELEMETRY_MAX_SERIES_POINTS))
+    level = max((level for level in ROLLUP_RESOLUTIONS if level <= resolution), default=0)
+    return math.ceil(resolution / level) * level if level else resolution
+
+
+def rollup_source(level: int) -> str:
+    """Name of the data a query was served from: "raw", "1m" or "1h"."""
+    return f"{level // 3600}h" if level >= 3600 else f"{level // 60}m" if level else "raw"
+
+
+def resolve_range(start: Optional[datetime], end: Optional[datetime]) -> Tuple[int, int]:
+    """[start, end) in epoch milliseconds; defaults to the last hour."""
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=1)
+    start_ms, end_ms = to_ms(start), to_ms(end)
+    if end_ms <= start_ms:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="`end` must be after `start`")
+    return start_ms, end_ms
+
+
+def find_segment_ids(db: Session, owner_id: str, metric_name: str, start_ms: int, end_ms: int) -> List[int]:
+    """Segments of a user's metric that may hold samples in [start_ms, end_ms)."""
+    metric_id = get_metric_ids(db, [metric_name], create=False).get(metric_name)
+    if metric_id is None:
+        return []
+    return db.execute(select(TelemetrySegment.id).where(
+        TelemetrySegment.owner_id == owner_id,
+        TelemetrySegment.metric_id == metric_id,
+        TelemetrySegment.start_ts > start_ms - SEGMENT_MS,
+        TelemetrySegment.start_ts < end_ms,
+    )).scalars().all()
+
+
+def query_series(db: Session, owner_id: str, metric_name: str, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None, resolution: Optional[int] = None) -> Dict[str, Any]:
+    """
+    min/max/avg/count of a metric per `resolution`-second bucket over [start, end),
+    read from the coarsest rollup that still satisfies the resolution (raw samples
+    below one minute). Without a resolution, auto_resolution picks one that yields
+    at most about TELEMETRY_MAX_SERIES_POINTS buckets. Defaults to the last hour. Rollups are
+    only computed by the background worker, so samples written within its last
+    interval may not be counted yet.
+    """
+    start_ms, end_ms = resolve_range(start, end)
+    if resolution is None:
+        resolution = auto_resolution(start_ms, end_ms)
+    level = pick_rollup_resolution(resolution)
+    result: Dict[str, Any] = {
+        "metric_name": metric_name,
+        "resolution": resolution,
+        "source": rollup_source(level),
+        "points": [],
+    }
+
+    segment_ids = find_segment_ids(db, owner_id, metric_name, start_ms, end_ms)
+    if not segment_ids:
+        return result
+
+    step = resolution * 1000
+    if level:
+        bucket = (TelemetryRollup.bucket_ts - TelemetryRollup.bucket_ts % step).label("bucket")
+        query = select(
+            bucket, func.min(TelemetryRollup.min_value), func.max(TelemetryRollup.max_value),
+            func.sum(TelemetryRollup.sum_value), func.sum(TelemetryRollup.count),
+        ).where(
+            TelemetryRollup.segment_id.in_(segment_ids),
+            TelemetryRollup.resolution == level,
+            TelemetryRollup.bucket_ts >= start_ms - start_ms % (level * 1000),
+            TelemetryRollup.bucket_ts < end_ms,
+        )
+    else:
+        bucket = (TelemetrySample.ts - TelemetrySample.ts % step).label("bucket")
+        query = select(
+            bucket, func.min(TelemetrySample.value), func.max(TelemetrySample.value),
+            func.sum(TelemetrySample.value), func.count(),
+        ).where(
+            TelemetrySample.segment_id.in_(segment_ids),
+            TelemetrySample.ts >= start_ms,
+            TelemetrySample.ts < end_ms,
+        )
+    rows = db.execute(query.group_by(bucket).order_by(bucket)).all()
+    result["points"] = [
+        {"timestamp": from_ms(bucket_ts), "min": low, "max": high, "avg": total / count, "count": count}
+        for bucket_ts, low, high, total, count in rows
+    ]
+    return result
+
+
+### Migration ###
+
+def merge_duplicate_segments(bind) -> int:
+    """
+    Folds segments that share a series and partition into the oldest of them,
+    moving their samples over. The merged segment is marked dirty as a whole so
+    its rollups are recomputed. Returns the number of segments removed.
+    """
+    series = (
+        TelemetrySegment.owner_id, TelemetrySegment.metric_id, TelemetrySegment.start_ts,
+        func.coalesce(TelemetrySegment.workflow_id, ""), func.coalesce(TelemetrySegment.dataset_id, ""),
+        func.coalesce(TelemetrySegment.device_id, ""),
+    )
+    db = SessionLocal(bind=bind)
+    merged = 0
+    try:
+        duplicated = db.execute(select(*series).group_by(*series).having(func.count() > 1)).all()
+        for key in duplicated:
+            segment_ids = db.execute(
+                select(TelemetrySegment.id).where(*(column == value for column, value in zip(series, key))).order_by(TelemetrySegment.id)
+            ).scalars().all()
+            kept, duplicates = segment_ids[0], segment_ids[1:]
+            start_ts = key[2]
+            db.execute(update(TelemetrySample).where(TelemetrySample.segment_id.in_(duplicates)).values(segment_id=kept))
+            db.execute(delete(TelemetryRollup).where(TelemetryRollup.segment_id.in_(duplicates)))
+            db.execute(delete(TelemetrySegment).where(TelemetrySegment.id.in_(duplicates)))
+            sample_count = select(func.count()).where(TelemetrySample.segment_id == kept).scalar_subquery()
+            db.execute(update(TelemetrySegment).where(TelemetrySegment.id == kept).values(
+                sample_count=sample_count, dirty_from_ts=start_ts, dirty_to_ts=start_ts + SEGMENT_MS - 1,
+            ))
+            db.commit()
+            merged += len(duplicates)
+    finally:
+        db.close()
+    return merged
+
+
+def backfill_legacy_telemetry(bind, chunk_size: int = 5000) -> int:
+    """
+    Moves rows from the legacy `telemetry_data` table into the compact store,
+    one chunk per transaction. Returns the number of rows moved.
+    """
+    db = SessionLocal(bind=bind)
+    moved = 0
+    try:
+        while True:
+            chunk = db.query(TelemetryData).order_by(TelemetryData.id).limit(chunk_size).all()
+            if not chunk:
+                break
+            by_owner: Dict[str, List[TelemetryData]] = {}
+            for row in chunk:
+                by_owner.setdefault(row.owner_id, []).append(row)
+            for owner_id, rows in by_owner.items():
+                append_points(db, rows, owner_id, commit=False)
+            db.execute(delete(TelemetryData).where(TelemetryData.id.in_([row.id for row in chunk])))
+            db.commit()
+            db.expunge_all()
+            moved += len(chunk)
+    finally:
+        db.close()
+    if moved:
+        logger.info(f"Moved {moved} legacy telemetry rows into the telemetry store.")
+    return moved
@@ -17,6 +17,10 @@ class ConnectionManager:
         if session_id in self.active_connections:
             await self.active_connections[session_id].send_text(message)
 
+    async def send_bytes_to_session(self, session_id: str, data: bytes):
+        if session_id in self.active_connections:
+            await self.active_connections[session_id].send_bytes(data)
+
     async def broadcast(self, message: str):
         for connection in self.active_connections.values():
             await connection.send_text(message)
@@ -4,6 +4,7 @@ from typing import Dict, Any
 from sqlalchemy.orm import Session
 
 from terminal.service import TerminalService
+from terminal.pty_stream import PtyOutputStream
 from cognisys.service import ChatService
 from .connection_manager import manager
 from server_python.database import User as DBUser
@@ -12,7 +13,7 @@ class EventHandler:
     def __init__(self):
         self.sessions: Dict[str, Dict[str, Any]] = {}
 
-    async def initialize_session(self, session_id: str, user: DBUser, db: Session, project_root: str):
+    async def initialize_session(self, session_id: str, user: DBUser, db: Session, project_root: str, binary_frames: bool = False):
         if session_id not in self.sessions:
             terminal_service = TerminalService(session_id, str(user.id))
             chat_service = ChatService(db) # ChatService needs the db session
@@ -25,10 +26,10 @@ class EventHandler:
                 "terminal_task": None,
             }
             
-            master_reader = await terminal_service.start_session(project_root)
+            master_fd = await terminal_service.start_session(project_root)
             
             terminal_task = asyncio.create_task(
-                self.forward_shell_output(session_id, master_reader)
+                self.forward_shell_output(session_id, master_fd, binary_frames)
             )
             self.sessions[session_id]["terminal_task"] = terminal_task
             
@@ -39,28 +40,36 @@ class EventHandler:
             session_data = self.sessions[session_id]
             if session_data["terminal_task"]:
                 session_data["terminal_task"].cancel()
+                # Let the task unregister the pty from the event loop before the fd is closed
+                await asyncio.gather(session_data["terminal_task"], return_exceptions=True)
             await session_data["terminal"].close_session()
             
             del self.sessions[session_id]
             print(f"Cleaned up services for session: {session_id}")
 
-    async def forward_shell_output(self, session_id: str, reader):
-        """Reads from the shell's output and sends it to the WebSocket client."""
+    async def forward_shell_output(self, session_id: str, master_fd: int, binary_frames: bool = False):
+        """
+        Streams the shell's output to the WebSocket client. Output is coalesced into
+        larger frames; with binary_frames the raw bytes are sent as binary frames,
+        otherwise as JSON "shell_output" messages.
+        """
+        shell_output = PtyOutputStream(master_fd)
         try:
-            while True:
-                output = await asyncio.to_thread(reader.read, 1024)
-                if not output:
-                    print(f"Shell output stream for session {session_id} ended.")
-                    break
-                
-                response = {
-                    "type": "shell_output",
-                    "payload": {"data": output.decode(errors='ignore')}
-                }
-                await manager.send_to_session(session_id, json.dumps(response))
+            if binary_frames:
+                async for frame in shell_output.frames():
+                    await manager.send_bytes_to_session(session_id, frame)
+            else:
+                async for text in shell_output.text_frames():
+                    response = {
+                        "type": "shell_output",
+                        "payload": {"data": text}
+                    }
+                    await manager.send_to_session(session_id, json.dumps(response))
+            print(f"Shell output stream for session {session_id} ended.")
         except Exception as e:
             print(f"Error in forward_shell_output for session {session_id}: {e}")
         finally:
+            shell_output.close()
             print(f"forward_shell_output task for session {session_id} finishing.")
 
 
@@ -75,7 +84,7 @@ class EventHandler:
             return {"type": "error", "payload": {"message": "Session not initialized."}}
 
         if event_type == "shell_input":
-            session_data["terminal"].write(payload.get("data", ""))
+            await session_data["terminal"].write(payload.get("data", ""))
             return None
         elif event_type == "shell_resize":
             cols = payload.get("cols")
@@ -88,8 +97,15 @@ class EventHandler:
             user = session_data["user"]
             prompt = payload.get("prompt", "")
             
-            # Pass the entire session_data dictionary
-            response_data = await chat_service.handle_message(user, prompt, session_data)
+            if payload.get("stream"):
+                # Push tokens as incremental chat_delta frames; chat_response marks the end of the stream
+                async def send_delta(delta: str):
+                    await manager.send_to_session(session_id, json.dumps({"type": "chat_delta", "payload": {"delta": delta}}))
+
+                response_data = await chat_service.stream_message(user, prompt, session_data, send_delta)
+            else:
+                # Pass the entire session_data dictionary
+                response_data = await chat_service.handle_message(user, prompt, session_data)
             
             return {
                 "type": "chat_response",
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, status
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Query, status
 from sqlalchemy.orm import Session
 import uuid
 import json
@@ -29,10 +29,11 @@ async def websocket_endpoint(
     websocket: WebSocket, 
     session_id: str,
     current_user: DBUser = Depends(get_db_user), # Use the new dependency
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    binary: bool = Query(False) # Send shell output as raw binary frames
 ):
     await manager.connect(session_id, websocket)
-    await event_handler.initialize_session(session_id, current_user, db, project_root)
+    await event_handler.initialize_session(session_id, current_user, db, project_root, binary_frames=binary)
     
     try:
         while True:
@@ -0,0 +1,72 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.orm import Query
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(sort_value: Optional[datetime], row_id: str) -> str:
+    """Opaque cursor pointing just after the row with this (sort_value, id); a NULL sort_value is kept as null."""
+    payload = json.dumps([sort_value.isoformat() if sort_value is not None else None, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(sort_value) if sort_value is not None else None), str(row_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+
+def paginate(query: Query, sort_column, id_column, skip: int = 0, limit: Optional[int] = 100,
+             cursor: Optional[str] = None, descending: bool = False) -> Query:
+    """
+    Orders `query` by (sort_column, id_column) and applies either keyset pagination
+    (when a cursor from a previous page is given) or the legacy skip/limit.
+    With a cursor the database seeks straight to the next row through the
+    (..., sort_column) index instead of scanning and discarding `skip` rows: the
+    row-value comparison `(sort_column, id_column) > (value, id)` is a range on
+    the index, where an OR of the two cases is not.
+    """
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        if sort_value is None:
+            # Sort columns have defaults, so this only happens for rows given an explicit NULL,
+            # which SQLite orders before every value
+            after = and_(sort_column.is_(None), id_column < row_id if descending else id_column > row_id)
+            query = query.filter(after if descending else or_(after, sort_column.isnot(None)))
+        elif descending:
+            query = query.filter(tuple_(sort_column, id_column) < tuple_(sort_value, row_id))
+        else:
+            query = query.filter(tuple_(sort_column, id_column) > tuple_(sort_value, row_id))
+    elif skip:
+        query = query.offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def next_cursor(items: Sequence[Any], limit: Optional[int], sort_attr: str) -> Optional[str]:
+    """Cursor for the page after `items`, or None when this page was the last one."""
+    if not items or limit is None or len(items) < limit:
+        return None
+    last = items[-1]
+    return encode_cursor(getattr(last, sort_attr), last.id)
+
+
+def set_next_cursor(response: Response, items: List[Any], limit: Optional[int], sort_attr: str) -> None:
+    """Exposes the next page's cursor in the X-Next-Cursor response header."""
+    cursor = next_cursor(items, limit, sort_attr)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
@@ -0,0 +1,205 @@
+"""
+Full-text search over a user's entities, backed by an SQLite FTS5 index.
+
+Each searchable row has a document in `search_documents` (see SearchDocument),
+kept in sync by SQL triggers on the source tables, so every write path (ORM,
+bulk updates, raw SQL) is covered. `search_fts` is an external-content FTS5
+table over those documents, maintained by triggers on `search_documents`.
+"""
+import html
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "search_fts"
+DOCUMENTS_TABLE = "search_documents"
+
+# entity type -> source table, indexed body (the title is the row's name) and the extra fields returned with hits
+SEARCH_SOURCES: Dict[str, Dict[str, Any]] = {
+    "workflow": {
+        "table": "workflows",
+        "body": "coalesce({row}.description, '')",
+        "fields": ("description", "status"),
+    },
+    "dataset": {
+        "table": "datasets",
+        "body": "coalesce({row}.description, '') || ' ' || coalesce({row}.format, '')",
+        "fields": ("description", "format"),
+    },
+    "ml_model": {
+        "table": "ml_models",
+        "body": "coalesce({row}.version, '') || ' ' || coalesce({row}.status, '')",
+        "fields": ("version", "status"),
+    },
+    "agent": {
+        "table": "agents",
+        "body": "coalesce({row}.type, '') || ' ' || coalesce({row}.status, '')",
+        "fields": ("type", "status"),
+    },
+    "hardware_device": {
+        "table": "hardware_devices",
+        "body": "coalesce({row}.device_type, '') || ' ' || coalesce({row}.status, '')",
+        "fields": ("device_type", "status"),
+    },
+    "routing_rule": {
+        "table": "routing_rules",
+        "body": "coalesce({row}.condition, '') || ' ' || coalesce({row}.target_model, '')",
+        "fields": ("target_model",),
+    },
+}
+
+# The title counts ten times as much as the body in the bm25 ranking
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+SNIPPET_TOKENS = 12
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 200
+HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE = "<mark>", "</mark>"
+# FTS5 wraps matches in these control characters; they become highlight tags once the text is HTML-escaped
+_MATCH_OPEN, _MATCH_CLOSE = "\x02", "\x03"
+
+_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def _document_values(entity_type: str, row: str) -> str:
+    source = SEARCH_SOURCES[entity_type]
+    extra = ", ".join(f"'{field}', {row}.{field}" for field in source["fields"])
+    return (
+        f"'{entity_type}', {row}.id, {row}.owner_id, {row}.name, "
+        f"{source['body'].format(row=row)}, json_object({extra})"
+    )
+
+
+def _indexed_columns(source: Dict[str, Any]) -> List[str]:
+    """Source columns a search document is built from; updates to other columns leave it alone."""
+    columns = ["id", "owner_id", "name", *re.findall(r"\{row\}\.(\w+)", source["body"]), *source["fields"]]
+    return list(dict.fromkeys(columns))
+
+
+def _render_matches(value: Optional[str]) -> Optional[str]:
+    """HTML-escapes indexed text (names and descriptions are user input) and marks up the matches."""
+    if value is None:
+        return None
+    return html.escape(value).replace(_MATCH_OPEN, HIGHLIGHT_OPEN).replace(_MATCH_CLOSE, HIGHLIGHT_CLOSE)
+
+
+def search_index_ddl() -> List[str]:
+    """Statements creating the FTS table and the triggers keeping it in sync. All are idempotent."""
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"title, body, content='{DOCUMENTS_TABLE}', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        # search_documents -> search_fts (the external-content pattern from the FTS5 docs)
+        f"CREATE TRIGGER IF NOT EXISTS {DOCUMENTS_TABLE}_ai AFTER INSERT ON {DOCUMENTS_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+        f"CREATE TRIGGER IF NOT EXISTS {DOCUMENTS_TABLE}_ad AFTER DELETE ON {DOCUMENTS_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+        f"CREATE TRIGGER IF NOT EXISTS {DOCUMENTS_TABLE}_au AFTER UPDATE ON {DOCUMENTS_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+        f"INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    ]
+    # Source tables -> search_documents
+    columns = "entity_type, entity_id, owner_id, title, body, fields"
+    for entity_type, source in SEARCH_SOURCES.items():
+        table = source["table"]
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {DOCUMENTS_TABLE} ({columns}) VALUES ({_document_values(entity_type, 'new')}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_au AFTER UPDATE OF {', '.join(_indexed_columns(source))} ON {table} BEGIN "
+            f"DELETE FROM {DOCUMENTS_TABLE} WHERE entity_type = '{entity_type}' AND entity_id = old.id; "
+            f"INSERT INTO {DOCUMENTS_TABLE} ({columns}) VALUES ({_document_values(entity_type, 'new')}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_ad AFTER DELETE ON {table} BEGIN "
+            f"DELETE FROM {DOCUMENTS_TABLE} WHERE entity_type = '{entity_type}' AND entity_id = old.id; END",
+        ]
+    return statements
+
+
+def create_search_index(connection) -> None:
+    """Creates the FTS table and sync triggers on an SQLite connection; a no-op on other databases."""
+    if connection.dialect.name != "sqlite":
+        return
+    for statement in search_index_ddl():
+        connection.exec_driver_sql(statement)
+
+
+def refresh_search_triggers(connection) -> None:
+    """Re-creates the sync triggers on the source tables, which `IF NOT EXISTS` would leave as first defined."""
+    if connection.dialect.name != "sqlite":
+        return
+    for source in SEARCH_SOURCES.values():
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {source['table']}_search_au")
+    create_search_index(connection)
+
+
+def rebuild_search_index(connection) -> int:
+    """
+    Re-creates every search document from the source tables and rebuilds the FTS
+    index from them. Used to index rows written before the triggers existed.
+    Returns the number of documents indexed.
+    """
+    create_search_index(connection)
+    connection.exec_driver_sql(f"DELETE FROM {DOCUMENTS_TABLE}")
+    for entity_type, source in SEARCH_SOURCES.items():
+        connection.exec_driver_sql(
+            f"INSERT INTO {DOCUMENTS_TABLE} (entity_type, entity_id, owner_id, title, body, fields) "
+            f"SELECT {_document_values(entity_type, source['table'])} FROM {source['table']}"
+        )
+    connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    indexed = connection.exec_driver_sql(f"SELECT count(*) FROM {DOCUMENTS_TABLE}").scalar()
+    logger.info(f"Rebuilt the search index with {indexed} documents.")
+    return indexed
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Turns free text into an FTS5 query: every word must match as a prefix
+    ("serv conf" finds "server configuration"). Words are quoted, so FTS5
+    operators and punctuation in user input are never interpreted.
+    """
+    terms = _TERM_PATTERN.findall(query)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search(db: Session, owner_id: str, query: str, entity_types: Optional[Sequence[str]] = None,
+           limit: int = SEARCH_DEFAULT_LIMIT) -> List[Dict[str, Any]]:
+    """
+    Searches the owner's entities with one indexed FTS5 query, best matches first.
+    Each hit has its type, id and name, the type's extra fields, the name with
+    matched terms highlighted, a snippet of the best matching text and its bm25
+    score (lower is better). The highlight and snippet are HTML-escaped, with
+    matches wrapped in <mark> tags.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return []
+    params: Dict[str, Any] = {"match": match, "owner_id": owner_id, "limit": limit, "open": _MATCH_OPEN, "close": _MATCH_CLOSE}
+    type_filter = ""
+    if entity_types:
+        names = [f":type_{index}" for index in range(len(entity_types))]
+        params.update({f"type_{index}": entity_type for index, entity_type in enumerate(entity_types)})
+        type_filter = f"AND d.entity_type IN ({', '.join(names)})"
+    rows = db.execute(text(
+        f"SELECT d.entity_type, d.entity_id, d.title, d.fields, "
+        f"highlight({FTS_TABLE}, 0, :open, :close) AS highlighted, "
+        f"snippet({FTS_TABLE}, -1, :open, :close, '…', {SNIPPET_TOKENS}) AS snippet, "
+        f"bm25({FTS_TABLE}, {TITLE_WEIGHT}, {BODY_WEIGHT}) AS score "
+        f"FROM {FTS_TABLE} JOIN {DOCUMENTS_TABLE} d ON d.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH :match AND d.owner_id = :owner_id {type_filter} "
+        f"ORDER BY score LIMIT :limit"
+    ), params).all()
+
+    results = []
+    for row in rows:
+        result: Dict[str, Any] = {"type": row.entity_type, "id": row.entity_id, "name": row.title}
+        result.update(json.loads(row.fields) if row.fields else {})
+        result.update({"highlight": _render_matches(row.highlighted), "snippet": _render_matches(row.snippet), "score": row.score})
+        results.append(result)
+    return results
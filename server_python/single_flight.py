@@ -0,0 +1,51 @@
+import asyncio
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is in flight,
+    later callers with the same key await its result instead of starting their own.
+
+    The shared call runs as its own task and every caller awaits it through
+    asyncio.shield, so cancelling one caller (a client disconnecting, a timeout)
+    never cancels the call the others are waiting for. Each caller gets its own
+    deep copy of the result; an exception is raised in every caller.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        task = self._calls.get(key)
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = loop.create_task(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda finished, key=key: self._finished(key, finished))
+            self._stats["calls"] += 1
+        else:
+            self._stats["coalesced"] += 1
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved even when every caller was cancelled
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Shared call {key[:12]} failed: {task.exception()!r}")
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats, in_flight=len(self._calls))
+
+
+# Identical concurrent LLM completion requests (see call_llm_api)
+llm_request_flights = SingleFlight()
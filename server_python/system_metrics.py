@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_METRICS_INTERVAL_SECONDS = float(os.getenv("SYSTEM_METRICS_INTERVAL_SECONDS", "2"))
+SYSTEM_METRICS_HISTORY_MINUTES = int(os.getenv("SYSTEM_METRICS_HISTORY_MINUTES", "60"))
+SYSTEM_METRICS_DISK_PATH = os.getenv("SYSTEM_METRICS_DISK_PATH", "/")
+
+# Values served when psutil cannot read the host (e.g. in restricted containers)
+MOCK_SYSTEM_METRICS = {
+    "cpu_percent": 10.0,
+    "memory_percent": 30.0,
+    "memory_total": 8 * 1024 * 1024 * 1024, # 8 GB
+    "memory_available": 5 * 1024 * 1024 * 1024, # 5 GB
+}
+
+METRIC_FIELDS = (
+    "timestamp",
+    "cpu_percent",
+    "memory_percent",
+    "memory_total",
+    "memory_available",
+    "disk_percent",
+    "disk_read_bytes",
+    "disk_write_bytes",
+    "net_bytes_sent",
+    "net_bytes_recv",
+)
+
+
+class SystemMetricsSampler:
+    """
+    Samples CPU, memory, disk and network counters on a background task and keeps
+    the most recent `capacity` samples in a fixed-size ring buffer (one
+    array('d') per field), so request handlers never call psutil themselves.
+
+    cpu_percent is measured over the time between two samples, which replaces
+    the blocking psutil.cpu_percent(interval=...) calls.
+    """
+
+    def __init__(
+        self,
+        interval: float = SYSTEM_METRICS_INTERVAL_SECONDS,
+        history_minutes: int = SYSTEM_METRICS_HISTORY_MINUTES,
+        disk_path: str = SYSTEM_METRICS_DISK_PATH,
+    ):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.capacity = max(1, int(history_minutes * 60 / interval))
+        self._columns = {field: array("d", bytes(8 * self.capacity)) for field in METRIC_FIELDS}
+        self._next = 0 # Slot the next sample is written to
+        self._count = 0
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.mocked = False
+        self.reason = ""
+
+    # --- Sampling ---
+
+    def _read(self) -> Dict[str, float]:
+        cpu_percent = psutil.cpu_percent(interval=None)
+        memory_info = psutil.virtual_memory()
+        values = {
+            "timestamp": time.time(),
+            "cpu_percent": cpu_percent,
+            "memory_percent": memory_info.percent,
+            "memory_total": memory_info.total,
+            "memory_available": memory_info.available,
+            "disk_percent": 0.0,
+            "disk_read_bytes": 0.0,
+            "disk_write_bytes": 0.0,
+            "net_bytes_sent": 0.0,
+            "net_bytes_recv": 0.0,
+        }
+        # Disk and network counters are optional; some hosts do not expose them
+        try:
+            values["disk_percent"] = psutil.disk_usage(self.disk_path).percent
+            disk_io = psutil.disk_io_counters()
+            if disk_io:
+                values["disk_read_bytes"] = disk_io.read_bytes
+                values["disk_write_bytes"] = disk_io.write_bytes
+            net_io = psutil.net_io_counters()
+            if net_io:
+                values["net_bytes_sent"] = net_io.bytes_sent
+                values["net_bytes_recv"] = net_io.bytes_recv
+        except Exception as e:
+            logger.debug(f"Disk/network counters unavailable: {e}")
+        return values
+
+    def sample(self) -> None:
+        """Takes one sample and appends it to the ring buffer."""
+        try:
+            values = self._read()
+            self.mocked, self.reason = False, ""
+        except PermissionError:
+            if not self.mocked:
+                logger.warning("Permission denied to access system metrics via psutil. Falling back to mock data.")
+            values = dict.fromkeys(METRIC_FIELDS, 0.0)
+            values.update(MOCK_SYSTEM_METRICS, timestamp=time.time())
+            self.mocked, self.reason = True, "PermissionError accessing system metrics"
+        except Exception as e:
+            if not self.mocked:
+                logger.error(f"Failed to get system metrics via psutil: {e}. Falling back to mock data.", exc_info=True)
+            values = dict.fromkeys(METRIC_FIELDS, 0.0)
+            values.update(MOCK_SYSTEM_METRICS, timestamp=time.time())
+            self.mocked, self.reason = True, f"Unexpected error: {e}"
+
+        with self._lock:
+            for field in METRIC_FIELDS:
+                self._columns[field][self._next] = float(values[field])
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.sample)
+            except Exception as e:
+                logger.error(f"System metrics sampler error: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            psutil.cpu_percent(interval=None) # Prime the CPU counter so the first sample is meaningful
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"System metrics sampler started ({self.interval}s interval, {self.capacity} samples).")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # --- Reading ---
+
+    def _row(self, slot: int) -> Dict[str, Any]:
+        row: Dict[str, Any] = {field: self._columns[field][slot] for field in METRIC_FIELDS}
+        for field in ("memory_total", "memory_available", "disk_read_bytes", "disk_write_bytes", "net_bytes_sent", "net_bytes_recv"):
+            row[field] = int(row[field])
+        row["timestamp"] = datetime.utcfromtimestamp(row["timestamp"]).isoformat()
+        return row
+
+    def latest(self) -> Dict[str, Any]:
+        """
+        The most recent sample, plus `mocked`/`reason` when psutil is unavailable.
+        If the sampler has not run yet, one non-blocking sample is taken.
+        """
+        if not self._count:
+            self.sample()
+        with self._lock:
+            row = self._row((self._next - 1) % self.capacity)
+        if self.mocked:
+            row.update(mocked=True, reason=self.reason)
+        return row
+
+    def history(self, minutes: float) -> List[Dict[str, Any]]:
+        """Samples from the last `minutes` minutes, oldest first."""
+        since = time.time() - minutes * 60
+        with self._lock:
+            start = (self._next - self._count) % self.capacity
+            slots = [(start + offset) % self.capacity for offset in range(self._count)]
+            timestamps = self._columns["timestamp"]
+            return [self._row(slot) for slot in slots if timestamps[slot] >= since]
+
+
+system_metrics_sampler = SystemMetricsSampler()
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from server_python.database import (
+    TerminalSession as DBTerminalSession,
+    TerminalCommandHistory as DBTerminalCommandHistory,
+)
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_HISTORY_BATCH_SIZE = int(os.getenv("TERMINAL_HISTORY_BATCH_SIZE", "20"))
+TERMINAL_HISTORY_FLUSH_INTERVAL_SECONDS = float(os.getenv("TERMINAL_HISTORY_FLUSH_INTERVAL_SECONDS", "2"))
+
+_ESC = "\x1b"
+
+
+class CommandLineAccumulator:
+    """
+    Rebuilds submitted command lines from raw terminal input (usually one
+    keystroke per WebSocket message). Backspace edits the pending line, Ctrl-C
+    and Ctrl-U discard it, Enter submits it. Escape sequences (arrow keys,
+    bracketed paste markers) and other control characters are dropped, so the
+    result is the line as typed, not as edited by the shell's own line editor.
+    """
+
+    def __init__(self):
+        self._line: List[str] = []
+        self._escape = ""
+
+    def feed(self, data: str) -> List[str]:
+        """Consumes input and returns the non-empty lines it completed."""
+        completed: List[str] = []
+        for char in data:
+            if self._escape:
+                self._escape += char
+                if self._escape_finished():
+                    self._escape = ""
+                continue
+            if char == _ESC:
+                self._escape = char
+            elif char in ("\r", "\n"):
+                line = "".join(self._line).strip()
+                self._line = []
+                if line:
+                    completed.append(line)
+            elif char in ("\x7f", "\b"):
+                if self._line:
+                    self._line.pop()
+            elif char in ("\x03", "\x15"):
+                self._line = []
+            elif char >= " ":
+                self._line.append(char)
+        return completed
+
+    def _escape_finished(self) -> bool:
+        seq = self._escape
+        if len(seq) < 2:
+            return False
+        if seq[1] == "[":
+            # CSI: parameters, then a final byte in the range @ to ~
+            return len(seq) > 2 and "@" <= seq[-1] <= "~"
+        if seq[1] == "O":
+            # SS3 (e.g. application-mode arrow keys) carries exactly one more character
+            return len(seq) == 3
+        return True
+
+
+class TerminalHistoryWriter:
+    """
+    Buffers TerminalCommandHistory rows for one terminal session and writes them
+    in bulk, together with the session's last_command, off the event loop.
+    A write happens when `batch_size` commands are pending, `flush_interval`
+    seconds after the first pending command, or on aclose().
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        session_id: str,
+        batch_size: int = TERMINAL_HISTORY_BATCH_SIZE,
+        flush_interval: float = TERMINAL_HISTORY_FLUSH_INTERVAL_SECONDS,
+    ):
+        self.bind = db.get_bind()
+        self.session_id = session_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[Dict[str, Any]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock = asyncio.Lock()
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    def add(self, command: str) -> None:
+        self._pending.append({
+            "id": str(uuid.uuid4()),
+            "session_id": self.session_id,
+            "command": command,
+            "timestamp": datetime.utcnow(),
+            "output": "",
+        })
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+
+    def _schedule_flush(self) -> None:
+        task = asyncio.ensure_future(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            records, self._pending = self._pending, []
+            if not records:
+                return 0
+            try:
+                await asyncio.to_thread(self._write, records)
+            except Exception as e:
+                logger.error(f"Failed to write {len(records)} history entries for terminal session {self.session_id}: {e}", exc_info=True)
+                self._pending = records + self._pending
+                return 0
+            return len(records)
+
+    async def aclose(self) -> None:
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        db = Session(bind=self.bind)
+        try:
+            db.bulk_insert_mappings(DBTerminalCommandHistory, records)
+            db.query(DBTerminalSession).filter(DBTerminalSession.id == self.session_id).update(
+                {DBTerminalSession.last_command: records[-1]["command"]}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
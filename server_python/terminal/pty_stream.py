@@ -0,0 +1,129 @@
+import asyncio
+import codecs
+import errno
+import logging
+import os
+from typing import AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+# Output is gathered for up to TERMINAL_COALESCE_MS before a frame is sent,
+# or sent straight away once TERMINAL_MAX_FRAME_BYTES have been buffered.
+TERMINAL_COALESCE_MS = float(os.getenv("TERMINAL_COALESCE_MS", "8"))
+TERMINAL_MAX_FRAME_BYTES = int(os.getenv("TERMINAL_MAX_FRAME_BYTES", "65536"))
+# Reading from the PTY is paused while this much output is waiting to be sent,
+# so a slow client applies backpressure to the shell instead of growing memory.
+TERMINAL_HIGH_WATER_BYTES = int(os.getenv("TERMINAL_HIGH_WATER_BYTES", str(4 * 65536)))
+TERMINAL_READ_CHUNK_BYTES = 65536
+
+
+class PtyOutputStream:
+    """
+    Reads the master end of a PTY from the event loop (via loop.add_reader)
+    instead of a thread-pool thread, and yields the output as coalesced frames.
+
+    Use `async for frame in stream.frames()` for raw bytes (binary WebSocket
+    frames) or `stream.text_frames()` for UTF-8 text that never splits a
+    multi-byte character across frames. Call close() before the fd is closed.
+    """
+
+    def __init__(
+        self,
+        fd: int,
+        coalesce_ms: float = TERMINAL_COALESCE_MS,
+        max_frame_bytes: int = TERMINAL_MAX_FRAME_BYTES,
+        high_water_bytes: int = TERMINAL_HIGH_WATER_BYTES,
+    ):
+        self.fd = fd
+        self.coalesce_delay = coalesce_ms / 1000
+        self.max_frame_bytes = max_frame_bytes
+        self.high_water_bytes = max(high_water_bytes, max_frame_bytes)
+        self._buffer = bytearray()
+        self._data_ready = asyncio.Event()
+        self._eof = False
+        self._reading = False
+        self._loop = asyncio.get_running_loop()
+        os.set_blocking(fd, False)
+        self._resume_reading()
+
+    def _resume_reading(self) -> None:
+        if not self._reading and not self._eof:
+            self._loop.add_reader(self.fd, self._on_readable)
+            self._reading = True
+
+    def _pause_reading(self) -> None:
+        if self._reading:
+            self._loop.remove_reader(self.fd)
+            self._reading = False
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self.fd, TERMINAL_READ_CHUNK_BYTES)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # Linux reports EIO on the master once the shell side has gone away
+            if e.errno != errno.EIO:
+                logger.warning(f"Error reading PTY fd {self.fd}: {e}")
+            data = b""
+        if not data:
+            self._eof = True
+            self._pause_reading()
+        else:
+            self._buffer += data
+            if len(self._buffer) >= self.high_water_bytes:
+                self._pause_reading()
+        self._data_ready.set()
+
+    async def frames(self) -> AsyncIterator[bytes]:
+        """Yields output frames until the PTY reaches end of file."""
+        try:
+            while True:
+                if not self._buffer and not self._eof:
+                    self._data_ready.clear()
+                    await self._data_ready.wait()
+                if not self._buffer and self._eof:
+                    return
+                # Let a burst of small writes (prompt + echo, build output) land in one frame
+                if self.coalesce_delay and not self._eof and len(self._buffer) < self.max_frame_bytes:
+                    await asyncio.sleep(self.coalesce_delay)
+                frame = bytes(self._buffer[:self.max_frame_bytes])
+                del self._buffer[:self.max_frame_bytes]
+                if len(self._buffer) < self.high_water_bytes:
+                    self._resume_reading()
+                yield frame
+        finally:
+            self.close()
+
+    async def text_frames(self) -> AsyncIterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        async for frame in self.frames():
+            text = decoder.decode(frame)
+            if text:
+                yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def close(self) -> None:
+        """Unregisters the fd from the event loop. Does not close the fd."""
+        self._eof = True
+        if self._reading and not self._loop.is_closed():
+            self._loop.remove_reader(self.fd)
+        self._reading = False
+        self._data_ready.set()
+
+
+async def write_to_pty(fd: int, data: bytes) -> None:
+    """
+    Writes all of `data` to a PTY master that PtyOutputStream has made non-blocking,
+    yielding to the event loop while the terminal's input queue is full.
+    """
+    view = memoryview(data)
+    while view:
+        try:
+            written = os.write(fd, view)
+        except BlockingIOError:
+            await asyncio.sleep(0.01)
+            continue
+        view = view[written:]
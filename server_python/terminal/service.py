@@ -6,6 +6,8 @@ import termios
 import struct
 from typing import Optional
 
+from .pty_stream import write_to_pty
+
 class TerminalService:
     def __init__(self, session_id: str, user_id: str):
         self.session_id = session_id
@@ -25,12 +27,12 @@ class TerminalService:
             cwd=project_root
         )
         
-        # Return a non-blocking reader for the master fd
-        return os.fdopen(self.master_fd, 'rb', 0)
+        # Return the master fd; callers watch it with a PtyOutputStream
+        return self.master_fd
 
-    def write(self, data: str):
+    async def write(self, data: str):
         if self.master_fd:
-            os.write(self.master_fd, data.encode())
+            await write_to_pty(self.master_fd, data.encode())
 
     async def execute_command(self, command: str) -> (str, str):
         """
@@ -0,0 +1,4 @@
+import os
+
+# Keep TestClient startups off the network: no warm-up requests to the seeded LLM providers
+os.environ.setdefault("LLM_HTTP_WARMUP", "false")
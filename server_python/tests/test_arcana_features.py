@@ -35,6 +35,7 @@ from server_python.database import Base, User, LLMProvider, LLMModel, ArcanaAgen
 from server_python.auth import get_password_hash, PermissionChecker, get_current_user
 from server_python.cognisys.crud import encrypt_api_key
 from server_python.arcana import crud
+from server_python.arcana.job_queue import agent_job_queue
 
 # Setup test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_arcana_features.db" # Use a different DB file for arcana tests
@@ -65,6 +66,8 @@ def client_fixture(db_session, mocker: MockerFixture):
     # Mock setup_default_user and populate_initial_llm_data to prevent them from running during tests
     mocker.patch("server_python.database.setup_default_user")
     mocker.patch("server_python.database.populate_initial_llm_data")
+    # Agent job workers open their own sessions, so point them at the test database
+    mocker.patch.object(agent_job_queue, "session_factory", TestingSessionLocal)
 
     with TestClient(app) as client:
         yield client
@@ -525,6 +528,137 @@ def test_execute_agent_task_autonomous_mode(client, auth_headers, db_session, te
     logs = logs_response.json()
     assert any("Reflection summary: Mocked reasoning summary" in log["content"] for log in logs)
     assert "Agent did not call a tool." in final_job_status["final_output"]
+
+### Tests for Arcana API Key Lookup ###
+
+def test_get_api_key_by_key_uses_fingerprint(db_session, test_user):
+    from server_python.schemas import ArcanaApiKeyCreate
+    from server_python.encryption_utils import compute_api_key_fingerprint
+
+    created = crud.create_api_key(db_session, ArcanaApiKeyCreate(name="cli-key"), str(test_user.id))
+    raw_key = created.raw_key
+    assert created.key_fingerprint == compute_api_key_fingerprint(raw_key)
+
+    found = crud.get_api_key_by_key(db_session, raw_key)
+    assert found is not None and found.id == created.id
+    assert crud.get_api_key_by_key(db_session, raw_key + "x") is None
+
+    # Deactivation must not be masked by the verified-key cache
+    crud.deactivate_api_key(db_session, created.id, str(test_user.id))
+    assert crud.get_api_key_by_key(db_session, raw_key) is None
+
+def test_get_api_key_by_key_backfills_legacy_key(db_session, test_user):
+    from server_python.database import ArcanaApiKey
+    from server_python.encryption_utils import compute_api_key_fingerprint
+
+    raw_key = f"arc_{uuid.uuid4()}.abcd"
+    legacy_key = ArcanaApiKey(id=str(uuid.uuid4()), key=encrypt_api_key(raw_key), user_id=str(test_user.id), name="legacy", is_active=True)
+    db_session.add(legacy_key)
+    db_session.commit()
+
+    found = crud.get_api_key_by_key(db_session, raw_key)
+    assert found is not None and found.id == legacy_key.id
+    assert found.key_fingerprint == compute_api_key_fingerprint(raw_key)
+
+### Tests for the Agent Job Queue ###
+
+def test_agent_job_queue_leasing_and_per_user_cap(db_session, test_user):
+    from datetime import timedelta
+    from server_python.arcana.job_queue import AgentJobQueue
+    from server_python.database import ArcanaAgentJob
+
+    agent = ArcanaAgent(id=str(uuid.uuid4()), owner_id=str(test_user.id), name="QueueAgent", persona="worker", mode="tool_user", status="idle")
+    db_session.add(agent)
+    db_session.commit()
+
+    queue = AgentJobQueue(session_factory=TestingSessionLocal, max_jobs_per_user=1, max_attempts=2)
+    jobs = [crud.create_agent_job(db_session, agent_id=agent.id, owner_id=str(test_user.id), goal=f"task {n}") for n in range(2)]
+    for job in jobs:
+        queue.enqueue(db_session, job.id)
+
+    assert queue.claim_next_job(db_session, "worker-a") == jobs[0].id
+    # The owner is at the concurrency cap, so the second job stays queued
+    assert queue.claim_next_job(db_session, "worker-b") is None
+    assert queue.renew_lease(db_session, jobs[0].id, "worker-a")
+    assert not queue.renew_lease(db_session, jobs[0].id, "worker-b")
+
+    # Simulate a crashed worker: the expired lease is re-queued and can be claimed again
+    db_session.query(ArcanaAgentJob).filter(ArcanaAgentJob.id == jobs[0].id).update({ArcanaAgentJob.lease_expires_at: datetime.utcnow() - timedelta(seconds=1)})
+    db_session.commit()
+    assert queue.requeue_expired_leases(db_session) == 1
+    assert queue.claim_next_job(db_session, "worker-b") == jobs[0].id
+
+    # Out of attempts: the job is failed instead of re-queued
+    db_session.query(ArcanaAgentJob).filter(ArcanaAgentJob.id == jobs[0].id).update({ArcanaAgentJob.lease_expires_at: datetime.utcnow() - timedelta(seconds=1)})
+    db_session.commit()
+    queue.requeue_expired_leases(db_session)
+    failed_job = db_session.query(ArcanaAgentJob).filter(ArcanaAgentJob.id == jobs[0].id).first()
+    assert failed_job.status == "failed" and failed_job.queue_state == "done"
+    assert queue.claim_next_job(db_session, "worker-a") == jobs[1].id
+
+def test_agent_job_log_sink_buffers_writes_and_pushes_immediately(db_session, test_user, mocker: MockerFixture):
+    import asyncio
+    from server_python.arcana.job_log_sink import AgentJobLogSink
+    from server_python.database import ArcanaAgentJobLog
+
+    agent = ArcanaAgent(id=str(uuid.uuid4()), owner_id=str(test_user.id), name="LogAgent", persona="logger", mode="tool_user", status="idle")
+    db_session.add(agent)
+    db_session.commit()
+    job = crud.create_agent_job(db_session, agent_id=agent.id, owner_id=str(test_user.id), goal="log things")
+
+    sink = AgentJobLogSink(batch_size=3, flush_interval=60)
+    mocker.patch.object(crud, "agent_job_log_sink", sink)
+    send_mock = mocker.patch("server_python.arcana.job_log_sink.manager.send_to_session", new_callable=mocker.AsyncMock)
+
+    async def run():
+        await crud.add_agent_job_log(db_session, job.id, "thought", "first")
+        await crud.add_agent_job_log(db_session, job.id, "command", "second")
+        # Pushed live but not yet written; readers still see the buffered entries
+        assert send_mock.await_count == 2
+        assert db_session.query(ArcanaAgentJobLog).filter(ArcanaAgentJobLog.job_id == job.id).count() == 0
+        assert [log.content for log in crud.get_agent_job_logs(db_session, job.id)] == ["first", "second"]
+
+        await crud.add_agent_job_log(db_session, job.id, "output", "third") # Reaches batch_size
+        assert db_session.query(ArcanaAgentJobLog).filter(ArcanaAgentJobLog.job_id == job.id).count() == 3
+
+        await crud.add_agent_job_log(db_session, job.id, "info", "fourth")
+        assert await sink.flush(job.id) == 1
+
+    asyncio.run(run())
+    assert [log.content for log in crud.get_agent_job_logs(db_session, job.id)] == ["first", "second", "third", "fourth"]
+
+def test_agent_job_logs_stay_visible_while_a_flush_writes_them(db_session, test_user, mocker: MockerFixture):
+    import asyncio
+    from server_python.arcana.job_log_sink import AgentJobLogSink
+
+    agent = ArcanaAgent(id=str(uuid.uuid4()), owner_id=str(test_user.id), name="FlushAgent", persona="logger", mode="tool_user", status="idle")
+    db_session.add(agent)
+    db_session.commit()
+    job = crud.create_agent_job(db_session, agent_id=agent.id, owner_id=str(test_user.id), goal="log things")
+
+    sink = AgentJobLogSink(batch_size=10, flush_interval=60)
+    mocker.patch.object(crud, "agent_job_log_sink", sink)
+    mocker.patch("server_python.arcana.job_log_sink.manager.send_to_session", new_callable=mocker.AsyncMock)
+    seen_during_write = []
+    write = AgentJobLogSink._write
+
+    def observed_write(bind, records):
+        seen_during_write.append([log.content for log in crud.get_agent_job_logs(db_session, job.id)])
+        write(bind, records)
+        # Committed but not yet dropped from the pending records: listed once
+        seen_during_write.append([log.content for log in crud.get_agent_job_logs(db_session, job.id)])
+
+    mocker.patch.object(sink, "_write", side_effect=observed_write)
+
+    async def run():
+        await crud.add_agent_job_log(db_session, job.id, "thought", "first")
+        await crud.add_agent_job_log(db_session, job.id, "output", "second")
+        await sink.flush(job.id)
+
+    asyncio.run(run())
+    assert seen_during_write == [["first", "second"], ["first", "second"]]
+    assert sink.pending(job.id) == []
+
 # Cleanup the test database and dataset/file_ops directories after tests run
 def teardown_module(module):
     import os
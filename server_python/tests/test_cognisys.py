@@ -5,6 +5,8 @@ from sqlalchemy.orm import sessionmaker
 import sys
 import os
 import uuid # Added this line
+import json
+from datetime import datetime
 from pytest_mock import MockerFixture
 from typing import List # Added this line
 import shutil # For cleaning up test directories
@@ -21,7 +23,7 @@ os.makedirs(TEST_DATASET_STORAGE_DIR, exist_ok=True)
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
 from server_python.main import app, get_db
-from server_python.database import Base, User, LLMProvider, LLMModel, RoutingRule, Permission, Role
+from server_python.database import Base, User, LLMProvider, LLMModel, RoutingRule, Permission, Role, Agent, UserDashboardStats
 from server_python.auth import get_password_hash, PermissionChecker, get_current_user
 from server_python.cognisys.crud import encrypt_api_key
 
@@ -262,6 +264,25 @@ def test_test_llm_provider_connection(client, auth_headers, db_session, mocker:
     assert response.status_code == 200
     assert "success" in response.json()["status"]
 
+def test_provider_client_registry_reuses_and_rebuilds_clients():
+    import asyncio
+    from server_python.llm_client_registry import ProviderClientRegistry
+
+    async def run():
+        registry = ProviderClientRegistry()
+        first = registry.get_client("provider_pool", "http://pool.com", "key1")
+        assert registry.get_client("provider_pool", "http://pool.com", "key1") is first
+
+        # A changed key (or base_url) must produce a fresh client
+        rotated = registry.get_client("provider_pool", "http://pool.com", "key2")
+        assert rotated is not first
+
+        registry.invalidate("provider_pool")
+        assert registry.get_client("provider_pool", "http://pool.com", "key2") is not rotated
+        await registry.aclose()
+
+    asyncio.run(run())
+
 ### Tests for LLM Model Management ###
 
 def test_create_llm_model(client, admin_auth_headers, db_session, override_admin_permission_checker, override_get_current_admin_user):
@@ -504,8 +525,275 @@ def test_delete_routing_rule(client, auth_headers, db_session, test_user):
     get_response = client.get(f"/api/cognisys/routing-rules/{rule.id}", headers=auth_headers)
     assert get_response.status_code == 404
 
+def test_routing_rules_are_compiled_once_and_invalidated_on_change(client, auth_headers, db_session, test_user, mocker: MockerFixture):
+    from server_python.cognisys import routing_engine
+    from server_python.cognisys.llm_interaction import evaluate_routing_rules
+
+    provider = LLMProvider(
+        id="provider_for_rule_engine", name="RuleEngineProvider", base_url="http://ruleengine.com",
+        api_key_encrypted=encrypt_api_key("ruleenginekey"), enabled=True, organization_id=None
+    )
+    db_session.add(provider)
+    db_session.add_all([
+        LLMModel(id=f"model_{name}", provider_id=provider.id, model_name=name, type="chat", is_active=True,
+                 reasoning=False, role="general", max_tokens=1000, cost_per_token=0.001)
+        for name in ("coder", "chatter")
+    ])
+    db_session.commit()
+    routing_engine.routing_rule_cache.invalidate()
+
+    def create_rule(name, condition, target_model, priority):
+        response = client.post("/api/cognisys/routing-rules/", headers=auth_headers, json={
+            "name": name, "condition": json.dumps(condition), "target_model": target_model, "priority": priority,
+        })
+        assert response.status_code == 201
+        return response.json()["id"]
+
+    code_rule = create_rule("Code", {"all": [
+        {"fact": "intent", "operator": "equals", "value": "CODE_GENERATION"},
+        {"any": [{"fact": "prompt", "operator": "contains", "value": "Python"}, {"fact": "prompt", "operator": "startsWith", "value": "write"}]},
+    ]}, "coder", 10)
+    create_rule("Missing model", {"fact": "intent", "operator": "equals", "value": "conversation"}, "no-such-model", 5)
+    create_rule("Fallback", {"fact": "prompt", "operator": "endsWith", "value": "?"}, "chatter", 1)
+
+    compile_rules = mocker.spy(routing_engine, "compile_rules")
+    assert evaluate_routing_rules(db_session, test_user, "code_generation", "Sort a list in PYTHON").model_name == "coder"
+    assert evaluate_routing_rules(db_session, test_user, "conversation", "How are you?").model_name == "chatter"
+    assert evaluate_routing_rules(db_session, test_user, "conversation", "Hello") is None
+    assert compile_rules.call_count == 1 # Compiled on first use, then served from memory
+
+    _, outcomes = routing_engine.routing_rule_cache.get(db_session, test_user.id).evaluate("conversation", "How are you?")
+    assert [(outcome.rule.name, outcome.matched, outcome.selected) for outcome in outcomes] == [
+        ("Code", False, False), ("Missing model", True, False), ("Fallback", True, True),
+    ]
+
+    response = client.put(f"/api/cognisys/routing-rules/{code_rule}", headers=auth_headers, json={"target_model": "chatter"})
+    assert response.status_code == 200
+    assert evaluate_routing_rules(db_session, test_user, "code_generation", "python").model_name == "chatter"
+    assert compile_rules.call_count == 2
+
+    assert client.delete(f"/api/cognisys/routing-rules/{code_rule}", headers=auth_headers).status_code == 204
+    assert evaluate_routing_rules(db_session, test_user, "code_generation", "python") is None
+    assert compile_rules.call_count == 3
+
+def test_intent_detection_runs_only_when_a_rule_needs_it(db_session, test_user):
+    from server_python.cognisys.routing_engine import compile_rules
+
+    db_session.add(LLMModel(id="model_intent_dep", provider_id="p", model_name="dep-model", type="chat", is_active=True,
+                            reasoning=False, role="general", max_tokens=1000, cost_per_token=0.001))
+    db_session.add_all([
+        RoutingRule(id="dep1", owner_id=test_user.id, name="Prompt", condition=json.dumps({"fact": "prompt", "operator": "contains", "value": "urgent"}), target_model="dep-model", priority=10),
+        RoutingRule(id="dep2", owner_id=test_user.id, name="Unresolved", condition=json.dumps({"fact": "intent", "operator": "equals", "value": "x"}), target_model="missing", priority=9),
+        RoutingRule(id="dep3", owner_id=test_user.id, name="Intent", condition=json.dumps({"any": [{"fact": "intent", "operator": "equals", "value": "code_generation"}]}), target_model="dep-model", priority=5),
+    ])
+    db_session.commit()
+
+    rule_set = compile_rules(db_session, test_user.id)
+    assert rule_set.rules[2].facts == {"intent"}
+    assert not rule_set.needs_intent("URGENT: server down") # Decided by the prompt rule first
+    assert rule_set.needs_intent("write a sort function")
+    db_session.delete(db_session.get(RoutingRule, "dep3"))
+    db_session.commit()
+    assert not compile_rules(db_session, test_user.id).needs_intent("write a sort function")
+
+def test_local_intent_classifier_and_cache(mocker: MockerFixture):
+    import asyncio
+    import time
+    from server_python.cognisys import llm_interaction
+    from server_python.cognisys.intent_classifier import classify_intent_locally, intent_cache
+    from server_python.cognisys.schemas import IntentDetectionResponse
+
+    assert classify_intent_locally("Run the command ls -la in the terminal").intent == "shell_command"
+    assert classify_intent_locally("Hello! How are you?").intent == "conversation"
+    assert classify_intent_locally("git status").confidence >= 0.8
+    assert classify_intent_locally("asdf qwerty").intent == "unknown"
+    ambiguous = classify_intent_locally("Write a Python function that deletes old log files")
+    assert ambiguous.confidence < 0.8 # Code and file cues compete
+
+    # Long prompts of cue verbs without their objects used to backtrack quadratically
+    started = time.monotonic()
+    for prompt in ("run " * 16_000, "write a " * 8_000, "create " * 16_000 + "agents"):
+        classify_intent_locally(prompt)
+    assert time.monotonic() - started < 1.0
+
+    intent_cache.clear()
+    detect = mocker.patch.object(llm_interaction, "detect_intent", new_callable=mocker.AsyncMock,
+                                 return_value=IntentDetectionResponse(intent="code_generation", confidence=0.9))
+    resolve = lambda prompt: asyncio.run(llm_interaction.resolve_intent(None, None, prompt))
+    assert resolve("Hello there").intent == "conversation"
+    assert resolve("Write a Python function that deletes old log files").intent == "code_generation"
+    assert resolve("  write a python function that DELETES old log files ").intent == "code_generation" # Cached
+    assert detect.await_count == 1
+
+    detect.return_value = IntentDetectionResponse(intent="unknown", confidence=0.1, reasoning="Error: timeout")
+    resolve("Summarise this for me")
+    resolve("Summarise this for me")
+    assert detect.await_count == 3 # Failed detections are not cached
+    intent_cache.clear()
+
+def test_tool_executor_runs_independent_calls_concurrently_in_order():
+    import asyncio
+    import time
+    from server_python.cognisys.tool_executor import ToolExecutor
+
+    def call(call_id, name, **arguments):
+        return {"id": call_id, "function": {"name": name, "arguments": json.dumps(arguments)}}
+
+    events = []
+
+    async def dispatch(name, arguments):
+        events.append(("start", name, arguments.get("local_path")))
+        await asyncio.sleep(arguments.get("delay", 0.1))
+        events.append(("end", name, arguments.get("local_path")))
+        return f"{name} done"
+
+    tool_calls = [
+        call("c1", "git_get_status", local_path="/repos/a"),
+        call("c2", "git_get_status", local_path="/repos/b"),
+        call("c3", "git_add_files", local_path="/repos/a", files=["x"]),
+        call("c4", "git_commit_changes", local_path="/repos/a", message="m", delay=0.05),
+        call("c5", "generate_code", prompt="p", language="python"),
+        {"id": "c6", "function": {"name": "git_add_files", "arguments": "{not json"}},
+        call("c7", "git_checkout_branch", local_path="/repos/a", branch_name="dev", delay=5),
+    ]
+    started = time.monotonic()
+    results = asyncio.run(ToolExecutor(timeout=0.5).run(tool_calls, dispatch))
+    elapsed = time.monotonic() - started
+
+    assert [result.tool_call_id for result in results] == ["c1", "c2", "c3", "c4", "c5", "c6", "c7"]
+    assert [result.message()["role"] for result in results] == ["tool"] * 7
+    assert results[0].content == "git_get_status done" and results[3].content == "git_commit_changes done"
+    assert results[5].content.startswith("Error executing tool 'git_add_files'")
+    assert results[6].timed_out and "timed out" in results[6].content
+    # Reads and the unrelated repository overlap; mutations on /repos/a run one after another
+    assert elapsed < 0.2 + 0.05 + 0.5 + 0.3
+    repo_a = [event for event in events if event[2] == "/repos/a"]
+    assert repo_a[:6] == [
+        ("start", "git_get_status", "/repos/a"), ("end", "git_get_status", "/repos/a"),
+        ("start", "git_add_files", "/repos/a"), ("end", "git_add_files", "/repos/a"),
+        ("start", "git_commit_changes", "/repos/a"), ("end", "git_commit_changes", "/repos/a"),
+    ]
+    assert events.index(("start", "git_get_status", "/repos/b")) < events.index(("end", "git_get_status", "/repos/a"))
+
+def test_tool_executor_overlaps_and_times_out_blocking_file_operations(mocker: MockerFixture, tmp_path):
+    import asyncio
+    import time
+    from types import SimpleNamespace
+    from server_python.arcana import file_management_service
+    from server_python.arcana.schemas import FileOperationRequest
+    from server_python.cognisys.tool_executor import ToolExecutor
+
+    def slow_user_file_path(user_id, relative_path):
+        time.sleep(0.3) # Blocking, like a slow disk
+        return str(tmp_path)
+
+    mocker.patch.object(file_management_service, "get_user_file_path", side_effect=slow_user_file_path)
+    user = SimpleNamespace(id="user-1")
+
+    async def dispatch(name, arguments):
+        response = await file_management_service.perform_file_operation(user, FileOperationRequest(**arguments))
+        return response.message
+
+    tool_calls = [
+        {"id": f"c{n}", "function": {"name": "perform_file_operation", "arguments": json.dumps({"action": "list", "path": f"dir{n}"})}}
+        for n in range(4)
+    ]
+    started = time.monotonic()
+    results = asyncio.run(ToolExecutor(timeout=5).run(tool_calls, dispatch))
+    assert all("listed successfully" in result.content for result in results)
+    assert time.monotonic() - started < 0.9 # Four 0.3 s reads overlap instead of taking 1.2 s
+
+    results = asyncio.run(ToolExecutor(timeout=0.1).run(tool_calls[:1], dispatch))
+    assert results[0].timed_out and results[0].elapsed < 0.25
+
 ### Tests for Chat Endpoint (Cognisys) ###
 
+def test_read_routing_rules_cursor_pagination(client, auth_headers, db_session, test_user):
+    created_at = datetime(2024, 1, 1)
+    for n in range(5):
+        # Shared timestamps make the id tie-breaker part of the cursor
+        db_session.add(RoutingRule(id=f"rule-{n}", owner_id=test_user.id, name=f"Rule{n}", condition="true", target_model="m", priority=n, created_at=created_at if n < 3 else datetime(2024, 1, 2)))
+    db_session.commit()
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/cognisys/routing-rules/", headers=auth_headers, params=params)
+        assert response.status_code == 200
+        seen += [rule["id"] for rule in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == [f"rule-{n}" for n in range(5)]
+
+    # skip/limit keeps working for existing clients
+    response = client.get("/api/cognisys/routing-rules/", headers=auth_headers, params={"skip": 3, "limit": 2})
+    assert [rule["id"] for rule in response.json()] == ["rule-3", "rule-4"]
+
+    response = client.get("/api/cognisys/routing-rules/", headers=auth_headers, params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_system_status_counters_are_incremental_and_per_user(client, auth_headers, db_session, test_user):
+    other_user = User(id="otheruser456", username="otheruser", email="other@example.com", hashed_password=get_password_hash("x"), is_verified=True)
+    db_session.add(other_user)
+    db_session.add(Agent(owner_id=other_user.id, name="OtherAgent", type="worker", status="online"))
+    db_session.commit()
+
+    def status():
+        response = client.get("/api/system/status", headers=auth_headers)
+        assert response.status_code == 200
+        return response.json()
+
+    assert status()["myntrix"]["activeAgents"] == 0 # Other users' rows are not counted
+    assert db_session.get(UserDashboardStats, test_user.id) is not None
+
+    rule = client.post("/api/cognisys/routing-rules/", headers=auth_headers, json={
+        "name": "CounterRule", "condition": "intent == 'general_query'", "target_model": "any", "priority": 1
+    })
+    assert rule.status_code == 201
+    agent = Agent(id=str(uuid.uuid4()), owner_id=test_user.id, name="MyAgent", type="worker", status="offline")
+    db_session.add(agent)
+    db_session.commit()
+    agent_id = agent.id
+    assert status()["cognisys"]["routingRules"] == 1
+    assert status()["myntrix"]["activeAgents"] == 0
+
+    # The client fixture closes the session after each request, so reload the row
+    db_session.get(Agent, agent_id).status = "online"
+    db_session.commit()
+    assert status()["myntrix"]["activeAgents"] == 1
+
+    db_session.delete(db_session.get(Agent, agent_id))
+    db_session.commit()
+    assert status()["myntrix"]["activeAgents"] == 0
+    stats = db_session.get(UserDashboardStats, "otheruser456")
+    assert stats is None or stats.agents_online == 1
+
+def test_dashboard_counters_seed_idempotently_and_bulk_changes_invalidate_only_touched_users(db_session, test_user):
+    from server_python import dashboard_stats
+    other_user = User(id="otheruser789", username="otheruser789", email="other789@example.com", hashed_password="x", is_verified=True)
+    db_session.add_all([other_user, Agent(owner_id=test_user.id, name="A1", type="worker", status="online")])
+    db_session.commit()
+
+    # A change for a user without a counters row seeds it from a full count
+    db_session.add(Agent(owner_id=test_user.id, name="A2", type="worker", status="offline"))
+    db_session.commit()
+    stats = db_session.get(UserDashboardStats, test_user.id)
+    assert (stats.agents_total, stats.agents_online) == (2, 1)
+
+    # A concurrent seed of an existing row is a no-op instead of an IntegrityError
+    dashboard_stats.seed_user_stats(db_session.connection(), test_user.id)
+    db_session.commit()
+    assert dashboard_stats.get_user_stats(db_session, other_user.id).agents_total == 0
+    assert dashboard_stats.get_user_stats(db_session, test_user.id).agents_total == 2
+
+    db_session.query(Agent).filter(Agent.owner_id == test_user.id, Agent.status == "offline").delete(synchronize_session=False)
+    db_session.commit()
+    db_session.expire_all()
+    assert db_session.get(UserDashboardStats, test_user.id) is None # Re-seeded on next read
+    assert db_session.get(UserDashboardStats, other_user.id) is not None
+    assert dashboard_stats.get_user_stats(db_session, test_user.id).agents_total == 1
+
 def test_chat_with_cognisys_general_query(client, auth_headers, db_session, test_user, mocker: MockerFixture):
     # Mock the call_llm_api function (this is still needed if process_chat_request calls it)
     mocker.patch(
@@ -597,4 +885,481 @@ def test_detect_intent_endpoint(client, auth_headers, db_session, test_user, moc
     assert response.status_code == 200
     assert response.json()["intent"] == "shell_command"
     assert response.json()["confidence"] == 0.9
-    assert "reasoning" in response.json()
\ No newline at end of file
+    assert "reasoning" in response.json()
+
+def test_chat_stream_endpoint_emits_deltas_and_persists_reply(client, auth_headers, db_session, test_user, mocker: MockerFixture):
+    from server_python.database import ChatMessage as DBChatMessage
+
+    async def mock_stream(*args, **kwargs):
+        for delta in ["Hel", "lo", " there"]:
+            yield delta
+
+    mocker.patch("server_python.llm_service.stream_openrouter_completion", side_effect=mock_stream)
+
+    response = client.post("/api/chat/stream", headers=auth_headers, json={"message": "Hi"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = [block for block in response.text.split("\n\n") if block]
+    deltas = [json.loads(e.split("data: ", 1)[1])["delta"] for e in events if e.startswith("event: delta")]
+    assert deltas == ["Hel", "lo", " there"]
+    done = json.loads(events[-1].split("data: ", 1)[1])
+    assert events[-1].startswith("event: done")
+    assert done["response"] == "Hello there"
+
+    saved = db_session.query(DBChatMessage).filter(DBChatMessage.id == done["message_id"]).first()
+    assert saved is not None and saved.message_content == "Hello there"
+
+def test_chat_history_is_windowed_and_summarized_incrementally(db_session, test_user, mocker: MockerFixture):
+    import asyncio
+    from datetime import timedelta
+    from server_python import chat_context
+    from server_python.database import ChatMessage as DBChatMessage, Conversation as DBConversation, ConversationSummary
+
+    db_session.add(LLMModel(id="windowed_model", provider_id="p", model_name="windowed-model", max_tokens=2000))
+    conversation = DBConversation(user_id=test_user.id, title="Long chat")
+    db_session.add(conversation)
+    db_session.commit()
+    start = datetime(2024, 1, 1)
+
+    def add_messages(first, count):
+        for n in range(first, first + count):
+            db_session.add(DBChatMessage(conversation_id=conversation.id, user_id=test_user.id, sender="user" if n % 2 == 0 else "llm",
+                                         message_content=f"message {n} " + "x" * 400, timestamp=start + timedelta(minutes=n)))
+        db_session.commit()
+
+    summarize = mocker.AsyncMock(side_effect=lambda previous, messages, max_tokens: f"{previous or ''}+{len(messages)}")
+    assemble = lambda **kwargs: asyncio.run(chat_context.assemble_history(db_session, test_user.id, conversation.id, model_name="windowed-model", summarize=summarize, **kwargs))
+
+    add_messages(0, 60)
+    history = assemble()
+    assert summarize.await_count == 1
+    assert history[0]["role"] == "system" and history[0]["content"].endswith("+56")
+    assert history[1]["content"].startswith("message 56 ") and history[-1]["content"].startswith("message 59 ")
+    assert {message["role"] for message in history[1:]} == {"user", "assistant"}
+    # Summary and recent messages stay within the model's budget (half of max_tokens)
+    assert sum(chat_context.message_tokens(message) for message in history) <= 1000
+
+    # The next turns reuse the stored summary until the window fills up again
+    add_messages(60, 2)
+    assert len(assemble()) == 1 + 6 and summarize.await_count == 1
+    add_messages(62, 4)
+    history = assemble()
+    assert summarize.await_count == 2 and history[0]["content"].endswith("+56+6")
+    assert db_session.get(ConversationSummary, conversation.id).covered_messages == 62
+
+    # The message being answered is not repeated in the history
+    latest = db_session.query(DBChatMessage).filter(DBChatMessage.message_content.like("message 65 %")).one()
+    assert not any(message["content"] == latest.message_content for message in assemble(exclude_message_id=latest.id))
+
+    # Without a working summarizer the folded messages are kept in a truncated form
+    summarize.side_effect = RuntimeError("provider down")
+    add_messages(66, 10)
+    history = assemble()
+    last_folded = int(history[1]["content"].split()[1]) - 1
+    assert f": message {last_folded} " in history[0]["content"]
+    assert chat_context.estimate_tokens(history[0]["content"]) <= 250 + 10
+
+def test_concurrent_summary_folds_keep_the_furthest_summary(db_session, test_user):
+    import asyncio
+    from types import SimpleNamespace
+    from server_python import chat_context
+    from server_python.database import Conversation as DBConversation, ConversationSummary
+
+    conversation = DBConversation(user_id=test_user.id, title="Busy chat")
+    db_session.add(conversation)
+    db_session.commit()
+    messages = [SimpleNamespace(id=f"m{n}", timestamp=datetime(2024, 1, 1, 0, n)) for n in range(6)]
+    chat = lambda count: [{"role": "user", "content": f"message {n}"} for n in range(count)]
+
+    async def fold(summary, count, content):
+        return await chat_context.fold_into_summary(db_session, conversation.id, summary, messages[:count], chat(count), 100,
+                                                    summarize=lambda previous, folded, max_tokens: asyncio.sleep(0, content))
+
+    # Two turns that both saw no summary: the second insert used to fail on the primary key
+    assert asyncio.run(fold(None, 4, "first four")).content == "first four"
+    kept = asyncio.run(fold(None, 2, "first two"))
+    assert (kept.content, kept.covered_message_id, kept.covered_messages) == ("first four", "m3", 4)
+    advanced = asyncio.run(fold(None, 6, "all six"))
+    assert (advanced.content, advanced.covered_message_id, advanced.covered_messages) == ("all six", "m5", 6)
+    assert db_session.query(ConversationSummary).filter(ConversationSummary.conversation_id == conversation.id).count() == 1
+
+def test_identical_concurrent_llm_calls_share_one_request(mocker: MockerFixture):
+    import asyncio
+    import httpx
+    from server_python.cognisys import llm_interaction
+    from server_python.llm_response_cache import LLMResponseCache
+    from server_python.single_flight import SingleFlight
+
+    upstream_calls = []
+
+    async def respond(request):
+        prompt = json.loads(request.content)["messages"][0]["content"]
+        upstream_calls.append(prompt)
+        await asyncio.sleep(0.1)
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": f"reply to {prompt}"}}]})
+
+    provider = LLMProvider(id="flight_provider", name="FlightProvider", base_url="https://openrouter.ai/api/v1", api_key_encrypted="", enabled=True)
+    flights = SingleFlight()
+    mocker.patch.object(llm_interaction, "llm_request_flights", flights)
+    mocker.patch.object(llm_interaction, "llm_response_cache", LLMResponseCache(enabled=False))
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(respond)) as mock_client:
+            mocker.patch.object(llm_interaction.provider_clients, "get_client", return_value=mock_client)
+            call = lambda prompt: llm_interaction.call_llm_api(provider, "flight-model", "key", [{"role": "user", "content": prompt}])
+            waiters = [asyncio.ensure_future(call("classify this")) for _ in range(5)]
+            other = asyncio.ensure_future(call("something else"))
+            await asyncio.sleep(0.02)
+            waiters[0].cancel() # One caller giving up does not cancel the shared request
+            results = await asyncio.gather(*waiters[1:], other)
+            return waiters[0], results
+
+    cancelled, results = asyncio.run(run())
+    assert cancelled.cancelled()
+    assert sorted(upstream_calls) == ["classify this", "something else"]
+    shared = results[:4]
+    assert all(result == shared[0] for result in shared) and results[4] != shared[0]
+    assert shared[0] is not shared[1] # Every caller gets its own copy
+    assert flights.stats() == {"calls": 2, "coalesced": 4, "in_flight": 0}
+
+def test_llm_admission_prefers_interactive_lane_and_backs_off_on_429(mocker: MockerFixture):
+    import asyncio
+    import httpx
+    from fastapi import HTTPException
+    from server_python import llm_resilience
+    from server_python.cognisys import llm_interaction
+    from server_python.llm_admission import BACKGROUND, INTERACTIVE, ProviderAdmissionController, llm_request_lane
+    from server_python.llm_response_cache import LLMResponseCache
+
+    admission = ProviderAdmissionController(initial_limit=2, background_share=0.5, latency_target=0, max_wait=0.2)
+    started = []
+
+    async def request(name, lane, gate):
+        with llm_request_lane(lane):
+            async with admission.slot("p"):
+                started.append(name)
+                await gate.wait()
+
+    async def run_lanes():
+        gate = asyncio.Event()
+        tasks = []
+        for name, lane in [("bg1", BACKGROUND), ("bg2", BACKGROUND), ("i1", INTERACTIVE), ("i2", INTERACTIVE)]:
+            tasks.append(asyncio.ensure_future(request(name, lane, gate)))
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        queued = admission.stats()["p"]
+        gate.set()
+        await asyncio.gather(*tasks)
+        return queued
+
+    queued = asyncio.run(run_lanes())
+    # Background may only take half the slots, and queued interactive requests go first
+    assert started == ["bg1", "i1", "i2", "bg2"]
+    assert queued["in_flight"] == 2
+    assert queued["lanes"]["interactive"]["queued"] == 1 and queued["lanes"]["background"]["queued"] == 1
+    stats = admission.stats()["p"]
+    assert stats["lanes"]["background"]["admitted"] == 2 and stats["lanes"]["background"]["max_wait_seconds"] > 0
+    assert stats["limit"] > 2 # Additive increase on success
+
+    async def run_rejected():
+        gate = asyncio.Event()
+        holders = [asyncio.ensure_future(request(f"h{i}", INTERACTIVE, gate)) for i in range(int(admission.stats()["p"]["limit"]))]
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as rejected:
+            async with admission.slot("p"):
+                pass
+        gate.set()
+        await asyncio.gather(*holders)
+        return rejected.value
+
+    assert asyncio.run(run_rejected()).status_code == 503
+    assert admission.stats()["p"]["rejected"] == 1
+
+    provider = LLMProvider(id="busy_provider", name="BusyProvider", base_url="https://openrouter.ai/api/v1", api_key_encrypted="", enabled=True)
+    admission = ProviderAdmissionController(initial_limit=8)
+    mocker.patch.object(llm_interaction, "provider_admission", admission)
+    mocker.patch.object(llm_resilience, "provider_breakers", llm_resilience.CircuitBreakers())
+    mocker.patch.object(llm_resilience, "LLM_RETRY_BASE_DELAY_SECONDS", 0.001)
+    mocker.patch.object(llm_interaction, "llm_response_cache", LLMResponseCache(enabled=False))
+
+    async def run_overloaded():
+        transport = httpx.MockTransport(lambda request: httpx.Response(429, json={"error": "rate limited"}))
+        async with httpx.AsyncClient(transport=transport) as mock_client:
+            mocker.patch.object(llm_interaction.provider_clients, "get_client", return_value=mock_client)
+            with pytest.raises(HTTPException) as error:
+                await llm_interaction.call_llm_api(provider, "busy-model", "key", [{"role": "user", "content": "hi"}])
+            return error.value
+
+    assert asyncio.run(run_overloaded()).status_code == 429
+    stats = admission.stats()["busy_provider"]
+    # Every retried 429 halves the limit
+    assert stats["limit"] == 8 / 2 ** llm_resilience.LLM_RETRY_MAX_ATTEMPTS
+    assert stats["overloads"] == llm_resilience.LLM_RETRY_MAX_ATTEMPTS and stats["in_flight"] == 0
+
+def test_llm_calls_retry_then_fail_over_when_the_circuit_opens(db_session, mocker: MockerFixture):
+    import asyncio
+    import httpx
+    from server_python import llm_resilience
+    from server_python.cognisys import llm_interaction
+    from server_python.llm_admission import ProviderAdmissionController
+    from server_python.llm_response_cache import LLMResponseCache
+
+    breakers = llm_resilience.CircuitBreakers(failure_threshold=2, reset_seconds=60)
+    mocker.patch.object(llm_resilience, "provider_breakers", breakers)
+    mocker.patch.object(llm_interaction, "provider_breakers", breakers)
+    mocker.patch.object(llm_resilience, "LLM_RETRY_BASE_DELAY_SECONDS", 0.001)
+    mocker.patch.object(llm_interaction, "provider_admission", ProviderAdmissionController())
+    mocker.patch.object(llm_interaction, "llm_response_cache", LLMResponseCache(enabled=False))
+
+    primary = LLMProvider(id="primary_provider", name="Primary", base_url="https://primary.openrouter.ai/api/v1", api_key_encrypted=encrypt_api_key("k1"), enabled=True)
+    backup = LLMProvider(id="backup_provider", name="Backup", base_url="https://backup.openrouter.ai/api/v1", api_key_encrypted=encrypt_api_key("k2"), enabled=True)
+    db_session.add_all([primary, backup,
+                        LLMModel(id="primary_model", provider_id="primary_provider", model_name="primary-model", type="chat", role="coder", is_active=True),
+                        LLMModel(id="backup_model", provider_id="backup_provider", model_name="backup-model", type="chat", role="coder", is_active=True),
+                        LLMModel(id="other_role_model", provider_id="backup_provider", model_name="other-model", type="chat", role="reviewer", is_active=True)])
+    db_session.commit()
+
+    statuses = {"primary.openrouter.ai": [502], "backup.openrouter.ai": []}
+    requests_seen = []
+
+    def respond(request):
+        host = request.url.host
+        requests_seen.append((host, json.loads(request.content)["model"]))
+        if statuses[host]:
+            return httpx.Response(statuses[host].pop(0), json={"error": "unavailable"})
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": f"answer from {host}"}}]})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(respond)) as mock_client:
+            mocker.patch.object(llm_interaction.provider_clients, "get_client", return_value=mock_client)
+            call = lambda prompt: llm_interaction.call_llm_api(primary, "primary-model", "k1", [{"role": "user", "content": prompt}], db=db_session)
+            retried = await call("first") # One 502, then served by the retry
+            statuses["primary.openrouter.ai"] = [503] * 5
+            failed_over = await call("second") # Two failures open the circuit
+            seen_before = len(requests_seen)
+            while_open = await call("third") # Goes straight to the backup
+            return retried, failed_over, while_open, requests_seen[seen_before:]
+
+    retried, failed_over, while_open, while_open_requests = asyncio.run(run())
+    assert retried["message"]["content"] == "answer from primary.openrouter.ai"
+    assert failed_over["message"]["content"] == "answer from backup.openrouter.ai" and failed_over["model_used"] == "backup-model"
+    assert requests_seen[:5] == [("primary.openrouter.ai", "primary-model")] * 4 + [("backup.openrouter.ai", "backup-model")]
+    assert while_open["message"]["content"] == "answer from backup.openrouter.ai"
+    assert while_open_requests == [("backup.openrouter.ai", "backup-model")]
+    assert breakers.stats()["primary_provider"] == {"state": "open", "consecutive_failures": 2, "times_opened": 1}
+
+    async def run_hedged():
+        tracker = llm_resilience.LatencyTracker(min_samples=1, enabled=True)
+        delays = [0.5, 0.0]
+
+        async def slow_then_fast():
+            delay = delays.pop(0)
+            await asyncio.sleep(delay)
+            return delay
+
+        return await llm_resilience.hedged(slow_then_fast, 0.01, tracker), tracker
+
+    result, tracker = asyncio.run(run_hedged())
+    assert result == 0.0 and tracker.hedged == 1 and tracker.hedge_wins == 1
+
+
+def test_llm_calls_only_fail_over_on_provider_errors_and_stop_at_the_deadline(db_session, mocker: MockerFixture):
+    import asyncio
+    import time
+    import httpx
+    from fastapi import HTTPException
+    from server_python import llm_resilience
+    from server_python.cognisys import llm_interaction
+    from server_python.llm_admission import ProviderAdmissionController
+    from server_python.llm_response_cache import LLMResponseCache
+
+    breakers = llm_resilience.CircuitBreakers(failure_threshold=10, reset_seconds=60)
+    mocker.patch.object(llm_resilience, "provider_breakers", breakers)
+    mocker.patch.object(llm_interaction, "provider_breakers", breakers)
+    mocker.patch.object(llm_interaction, "provider_admission", ProviderAdmissionController())
+    mocker.patch.object(llm_interaction, "llm_response_cache", LLMResponseCache(enabled=False))
+
+    local = LLMProvider(id="local_provider", name="Local", base_url="https://llm.internal/v1", api_key_encrypted=encrypt_api_key("k0"), enabled=True)
+    slow = LLMProvider(id="slow_provider", name="Slow", base_url="https://slow.openrouter.ai/api/v1", api_key_encrypted=encrypt_api_key("k1"), enabled=True)
+    backup = LLMProvider(id="deadline_backup", name="Backup", base_url="https://backup.openrouter.ai/api/v1", api_key_encrypted=encrypt_api_key("k2"), enabled=True)
+    db_session.add_all([local, slow, backup,
+                        LLMModel(id="local_model", provider_id="local_provider", model_name="local-model", type="chat", role="planner", is_active=True),
+                        LLMModel(id="slow_model", provider_id="slow_provider", model_name="slow-model", type="chat", role="planner", is_active=True),
+                        LLMModel(id="deadline_backup_model", provider_id="deadline_backup", model_name="backup-model", type="chat", role="planner", is_active=True)])
+    db_session.commit()
+    requests_seen = []
+
+    async def respond(request):
+        requests_seen.append(request.url.host)
+        if request.url.host == "slow.openrouter.ai":
+            await asyncio.sleep(5)
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": "ok"}}]})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(respond)) as mock_client:
+            mocker.patch.object(llm_interaction.provider_clients, "get_client", return_value=mock_client)
+            messages = [{"role": "user", "content": "plan"}]
+            with pytest.raises(HTTPException) as unsupported:
+                await llm_interaction.call_llm_api(local, "local-model", "k0", messages, db=db_session)
+            started = time.monotonic()
+            with pytest.raises(HTTPException) as timed_out:
+                await llm_interaction.call_llm_api(slow, "slow-model", "k1", messages, db=db_session, deadline=started + 0.2)
+            return unsupported.value, timed_out.value, time.monotonic() - started
+
+    unsupported, timed_out, elapsed = asyncio.run(run())
+    # A failure on our side is not an unavailable provider: no failover
+    assert unsupported.status_code == 500 and "Unsupported LLM provider" in unsupported.detail
+    assert not llm_resilience.is_failover_error(unsupported)
+    assert timed_out.status_code == 504 and elapsed < 1
+    assert requests_seen == ["slow.openrouter.ai"] # Out of time, so no failover either
+    assert breakers.stats()["slow_provider"]["consecutive_failures"] == 0
+
+def test_deterministic_llm_calls_are_served_from_the_response_cache(tmp_path, mocker: MockerFixture):
+    import asyncio
+    import httpx
+    from server_python.cognisys import llm_interaction
+    from server_python.llm_response_cache import LLMResponseCache
+
+    requests_seen = []
+
+    def respond(request):
+        requests_seen.append(json.loads(request.content))
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": f"answer {len(requests_seen)}"}}],
+                                         "usage": {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}})
+
+    transport = httpx.MockTransport(respond)
+    provider = LLMProvider(id="cache_provider", name="CacheProvider", base_url="https://openrouter.ai/api/v1", api_key_encrypted="", enabled=True)
+    disk_path = str(tmp_path / "llm_cache.sqlite")
+    cache = LLMResponseCache(max_bytes=1024 * 1024, disk_path=disk_path)
+    mocker.patch.object(llm_interaction, "llm_response_cache", cache)
+    messages = [{"role": "user", "content": "list files"}]
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as mock_client:
+            mocker.patch.object(llm_interaction.provider_clients, "get_client", return_value=mock_client)
+            call = lambda **kwargs: llm_interaction.call_llm_api(provider, "cache-model", "key", kwargs.pop("messages", messages), **kwargs)
+            first = await call(temperature=0.2)
+            repeated = await call(temperature=0.2, messages=[{"role": "user", "content": "  list files\n"}])
+            opted_out = await call(temperature=0.2, cache=False)
+            other_params = await call(temperature=0.2, top_p=0.9)
+            sampled = await call(temperature=0.9)
+            opted_in = [await call(temperature=0.9, cache=True) for _ in range(2)]
+            return first, repeated, opted_out, other_params, sampled, opted_in
+
+    first, repeated, opted_out, other_params, sampled, opted_in = asyncio.run(run())
+    assert first["message"]["content"] == "answer 1" and repeated == first
+    assert opted_out["message"]["content"] == "answer 2" and other_params["message"]["content"] == "answer 3"
+    assert sampled["message"]["content"] == "answer 4"
+    assert opted_in[0] == opted_in[1] and opted_in[0]["message"]["content"] == "answer 5"
+    assert len(requests_seen) == 5
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["bypassed"], stats["stores"]) == (2, 3, 2, 3)
+    # Another worker sharing the disk tier gets the entry without a request
+    other_worker = LLMResponseCache(max_bytes=1024 * 1024, disk_path=disk_path)
+    key = llm_interaction.response_cache_key(provider.id, provider.base_url, "cache-model", messages, temperature=0.2, top_p=1.0)
+    assert other_worker.get(key) == first and other_worker.stats()["disk_hits"] == 1
+
+    # The memory tier stays within its byte budget
+    small = LLMResponseCache(max_bytes=2000)
+    for n in range(20):
+        small.put(f"key-{n}", {"message": {"content": "x" * 300}})
+    assert small.stats()["bytes"] <= 2000 and small.get("key-19") is not None and small.get("key-0") is None
+
+def test_response_cache_disk_tier_is_used_off_the_event_loop(tmp_path, mocker: MockerFixture):
+    import asyncio
+    import threading
+    from server_python.llm_response_cache import LLMResponseCache, _DiskTier
+
+    disk_threads = []
+    for name in ("get", "put"):
+        original = getattr(_DiskTier, name)
+        def record(self, *args, _original=original):
+            disk_threads.append(threading.get_ident())
+            return _original(self, *args)
+        mocker.patch.object(_DiskTier, name, record)
+    disk_path = str(tmp_path / "llm_cache.sqlite")
+
+    async def run():
+        await LLMResponseCache(disk_path=disk_path).aput("key", {"message": {"content": "cached"}})
+        return await LLMResponseCache(disk_path=disk_path).aget("key"), threading.get_ident()
+
+    value, loop_thread = asyncio.run(run())
+    assert value == {"message": {"content": "cached"}}
+    assert len(disk_threads) == 2 and loop_thread not in disk_threads
+
+def test_stream_llm_api_parses_openrouter_sse(mocker: MockerFixture):
+    import asyncio
+    import httpx
+    from server_python.cognisys import llm_interaction
+
+    sse_lines = [
+        ": OPENROUTER PROCESSING",
+        'data: {"choices": [{"delta": {"content": "Hello"}}]}',
+        'data: {"choices": [{"delta": {"content": " world"}}]}',
+        'data: {"choices": [{"delta": {"tool_calls": [{"index": 0, "id": "call_1", "function": {"name": "execute_shell_command", "arguments": "{\\"command\\": "}}]}}]}',
+        'data: {"choices": [{"delta": {"tool_calls": [{"index": 0, "function": {"arguments": "\\"ls\\"}"}}]}}], "usage": {"prompt_tokens": 3, "completion_tokens": 4, "total_tokens": 7}}',
+        "data: [DONE]",
+    ]
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text="\n\n".join(sse_lines) + "\n\n"))
+    provider = LLMProvider(id="stream_provider", name="StreamProvider", base_url="https://openrouter.ai/api/v1", api_key_encrypted="", enabled=True)
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as mock_client:
+            mocker.patch.object(llm_interaction.provider_clients, "get_client", return_value=mock_client)
+            deltas = []
+
+            async def on_delta(delta):
+                deltas.append(delta)
+
+            stream = await llm_interaction.call_llm_api(provider, "stream-model", "key", [{"role": "user", "content": "hi"}], stream=True)
+            final = await llm_interaction.collect_llm_stream(stream, on_delta)
+            return deltas, final
+
+    deltas, final = asyncio.run(run())
+    assert deltas == ["Hello", " world"]
+    assert final["message"]["content"] == "Hello world"
+    assert final["message"]["tool_calls"][0]["function"] == {"name": "execute_shell_command", "arguments": '{"command": "ls"}'}
+    assert final["total_tokens"] == 7
+
+def test_stream_openrouter_completion_shares_the_sse_parser(mocker: MockerFixture):
+    import asyncio
+    import httpx
+    from server_python import llm_service
+
+    sse_lines = [": OPENROUTER PROCESSING", 'data: {"choices": [{"delta": {"content": "Hi"}}]}', 'data: {"choices": [{"delta": {"content": " there"}}]}', "data: [DONE]"]
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text="\n\n".join(sse_lines) + "\n\n"))
+    mocker.patch.object(llm_service, "OPENROUTER_API_KEY", "sk-test")
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as mock_client:
+            mocker.patch.object(llm_service.provider_clients, "get_client", return_value=mock_client)
+            return [fragment async for fragment in llm_service.stream_openrouter_completion("user", "hello")]
+
+    assert asyncio.run(run()) == ["Hi", " there"]
+
+def test_chat_background_tasks_are_kept_until_done_and_failures_logged(caplog):
+    import asyncio
+    import logging
+    from fastapi import BackgroundTasks
+    from server_python.cognisys import service
+
+    ran = []
+
+    def failing_task():
+        ran.append(True)
+        raise RuntimeError("boom")
+
+    async def run():
+        background_tasks = BackgroundTasks()
+        background_tasks.add_task(failing_task)
+        service._run_in_background(background_tasks)
+        assert len(service._background_runs) == 1
+        while service._background_runs:
+            await asyncio.sleep(0.01)
+
+    with caplog.at_level(logging.ERROR, logger=service.__name__):
+        asyncio.run(run())
+    assert ran == [True]
+    assert "Chat background task failed" in caplog.text
@@ -0,0 +1,149 @@
+import os
+import sys
+from datetime import datetime
+
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import sqlite
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from server_python.database import (
+    Base, SchemaMigration, SCHEMA_MIGRATIONS, run_migrations,
+    ChatMessage, ArcanaAgentJobLog, ArcanaAgentJob, TelemetryData, RoutingRule, ContextMemory, TerminalCommandHistory,
+    Workflow, Dataset,
+)
+from server_python import search_index
+from server_python.pagination import encode_cursor, paginate
+
+# The hot queries of each area, with the composite index each one must use
+HOT_QUERIES = [
+    (select(ChatMessage).where(ChatMessage.conversation_id == "c1").order_by(ChatMessage.timestamp),
+     "ix_chat_messages_conversation_timestamp"),
+    (select(ArcanaAgentJobLog).where(ArcanaAgentJobLog.job_id == "j1").order_by(ArcanaAgentJobLog.timestamp),
+     "ix_arcana_agent_job_logs_job_timestamp"),
+    (select(ArcanaAgentJob).where(ArcanaAgentJob.agent_id == "a1", ArcanaAgentJob.owner_id == "u1").order_by(ArcanaAgentJob.created_at.desc()),
+     "ix_arcana_agent_jobs_agent_owner_created"),
+    (select(TelemetryData).where(TelemetryData.owner_id == "u1", TelemetryData.metric_name == "cpu", TelemetryData.timestamp >= datetime(2024, 1, 1)).order_by(TelemetryData.timestamp),
+     "ix_telemetry_data_owner_metric_timestamp"),
+    (select(RoutingRule).where(RoutingRule.owner_id == "u1").order_by(RoutingRule.priority.desc()),
+     "ix_routing_rules_owner_priority"),
+    (select(ContextMemory).where(ContextMemory.user_id == "u1", ContextMemory.key == "k"),
+     "ix_context_memory_user_key"),
+    (select(TerminalCommandHistory).where(TerminalCommandHistory.session_id == "s1").order_by(TerminalCommandHistory.timestamp),
+     "ix_terminal_command_history_session_timestamp"),
+]
+
+
+def _legacy_engine():
+    """An in-memory database created before the composite indexes were declared."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for _, index_name in HOT_QUERIES:
+            conn.execute(text(f"DROP INDEX {index_name}"))
+    return engine
+
+
+def test_run_migrations_creates_indexes_once():
+    engine = _legacy_engine()
+    assert "ix_chat_messages_conversation_timestamp" not in {i["name"] for i in inspect(engine).get_indexes("chat_messages")}
+
+    assert run_migrations(engine) == [version for version, _, _ in SCHEMA_MIGRATIONS]
+    assert run_migrations(engine) == [] # Already recorded
+    db = sessionmaker(bind=engine)()
+    assert db.query(SchemaMigration).count() == len(SCHEMA_MIGRATIONS)
+    db.close()
+
+    for query, index_name in HOT_QUERIES:
+        table_name = query.get_final_froms()[0].name
+        assert index_name in {i["name"] for i in inspect(engine).get_indexes(table_name)}
+
+
+def test_hot_queries_use_composite_indexes():
+    engine = _legacy_engine()
+    run_migrations(engine)
+    with engine.connect() as conn:
+        for query, index_name in HOT_QUERIES:
+            sql = str(query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+            plan = " ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+            assert f"INDEX {index_name}" in plan, f"{index_name} not used: {plan}"
+            assert "USE TEMP B-TREE FOR ORDER BY" not in plan, f"{index_name} does not cover the sort: {plan}"
+
+
+def test_cursor_pages_seek_the_sort_index():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    cursor = encode_cursor(datetime(2024, 1, 1), "m1")
+    with engine.connect() as conn:
+        for descending in (False, True):
+            query = paginate(db.query(ChatMessage).filter(ChatMessage.conversation_id == "c1"), ChatMessage.timestamp, ChatMessage.id,
+                             limit=50, cursor=cursor, descending=descending)
+            sql = str(query.statement.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+            plan = " ".join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+            assert "(conversation_id=? AND timestamp" in plan, f"cursor does not seek: {plan}"
+    db.close()
+
+
+def test_search_index_follows_writes_and_backfills():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    workflow = Workflow(owner_id="u1", name="Nightly ingest", description="Loads sensor readings", status="active", steps="[]")
+    db.add_all([
+        workflow,
+        Dataset(owner_id="u1", name="Sensor archive", description="Raw readings", format="csv"),
+        Dataset(owner_id="u2", name="Sensor archive", format="csv"),
+    ])
+    db.commit()
+
+    hits = search_index.search(db, "u1", "sens")
+    assert [hit["name"] for hit in hits] == ["Sensor archive", "Nightly ingest"] # Title matches rank first
+    assert hits[0]["highlight"] == "<mark>Sensor</mark> archive" and hits[0]["format"] == "csv"
+    assert "<mark>sensor</mark>" in hits[1]["snippet"]
+    assert search_index.search(db, "u1", "sensor", entity_types=["workflow"])[0]["id"] == workflow.id
+    assert search_index.search(db, "u1", 'ingest" OR *') == [] # User input is never parsed as FTS syntax
+
+    workflow.name = "Hourly export"
+    db.commit()
+    assert search_index.search(db, "u1", "nightly") == []
+    db.delete(workflow)
+    db.commit()
+    assert [hit["type"] for hit in search_index.search(db, "u1", "sensor")] == ["dataset"]
+
+    # Rows written before the index existed are picked up by the migration
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM search_documents"))
+        conn.execute(text("INSERT INTO search_fts(search_fts) VALUES ('delete-all')"))
+    assert search_index.search(db, "u1", "sensor") == []
+    with engine.begin() as conn:
+        assert search_index.rebuild_search_index(conn) == 2
+    assert len(search_index.search(db, "u2", "archive")) == 1
+    db.close()
+
+
+def test_search_hits_are_escaped_and_triggers_skip_unindexed_columns():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    workflow = Workflow(owner_id="u1", name="<img src=x onerror=alert(1)> sensor", description="a <b>reading</b> & more", status="active", steps="[]")
+    db.add(workflow)
+    db.commit()
+
+    hit = search_index.search(db, "u1", "sensor")[0]
+    assert hit["highlight"] == "&lt;img src=x onerror=alert(1)&gt; <mark>sensor</mark>"
+    assert search_index.search(db, "u1", "reading")[0]["snippet"] == "a &lt;b&gt;<mark>reading</mark>&lt;/b&gt; &amp; more"
+
+    def stored_body():
+        return db.execute(text("SELECT body FROM search_documents WHERE entity_id = :id"), {"id": workflow.id}).scalar()
+
+    db.execute(text("UPDATE search_documents SET body = 'stale'"))
+    workflow.steps = '["step"]'
+    db.commit()
+    assert stored_body() == "stale" # Not re-indexed for a column the document doesn't use
+    workflow.status = "paused"
+    db.commit()
+    assert stored_body() == "a <b>reading</b> & more"
+    db.close()
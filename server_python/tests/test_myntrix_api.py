@@ -0,0 +1,181 @@
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from pytest_mock import MockerFixture
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from server_python.main import app, get_db
+from server_python.database import Base, Device, ScheduledTask, TaskRun, User
+from server_python.auth import get_password_hash
+from server_python.neosyntis import telemetry_store
+
+# Setup test database
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_myntrix_api.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(name="db_session")
+def db_session_fixture():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = TestingSessionLocal(bind=connection)
+    try:
+        yield db
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+
+@pytest.fixture(name="client")
+def client_fixture(db_session):
+    def override_get_db():
+        yield db_session
+
+    app.dependency_overrides[get_db] = override_get_db
+    with TestClient(app) as client:
+        yield client
+    app.dependency_overrides.clear()
+
+@pytest.fixture(name="test_user")
+def test_user_fixture(db_session):
+    user = User(id="myntrixuser1", username="myntrixuser", email="myntrix@example.com", hashed_password=get_password_hash("testpassword"), is_verified=True)
+    db_session.add(user)
+    db_session.commit()
+    db_session.refresh(user)
+    return user
+
+@pytest.fixture(name="auth_headers")
+def auth_headers_fixture(client, test_user):
+    response = client.post("/api/token", data={"username": test_user.username, "password": "testpassword"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+### System metrics ###
+
+def test_system_metrics_sampler_ring_buffer(mocker: MockerFixture):
+    from server_python.system_metrics import SystemMetricsSampler
+    mocker.patch("psutil.cpu_percent", return_value=25.5)
+    mocker.patch("psutil.virtual_memory", return_value=mocker.Mock(percent=50.0, total=1000000000, available=500000000))
+    clock = mocker.patch("server_python.system_metrics.time.time", return_value=1_700_000_000.0)
+
+    sampler = SystemMetricsSampler(interval=60, history_minutes=3) # Room for 3 samples
+    for minute in range(5):
+        clock.return_value = 1_700_000_000.0 + minute * 60
+        sampler.sample()
+
+    history = sampler.history(minutes=10)
+    assert len(history) == 3 # The oldest samples were overwritten
+    assert [sample["timestamp"] for sample in history] == sorted(sample["timestamp"] for sample in history)
+    assert len(sampler.history(minutes=1.5)) == 2
+    latest = sampler.latest()
+    assert latest == history[-1]
+    assert latest["cpu_percent"] == 25.5
+    assert latest["memory_total"] == 1000000000
+
+def test_get_system_metrics_serves_the_latest_sample(client, auth_headers, mocker: MockerFixture):
+    from server_python.system_metrics import system_metrics_sampler
+    mocker.patch("psutil.cpu_percent", return_value=25.5)
+    mocker.patch("psutil.virtual_memory", return_value=mocker.Mock(percent=50.0, total=1000000000, available=500000000))
+    system_metrics_sampler.sample()
+
+    response = client.get("/api/myntrix/system-metrics", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["cpu_percent"] == 25.5
+    assert response.json()["memory_percent"] == 50.0
+
+def test_get_system_metrics_history(client, auth_headers):
+    response = client.get("/api/myntrix/system-metrics/history?minutes=5", headers=auth_headers)
+    assert response.status_code == 200
+    assert isinstance(response.json()["samples"], list)
+    assert response.json()["interval_seconds"] > 0
+
+    response = client.get("/api/myntrix/system-metrics/history?minutes=0", headers=auth_headers)
+    assert response.status_code == 422
+
+### Device telemetry ###
+
+def test_device_telemetry_websocket_fans_out_and_stores(client, auth_headers, db_session, test_user):
+    device = Device(id=str(uuid.uuid4()), owner_id=test_user.id, name="Sensor", type="Sensor", connection_string="/dev/ttyUSB0")
+    db_session.add(device)
+    db_session.commit()
+    token = auth_headers["Authorization"].split(" ", 1)[1]
+
+    with client.websocket_connect(f"/api/myntrix/ws/myntrix/telemetry/subscribe?device_id={device.id}&token={token}") as dashboard:
+        with client.websocket_connect(f"/api/myntrix/ws/myntrix/telemetry/{device.id}?token={token}") as device_socket:
+            device_socket.send_text(json.dumps({"temperature": 21.5, "speed": 1200}))
+            message = dashboard.receive_json()
+            assert message["type"] == "telemetry"
+            assert message["payload"] == {"temperature": 21.5, "speed": 1200.0}
+
+    # The device socket stores its samples in batches once it disconnects
+    for _ in range(100):
+        stored = telemetry_store.list_samples(db_session, owner_id=test_user.id, metric_name="temperature")
+        if stored:
+            break
+        time.sleep(0.05)
+    assert [(sample.value, sample.device_id) for sample in stored] == [(21.5, device.id)]
+
+def test_device_telemetry_websocket_accepts_binary_frames(client, auth_headers, db_session, test_user):
+    from server_python.neosyntis.telemetry_frames import encode_dictionary, encode_frame
+    device = Device(id=str(uuid.uuid4()), owner_id=test_user.id, name="Sensor", type="Sensor", connection_string="/dev/ttyUSB0")
+    db_session.add(device)
+    db_session.commit()
+    token = auth_headers["Authorization"].split(" ", 1)[1]
+    timestamps = [1_700_000_000.0 + n / 100 for n in range(2000)]
+
+    with client.websocket_connect(f"/api/myntrix/ws/myntrix/telemetry/{device.id}?token={token}") as device_socket:
+        device_socket.send_bytes(encode_frame([(0, [1_700_000_000.0], [1.0])]))
+        assert "not been defined" in device_socket.receive_json()["errors"][0]["error"]
+        device_socket.send_bytes(encode_dictionary(["vibration"]))
+        device_socket.send_bytes(encode_frame([(0, timestamps, [float(n) for n in range(2000)])]))
+
+    for _ in range(100):
+        stored = telemetry_store.list_samples(db_session, owner_id=test_user.id, metric_name="vibration", limit=None)
+        if len(stored) == 2000:
+            break
+        time.sleep(0.05)
+    assert len(stored) == 2000
+    assert (stored[-1].value, stored[-1].device_id) == (1999.0, device.id)
+
+### Task history ###
+
+def test_task_history_cursor_pagination_handles_null_start_times(client, auth_headers, db_session, test_user):
+    task = ScheduledTask(id="task-1", owner_id=test_user.id, name="Nightly", schedule="0 0 * * *", action="{}")
+    db_session.add(task)
+    start_times = [datetime(2024, 1, 2), None, datetime(2024, 1, 1), None, datetime(2024, 1, 1)]
+    for n, start_time in enumerate(start_times):
+        db_session.add(TaskRun(id=f"run-{n}", task_id=task.id, status="success", start_time=start_time))
+    db_session.commit()
+    # The column default replaces None on insert, so clear it afterwards
+    db_session.query(TaskRun).filter(TaskRun.id.in_(["run-1", "run-3"])).update({TaskRun.start_time: None})
+    db_session.commit()
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/api/myntrix/tasks/history/{task.id}", headers=auth_headers, params=params)
+        assert response.status_code == 200
+        seen += [run["id"] for run in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ["run-1", "run-3", "run-2", "run-4", "run-0"] # SQLite orders NULLs first
+
+def teardown_module(module):
+    engine.dispose()
+    if os.path.exists("./test_myntrix_api.db"):
+        os.remove("./test_myntrix_api.db")
@@ -18,6 +18,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from main import app, get_db
 from server_python.database import Base, User, Workflow, Dataset, MLModel, TrainingJob, Permission, Role, TelemetryData
 from auth import get_password_hash, PermissionChecker, get_current_user
+from server_python.neosyntis import telemetry_store
+from server_python.neosyntis.schemas import TelemetryDataCreate
 
 # Setup test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test_neosyntis.db"
@@ -428,14 +430,10 @@ def test_ingest_telemetry(client, auth_headers, test_user):
     assert "id" in response.json()
 
 def test_get_telemetry(client, auth_headers, db_session, test_user):
-    telemetry_data_1 = TelemetryData(
-        id=str(uuid.uuid4()), owner_id=test_user.id, metric_name="temp", value=25.0
-    )
-    telemetry_data_2 = TelemetryData(
-        id=str(uuid.uuid4()), owner_id=test_user.id, metric_name="humidity", value=60.0
-    )
-    db_session.add_all([telemetry_data_1, telemetry_data_2])
-    db_session.commit()
+    telemetry_store.append_points(db_session, [
+        TelemetryDataCreate(metric_name="temp", value=25.0),
+        TelemetryDataCreate(metric_name="humidity", value=60.0),
+    ], owner_id=test_user.id)
 
     response = client.get("/api/neosyntis/telemetry/", headers=auth_headers)
     assert response.status_code == 200
@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from server_python.main import app, get_db
+from server_python.database import Base, Dataset, User, Workflow
+from server_python.auth import get_password_hash
+from server_python.neosyntis import telemetry_store
+
+# Setup test database
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_neosyntis_api.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(name="db_session")
+def db_session_fixture():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = TestingSessionLocal(bind=connection)
+    try:
+        yield db
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+
+@pytest.fixture(name="client")
+def client_fixture(db_session):
+    def override_get_db():
+        yield db_session
+
+    app.dependency_overrides[get_db] = override_get_db
+    with TestClient(app) as client:
+        yield client
+    app.dependency_overrides.clear()
+
+@pytest.fixture(name="test_user")
+def test_user_fixture(db_session):
+    user = User(id="neosyntisuser1", username="neosyntisuser", email="neosyntis@example.com", hashed_password=get_password_hash("testpassword"), is_verified=True)
+    db_session.add(user)
+    db_session.commit()
+    db_session.refresh(user)
+    return user
+
+@pytest.fixture(name="auth_headers")
+def auth_headers_fixture(client, test_user):
+    response = client.post("/api/token", data={"username": test_user.username, "password": "testpassword"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+### Telemetry ingest ###
+
+def test_ingest_telemetry_batch(client, auth_headers, db_session, test_user):
+    points = [{"metric_name": "cpu_usage", "value": float(n)} for n in range(50)]
+    points.append({"metric_name": "cpu_usage", "value": "not-a-number"})
+    response = client.post("/api/neosyntis/telemetry/ingest/batch", headers=auth_headers, json=points)
+    assert response.status_code == 200
+    assert response.json()["accepted"] == 50
+    assert response.json()["rejected"] == 1
+    assert response.json()["errors"][0]["index"] == 50
+    assert len(telemetry_store.list_samples(db_session, owner_id=test_user.id, limit=None)) == 50
+
+def test_ingest_telemetry_batch_ndjson(client, auth_headers, db_session, test_user):
+    body = "\n".join([json.dumps({"metric_name": "temp", "value": 21.5}), "{broken", json.dumps({"metric_name": "temp", "value": 22.0})])
+    response = client.post(
+        "/api/neosyntis/telemetry/ingest/batch",
+        headers={**auth_headers, "Content-Type": "application/x-ndjson"},
+        content=body,
+    )
+    assert response.status_code == 200
+    assert response.json()["accepted"] == 2
+    assert response.json()["errors"][0]["index"] == 1
+    assert len(telemetry_store.list_samples(db_session, owner_id=test_user.id, metric_name="temp")) == 2
+
+def test_receive_neosyntis_telemetry_stores_the_point(client, auth_headers, db_session, test_user):
+    response = client.post("/api/neosyntis/telemetry", headers=auth_headers, json={
+        "source_id": "sensor-1", "source_type": "sensor", "metric_name": "temp", "metric_value": 21.5,
+    })
+    assert response.status_code == 200
+    samples = telemetry_store.list_samples(db_session, owner_id=test_user.id, metric_name="temp")
+    assert [sample.value for sample in samples] == [21.5]
+
+### Search ###
+
+def test_search_ranks_and_highlights(client, auth_headers, db_session, test_user):
+    db_session.add_all([
+        Workflow(id=str(uuid.uuid4()), owner_id=test_user.id, name="Anomaly detection", description="Flags outliers", status="active", steps="[]"),
+        Dataset(id=str(uuid.uuid4()), owner_id=test_user.id, name="Vibration log", description="Input for anomaly detection", format="csv"),
+    ])
+    db_session.commit()
+
+    response = client.get("/api/search?query=anom det", headers=auth_headers)
+    assert response.status_code == 200
+    hits = response.json()
+    assert [hit["type"] for hit in hits] == ["workflow", "dataset"]
+    assert hits[0]["highlight"] == "<mark>Anomaly</mark> <mark>detection</mark>"
+    assert "<mark>anomaly</mark>" in hits[1]["snippet"]
+
+    response = client.get("/api/neosyntis/search?query=anomaly&entity_type=agents", headers=auth_headers)
+    assert response.status_code == 400
+
+def teardown_module(module):
+    engine.dispose()
+    if os.path.exists("./test_neosyntis_api.db"):
+        os.remove("./test_neosyntis_api.db")
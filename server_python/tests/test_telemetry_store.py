@@ -0,0 +1,377 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from sqlalchemy import create_engine, insert, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from server_python.database import Base, TelemetryData, TelemetryMetric, TelemetrySegment, TelemetrySample, TelemetryRollup, run_migrations
+from server_python.neosyntis import telemetry_query, telemetry_store
+from server_python.pagination import encode_cursor
+from server_python.neosyntis.telemetry_frames import TelemetryFrameDecoder, TelemetryFrameError, encode_dictionary, encode_frame
+from server_python.neosyntis.schemas import TelemetryDataCreate
+from server_python.neosyntis.telemetry_hub import TelemetryHub
+from server_python.neosyntis.telemetry_ingest import TelemetryBatchWriter, parse_device_message
+
+START = datetime(2024, 1, 1)
+
+
+def _session():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(bind=engine)()
+
+
+def test_append_points_uses_metric_dictionary_and_segments():
+    _, db = _session()
+    # Two days of one point per minute, for two metrics
+    points = [
+        TelemetryDataCreate(metric_name=name, value=float(minute), timestamp=START + timedelta(minutes=minute))
+        for minute in range(2 * 24 * 60) for name in ("cpu", "mem")
+    ]
+    assert telemetry_store.append_points(db, points, owner_id="u1") == len(points)
+    record = telemetry_store.append_point(db, TelemetryDataCreate(metric_name="cpu", value=-1.0, timestamp=START - timedelta(seconds=1)), owner_id="u1")
+    assert record.id.isdigit() and record.metric_name == "cpu"
+
+    assert db.query(TelemetryMetric).count() == 2
+    assert db.query(TelemetrySegment).count() == 5 # 2 metrics x 2 daily segments, plus the day before
+    cpu = telemetry_store.list_samples(db, owner_id="u1", metric_name="cpu", limit=3)
+    assert [record.value for record in cpu] == [-1.0, 0.0, 1.0]
+    assert telemetry_store.list_samples(db, owner_id="u2", metric_name="cpu") == []
+    db.close()
+
+
+def test_list_samples_cursor_pages_across_segments():
+    _, db = _session()
+    # Three daily segments per metric, with equal timestamps so the id breaks ties
+    points = [
+        TelemetryDataCreate(metric_name=name, value=float(hour), timestamp=START + timedelta(hours=hour))
+        for hour in range(0, 72, 5) for name in ("cpu", "mem")
+    ]
+    telemetry_store.append_points(db, points, owner_id="u1")
+    everything = telemetry_store.list_samples(db, owner_id="u1", limit=None)
+
+    for metric_name in (None, "cpu"):
+        seen, cursor = [], None
+        while True:
+            page = telemetry_store.list_samples(db, owner_id="u1", metric_name=metric_name, limit=4, cursor=cursor)
+            seen += page
+            if len(page) < 4:
+                break
+            cursor = encode_cursor(page[-1].timestamp, page[-1].id)
+        assert seen == [record for record in everything if metric_name in (None, record.metric_name)]
+    db.close()
+
+
+def test_query_series_picks_coarsest_rollup():
+    _, db = _session()
+    points = [
+        TelemetryDataCreate(metric_name="cpu", value=float(second % 100), timestamp=START + timedelta(seconds=second))
+        for second in range(0, 3 * 3600, 10)
+    ]
+    telemetry_store.append_points(db, points, owner_id="u1")
+    assert telemetry_store.compute_rollups(db) == 1
+    assert db.query(TelemetrySegment).filter(TelemetrySegment.dirty_from_ts != None).count() == 0
+    assert db.query(TelemetryRollup).filter(TelemetryRollup.resolution == 3600).count() == 3
+
+    end = START + timedelta(hours=3)
+    hourly = telemetry_store.query_series(db, "u1", "cpu", START, end, resolution=3600)
+    assert hourly["source"] == "1h"
+    assert [point["count"] for point in hourly["points"]] == [360, 360, 360]
+
+    five_minutes = telemetry_store.query_series(db, "u1", "cpu", START, end, resolution=300)
+    assert five_minutes["source"] == "1m" and len(five_minutes["points"]) == 36
+
+    raw = telemetry_store.query_series(db, "u1", "cpu", START, START + timedelta(minutes=1), resolution=30)
+    assert raw["source"] == "raw"
+    assert [(point["min"], point["max"], point["count"]) for point in raw["points"]] == [(0.0, 20.0, 3), (30.0, 50.0, 3)]
+
+    # The rollup matches the raw data it summarises
+    raw_hour = telemetry_store.query_series(db, "u1", "cpu", START, START + timedelta(hours=1), resolution=59)
+    assert sum(point["count"] for point in raw_hour["points"]) == 360
+    assert abs(hourly["points"][0]["avg"] - sum(p["avg"] * p["count"] for p in raw_hour["points"]) / 360) < 1e-9
+
+    # Late points make the segment dirty again; queries see them once the worker has rolled them up
+    telemetry_store.append_points(db, [TelemetryDataCreate(metric_name="cpu", value=1000.0, timestamp=START)], owner_id="u1")
+    hourly = telemetry_store.query_series(db, "u1", "cpu", START, end, resolution=3600)
+    assert hourly["points"][0]["count"] == 360
+    assert telemetry_store.compute_rollups(db) == 1
+    hourly = telemetry_store.query_series(db, "u1", "cpu", START, end, resolution=3600)
+    assert hourly["points"][0]["count"] == 361 and hourly["points"][0]["max"] == 1000.0
+    db.close()
+
+
+def test_query_series_default_resolution_reads_rollups():
+    _, db = _session()
+    end = datetime.utcnow().replace(microsecond=0)
+    points = [
+        TelemetryDataCreate(metric_name="cpu", value=1.0, timestamp=end - timedelta(seconds=second))
+        for second in range(1, 7 * 24 * 3600, 120)
+    ]
+    telemetry_store.append_points(db, points, owner_id="u1")
+    telemetry_store.compute_rollups(db)
+
+    # The last hour (the default range) is fine-grained enough for raw samples
+    last_hour = telemetry_store.query_series(db, "u1", "cpu")
+    assert last_hour["source"] == "raw" and last_hour["resolution"] == 4
+    assert sum(point["count"] for point in last_hour["points"]) == 30
+
+    day = telemetry_store.query_series(db, "u1", "cpu", end - timedelta(days=1), end)
+    assert day["source"] == "1m" and day["resolution"] == 120 # 87s rounded up to whole minutes
+    assert len(day["points"]) <= telemetry_store.TELEMETRY_MAX_SERIES_POINTS
+    week = telemetry_store.query_series(db, "u1", "cpu", end - timedelta(days=7), end)
+    assert week["source"] == "1m" and week["resolution"] == 660
+    assert sum(point["count"] for point in week["points"]) == len(points)
+    assert telemetry_store.auto_resolution(0, 90 * 86400 * 1000) == 10800 # Whole hours past an hour
+    db.close()
+
+
+def test_migration_moves_legacy_telemetry_rows():
+    engine, db = _session()
+    db.add_all([
+        TelemetryData(id=f"legacy-{n}", owner_id="u1", metric_name="temp", value=float(n), timestamp=START + timedelta(minutes=n))
+        for n in range(10)
+    ])
+    db.commit()
+
+    run_migrations(engine)
+    assert db.query(TelemetryData).count() == 0
+    assert [record.value for record in telemetry_store.list_samples(db, owner_id="u1", metric_name="temp")] == [float(n) for n in range(10)]
+    db.close()
+
+
+def _race_after_first_query(db, concurrent_write):
+    """Runs `concurrent_write` right after the session's next query, as a racing writer would."""
+    execute = db.execute
+
+    def execute_then_race(*args, **kwargs):
+        result = execute(*args, **kwargs).freeze()
+        db.execute = execute
+        concurrent_write()
+        return result()
+
+    db.execute = execute_then_race
+
+
+def test_metrics_and_segments_survive_a_concurrent_first_write(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'telemetry.db'}")
+    Base.metadata.create_all(bind=engine)
+    db, other = sessionmaker(bind=engine)(), sessionmaker(bind=engine)()
+
+    def add_metric():
+        other.execute(insert(TelemetryMetric).values(name="cpu"))
+        other.commit()
+
+    _race_after_first_query(db, add_metric)
+    metric_ids = telemetry_store.get_metric_ids(db, ["cpu"]) # No IntegrityError
+    db.commit()
+    assert metric_ids == {"cpu": other.query(TelemetryMetric.id).scalar()}
+
+    def add_segment():
+        other.execute(insert(TelemetrySegment).values(owner_id="u1", metric_id=metric_ids["cpu"], start_ts=0, sample_count=0))
+        other.commit()
+
+    _race_after_first_query(db, add_segment)
+    segment_id = telemetry_store._get_or_create_segment(db, "u1", (metric_ids["cpu"], None, None, None, 0))
+    db.commit()
+    assert db.query(TelemetrySegment.id).all() == [(segment_id,)]
+    db.close()
+    other.close()
+    engine.dispose()
+
+
+def test_migration_merges_duplicate_segments():
+    engine, db = _session()
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_telemetry_segments_series"))
+        conn.execute(text("CREATE INDEX ix_telemetry_segments_owner_metric_start ON telemetry_segments (owner_id, metric_id, start_ts)"))
+    metric_id = telemetry_store.get_metric_ids(db, ["cpu"])["cpu"]
+    for minute in range(3):
+        # What concurrent writers could leave behind before the unique index existed
+        segment = TelemetrySegment(owner_id="u1", metric_id=metric_id, start_ts=0, sample_count=1)
+        db.add(segment)
+        db.flush()
+        db.execute(insert(TelemetrySample).values(segment_id=segment.id, ts=minute * 60_000, value=float(minute)))
+    db.commit()
+
+    run_migrations(engine)
+    segment = db.query(TelemetrySegment).one()
+    assert segment.sample_count == 3 and segment.dirty_from_ts == 0
+    telemetry_store.compute_rollups(db)
+    series = telemetry_store.query_series(db, "u1", "cpu", START - timedelta(days=20000), START, resolution=3600)
+    assert series["source"] == "1h" and series["points"][0]["count"] == 3
+    assert "ix_telemetry_segments_owner_metric_start" not in {index["name"] for index in inspect(engine).get_indexes("telemetry_segments")}
+    db.close()
+
+
+def test_aggregate_samples_matches_numpy():
+    rng = np.random.default_rng(7)
+    ts = np.sort(rng.integers(0, 600_000, 5000))
+    values = rng.normal(50, 10, 5000)
+    buckets, columns = telemetry_query.aggregate_samples(ts, values, 60_000, ["avg", "min", "max", "count", "p95", "rate"])
+    for index, bucket_ts in enumerate(buckets):
+        mask = (ts >= bucket_ts) & (ts < bucket_ts + 60_000)
+        window_ts, window = ts[mask], values[mask]
+        assert columns["count"][index] == len(window)
+        assert np.isclose(columns["avg"][index], window.mean())
+        assert columns["min"][index] == window.min() and columns["max"][index] == window.max()
+        assert np.isclose(columns["p95"][index], np.percentile(window, 95))
+        assert np.isclose(columns["rate"][index], (window[-1] - window[0]) / ((window_ts[-1] - window_ts[0]) / 1000))
+
+
+def test_lttb_keeps_ends_and_peaks():
+    x = np.arange(10_000)
+    y = np.zeros(10_000)
+    y[4321] = 100.0 # A spike that plain striding would drop
+    keep = telemetry_query.lttb(x, y, 100)
+    assert len(keep) == 100
+    assert keep[0] == 0 and keep[-1] == 9_999 and 4321 in keep
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_query_telemetry_serves_rollup_aggregations_from_rollups():
+    _, db = _session()
+    week = [
+        TelemetryDataCreate(metric_name="cpu", value=float(second % 60), timestamp=START + timedelta(seconds=second))
+        for second in range(0, 7 * 24 * 3600, 15)
+    ]
+    telemetry_store.append_points(db, week, owner_id="u1")
+    telemetry_store.compute_rollups(db)
+    end = START + timedelta(days=7)
+
+    daily = telemetry_query.query_telemetry(db, "u1", "cpu", START, end, bucket=86400, aggs="avg,max,count")
+    assert daily["source"] == "1h" and len(daily["points"]) == 7
+    assert daily["points"][0] == {"timestamp": START, "avg": 22.5, "max": 45.0, "count": 5760}
+
+    p99 = telemetry_query.query_telemetry(db, "u1", "cpu", START, end, bucket=86400, aggs="p99")
+    assert p99["source"] == "raw" and p99["points"][0]["p99"] == 45.0
+
+    chart = telemetry_query.query_telemetry(db, "u1", "cpu", START, end, max_points=500)
+    assert chart["aggregations"] == ["value"] and len(chart["points"]) == 500
+    db.close()
+
+
+def test_telemetry_hub_bounds_slow_subscribers():
+    async def run():
+        hub = TelemetryHub()
+        slow = hub.subscribe("u1", max_queue=100)
+        latest = hub.subscribe("u1", device_ids=["d1"], conflate=True)
+        other_user = hub.subscribe("u2")
+        # A burst far larger than the queue never blocks the publisher
+        points = [TelemetryDataCreate(metric_name=f"m{n % 3}", value=float(n), device_id="d1", timestamp=START) for n in range(10_000)]
+        hub.publish("u1", points)
+        hub.publish("u1", [TelemetryDataCreate(metric_name="m0", value=-1.0, device_id="d2", timestamp=START)])
+
+        samples = await slow.get()
+        assert len(samples) == 100 and samples[-1]["device_id"] == "d2"
+        assert slow.dropped == 10_001 - 100
+        assert {sample["metric_name"]: sample["value"] for sample in await latest.get()} == {"m0": 9999.0, "m1": 9997.0, "m2": 9998.0}
+        assert other_user.drain() == []
+
+        hub.unsubscribe(slow)
+        assert hub.subscriber_count("u1") == 1
+
+    asyncio.run(run())
+
+
+def test_parse_device_message_accepts_metric_maps():
+    points, errors = parse_device_message('{"temperature": 21.5, "speed": 1200, "status": "ok"}', "dev-1")
+    assert {(point.metric_name, point.value, point.device_id) for point in points} == {("temperature", 21.5, "dev-1"), ("speed", 1200.0, "dev-1")}
+    assert all(point.timestamp is not None for point in points)
+    assert len(errors) == 1 and errors[0].index == 2
+
+    points, errors = parse_device_message('[{"metric_name": "rpm", "value": 3, "device_id": "spoofed"}]', "dev-1")
+    assert points[0].device_id == "dev-1" and not errors
+    assert parse_device_message("not json", "dev-1")[0] == []
+
+
+def test_frame_decoder_reads_columns_from_the_frame():
+    decoder = TelemetryFrameDecoder(max_samples=10_000)
+    assert decoder.decode(encode_dictionary(["cpu", "mem"])) == []
+    timestamps = np.arange(5000) / 10 + 1_700_000_000.0
+    frame = encode_frame([(0, timestamps, np.sin(timestamps)), (1, timestamps[:3], [1.0, 2.0, 3.0])])
+    (cpu, cpu_ts, cpu_values), (mem, _, mem_values) = decoder.decode(frame)
+    assert (cpu, mem) == ("cpu", "mem")
+    assert np.array_equal(cpu_ts, timestamps) and np.array_equal(cpu_values, np.sin(timestamps))
+    assert mem_values.tolist() == [1.0, 2.0, 3.0]
+    assert not cpu_ts.flags.writeable # A view of the frame, not a copy
+
+    with pytest.raises(TelemetryFrameError):
+        decoder.decode(frame[:-8])
+    with pytest.raises(TelemetryFrameError):
+        decoder.decode(encode_frame([(2, [1.0], [1.0])]))
+    with pytest.raises(TelemetryFrameError):
+        decoder.decode(encode_frame([(0, [1.0], [float("nan")])]))
+    with pytest.raises(TelemetryFrameError):
+        TelemetryFrameDecoder(max_samples=100).decode(frame)
+
+
+def test_frame_decoder_rejects_timestamps_outside_the_datetime_range():
+    decoder = TelemetryFrameDecoder(max_samples=10)
+    decoder.decode(encode_dictionary(["cpu"]))
+    # 1e12 s would be stored as 1e15 ms, past year 9999, and break every later listing
+    for ts in (1e12, -1.0, 1e300):
+        with pytest.raises(TelemetryFrameError):
+            decoder.decode(encode_frame([(0, [1_700_000_000.0, ts], [1.0, 2.0])]))
+    assert len(decoder.decode(encode_frame([(0, [0.0, 253402300799.0], [1.0, 2.0])]))[0][1]) == 2
+
+
+def test_batch_writer_does_not_store_points_twice_after_a_failed_flush(monkeypatch):
+    _, db = _session()
+    writer = TelemetryBatchWriter(db, "owner", batch_size=1000)
+    append_columns = telemetry_store.append_columns
+    calls = []
+
+    def failing_once(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("disk full")
+        return append_columns(*args, **kwargs)
+
+    monkeypatch.setattr(telemetry_store, "append_columns", failing_once)
+
+    async def run():
+        writer.add([TelemetryDataCreate(metric_name="cpu", value=1.0, timestamp=START)])
+        writer.add_columns("mem", telemetry_store.to_ms(START) + np.arange(3), np.ones(3))
+        assert await writer.flush() == 0
+        assert await writer.flush() == 4
+
+    asyncio.run(run())
+    assert db.query(TelemetrySample).count() == 4
+
+
+def test_append_columns_splits_segments_and_marks_rollups():
+    _, db = _session()
+    # 36 hours at one sample per second crosses a daily segment boundary
+    ts_ms = telemetry_store.to_ms(START) + np.arange(36 * 3600) * 1000
+    values = np.arange(36 * 3600, dtype=np.float64)
+    assert telemetry_store.append_columns(db, "u1", "cpu", ts_ms, values, device_id="d1") == len(ts_ms)
+    assert db.query(TelemetrySegment).count() == 2
+    assert telemetry_store.compute_rollups(db) == 2
+    hourly = telemetry_store.query_series(db, "u1", "cpu", START, START + timedelta(hours=36), resolution=3600)
+    assert [point["count"] for point in hourly["points"]] == [3600] * 36
+    assert hourly["points"][-1]["max"] == values[-1]
+    assert telemetry_store.list_samples(db, owner_id="u1", metric_name="cpu", limit=1)[0].device_id == "d1"
+    db.close()
+
+
+def test_telemetry_hub_publishes_columns_tail():
+    async def run():
+        hub = TelemetryHub()
+        assert hub.publish_columns("u1", "cpu", np.arange(10), np.arange(10.0)) == 0
+        recent = hub.subscribe("u1", max_queue=5)
+        latest = hub.subscribe("u1", conflate=True)
+        hub.publish_columns("u1", "cpu", np.arange(1000), np.arange(1000.0), device_id="d1")
+        assert [sample["value"] for sample in await recent.get()] == [995.0, 996.0, 997.0, 998.0, 999.0]
+        assert recent.dropped == 995
+        assert [sample["value"] for sample in await latest.get()] == [999.0]
+
+    asyncio.run(run())
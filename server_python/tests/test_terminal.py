@@ -0,0 +1,104 @@
+import asyncio
+import os
+import pty
+import sys
+import uuid
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# Add the project root to sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from server_python.database import Base, TerminalSession, TerminalCommandHistory
+from server_python.terminal.pty_stream import PtyOutputStream
+from server_python.terminal.command_history import CommandLineAccumulator, TerminalHistoryWriter
+
+
+def test_pty_output_stream_coalesces_frames_until_eof():
+    async def run():
+        master_fd, slave_fd = pty.openpty()
+        try:
+            stream = PtyOutputStream(master_fd, coalesce_ms=20, max_frame_bytes=4096)
+            # Many small writes, as a shell printing line by line would produce
+            lines = [f"line {n} ü\n".encode() for n in range(200)]
+            for line in lines:
+                os.write(slave_fd, line)
+            os.close(slave_fd)
+            slave_fd = None
+
+            frames = [frame async for frame in stream.frames()]
+            return lines, frames
+        finally:
+            if slave_fd is not None:
+                os.close(slave_fd)
+            os.close(master_fd)
+
+    lines, frames = asyncio.run(run())
+    received = b"".join(frames)
+    # The pty translates "\n" to "\r\n" on output
+    assert received == b"".join(lines).replace(b"\n", b"\r\n")
+    assert all(len(frame) <= 4096 for frame in frames)
+    assert len(frames) < len(lines) / 10
+
+
+def test_pty_output_stream_text_frames_do_not_split_characters():
+    async def run():
+        master_fd, slave_fd = pty.openpty()
+        try:
+            stream = PtyOutputStream(master_fd, coalesce_ms=0, max_frame_bytes=3)
+            os.write(slave_fd, "ééé".encode())
+            os.close(slave_fd)
+            slave_fd = None
+            return [text async for text in stream.text_frames()]
+        finally:
+            if slave_fd is not None:
+                os.close(slave_fd)
+            os.close(master_fd)
+
+    texts = asyncio.run(run())
+    assert "".join(texts) == "ééé"
+    assert "�" not in "".join(texts)
+
+
+def test_command_line_accumulator_rebuilds_submitted_lines():
+    accumulator = CommandLineAccumulator()
+    completed = []
+    # One keystroke per message, with a typo fixed by backspace and an arrow key press
+    for key in ["l", "x", "\x7f", "s", " ", "-", "l", "\x1b[A", "\r"]:
+        completed += accumulator.feed(key)
+    assert completed == ["ls -l"]
+
+    assert accumulator.feed("rm -rf /tmp/x\x03") == []  # Ctrl-C discards the line
+    assert accumulator.feed("\r") == []
+    assert accumulator.feed("\x1b[200~echo one\necho two\x1b[201~\r") == ["echo one", "echo two"]
+
+
+def test_terminal_history_writer_batches_rows():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    session_id = str(uuid.uuid4())
+    db.add(TerminalSession(id=session_id, user_id=str(uuid.uuid4()), status="active"))
+    db.commit()
+
+    def history_count():
+        return db.query(TerminalCommandHistory).filter(TerminalCommandHistory.session_id == session_id).count()
+
+    async def run():
+        writer = TerminalHistoryWriter(db, session_id, batch_size=3, flush_interval=60)
+        writer.add("pwd")
+        writer.add("ls")
+        assert history_count() == 0
+        writer.add("whoami")  # Reaches batch_size
+        await asyncio.sleep(0.1)
+        assert history_count() == 3
+        writer.add("exit")
+        await writer.aclose()
+
+    asyncio.run(run())
+    db.expire_all()
+    assert [row.command for row in db.query(TerminalCommandHistory).order_by(TerminalCommandHistory.timestamp)] == ["pwd", "ls", "whoami", "exit"]
+    assert db.query(TerminalSession).get(session_id).last_command == "exit"
+    db.close()